@@ -4,9 +4,12 @@ IBEIS: main package init
 
 __version__ = '2.3.2'
 
-try:
-    import cv2  # NOQA
-except ImportError as ex:
+import importlib
+import importlib.util
+
+# Check for cv2 without importing it. The import itself is deferred to the
+# subsystems that need it.
+if importlib.util.find_spec('cv2') is None:
     import ubelt as ub
     msg = ub.paragraph(
         '''
@@ -29,9 +32,7 @@ except ImportError as ex:
         `pip install opencv-python`.
 
         We apologize for this issue and hope this documentation is sufficient.
-
-        orig_ex={!r}
-        ''').format(ex)
+        ''')
     raise ImportError(msg)
 
 
@@ -59,49 +60,95 @@ if ut.VERBOSE:
 ENABLE_WILDBOOK_SIGNAL = True
 
 
-try:
-    from ibeis import constants
-    from ibeis import constants as const  # NOQA
-    from ibeis import params
-    from ibeis import main_module
-    from ibeis import other
-    from ibeis.init import sysres
-    #main_module._preload()
-
-    from ibeis import control
-    from ibeis import dbio
-    #from ibeis import web
-
-    from ibeis.init import sysres  # NOQA
-    from ibeis.main_module import (main, _preload, _init_numpy, main_loop, opendb, opendb_in_background, opendb_bg_web)  # NOQA
-    from ibeis.control.IBEISControl import IBEISController  # NOQA
-    from ibeis.algo.hots.query_request import QueryRequest  # NOQA
-    from ibeis.algo.hots.chip_match import ChipMatch, AnnotMatch  # NOQA
-    from ibeis.algo.graph.core import AnnotInference  # NOQA
-    from ibeis.init.sysres import (get_workdir, set_workdir, ensure_pz_mtest, ensure_nauts, ensure_wilddogs, list_dbs)  # NOQA
-    from ibeis.init import main_helpers  # NOQA
-
-    from ibeis import algo
-
-    from ibeis import expt  # NOQA
-    from ibeis import templates  # NOQA
-    from ibeis.templates import generate_notebook  # NOQA
-    from ibeis.control.controller_inject import register_preprocs  # NOQA
-    from ibeis import core_annots  # NOQA
-    from ibeis import core_images  # NOQA
-
-    try:
-        from ibeis.scripts import postdoc  # NOQA
-    except ImportError:
-        pass
-except Exception as ex:
-    ut.printex(ex, 'Error when importing ibeis', tb=True)
-    raise
+from ibeis import constants
+from ibeis import constants as const  # NOQA
+from ibeis import params
+
+
+# Subsystems (the controller and its plugins, algo, web, gui, viz, ...) are
+# imported on first attribute access instead of by ``import ibeis``, so job
+# engine workers and multiprocessing children only pay for what they use.
+# Any ibeis submodule can be reached as ``ibeis.<name>``. These are the
+# names that are re-exported from deeper modules.
+_LAZY_ATTRS = {
+    'main': 'ibeis.main_module',
+    '_preload': 'ibeis.main_module',
+    '_init_numpy': 'ibeis.main_module',
+    'main_loop': 'ibeis.main_module',
+    'opendb': 'ibeis.main_module',
+    'opendb_in_background': 'ibeis.main_module',
+    'opendb_bg_web': 'ibeis.main_module',
+    'sysres': 'ibeis.init.sysres',
+    'main_helpers': 'ibeis.init.main_helpers',
+    'IBEISController': 'ibeis.control.IBEISControl',
+    'QueryRequest': 'ibeis.algo.hots.query_request',
+    'ChipMatch': 'ibeis.algo.hots.chip_match',
+    'AnnotMatch': 'ibeis.algo.hots.chip_match',
+    'AnnotInference': 'ibeis.algo.graph.core',
+    'get_workdir': 'ibeis.init.sysres',
+    'set_workdir': 'ibeis.init.sysres',
+    'ensure_pz_mtest': 'ibeis.init.sysres',
+    'ensure_nauts': 'ibeis.init.sysres',
+    'ensure_wilddogs': 'ibeis.init.sysres',
+    'list_dbs': 'ibeis.init.sysres',
+    'generate_notebook': 'ibeis.templates',
+    'register_preprocs': 'ibeis.control.controller_inject',
+    'testdata_cm': 'ibeis.init.main_helpers',
+    'testdata_cmlist': 'ibeis.init.main_helpers',
+    'testdata_qreq_': 'ibeis.init.main_helpers',
+    'testdata_pipecfg': 'ibeis.init.main_helpers',
+    'testdata_filtcfg': 'ibeis.init.main_helpers',
+    'testdata_expts': 'ibeis.init.main_helpers',
+    'testdata_expanded_aids': 'ibeis.init.main_helpers',
+    'testdata_aids': 'ibeis.init.main_helpers',
+    'VERSION_CURRENT': 'ibeis.control.DB_SCHEMA_CURRENT',
+}
+
+
+def __getattr__(key):
+    """
+    Lazily resolves subsystems and re-exported names (PEP 562)
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> import ibeis
+        >>> assert ibeis.ChipMatch is ibeis.algo.hots.chip_match.ChipMatch
+        >>> assert 'ChipMatch' in dir(ibeis)
+        >>> assert not hasattr(ibeis, 'not_a_real_attribute')
+    """
+    if key.startswith('__'):
+        raise AttributeError(key)
+    if key in _LAZY_ATTRS:
+        modname = _LAZY_ATTRS[key]
+        module = importlib.import_module(modname)
+        if modname.endswith('.' + key):
+            value = module
+        else:
+            value = getattr(module, key)
+    elif key == 'postdoc':
+        try:
+            value = importlib.import_module('ibeis.scripts.postdoc')
+        except ImportError:
+            raise AttributeError(key)
+    elif importlib.util.find_spec(__name__ + '.' + key) is not None:
+        value = importlib.import_module(__name__ + '.' + key)
+    else:
+        raise AttributeError('module %r has no attribute %r' % (__name__, key))
+    globals()[key] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
 
 
 def import_subs():
     # Weird / Fancy loading.
     # I want to make this simpler
+    from ibeis import main_module  # NOQA
+    from ibeis import other  # NOQA
+    from ibeis import control  # NOQA
+    from ibeis import dbio  # NOQA
     from ibeis import algo  # NOQA
     from ibeis import viz  # NOQA
     from ibeis import web  # NOQA
@@ -150,6 +197,8 @@ def run_experiment(e='print', db='PZ_MTEST', dbdir=None, a=['unctrl'], t=['defau
         >>> ut.show_if_requested()
     """
     import functools
+    from ibeis.init import main_helpers
+
     def find_expt_func(e):
         import utool as ut
         import ibeis.dev
@@ -263,10 +312,6 @@ def run_experiment(e='print', db='PZ_MTEST', dbdir=None, a=['unctrl'], t=['defau
         return testres
 
 
-def testdata_expts(*args, **kwargs):
-    ibs, testres = main_helpers.testdata_expts(*args, **kwargs)
-    return testres
-
 #import_subs()
 #from ibeis import gui
 #from ibeis import algo
@@ -298,16 +343,6 @@ def testdata_expts(*args, **kwargs):
 #)
 
 
-from ibeis.init import main_helpers  # NOQA
-testdata_cm = main_helpers.testdata_cm
-testdata_cmlist = main_helpers.testdata_cmlist
-testdata_qreq_ = main_helpers.testdata_qreq_
-testdata_pipecfg = main_helpers.testdata_pipecfg
-testdata_filtcfg = main_helpers.testdata_filtcfg
-testdata_expts = main_helpers.testdata_expts  # NOQA
-testdata_expanded_aids = main_helpers.testdata_expanded_aids
-testdata_aids = main_helpers.testdata_aids
-
 # Utool generated init makeinit.py
 print, rrr, profile = ut.inject2(__name__)
 
@@ -317,24 +352,22 @@ def reload_subs(verbose=True):
     import_subs()
     rrr(verbose=verbose)
     getattr(constants, 'rrr', lambda verbose: None)(verbose=verbose)
-    getattr(main_module, 'rrr', lambda verbose: None)(verbose=verbose)
+    getattr(main_module, 'rrr', lambda verbose: None)(verbose=verbose)  # NOQA
     getattr(params, 'rrr', lambda verbose: None)(verbose=verbose)
-    getattr(other, 'reload_subs', lambda verbose: None)(verbose=verbose)
-    getattr(dbio, 'reload_subs', lambda verbose: None)(verbose=verbose)
-    getattr(algo, 'reload_subs', lambda verbose: None)(verbose=verbose)
-    getattr(control, 'reload_subs', lambda verbose: None)(verbose=verbose)
+    getattr(other, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
+    getattr(dbio, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
+    getattr(algo, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
+    getattr(control, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
     getattr(viz, 'reload_subs', lambda: None)()  # NOQA
 
     getattr(gui, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
-    getattr(algo, 'reload_subs', lambda verbose: None)(verbose=verbose)
+    getattr(algo, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
     getattr(viz, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
     getattr(web, 'reload_subs', lambda verbose: None)(verbose=verbose)  # NOQA
 
     rrr(verbose=verbose)
 rrrr = reload_subs
 
-from ibeis.control.DB_SCHEMA_CURRENT import VERSION_CURRENT  # NOQA
-
 
 """
 Regen Command:
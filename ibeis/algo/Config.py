@@ -228,10 +228,16 @@ class NNConfig(ConfigBase):
         #    nn_cfg.checks = 800
         # number of annots before a new multi-indexer is built
         nn_cfg.min_reindex_thresh = 200
+        # number of threads searching the shards of a sharded indexer
+        nn_cfg.shard_workers = None  # doesnt change config, just speed
+        # fraction of brute force delta vectors / tombstoned vectors before an
+        # incremental indexer is compacted into a new flann index
+        nn_cfg.delta_thresh = .1
+        nn_cfg.tombstone_thresh = .1
         # number of annots before a new multi-indexer is built
         # nn_cfg.max_subindexers = 2
         # nn_cfg.valid_index_methods = ['single', 'multi', 'name']
-        nn_cfg.valid_index_methods = ['single']
+        nn_cfg.valid_index_methods = ['single', 'sharded', 'incremental']
         nn_cfg.update(**kwargs)
 
     def make_feasible(nn_cfg):
@@ -244,6 +250,9 @@ class NNConfig(ConfigBase):
         param_info_list = ut.flatten([
             [
                 ut.ParamInfo('index_method', 'single', ''),
+                # number of annots in each shard of a sharded indexer
+                ut.ParamInfo('shard_size', 10000, 'shsz', type_=int,
+                             hideif=lambda cfg: cfg['index_method'] != 'sharded'),
                 ut.ParamInfo('K', 4, type_=int),
                 ut.ParamInfo('Knorm', 1, 'Kn='),
                 ut.ParamInfo('use_k_padding', False, 'padk='),
@@ -282,6 +291,8 @@ class SpatialVerifyConfig(ConfigBase):
         sv_cfg.refine_method = 'homog'
         # weight feature scores with sver errors
         sv_cfg.weight_inliers = True
+        # number of processes verifying shortlist pairs
+        sv_cfg.sver_workers = None  # doesnt change config, just speed
         sv_cfg.update(**kwargs)
 
     def get_cfgstr_list(sv_cfg, **kwargs):
@@ -373,6 +384,8 @@ class FlannConfig(ConfigBase):
         flann_cfg.fgw_thresh = None
         flann_cfg.minscale_thresh = None
         flann_cfg.maxscale_thresh = None
+        # memory map the indexed descriptors from disk
+        flann_cfg.use_memmap = False  # doesnt change config, just memory
         flann_cfg.update(**kwargs)
 
     def get_flann_params(flann_cfg):
@@ -859,6 +872,8 @@ class OtherConfig(ConfigBase):
         other_cfg.smart_enabled = True
         other_cfg.enable_custom_filter = False
         other_cfg.hots_batch_size = 256
+        # number of processes executing query chunks
+        other_cfg.hots_n_workers = 1
         other_cfg.use_augmented_indexer = True
         other_cfg.show_shipped_imagesets = ut.is_developer()
         other_cfg.update(**kwargs)
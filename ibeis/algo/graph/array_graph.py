@@ -0,0 +1,1350 @@
+# -*- coding: utf-8 -*-
+"""
+Array-backed storage for the review graphs of AnnotInference.
+
+A networkx graph keeps a dict of neighbor dicts per node and one attribute
+dict per edge, which costs a few hundred bytes per edge before any attribute
+is stored. ArrayGraph keeps the same graph in flat arrays:
+
+    * nodes get dense integer ids. Node attribute dicts are kept as is.
+    * edges get dense integer ids. Their endpoints are stored in two int
+      arrays and each edge attribute is one column indexed by edge id. String
+      attributes (decisions, user ids, inferred states) are stored as small
+      integer codes, ints and floats in numeric arrays, and anything else
+      (e.g. tags) in object arrays.
+    * the adjacency is a CSR matrix (indptr / indices / edge ids) plus a
+      small dict overlay holding the edges added since the last compaction.
+      Appends go to the overlay and removals only mark the edge as dead, so
+      both are O(1). Once the overlay and the dead entries grow past a
+      fraction of the graph, everything is rebuilt in one vectorized pass.
+
+ArrayGraph is a networkx Graph subclass whose ``_adj`` is a read / write view
+over these arrays, so it works with the networkx algorithms and with the
+DynamicUpdate / Redundancy mixins unchanged. Neighbor and edge order is the
+same as for a networkx graph built by the same calls. Bulk attribute access
+(:meth:`ArrayGraph.gen_edge_attrs`, :meth:`ArrayGraph.set_edge_attrs`)
+resolves edge ids with one searchsorted over the compacted edges instead of
+walking nested dicts.
+
+ArrayDynConnGraph adds the union-find connected components of
+:class:`ibeis.algo.graph.nx_dynamic_graph.DynConnGraph`.
+
+AnnotInference uses these classes when run with ``--array-graph``.
+
+CommandLine:
+    python -m ibeis.algo.graph.array_graph --allexamples
+    python -m ibeis.algo.graph.tests.bench bench_review_graph_backends
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import weakref
+import six
+import numpy as np
+import utool as ut
+import networkx as nx
+from six.moves import zip
+from ibeis.algo.graph import nx_dynamic_graph
+from ibeis.algo.graph.nx_dynamic_graph import GraphHelperMixin
+try:
+    from collections.abc import Mapping, MutableMapping, ItemsView
+except ImportError:  # nocover
+    from collections import Mapping, MutableMapping, ItemsView
+print, rrr, profile = ut.inject2(__name__)
+
+
+# Do not rebuild the arrays until this many entries are stale
+COMPACT_MIN = 1024
+# Rebuild once stale entries exceed this fraction of the live edges
+COMPACT_FRAC = .25
+# Prune the references to dead edge views once there are this many
+VIEW_PRUNE_MIN = 1024
+
+_IDX_DTYPE = np.int32
+
+# Edge attribute values stored as codes of a categorical column
+_CATEGORY_TYPES = tuple({str, six.text_type, bool, type(None)})
+_CODE_DTYPE = np.int16
+_MAX_CATEGORIES = np.iinfo(_CODE_DTYPE).max
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 63 - 1
+# Edge attribute values stored in numeric arrays, mapped to the array dtype.
+# Numpy scalars are read back as numpy scalars of the same type.
+_NUMERIC_DTYPES = dict([
+    (float, np.float64),
+    (np.float64, np.float64),
+    (np.float32, np.float32),
+    (np.int64, np.int64),
+    (np.int32, np.int32),
+] + [(int_type, np.int64) for int_type in six.integer_types])
+
+
+class _Missing(object):
+    """ Marks an empty slot of a node or edge column """
+    def __repr__(self):
+        return '_MISSING'
+
+    def __reduce__(self):
+        # keeps identity through pickle and deepcopy
+        return '_MISSING'
+
+
+_MISSING = _Missing()
+
+_clear_nx_cache = getattr(nx, '_clear_cache', lambda G: None)
+
+
+def _grow(arr, size, fill):
+    new = np.full(size, fill, dtype=arr.dtype)
+    new[:len(arr)] = arr
+    return new
+
+
+class _ObjectColumn(object):
+    """
+    Edge attribute column of arbitrary values. ``mask`` flags the edges that
+    have a value.
+
+    The column classes share one interface: ``set`` and ``put`` return False
+    without storing anything if a value does not fit the column, in which
+    case the graph converts it with ``to_object``. Empty slots read as
+    ``_MISSING``.
+    """
+    __slots__ = ('values', 'mask')
+
+    def __init__(self, size):
+        self.values = np.full(size, None, dtype=object)
+        self.mask = np.zeros(size, dtype=np.bool_)
+
+    def get(self, eid):
+        return self.values[eid] if self.mask[eid] else _MISSING
+
+    def has(self, eid):
+        return self.mask[eid]
+
+    def set(self, eid, val):
+        self.values[eid] = val
+        self.mask[eid] = True
+        return True
+
+    def put(self, eids, vals):
+        values = self.values
+        for eid, val in zip(eids, vals):
+            # assigning a list to a slice would broadcast list values
+            values[eid] = val
+        self.mask[eids] = True
+        return True
+
+    def clear(self, eid):
+        self.values[eid] = None
+        self.mask[eid] = False
+
+    def take(self, eids):
+        eids = np.asarray(eids, dtype=np.int64)
+        values = self.values[eids].tolist()
+        mask = self.mask[eids].tolist()
+        return [val if flag else _MISSING for val, flag in zip(values, mask)]
+
+    def any(self):
+        return self.mask.any()
+
+    def _new(self, values, mask):
+        col = self.__class__.__new__(self.__class__)
+        col.values = values
+        col.mask = mask
+        return col
+
+    def resize(self, size):
+        return self._new(_grow(self.values, size, None),
+                         _grow(self.mask, size, False))
+
+    def subset(self, eids, size):
+        """ The values of eids renumbered from zero in a column of size """
+        return self._new(_grow(self.values[eids], size, None),
+                         _grow(self.mask[eids], size, False))
+
+    def copy(self):
+        return self._new(self.values.copy(), self.mask.copy())
+
+    def to_object(self):
+        return self
+
+
+class _NumericColumn(_ObjectColumn):
+    """
+    Edge attribute column of numbers of one type stored in a numeric array
+    (see _NUMERIC_DTYPES).
+    """
+    __slots__ = ('type',)
+
+    def __init__(self, size, type_):
+        self.type = type_
+        self.values = np.zeros(size, dtype=_NUMERIC_DTYPES[type_])
+        self.mask = np.zeros(size, dtype=np.bool_)
+
+    def _fits(self, val):
+        if type(val) is not self.type:
+            return False
+        return (self.type not in six.integer_types or
+                _INT_MIN <= val <= _INT_MAX)
+
+    def get(self, eid):
+        if not self.mask[eid]:
+            return _MISSING
+        val = self.values[eid]
+        return val if issubclass(self.type, np.generic) else val.item()
+
+    def take(self, eids):
+        eids = np.asarray(eids, dtype=np.int64)
+        values = self.values[eids]
+        if issubclass(self.type, np.generic):
+            values = list(values)
+        else:
+            values = values.tolist()
+        mask = self.mask[eids].tolist()
+        return [val if flag else _MISSING for val, flag in zip(values, mask)]
+
+    def set(self, eid, val):
+        if not self._fits(val):
+            return False
+        self.values[eid] = val
+        self.mask[eid] = True
+        return True
+
+    def put(self, eids, vals):
+        if not all(self._fits(val) for val in vals):
+            return False
+        self.values[eids] = vals
+        self.mask[eids] = True
+        return True
+
+    def clear(self, eid):
+        self.mask[eid] = False
+
+    def _new(self, values, mask):
+        col = super(_NumericColumn, self)._new(values, mask)
+        col.type = self.type
+        return col
+
+    def resize(self, size):
+        return self._new(_grow(self.values, size, 0),
+                         _grow(self.mask, size, False))
+
+    def subset(self, eids, size):
+        return self._new(_grow(self.values[eids], size, 0),
+                         _grow(self.mask[eids], size, False))
+
+    def to_object(self):
+        col = _ObjectColumn(len(self.values))
+        flags = np.flatnonzero(self.mask)
+        col.put(flags, self.take(flags))
+        return col
+
+
+class _CategoryColumn(object):
+    """
+    Edge attribute column of strings, bools and None stored as int16 codes
+    into a list of distinct values. A code of -1 is an empty slot.
+    """
+    __slots__ = ('codes', 'categories', 'index')
+
+    def __init__(self, size):
+        self.codes = np.full(size, -1, dtype=_CODE_DTYPE)
+        self.categories = []
+        self.index = {}
+
+    def _code(self, val):
+        """ The code of a value or None if it does not fit """
+        if type(val) not in _CATEGORY_TYPES:
+            return None
+        code = self.index.get(val, None)
+        if code is None:
+            if len(self.categories) >= _MAX_CATEGORIES:
+                return None
+            code = self.index[val] = len(self.categories)
+            self.categories.append(val)
+        return code
+
+    def get(self, eid):
+        code = self.codes[eid]
+        return self.categories[code] if code >= 0 else _MISSING
+
+    def has(self, eid):
+        return self.codes[eid] >= 0
+
+    def set(self, eid, val):
+        code = self._code(val)
+        if code is None:
+            return False
+        self.codes[eid] = code
+        return True
+
+    def put(self, eids, vals):
+        if not all(type(val) in _CATEGORY_TYPES for val in vals):
+            return False
+        codes = [self._code(val) for val in vals]
+        if None in codes:
+            # ran out of codes
+            return False
+        self.codes[eids] = codes
+        return True
+
+    def clear(self, eid):
+        self.codes[eid] = -1
+
+    def take(self, eids):
+        categories = self.categories
+        codes = self.codes[np.asarray(eids, dtype=np.int64)].tolist()
+        return [categories[code] if code >= 0 else _MISSING for code in codes]
+
+    def any(self):
+        return (self.codes >= 0).any()
+
+    def _new(self, codes):
+        col = self.__class__.__new__(self.__class__)
+        col.codes = codes
+        col.categories = list(self.categories)
+        col.index = self.index.copy()
+        return col
+
+    def resize(self, size):
+        return self._new(_grow(self.codes, size, -1))
+
+    def subset(self, eids, size):
+        return self._new(_grow(self.codes[eids], size, -1))
+
+    def copy(self):
+        return self._new(self.codes.copy())
+
+    def to_object(self):
+        col = _ObjectColumn(len(self.codes))
+        flags = np.flatnonzero(self.codes >= 0)
+        col.put(flags, self.take(flags))
+        return col
+
+
+def _new_column(val, size):
+    """ An empty column of the type that best fits val """
+    if type(val) in _CATEGORY_TYPES:
+        return _CategoryColumn(size)
+    elif type(val) in _NUMERIC_DTYPES:
+        return _NumericColumn(size, type(val))
+    else:
+        return _ObjectColumn(size)
+
+
+class _EdgeAttrs(MutableMapping):
+    """
+    The attribute dict of one edge. Reads and writes go to the edge columns.
+
+    Views are made on demand and the graph only keeps weak references to
+    them (see ArrayGraph._edge_view). The columns of a removed edge are kept
+    until the next compaction, which detaches its views. A detached view
+    keeps a plain dict copy of the attributes, just like the orphaned data
+    dict of a networkx edge.
+    """
+    __slots__ = ('_graph', '_eid', '_data', '__weakref__')
+
+    def __init__(self, graph, eid):
+        self._graph = graph
+        self._eid = eid
+        self._data = None
+
+    def _detach(self):
+        self._data = self.copy()
+        self._graph = None
+        self._eid = None
+
+    def __getitem__(self, key):
+        if self._data is not None:
+            return self._data[key]
+        col = self._graph._ecols.get(key, None)
+        if col is None:
+            raise KeyError(key)
+        val = col.get(self._eid)
+        if val is _MISSING:
+            raise KeyError(key)
+        return val
+
+    def get(self, key, default=None):
+        if self._data is not None:
+            return self._data.get(key, default)
+        col = self._graph._ecols.get(key, None)
+        if col is None:
+            return default
+        val = col.get(self._eid)
+        return default if val is _MISSING else val
+
+    def __contains__(self, key):
+        if self._data is not None:
+            return key in self._data
+        col = self._graph._ecols.get(key, None)
+        return col is not None and bool(col.has(self._eid))
+
+    def __setitem__(self, key, val):
+        if self._data is not None:
+            self._data[key] = val
+        else:
+            self._graph._set_edge_value(key, self._eid, val)
+
+    def __delitem__(self, key):
+        if self._data is not None:
+            del self._data[key]
+            return
+        col = self._graph._ecols.get(key, None)
+        if col is None or not col.has(self._eid):
+            raise KeyError(key)
+        col.clear(self._eid)
+
+    def __iter__(self):
+        if self._data is not None:
+            return iter(self._data)
+        eid = self._eid
+        keys = [key for key, col in self._graph._ecols.items()
+                if col.has(eid)]
+        return iter(keys)
+
+    def __len__(self):
+        if self._data is not None:
+            return len(self._data)
+        eid = self._eid
+        return sum(bool(col.has(eid))
+                   for col in self._graph._ecols.values())
+
+    def update(self, *args, **kwargs):
+        if self._data is not None:
+            self._data.update(*args, **kwargs)
+            return
+        graph = self._graph
+        eid = self._eid
+        for key, val in dict(*args, **kwargs).items():
+            graph._set_edge_value(key, eid, val)
+
+    def copy(self):
+        if self._data is not None:
+            return self._data.copy()
+        eid = self._eid
+        data = {}
+        for key, col in self._graph._ecols.items():
+            val = col.get(eid)
+            if val is not _MISSING:
+                data[key] = val
+        return data
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+class _NeighborItems(ItemsView):
+    """ Iterates (neighbor, edge attrs) without a lookup per neighbor """
+    def __iter__(self):
+        return self._mapping._iter_items()
+
+
+class _ArrayNeighbors(Mapping):
+    """
+    The neighbor dict of one node: maps neighbor to its edge attrs. The
+    graph updates ``_ui`` when it renumbers the nodes.
+    """
+    __slots__ = ('_graph', '_label', '_ui')
+
+    def __init__(self, graph, label, ui):
+        self._graph = graph
+        self._label = label
+        self._ui = ui
+
+    def __getitem__(self, key):
+        graph = self._graph
+        vi = graph._nidx.get(key, None)
+        eid = None if vi is None else graph._find_eid(self._ui, vi)
+        if eid is None:
+            raise KeyError(key)
+        return graph._edge_view(eid)
+
+    def __contains__(self, key):
+        graph = self._graph
+        vi = graph._nidx.get(key, None)
+        return vi is not None and graph._find_eid(self._ui, vi) is not None
+
+    def __iter__(self):
+        graph = self._graph
+        ui = self._ui
+        nbrs = graph._nbr_cache.get(ui, None)
+        if nbrs is None:
+            nlabels = graph._nlabels
+            nbrs = graph._nbr_cache[ui] = tuple(
+                [nlabels[vi] for vi in graph._row_nbrs(ui)])
+        return iter(nbrs)
+
+    def __len__(self):
+        return self._graph._deg[self._ui]
+
+    def _iter_items(self):
+        graph = self._graph
+        ui = self._ui
+        epoch = graph._epoch
+        nlabels = graph._nlabels
+        items = [(nlabels[vi], eid) for vi, eid in graph._row(ui)]
+        for nbr, eid in items:
+            if graph._epoch != epoch:
+                # the graph was compacted while iterating
+                eid = graph._lookup_eid(self._label, nbr)
+                if eid is None:
+                    continue
+            yield nbr, graph._edge_view(eid)
+
+    def items(self):
+        return _NeighborItems(self)
+
+    def __repr__(self):
+        return repr({nbr: data.copy() for nbr, data in self.items()})
+
+
+class _ArrayAdjacency(dict):
+    """
+    Stands in for the networkx dict of neighbor dicts. Maps each node to its
+    _ArrayNeighbors view and is only changed by ArrayGraph.
+    """
+    __slots__ = ()
+
+
+class ArrayGraph(nx.Graph, GraphHelperMixin):
+    r"""
+    Undirected graph stored in integer arrays with columnar edge attributes.
+
+    CommandLine:
+        python -m ibeis.algo.graph.array_graph ArrayGraph
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.graph.array_graph import *  # NOQA
+        >>> from ibeis.algo.graph.nx_dynamic_graph import NiceGraph
+        >>> graphs = [NiceGraph(), ArrayGraph()]
+        >>> for G in graphs:
+        >>>     G.add_edges_from([(1, 2), (2, 3), (4, 5), (3, 1)], decision='match')
+        >>>     G.add_edge(5, 6, decision='nomatch', prob=.3)
+        >>>     G.remove_edge(2, 3)
+        >>>     G.add_edge(3, 2)
+        >>>     G.adj[4][5]['prob'] = .9
+        >>>     G.remove_node(1)
+        >>> G1, G2 = graphs
+        >>> print(list(G2.edges(data=True)))
+        [(2, 3, {}), (4, 5, {'decision': 'match', 'prob': 0.9}), (5, 6, {'decision': 'nomatch', 'prob': 0.3})]
+        >>> assert list(G1.edges(data=True)) == list(G2.edges(data=True))
+        >>> assert [list(G1.adj[n]) for n in G1] == [list(G2.adj[n]) for n in G2]
+        >>> print(list(G2.gen_edge_attrs('prob', [(6, 5), (3, 2)], default=None)))
+        [((6, 5), 0.3), ((3, 2), None)]
+        >>> print(G2.__nice__())
+        nNodes=5, nEdges=3
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> # Compaction keeps the graph identical to networkx
+        >>> from ibeis.algo.graph.array_graph import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> G1, G2 = nx.Graph(), ArrayGraph()
+        >>> for _ in range(3000):
+        >>>     u, v = rng.randint(0, 60, size=2)
+        >>>     for G in [G1, G2]:
+        >>>         if G.has_edge(u, v):
+        >>>             G.remove_edge(u, v)
+        >>>         else:
+        >>>             G.add_edge(u, v, weight=u + v)
+        >>> assert G2._epoch > 0
+        >>> assert list(G1.edges(data=True)) == list(G2.edges(data=True))
+        >>> assert [list(G1.adj[n]) for n in G1] == [list(G2.adj[n]) for n in G2]
+        >>> assert G1.number_of_edges() == G2.number_of_edges()
+        >>> assert nx.utils.graphs_equal(G1, G2.copy())
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> # Columns are typed by their values
+        >>> from ibeis.algo.graph.array_graph import *  # NOQA
+        >>> G = ArrayGraph()
+        >>> G.add_edges_from([(1, 2), (2, 3)], decision='match', num_reviews=1)
+        >>> G.add_edge(3, 4, decision=None, tags=['photobomb'])
+        >>> print(sorted((key, type(col).__name__) for key, col in G._ecols.items()))
+        [('decision', '_CategoryColumn'), ('num_reviews', '_NumericColumn'), ('tags', '_ObjectColumn')]
+        >>> # a value that does not fit converts the column
+        >>> G.edges[1, 2]['num_reviews'] = 2 ** 70
+        >>> print(type(G._ecols['num_reviews']).__name__)
+        _ObjectColumn
+        >>> print(list(G.edges(data=True)))
+        [(1, 2, {'decision': 'match', 'num_reviews': 1180591620717411303424}), (2, 3, {'decision': 'match', 'num_reviews': 1}), (3, 4, {'decision': None, 'tags': ['photobomb']})]
+    """
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        self._reset_storage()
+        super(ArrayGraph, self).__init__(incoming_graph_data, **attr)
+
+    def adjlist_outer_dict_factory(self):
+        return _ArrayAdjacency()
+
+    def _reset_storage(self):
+        # node ids
+        self._nidx = {}
+        self._nlabels = []
+        self._deg = []
+        self._num_dead_nodes = 0
+        # edge arrays
+        self._eu = np.empty(0, dtype=_IDX_DTYPE)
+        self._ev = np.empty(0, dtype=_IDX_DTYPE)
+        self._ealive = np.empty(0, dtype=np.bool_)
+        self._ecols = {}
+        self._num_eids = 0
+        self._num_alive = 0
+        # compacted adjacency. indptr is a list for fast scalar access.
+        self._indptr = [0]
+        self._indices = np.empty(0, dtype=_IDX_DTYPE)
+        self._ieids = np.empty(0, dtype=_IDX_DTYPE)
+        # sorted keys (lo * ncsr + hi) of the compacted edges
+        self._ckeys = np.empty(0, dtype=np.int64)
+        self._ckey_eids = np.empty(0, dtype=_IDX_DTYPE)
+        self._ncsr = 0
+        # number of dead entries in each compacted row
+        self._row_dead = {}
+        # neighbor labels of recently iterated rows. Set operations on
+        # neighborhoods (e.g. nx_utils.edges_cross) iterate the same rows
+        # many times between changes.
+        self._nbr_cache = {}
+        # edges added since the last compaction
+        self._pending = {}
+        self._num_pending = 0
+        # bumped whenever node and edge ids are renumbered
+        self._epoch = 0
+        self._reset_views()
+
+    _STORAGE_ATTRS = [
+        '_num_dead_nodes', '_num_eids', '_num_alive', '_indices',
+        '_ieids', '_ckeys', '_ckey_eids', '_ncsr', '_num_pending', '_epoch',
+    ]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_views']
+        del state['_max_views']
+        state['_nbr_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_views()
+
+    # --- storage internals ---
+
+    def _reset_views(self):
+        # weak references to the attribute views made since the last
+        # compaction. Dead references are pruned once there are too many.
+        self._views = []
+        self._max_views = VIEW_PRUNE_MIN
+
+    def _edge_view(self, eid):
+        view = _EdgeAttrs(self, eid)
+        views = self._views
+        views.append(weakref.ref(view))
+        if len(views) > self._max_views:
+            self._views = views = [ref for ref in views if ref() is not None]
+            self._max_views = max(VIEW_PRUNE_MIN, 2 * len(views))
+        return view
+
+    def _live_views(self):
+        views = (ref() for ref in self._views)
+        return [view for view in views
+                if view is not None and view._graph is self]
+
+    def _detach_views(self):
+        for view in self._live_views():
+            view._detach()
+        self._reset_views()
+
+    def _set_edge_value(self, key, eid, val):
+        col = self._ecols.get(key, None)
+        if col is None:
+            col = self._ecols[key] = _new_column(val, len(self._eu))
+        if not col.set(eid, val):
+            col = self._ecols[key] = col.to_object()
+            col.set(eid, val)
+
+    def _put_edge_values(self, key, eids, vals):
+        """ Sets key of several edges. eids is an array of live edge ids """
+        if len(vals) == 0:
+            return
+        col = self._ecols.get(key, None)
+        if col is None:
+            col = self._ecols[key] = _new_column(vals[0], len(self._eu))
+        if not col.put(eids, vals):
+            col = self._ecols[key] = col.to_object()
+            col.put(eids, vals)
+
+    def _ensure_node(self, n):
+        ui = self._nidx.get(n, None)
+        if ui is None:
+            if n is None:
+                raise ValueError('None cannot be a node')
+            ui = self._nidx[n] = len(self._nlabels)
+            self._nlabels.append(n)
+            self._deg.append(0)
+            self._node[n] = self.node_attr_dict_factory()
+            self._adj[n] = _ArrayNeighbors(self, n, ui)
+        return ui
+
+    def _find_eid(self, ui, vi):
+        pend = self._pending.get(ui, None)
+        if pend is not None:
+            eid = pend.get(vi, None)
+            if eid is not None:
+                return eid
+        ncsr = self._ncsr
+        if ui < ncsr and vi < ncsr:
+            key = ui * ncsr + vi if ui <= vi else vi * ncsr + ui
+            ckeys = self._ckeys
+            pos = ckeys.searchsorted(key)
+            if pos < len(ckeys) and ckeys[pos] == key:
+                eid = int(self._ckey_eids[pos])
+                if self._ealive[eid]:
+                    return eid
+        return None
+
+    def _lookup_eid(self, u, v):
+        ui = self._nidx.get(u, None)
+        vi = self._nidx.get(v, None)
+        if ui is None or vi is None:
+            return None
+        return self._find_eid(ui, vi)
+
+    def _lookup_eids(self, edges):
+        """
+        Returns:
+            list: the edge id of each (u, v) pair or -1 if there is no such
+                edge
+        """
+        num = len(edges)
+        if num <= 32:
+            # not worth the array overhead
+            eids = [self._lookup_eid(u, v) for u, v in edges]
+            return [-1 if eid is None else eid for eid in eids]
+        nidx = self._nidx
+        uis = np.fromiter((nidx.get(u, -1) for u, _ in edges), np.int64, num)
+        vis = np.fromiter((nidx.get(v, -1) for _, v in edges), np.int64, num)
+        eids = np.full(num, -1, dtype=np.int64)
+        ncsr = self._ncsr
+        if len(self._ckeys) > 0:
+            lo = np.minimum(uis, vis)
+            hi = np.maximum(uis, vis)
+            flags = (lo >= 0) & (hi < ncsr)
+            keys = lo[flags] * ncsr + hi[flags]
+            pos = np.minimum(self._ckeys.searchsorted(keys),
+                             len(self._ckeys) - 1)
+            found = self._ckey_eids[pos]
+            hit = (self._ckeys[pos] == keys) & self._ealive[found]
+            eids[flags] = np.where(hit, found, -1)
+        eids = eids.tolist()
+        if self._pending:
+            pending = self._pending
+            uis = uis.tolist()
+            vis = vis.tolist()
+            for x, eid in enumerate(eids):
+                if eid < 0:
+                    pend = pending.get(uis[x], None)
+                    if pend is not None:
+                        eids[x] = pend.get(vis[x], -1)
+        return eids
+
+    def _row(self, ui):
+        """ (neighbor id, edge id) pairs of one node in insertion order """
+        items = []
+        if ui < self._ncsr:
+            start, stop = self._indptr[ui], self._indptr[ui + 1]
+            if start != stop:
+                eids = self._ieids[start:stop]
+                nbrs = self._indices[start:stop]
+                if ui in self._row_dead:
+                    alive = self._ealive[eids]
+                    eids = eids[alive]
+                    nbrs = nbrs[alive]
+                items.extend(zip(nbrs.tolist(), eids.tolist()))
+        pend = self._pending.get(ui, None)
+        if pend:
+            items.extend(pend.items())
+        return items
+
+    def _row_nbrs(self, ui):
+        """ neighbor ids of one node in insertion order """
+        nbrs = []
+        if ui < self._ncsr:
+            start, stop = self._indptr[ui], self._indptr[ui + 1]
+            if start != stop:
+                if ui in self._row_dead:
+                    eids = self._ieids[start:stop]
+                    nbrs = self._indices[start:stop][self._ealive[eids]].tolist()
+                else:
+                    nbrs = self._indices[start:stop].tolist()
+        pend = self._pending.get(ui, None)
+        if pend:
+            nbrs.extend(pend.keys())
+        return nbrs
+
+    def _new_edge(self, ui, vi):
+        eid = self._num_eids
+        if eid == len(self._eu):
+            size = max(16, 2 * len(self._eu))
+            self._eu = _grow(self._eu, size, -1)
+            self._ev = _grow(self._ev, size, -1)
+            self._ealive = _grow(self._ealive, size, False)
+            for key, col in self._ecols.items():
+                self._ecols[key] = col.resize(size)
+        self._eu[eid] = ui
+        self._ev[eid] = vi
+        self._ealive[eid] = True
+        self._num_eids += 1
+        self._num_alive += 1
+        self._pending.setdefault(ui, {})[vi] = eid
+        self._deg[ui] += 1
+        self._nbr_cache.pop(ui, None)
+        self._nbr_cache.pop(vi, None)
+        if ui != vi:
+            self._pending.setdefault(vi, {})[ui] = eid
+            self._deg[vi] += 1
+        self._num_pending += 1
+        return eid
+
+    def _kill_edge(self, ui, vi, eid):
+        # Edge ids are not reused before the next compaction, which drops
+        # the values of dead edges, so the columns are left as they are.
+        self._ealive[eid] = False
+        self._num_alive -= 1
+        self._deg[ui] -= 1
+        self._nbr_cache.pop(ui, None)
+        self._nbr_cache.pop(vi, None)
+        if ui != vi:
+            self._deg[vi] -= 1
+        pend = self._pending.get(ui, None)
+        if pend is not None and pend.get(vi, None) == eid:
+            del pend[vi]
+            if ui != vi:
+                del self._pending[vi][ui]
+            self._num_pending -= 1
+        else:
+            row_dead = self._row_dead
+            row_dead[ui] = row_dead.get(ui, 0) + 1
+            if ui != vi:
+                row_dead[vi] = row_dead.get(vi, 0) + 1
+
+    def _maybe_compact(self):
+        num_stale = (self._num_pending + self._num_eids - self._num_alive +
+                     self._num_dead_nodes)
+        if num_stale > max(COMPACT_MIN, COMPACT_FRAC * self._num_alive):
+            self._compact()
+
+    @profile
+    def _compact(self):
+        """
+        Rebuilds the CSR adjacency from the live entries, drops dead nodes
+        and edges and renumbers the rest (keeping their order).
+        """
+        nlabels = self._nlabels
+        alive_nodes = [ui for ui, label in enumerate(nlabels)
+                       if label is not _MISSING]
+        num_nodes = len(alive_nodes)
+        node_remap = np.full(len(nlabels), -1, dtype=np.int64)
+        node_remap[alive_nodes] = np.arange(num_nodes)
+
+        num_eids = self._num_eids
+        alive_eids = np.flatnonzero(self._ealive[:num_eids])
+        edge_remap = np.full(num_eids, -1, dtype=np.int64)
+        edge_remap[alive_eids] = np.arange(len(alive_eids))
+
+        # Views of removed edges keep a copy of their values and the others
+        # follow the renumbering
+        views = self._live_views()
+        self._reset_views()
+        for view in views:
+            if self._ealive[view._eid]:
+                view._eid = int(edge_remap[view._eid])
+                self._views.append(weakref.ref(view))
+            else:
+                view._detach()
+
+        # Live compacted entries go before the pending ones of the same row.
+        # A stable sort on the row keeps insertion order within each row.
+        ncsr = self._ncsr
+        rows = np.repeat(np.arange(ncsr), np.diff(self._indptr))
+        alive = self._ealive[self._ieids]
+        pend_rows, pend_nbrs, pend_eids = [], [], []
+        for ui, pend in self._pending.items():
+            pend_rows.extend([ui] * len(pend))
+            pend_nbrs.extend(pend.keys())
+            pend_eids.extend(pend.values())
+        rows = np.hstack([rows[alive], np.array(pend_rows, dtype=np.int64)])
+        nbrs = np.hstack([self._indices[alive], np.array(pend_nbrs, dtype=np.int64)])
+        eids = np.hstack([self._ieids[alive], np.array(pend_eids, dtype=np.int64)])
+        sortx = np.argsort(rows, kind='stable')
+        rows = node_remap[rows[sortx]]
+        nbrs = node_remap[nbrs[sortx]]
+        eids = edge_remap[eids[sortx]]
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+        upper = rows <= nbrs
+        ckeys = rows[upper] * num_nodes + nbrs[upper]
+        keyx = ckeys.argsort()
+
+        self._indptr = indptr.tolist()
+        self._row_dead = {}
+        self._nbr_cache = {}
+        self._indices = nbrs.astype(_IDX_DTYPE)
+        self._ieids = eids.astype(_IDX_DTYPE)
+        self._ckeys = ckeys[keyx]
+        self._ckey_eids = eids[upper][keyx].astype(_IDX_DTYPE)
+        self._ncsr = num_nodes
+
+        num_alive = len(alive_eids)
+        size = max(16, num_alive + num_alive // 2)
+        self._eu = _grow(node_remap[self._eu[alive_eids]].astype(_IDX_DTYPE),
+                         size, -1)
+        self._ev = _grow(node_remap[self._ev[alive_eids]].astype(_IDX_DTYPE),
+                         size, -1)
+        self._ealive = _grow(np.ones(num_alive, dtype=np.bool_), size, False)
+        for key, col in list(self._ecols.items()):
+            col = col.subset(alive_eids, size)
+            if col.any():
+                self._ecols[key] = col
+            else:
+                del self._ecols[key]
+        self._num_eids = num_alive
+
+        self._nlabels = [nlabels[ui] for ui in alive_nodes]
+        self._deg = ut.take(self._deg, alive_nodes)
+        self._nidx = {label: ui for ui, label in enumerate(self._nlabels)}
+        adj = self._adj
+        for label, ui in self._nidx.items():
+            adj[label]._ui = ui
+        self._num_dead_nodes = 0
+        self._pending = {}
+        self._num_pending = 0
+        self._epoch += 1
+
+    def _iter_edge_eids(self):
+        """ (u, v, edge id) triples in the order of ``G.edges()`` """
+        nidx = self._nidx
+        nlabels = self._nlabels
+        seen = set()
+        for n in list(self._node):
+            ui = nidx[n]
+            for vi, eid in self._row(ui):
+                if vi not in seen:
+                    yield n, nlabels[vi], eid
+            seen.add(ui)
+
+    # --- networkx mutators ---
+
+    def add_node(self, node_for_adding, **attr):
+        self._ensure_node(node_for_adding)
+        self._node[node_for_adding].update(attr)
+        _clear_nx_cache(self)
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        for n in nodes_for_adding:
+            try:
+                n in self._node
+                newdict = attr
+            except TypeError:
+                n, ndict = n
+                newdict = attr.copy()
+                newdict.update(ndict)
+            self._ensure_node(n)
+            self._node[n].update(newdict)
+        _clear_nx_cache(self)
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        u, v = u_of_edge, v_of_edge
+        ui = self._ensure_node(u)
+        vi = self._ensure_node(v)
+        eid = self._find_eid(ui, vi)
+        if eid is None:
+            eid = self._new_edge(ui, vi)
+        for key, val in attr.items():
+            self._set_edge_value(key, eid, val)
+        self._maybe_compact()
+        _clear_nx_cache(self)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        for e in ebunch_to_add:
+            ne = len(e)
+            if ne == 3:
+                u, v, dd = e
+            elif ne == 2:
+                u, v = e
+                dd = {}
+            else:
+                raise nx.NetworkXError(
+                    'Edge tuple %s must be a 2-tuple or 3-tuple.' % (e,))
+            ui = self._ensure_node(u)
+            vi = self._ensure_node(v)
+            eid = self._find_eid(ui, vi)
+            if eid is None:
+                eid = self._new_edge(ui, vi)
+            for key, val in attr.items():
+                self._set_edge_value(key, eid, val)
+            for key, val in dd.items():
+                self._set_edge_value(key, eid, val)
+        self._maybe_compact()
+        _clear_nx_cache(self)
+
+    def remove_edge(self, u, v):
+        ui = self._nidx.get(u, None)
+        vi = self._nidx.get(v, None)
+        eid = None if ui is None or vi is None else self._find_eid(ui, vi)
+        if eid is None:
+            raise nx.NetworkXError(
+                'The edge %s-%s is not in the graph' % (u, v))
+        self._kill_edge(ui, vi, eid)
+        self._maybe_compact()
+        _clear_nx_cache(self)
+
+    def remove_edges_from(self, ebunch):
+        for e in ebunch:
+            u, v = e[:2]
+            ui = self._nidx.get(u, None)
+            vi = self._nidx.get(v, None)
+            if ui is not None and vi is not None:
+                eid = self._find_eid(ui, vi)
+                if eid is not None:
+                    self._kill_edge(ui, vi, eid)
+        self._maybe_compact()
+        _clear_nx_cache(self)
+
+    def _remove_node_storage(self, n):
+        ui = self._nidx.pop(n)
+        for vi, eid in self._row(ui):
+            self._kill_edge(ui, vi, eid)
+        del self._node[n]
+        del self._adj[n]
+        self._nlabels[ui] = _MISSING
+        self._pending.pop(ui, None)
+        self._num_dead_nodes += 1
+
+    def remove_node(self, n):
+        if n not in self._nidx:
+            raise nx.NetworkXError('The node %s is not in the graph.' % (n,))
+        self._remove_node_storage(n)
+        self._maybe_compact()
+        _clear_nx_cache(self)
+
+    def remove_nodes_from(self, nodes):
+        for n in nodes:
+            try:
+                if n in self._nidx:
+                    self._remove_node_storage(n)
+            except TypeError:
+                pass
+        self._maybe_compact()
+        _clear_nx_cache(self)
+
+    def clear(self):
+        self._detach_views()
+        self.graph.clear()
+        self._node.clear()
+        self._adj.clear()
+        self._reset_storage()
+        _clear_nx_cache(self)
+
+    def clear_edges(self):
+        self._detach_views()
+        num_nodes = len(self._nlabels)
+        self._eu = np.empty(0, dtype=_IDX_DTYPE)
+        self._ev = np.empty(0, dtype=_IDX_DTYPE)
+        self._ealive = np.empty(0, dtype=np.bool_)
+        self._ecols = {}
+        self._num_eids = 0
+        self._num_alive = 0
+        self._indptr = [0] * (num_nodes + 1)
+        self._row_dead = {}
+        self._nbr_cache = {}
+        self._indices = np.empty(0, dtype=_IDX_DTYPE)
+        self._ieids = np.empty(0, dtype=_IDX_DTYPE)
+        self._ckeys = np.empty(0, dtype=np.int64)
+        self._ckey_eids = np.empty(0, dtype=_IDX_DTYPE)
+        self._ncsr = num_nodes
+        self._pending = {}
+        self._num_pending = 0
+        self._deg = [0] * num_nodes
+        self._epoch += 1
+        _clear_nx_cache(self)
+
+    # --- networkx readers ---
+    # Subgraph views share this class but replace _adj with a filtered view,
+    # so the fast paths only apply to a graph that owns its arrays.
+
+    def _owns_arrays(self):
+        return type(self._adj) is _ArrayAdjacency
+
+    def number_of_edges(self, u=None, v=None):
+        if u is None and self._owns_arrays():
+            return self._num_alive
+        return super(ArrayGraph, self).number_of_edges(u, v)
+
+    def size(self, weight=None):
+        if weight is None and self._owns_arrays():
+            return self._num_alive
+        return super(ArrayGraph, self).size(weight)
+
+    def has_edge(self, u, v):
+        if type(self._adj) is _ArrayAdjacency:
+            nidx = self._nidx
+            ui = nidx.get(u, None)
+            vi = nidx.get(v, None)
+            return (ui is not None and vi is not None and
+                    self._find_eid(ui, vi) is not None)
+        return super(ArrayGraph, self).has_edge(u, v)
+
+    def copy(self, as_view=False):
+        if as_view or not self._owns_arrays():
+            return super(ArrayGraph, self).copy(as_view=as_view)
+        G = self.__class__()
+        G.graph.update(self.graph)
+        for attr in self._STORAGE_ATTRS:
+            val = getattr(self, attr)
+            setattr(G, attr, val.copy() if isinstance(val, np.ndarray) else val)
+        G._nidx = self._nidx.copy()
+        G._nlabels = list(self._nlabels)
+        G._deg = list(self._deg)
+        G._eu = self._eu.copy()
+        G._ev = self._ev.copy()
+        G._ealive = self._ealive.copy()
+        G._ecols = {key: col.copy() for key, col in self._ecols.items()}
+        G._indptr = list(self._indptr)
+        G._row_dead = self._row_dead.copy()
+        G._pending = {ui: pend.copy() for ui, pend in self._pending.items()}
+        G._node.update((n, d.copy()) for n, d in self._node.items())
+        G._adj.update((n, _ArrayNeighbors(G, n, ui))
+                      for n, ui in G._nidx.items())
+        return G
+
+    # --- bulk attribute access ---
+
+    def _gen_edge_items(self, key, edges, default, on_missing, on_keyerr):
+        if edges is None:
+            triples = list(self._iter_edge_eids())
+            edges = [(u, v) for u, v, _ in triples]
+            eids = [eid for _, _, eid in triples]
+        else:
+            edges = list(edges)
+            eids = self._lookup_eids(edges)
+        col = self._ecols.get(key, None)
+        if col is None:
+            values = [_MISSING] * len(edges)
+        elif len(eids) <= 32:
+            # values of missing edges (eid -1) are replaced below
+            values = [col.get(eid) for eid in eids]
+        else:
+            # one gather from the attribute column
+            values = col.take(eids)
+        for edge, eid, val in zip(edges, eids, values):
+            if eid < 0:
+                val = _MISSING
+                if on_missing == 'error':
+                    raise KeyError(edge[1])
+                elif on_missing == 'filter':
+                    continue
+            if val is _MISSING:
+                if on_keyerr == 'error':
+                    raise KeyError(key)
+                elif on_keyerr == 'filter':
+                    continue
+                val = default
+            yield edge, val
+
+    def gen_edge_attrs(self, key, edges=None, default=ut.NoParam,
+                       on_missing=None, on_keyerr='default'):
+        """
+        Columnar version of ``ut.nx_gen_edge_attrs`` with the same arguments
+        and results
+        """
+        if on_missing is None:
+            on_missing = 'error'
+        if default is ut.NoParam and on_keyerr == 'default':
+            on_keyerr = 'error'
+        if on_missing not in {'error', 'filter', 'default'}:
+            raise KeyError('on_missing={}'.format(on_missing))
+        if on_keyerr not in {'error', 'filter', 'default'}:
+            raise KeyError('on_keyerr={}'.format(on_keyerr))
+        return self._gen_edge_items(key, edges, default, on_missing, on_keyerr)
+
+    def gen_edge_values(self, key, edges=None, default=ut.NoParam,
+                        on_missing='error', on_keyerr='default'):
+        """
+        Columnar version of ``ut.nx_gen_edge_values`` with the same arguments
+        and results
+        """
+        if on_missing is None:
+            on_missing = 'error'
+        if on_keyerr is None:
+            on_keyerr = 'default'
+        if default is ut.NoParam and on_keyerr == 'default':
+            on_keyerr = 'error'
+        if on_missing not in {'error', 'default'}:
+            raise KeyError('on_missing={} must be error, filter or default'.format(
+                on_missing))
+        if on_keyerr not in {'error', 'default'}:
+            raise KeyError('on_keyerr={} must be error or default'.format(on_keyerr))
+        items = self._gen_edge_items(key, edges, default, on_missing, on_keyerr)
+        return (val for _, val in items)
+
+    def set_edge_attrs(self, key, edge_to_prop):
+        """
+        Columnar version of ``nx.set_edge_attributes`` for a dict of values.
+        Edges that are not in the graph are ignored.
+        """
+        if len(edge_to_prop) <= 32:
+            # not worth the array overhead
+            for edge, val in edge_to_prop.items():
+                eid = self._lookup_eid(*edge)
+                if eid is not None:
+                    self._set_edge_value(key, eid, val)
+            _clear_nx_cache(self)
+            return
+        edges = list(edge_to_prop.keys())
+        eids = np.array(self._lookup_eids(edges), dtype=np.int64)
+        vals = list(edge_to_prop.values())
+        if len(eids) and eids.min() < 0:
+            flags = eids >= 0
+            vals = ut.compress(vals, flags)
+            eids = eids[flags]
+        self._put_edge_values(key, eids, vals)
+        _clear_nx_cache(self)
+
+    def update_edge_attrs(self, edge, attr):
+        """
+        Sets several attributes of one edge with a single lookup. Does
+        nothing if the edge is not in the graph.
+        """
+        eid = self._lookup_eid(*edge)
+        if eid is not None:
+            for key, val in attr.items():
+                self._set_edge_value(key, eid, val)
+            _clear_nx_cache(self)
+
+    # --- snapshot support ---
+
+    def _export_adjacency(self):
+        """
+        The adjacency in the layout of ``_SnapshotWriter.graph``. Each edge
+        gets the index of its first appearance.
+        """
+        nodes = list(self._node)
+        nlabels = self._nlabels
+        eid_to_eidx = {}
+        edge_eids = []
+        offsets = [0]
+        nbr_flat = []
+        eidx_flat = []
+        for n in nodes:
+            for vi, eid in self._row(self._nidx[n]):
+                eidx = eid_to_eidx.get(eid, None)
+                if eidx is None:
+                    eidx = eid_to_eidx[eid] = len(edge_eids)
+                    edge_eids.append(eid)
+                nbr_flat.append(nlabels[vi])
+                eidx_flat.append(eidx)
+            offsets.append(len(nbr_flat))
+        eu = self._eu[edge_eids].tolist()
+        ev = self._ev[edge_eids].tolist()
+        edge_uv = [(nlabels[ui], nlabels[vi]) for ui, vi in zip(eu, ev)]
+        edge_data = [{} for _ in edge_eids]
+        for key, col in self._ecols.items():
+            for data, val in zip(edge_data, col.take(edge_eids)):
+                if val is not _MISSING:
+                    data[key] = val
+        return nodes, offsets, nbr_flat, eidx_flat, edge_uv, edge_data
+
+    def _import_adjacency(self, nodes, node_data, offsets, nbrs, eidxs,
+                          edge_uv, edge_data):
+        """
+        Loads an adjacency exported by :meth:`_export_adjacency` straight
+        into compacted arrays
+        """
+        self._detach_views()
+        self._node.clear()
+        self._adj.clear()
+        self._reset_storage()
+        self._nlabels = list(nodes)
+        self._nidx = {label: ui for ui, label in enumerate(nodes)}
+        self._node.update(zip(nodes, node_data))
+        self._adj.update((n, _ArrayNeighbors(self, n, ui))
+                         for ui, n in enumerate(nodes))
+        num_nodes = len(nodes)
+        indptr = np.array(offsets, dtype=np.int64)
+        self._deg = np.diff(indptr).tolist()
+        nidx = self._nidx
+        num_edges = len(edge_uv)
+        self._eu = np.array([nidx[u] for u, _ in edge_uv], dtype=_IDX_DTYPE)
+        self._ev = np.array([nidx[v] for _, v in edge_uv], dtype=_IDX_DTYPE)
+        self._ealive = np.ones(num_edges, dtype=np.bool_)
+        key_to_eids = ut.ddict(list)
+        key_to_vals = ut.ddict(list)
+        for eid, data in enumerate(edge_data):
+            for key, val in data.items():
+                key_to_eids[key].append(eid)
+                key_to_vals[key].append(val)
+        for key, eids in key_to_eids.items():
+            self._put_edge_values(key, np.array(eids, dtype=np.int64),
+                                  key_to_vals[key])
+        self._num_eids = self._num_alive = num_edges
+        rows = np.repeat(np.arange(num_nodes), np.diff(indptr))
+        indices = np.array([nidx[v] for v in nbrs], dtype=np.int64)
+        eids = np.array(eidxs, dtype=np.int64)
+        upper = rows <= indices
+        ckeys = rows[upper] * num_nodes + indices[upper]
+        keyx = ckeys.argsort()
+        self._indptr = list(offsets)
+        self._indices = indices.astype(_IDX_DTYPE)
+        self._ieids = eids.astype(_IDX_DTYPE)
+        self._ckeys = ckeys[keyx]
+        self._ckey_eids = eids[upper][keyx].astype(_IDX_DTYPE)
+        self._ncsr = num_nodes
+        _clear_nx_cache(self)
+
+
+class ArrayDynConnGraph(nx_dynamic_graph.DynConnGraph, ArrayGraph):
+    """
+    DynConnGraph with array storage. The union-find bookkeeping of
+    DynConnGraph is reused as is.
+
+    CommandLine:
+        python -m ibeis.algo.graph.array_graph ArrayDynConnGraph
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.graph.array_graph import *  # NOQA
+        >>> self = ArrayDynConnGraph()
+        >>> self.add_edges_from([(1, 2), (2, 3), (4, 5), (6, 7), (7, 4)])
+        >>> assert self._ccs == {1: {1, 2, 3}, 4: {4, 5, 6, 7}}
+        >>> self.add_edge(1, 5)
+        >>> assert self._ccs == {1: {1, 2, 3, 4, 5, 6, 7}}
+        >>> self.remove_edge(1, 5)
+        >>> assert self._ccs == {1: {1, 2, 3}, 4: {4, 5, 6, 7}}
+        >>> self.remove_node(2)
+        >>> assert self._ccs == {1: {1}, 3: {3}, 4: {4, 5, 6, 7}}
+        >>> other = self.copy()
+        >>> assert other._ccs == self._ccs and other is not self
+        >>> print(other.__nice__())
+        nNodes=6, nEdges=3, nCCs=3
+    """
+
+    def copy(self, as_view=False):
+        G = super(ArrayDynConnGraph, self).copy(as_view=as_view)
+        if not as_view and self._owns_arrays():
+            G._ccs = {label: set(cc) for label, cc in self._ccs.items()}
+            G._union_find.parents = self._union_find.parents.copy()
+            G._union_find.weights = self._union_find.weights.copy()
+        return G
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.graph.array_graph
+        python -m ibeis.algo.graph.array_graph --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
@@ -3,12 +3,12 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import numpy as np  # NOQA
 import utool as ut
 # import logging
-import itertools as it
 import copy
 import six
 import collections
 from ibeis import constants as const
 from ibeis.algo.graph import nx_dynamic_graph
+from ibeis.algo.graph import array_graph
 # from ibeis.algo.graph import _dep_mixins
 from ibeis.algo.graph import mixin_viz
 from ibeis.algo.graph import mixin_helpers
@@ -19,6 +19,7 @@ from ibeis.algo.graph import mixin_matching
 from ibeis.algo.graph import mixin_groundtruth
 from ibeis.algo.graph import mixin_simulation
 from ibeis.algo.graph import mixin_ibeis
+from ibeis.algo.graph import mixin_snapshot
 from ibeis.algo.graph import nx_utils as nxu
 import pandas as pd
 from ibeis.algo.graph.state import POSTV, NEGTV, INCMP, UNREV, UNKWN
@@ -32,6 +33,9 @@ print, rrr, profile = ut.inject2(__name__)
 DEBUG_CC = False
 # DEBUG_CC = True
 
+# Store the annotation and review graphs in arrays (see array_graph)
+USE_ARRAY_GRAPH = ut.get_argflag('--array-graph')
+
 
 def _rectify_decision(evidence_decision, meta_decision):
     """
@@ -62,6 +66,11 @@ class Feedback(object):
         if aid2 not in infr.aids_set:
             raise ValueError('aid2=%r is not part of the graph' % (aid2,))
 
+    def _next_review_id(infr):
+        review_id = infr.review_counter
+        infr.review_counter += 1
+        return review_id
+
     def add_feedback_from(infr, items, verbose=None, **kwargs):
         if verbose is None:
             verbose = infr.verbose > 5
@@ -218,7 +227,7 @@ class Feedback(object):
         # Keep track of sequential reviews and set properties on global graph
         num_reviews = infr.get_edge_attr(edge, 'num_reviews', default=0)
 
-        review_id = next(infr.review_counter)
+        review_id = infr._next_review_id()
         feedback_item = {
             'tags': tags,
             'evidence_decision': evidence_decision,
@@ -322,7 +331,7 @@ class Feedback(object):
         for edge, vals in infr.all_feedback_items():
             # hack for feedback rectification
             feedback_item = infr._rectify_feedback_item(vals)
-            feedback_item['review_id'] = next(infr.review_counter)
+            feedback_item['review_id'] = infr._next_review_id()
             feedback_item['num_reviews'] = len(vals)
             # if feedback_item['decision'] == 'unknown':
             #     continue
@@ -809,7 +818,7 @@ class MiscHelpers(object):
         else:
             infr.graph = graph
 
-        infr.review_graphs[POSTV] = nx_dynamic_graph.DynConnGraph()
+        infr.review_graphs[POSTV] = infr._dyn_graph_cls()
         infr.review_graphs[NEGTV] = infr._graph_cls()
         infr.review_graphs[INCMP] = infr._graph_cls()
         infr.review_graphs[UNKWN] = infr._graph_cls()
@@ -873,7 +882,15 @@ class MiscHelpers(object):
 
 
 class AltConstructors(object):
-    _graph_cls = nx_dynamic_graph.NiceGraph
+    if USE_ARRAY_GRAPH:
+        _graph_cls = array_graph.ArrayGraph
+        _dyn_graph_cls = array_graph.ArrayDynConnGraph
+    else:
+        _graph_cls = nx_dynamic_graph.NiceGraph
+        _dyn_graph_cls = nx_dynamic_graph.DynConnGraph
+    # The PCC metagraphs are small and rewired on every merge and split, so
+    # they stay networkx graphs with either backend.
+    _meta_graph_cls = nx_dynamic_graph.NiceGraph
     # _graph_cls = nx.Graph
     # nx.Graph
     # _graph_cls = nx.DiGraph
@@ -1015,6 +1032,7 @@ class AnnotInference(ut.NiceRepr,
                      mixin_groundtruth.Groundtruth,
                      mixin_ibeis.IBEISIO,
                      mixin_ibeis.IBEISGroundtruth,
+                     mixin_snapshot.Snapshot,
                      # _dep_mixins._AnnotInfrDepMixin,
                      ):
     """
@@ -1186,22 +1204,25 @@ class AnnotInference(ut.NiceRepr,
         infr.queue = ut.PriorityQueue()
         infr.refresh = None
 
-        infr.review_counter = it.count(0)
+        # The next review id. Kept as an int so snapshots can store it
+        infr.review_counter = 0
         infr.nid_counter = None
+        # Latest staging review reflected in the graph (see save_snapshot)
+        infr.staging_rowid = None
 
         # Dynamic Properties (requires bookkeeping)
         infr.nid_to_errors = {}
         infr.recovery_ccs = []
 
         # Recover graph holds positive edges of inconsistent PCCs
-        infr.recover_graph = nx_dynamic_graph.DynConnGraph()
+        infr.recover_graph = infr._dyn_graph_cls()
         # Set of PCCs that are positive redundant
         infr.pos_redun_nids = set([])
         # Represents the metagraph of negative edges between PCCs
-        infr.neg_redun_metagraph = infr._graph_cls()
+        infr.neg_redun_metagraph = infr._meta_graph_cls()
         # NEW VERSION: metagraph of PCCs with ANY number of negative edges
         # between them. The weight on the edge should represent the strength.
-        infr.neg_metagraph = infr._graph_cls()
+        infr.neg_metagraph = infr._meta_graph_cls()
 
         infr.print('__init__ feedback', level=1)
 
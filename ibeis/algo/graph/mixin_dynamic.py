@@ -208,39 +208,44 @@ class DynamicUpdate(object):
             accordingly.
         """
         nmg = infr.neg_metagraph
+        # Meta edge weights are read and written in bulk (see
+        # array_graph.ArrayGraph.gen_edge_values)
+        ne = (nid1, nid2)
 
         if decision == NEGTV and prev_decision != NEGTV:
             # New negative feedback. Add meta edge or increase weight
             if not nmg.has_edge(nid1, nid2):
                 nmg.add_edge(nid1, nid2, weight=1)
             else:
-                nmg.edges[nid1, nid2]['weight'] += 1
+                weight, = nmg.gen_edge_values('weight', [ne])
+                nmg.set_edge_attrs('weight', {ne: weight + 1})
         elif decision != NEGTV and prev_decision == NEGTV:
             # Undid negative feedback. Remove meta edge or decrease weight.
-            nmg.edges[nid1, nid2]['weight'] -= 1
-            if nmg.edges[nid1, nid2]['weight'] == 0:
+            weight, = nmg.gen_edge_values('weight', [ne])
+            if weight == 1:
                 nmg.remove_edge(nid1, nid2)
+            else:
+                nmg.set_edge_attrs('weight', {ne: weight - 1})
 
         if merge_nid:
             # Combine the negative edges between the merged PCCS
             assert split_nids is None
             # Find external nids marked as negative
-            prev_edges = nmg.edges(nbunch=[nid1, nid2], data=True)
+            prev_edges = [(u, v) for u in (nid1, nid2) if nmg.has_node(u)
+                          for v in nmg.adj[u] if u == nid1 or v != nid1]
+            prev_weights = nmg.gen_edge_values('weight', prev_edges)
             # Map external neg edges onto new merged PCC
             # Accumulate weights between duplicate new name edges
             lookup = {nid1: merge_nid, nid2: merge_nid}
             ne_accum = {}
-            for (u, v, d) in prev_edges:
+            for (u, v), weight in zip(prev_edges, prev_weights):
                 new_ne = infr.e_(lookup.get(u, u), lookup.get(v, v))
-                if new_ne in ne_accum:
-                    ne_accum[new_ne]['weight'] += d['weight']
-                else:
-                    ne_accum[new_ne] = d
-            merged_edges = ((u, v, d) for (u, v), d in ne_accum.items())
+                ne_accum[new_ne] = ne_accum.get(new_ne, 0) + weight
 
             nmg.remove_nodes_from([nid1, nid2])
             nmg.add_node(merge_nid)
-            nmg.add_edges_from(merged_edges)
+            nmg.add_edges_from(ne_accum.keys())
+            nmg.set_edge_attrs('weight', ne_accum)
 
         if split_nids:
             # Splitup the negative edges between the split PCCS
@@ -256,7 +261,7 @@ class DynamicUpdate(object):
 
             # Determine how to split existing negative edges between the split
             # by going back to the original negative graph.
-            split_edges = []
+            split_weights = {}
             for new_nid in split_nids:
                 cc1 = infr.pos_graph.component(new_nid)
                 for other_nid in extern_nids:
@@ -264,12 +269,12 @@ class DynamicUpdate(object):
                     num = sum(1 for _ in nxu.edges_between(
                         infr.neg_graph, cc1, cc2, assume_dense=False))
                     if num:
-                        split_edges.append(
-                            (new_nid, other_nid, {'weight': num}))
+                        split_weights[(new_nid, other_nid)] = num
 
             nmg.remove_node(old_nid)
             nmg.add_nodes_from(split_nids)
-            nmg.add_edges_from(split_edges)
+            nmg.add_edges_from(split_weights.keys())
+            nmg.set_edge_attrs('weight', split_weights)
 
     @profile
     def _positive_decision(infr, edge):
@@ -1335,12 +1340,13 @@ class NonDynamicUpdate(object):
         # * negative redundancy
         # * inconsistency
         infr.pos_redun_nids = set(infr.find_pos_redun_nids())
-        infr.neg_redun_metagraph = infr._graph_cls(list(infr.find_neg_redun_nids()))
+        infr.neg_redun_metagraph = infr._meta_graph_cls(
+            list(infr.find_neg_redun_nids()))
 
         # make a node for each PCC, and place an edge between any pccs with at
         # least one negative edge, with weight being the number of negative
         # edges. Self loops indicate inconsistency.
-        infr.neg_metagraph = infr._graph_cls()
+        infr.neg_metagraph = infr._meta_graph_cls()
         infr.neg_metagraph.add_nodes_from(infr.pos_graph.component_labels())
         for (nid1, nid2), edges in ne_to_edges[NEGTV].items():
             infr.neg_metagraph.add_edge(nid1, nid2, weight=len(edges))
@@ -11,6 +11,7 @@ from ibeis.algo.graph.state import POSTV, NEGTV, INCMP, UNREV, UNKWN
 from ibeis.algo.graph.state import SAME, DIFF, NULL  # NOQA
 from ibeis.algo.graph.nx_utils import e_
 from ibeis.algo.graph import nx_utils as nxu
+from ibeis.algo.graph.array_graph import ArrayGraph
 import six
 print, rrr, profile = ut.inject2(__name__)
 
@@ -28,6 +29,9 @@ class AttrAccess(object):
     def gen_edge_attrs(infr, key, edges=None, default=ut.NoParam,
                        on_missing=None):
         """ maybe change to gen edge items """
+        if isinstance(infr.graph, ArrayGraph):
+            return infr.graph.gen_edge_attrs(
+                key, edges=edges, default=default, on_missing=on_missing)
         return ut.util_graph.nx_gen_edge_attrs(
                 infr.graph, key, edges=edges, default=default,
                 on_missing=on_missing)
@@ -38,6 +42,10 @@ class AttrAccess(object):
 
     def gen_edge_values(infr, key, edges=None, default=ut.NoParam,
                         on_missing='error', on_keyerr='default'):
+        if isinstance(infr.graph, ArrayGraph):
+            return infr.graph.gen_edge_values(
+                key, edges, default=default, on_missing=on_missing,
+                on_keyerr=on_keyerr)
         return ut.util_graph.nx_gen_edge_values(
             infr.graph, key, edges, default=default, on_missing=on_missing,
             on_keyerr=on_keyerr)
@@ -74,6 +82,8 @@ class AttrAccess(object):
 
     def set_edge_attrs(infr, key, edge_to_prop):
         """ Networkx edge setter helper """
+        if isinstance(infr.graph, ArrayGraph) and isinstance(edge_to_prop, dict):
+            return infr.graph.set_edge_attrs(key, edge_to_prop)
         return nx.set_edge_attributes(infr.graph, name=key, values=edge_to_prop)
 
     def get_edge_attr(infr, edge, key, default=ut.NoParam, on_missing='error'):
@@ -83,6 +93,8 @@ class AttrAccess(object):
 
     def set_edge_attr(infr, edge, attr):
         """ single edge setter helper """
+        if isinstance(infr.graph, ArrayGraph):
+            return infr.graph.update_edge_attrs(edge, attr)
         for key, value in attr.items():
             infr.set_edge_attrs(key, {edge: value})
 
@@ -544,8 +544,16 @@ class IBEISIO(object):
         # TODO: READ ONLY AFTER THE LATEST ANNOTMATCH TIME STAMP
 
         infr.print('read_ibeis_staging_feedback', 1)
-        ibs = infr.ibs
+        review_ids = infr._get_staging_review_rowids(edges)
+        infr.print('read %d staged reviews' % (len(review_ids)), 2)
+        feedback = ut.ddict(list)
+        for edge, feedback_item in infr._read_ibeis_staging_items(review_ids):
+            feedback[edge].append(feedback_item)
+        return feedback
 
+    def _get_staging_review_rowids(infr, edges=None):
+        """ Sorted staging review rowids between the nodes (or on edges) """
+        ibs = infr.ibs
         from ibeis.control.manual_review_funcs import hack_create_aidpair_index
         hack_create_aidpair_index(ibs)
 
@@ -553,10 +561,14 @@ class IBEISIO(object):
             review_ids = ut.flatten(ibs.get_review_rowids_from_edges(edges))
         else:
             review_ids = ibs.get_review_rowids_between(infr.aids)
+        return sorted(review_ids)
 
-        review_ids = sorted(review_ids)
-
-        infr.print('read %d staged reviews' % (len(review_ids)), 2)
+    def _read_ibeis_staging_items(infr, review_ids):
+        """
+        Returns (edge, feedback_item) pairs for staging reviews in the order of
+        review_ids
+        """
+        ibs = infr.ibs
 
         from ibeis.control.manual_review_funcs import (
             # REVIEW_UUID,
@@ -591,7 +603,7 @@ class IBEISIO(object):
         lookup_meta = ibs.const.META_DECISION.INT_TO_CODE
         lookup_conf = ibs.const.CONFIDENCE.INT_TO_CODE
 
-        feedback = ut.ddict(list)
+        items = []
         for data in review_data:
             feedback_item = dict(zip(feedback_keys, data))
             aid1 = feedback_item.pop('aid1')
@@ -604,8 +616,8 @@ class IBEISIO(object):
             feedback_item['confidence'] = lookup_conf[feedback_item['confidence']]
             feedback_item['tags'] =  [] if not tags else tags.split(';')
 
-            feedback[edge].append(feedback_item)
-        return feedback
+            items.append((edge, feedback_item))
+        return items
 
     def read_ibeis_annotmatch_feedback(infr, edges=None):
         r"""
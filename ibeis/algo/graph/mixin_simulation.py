@@ -59,7 +59,6 @@ class SimulationHelpers(object):
         infr.params['algo.max_outer_loops'] = max_outer_loops
 
     def init_test_mode(infr):
-        from ibeis.algo.graph import nx_dynamic_graph
         infr.print('init_test_mode')
         infr.test_mode = True
         # infr.edge_truth = {}
@@ -72,7 +71,7 @@ class SimulationHelpers(object):
             'n_error_edges': 0,
             'confusion': None,
         }
-        infr.test_gt_pos_graph = nx_dynamic_graph.DynConnGraph()
+        infr.test_gt_pos_graph = infr._dyn_graph_cls()
         infr.test_gt_pos_graph.add_nodes_from(infr.aids)
         infr.nid_to_gt_cc = ut.group_items(infr.aids, infr.orig_name_labels)
         infr.node_truth = ut.dzip(infr.aids, infr.orig_name_labels)
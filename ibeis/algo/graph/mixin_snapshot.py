@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary snapshots of the AnnotInference graph state.
+
+Initializing an AnnotInference from a large database (reading the review
+tables, building the review graphs, ensure_mst, apply_nondynamic_update) can
+take minutes. A snapshot stores the computed state so a new session can warm
+start from it and only replay the staging reviews that were added since.
+
+A snapshot is a single pickle-free ``.npz`` file. Graphs are stored as their
+exact adjacency (node order, neighbor order and one attribute row per edge)
+so iteration order, and therefore review order, survives a round trip.
+Attribute dictionaries are stored column-wise: booleans, integers and floats
+as typed arrays, strings as categorical codes and everything else as JSON.
+
+CommandLine:
+    python -m ibeis.algo.graph.mixin_snapshot --allexamples
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import six
+import json
+import itertools as it
+import numpy as np
+import utool as ut
+from ibeis.algo.graph import nx_dynamic_graph
+from ibeis.algo.graph import array_graph
+from ibeis.algo.graph.state import POSTV, NEGTV, INCMP, UNREV, UNKWN
+print, rrr, profile = ut.inject2(__name__)
+
+
+SNAPSHOT_VERSION = 1
+_MISSING = object()
+
+
+def _is_bool(val):
+    return isinstance(val, (bool, np.bool_))
+
+
+def _is_int(val):
+    return isinstance(val, (int, np.integer)) and not _is_bool(val)
+
+
+def _is_float(val):
+    return isinstance(val, (float, np.floating))
+
+
+class _SnapshotWriter(object):
+    """ Collects the arrays and the json header of a snapshot """
+    def __init__(writer):
+        writer.arrays = {}
+        writer.header = {}
+
+    def array(writer, key, arr, dtype=None):
+        writer.arrays[key] = np.asarray(arr, dtype=dtype)
+
+    def json(writer, key, data):
+        text = ut.to_json(data)
+        writer.arrays[key] = np.frombuffer(text.encode('utf8'), dtype=np.uint8)
+
+    def column(writer, key, values):
+        """
+        Stores a list of values where ``_MISSING`` marks an absent value.
+        Returns the spec needed to decode it.
+        """
+        present = np.array([val is not _MISSING for val in values], dtype=bool)
+        vals = [val for val in values if val is not _MISSING]
+        spec = {'partial': not present.all()}
+        if spec['partial']:
+            writer.array(key + ':m', present)
+        if len(vals) > 0 and all(_is_bool(val) for val in vals):
+            spec['kind'] = 'bool'
+            writer.array(key + ':v', vals, dtype=bool)
+        elif len(vals) > 0 and all(_is_int(val) for val in vals):
+            spec['kind'] = 'int'
+            writer.array(key + ':v', vals, dtype=np.int64)
+        elif len(vals) > 0 and all(_is_float(val) for val in vals):
+            spec['kind'] = 'float'
+            writer.array(key + ':v', vals, dtype=np.float64)
+        elif len(vals) > 0 and all(isinstance(val, six.string_types)
+                                   for val in vals):
+            spec['kind'] = 'str'
+            cats, codes = np.unique(np.array(vals, dtype=object),
+                                    return_inverse=True)
+            spec['cats'] = cats.tolist()
+            writer.array(key + ':v', codes, dtype=np.int32)
+        else:
+            spec['kind'] = 'json'
+            writer.json(key + ':v', vals)
+        return spec
+
+    def table(writer, key, rows):
+        """ Stores a list of flat dicts column-wise """
+        colnames = list(ut.unique(it.chain.from_iterable(rows)))
+        writer.header[key] = {
+            'num': len(rows),
+            'cols': [
+                (colname, writer.column(
+                    key + '/' + colname,
+                    [row.get(colname, _MISSING) for row in rows]))
+                for colname in colnames
+            ]
+        }
+
+    def edges(writer, key, edges):
+        writer.array(key, np.array(edges, dtype=np.int64).reshape(-1, 2))
+
+    def graph(writer, key, graph, node_attrs=True):
+        """
+        Stores the exact adjacency of a networkx graph. Edge data dicts are
+        shared between both directions, so each edge is stored once.
+        """
+        if isinstance(graph, array_graph.ArrayGraph):
+            # edge attrs are views here, so edges are identified by edge id
+            (nodes, offsets, nbr_flat, eidx_flat, edge_uv,
+             edge_data) = graph._export_adjacency()
+        else:
+            nodes = list(graph.nodes())
+            adj = graph.adj
+            edge_ids = {}
+            edge_uv = []
+            edge_data = []
+            offsets = [0]
+            nbr_flat = []
+            eidx_flat = []
+            for u in nodes:
+                for v, data in adj[u].items():
+                    eidx = edge_ids.get(id(data), None)
+                    if eidx is None:
+                        eidx = edge_ids[id(data)] = len(edge_uv)
+                        edge_uv.append((u, v))
+                        edge_data.append(data)
+                    nbr_flat.append(v)
+                    eidx_flat.append(eidx)
+                offsets.append(len(nbr_flat))
+        writer.array(key + '/nodes', nodes, dtype=np.int64)
+        writer.array(key + '/offsets', offsets, dtype=np.int64)
+        writer.array(key + '/nbrs', nbr_flat, dtype=np.int64)
+        writer.array(key + '/eidx', eidx_flat, dtype=np.int64)
+        writer.edges(key + '/edges', edge_uv)
+        writer.table(key + '/edata', edge_data)
+        if node_attrs:
+            writer.table(key + '/ndata',
+                         [graph.nodes[node] for node in nodes])
+        if isinstance(graph, nx_dynamic_graph.DynConnGraph):
+            union_find = graph._union_find
+            elements = list(union_find.parents.keys())
+            writer.array(key + '/uf_elements', elements, dtype=np.int64)
+            writer.array(key + '/uf_parents',
+                         ut.take(union_find.parents, elements), dtype=np.int64)
+            writer.array(key + '/uf_weights',
+                         ut.take(union_find.weights, elements), dtype=np.int64)
+            writer.groups(key + '/ccs', list(graph._ccs.keys()),
+                          list(graph._ccs.values()))
+
+    def groups(writer, key, labels, groups):
+        """ Stores a list of integer collections with optional labels """
+        if labels is not None:
+            writer.array(key + '/labels', labels, dtype=np.int64)
+        groups = [list(group) for group in groups]
+        writer.array(key + '/offsets',
+                     np.cumsum([0] + list(map(len, groups))), dtype=np.int64)
+        writer.array(key + '/flat', list(it.chain.from_iterable(groups)),
+                     dtype=np.int64)
+
+    def save(writer, fpath):
+        writer.json('__header__', writer.header)
+        # Write to a temporary file first so a crash never leaves a partial
+        # snapshot behind
+        temp_fpath = fpath + '.tmp'
+        with open(temp_fpath, 'wb') as file_:
+            np.savez_compressed(file_, **writer.arrays)
+        os.replace(temp_fpath, fpath)
+
+
+class _SnapshotReader(object):
+    """ Decodes a snapshot written by _SnapshotWriter """
+    def __init__(reader, fpath):
+        with np.load(fpath, allow_pickle=False) as data:
+            reader.arrays = {key: data[key] for key in data.files}
+        reader.header = reader.json('__header__')
+
+    def array(reader, key):
+        return reader.arrays[key]
+
+    def json(reader, key):
+        return json.loads(reader.arrays[key].tobytes().decode('utf8'))
+
+    def column(reader, key, spec, num):
+        kind = spec['kind']
+        if kind == 'json':
+            vals = reader.json(key + ':v')
+        elif kind == 'str':
+            cats = spec['cats']
+            vals = [cats[code] for code in reader.array(key + ':v').tolist()]
+        else:
+            vals = reader.array(key + ':v').tolist()
+        if not spec['partial']:
+            return vals
+        values = [_MISSING] * num
+        for idx, val in zip(np.flatnonzero(reader.array(key + ':m')), vals):
+            values[idx] = val
+        return values
+
+    def table(reader, key):
+        info = reader.header[key]
+        num = info['num']
+        rows = [{} for _ in range(num)]
+        for colname, spec in info['cols']:
+            values = reader.column(key + '/' + colname, spec, num)
+            for row, val in zip(rows, values):
+                if val is not _MISSING:
+                    row[colname] = val
+        return rows
+
+    def edges(reader, key):
+        return list(map(tuple, reader.array(key).tolist()))
+
+    def groups(reader, key):
+        bounds = reader.array(key + '/offsets').tolist()
+        flat = reader.array(key + '/flat').tolist()
+        groups = [flat[start:stop]
+                  for start, stop in zip(bounds[:-1], bounds[1:])]
+        labels = reader.arrays.get(key + '/labels', None)
+        if labels is not None:
+            labels = labels.tolist()
+        return labels, groups
+
+    def graph(reader, key, graph):
+        """
+        Fills an empty graph with the stored adjacency. This writes the
+        adjacency dicts directly instead of replaying add_edge so that
+        neighbor order is exactly preserved (and DynConnGraph does not redo
+        its union-find work).
+        """
+        nodes = reader.array(key + '/nodes').tolist()
+        bounds = reader.array(key + '/offsets').tolist()
+        nbrs = reader.array(key + '/nbrs').tolist()
+        eidxs = reader.array(key + '/eidx').tolist()
+        edge_data = reader.table(key + '/edata')
+        if (key + '/ndata') in reader.header:
+            node_data = reader.table(key + '/ndata')
+        else:
+            node_data = [{} for _ in nodes]
+        if isinstance(graph, array_graph.ArrayGraph):
+            edge_uv = reader.edges(key + '/edges')
+            graph._import_adjacency(nodes, node_data, bounds, nbrs, eidxs,
+                                    edge_uv, edge_data)
+        else:
+            graph._node.clear()
+            graph._adj.clear()
+            for node, ndata, start, stop in zip(nodes, node_data, bounds[:-1],
+                                                bounds[1:]):
+                graph._node[node] = ndata
+                graph._adj[node] = {
+                    nbr: edge_data[eidx]
+                    for nbr, eidx in zip(nbrs[start:stop], eidxs[start:stop])
+                }
+        if isinstance(graph, nx_dynamic_graph.DynConnGraph):
+            elements = reader.array(key + '/uf_elements').tolist()
+            union_find = graph._union_find
+            union_find.parents = ut.dzip(
+                elements, reader.array(key + '/uf_parents').tolist())
+            union_find.weights = ut.dzip(
+                elements, reader.array(key + '/uf_weights').tolist())
+            labels, groups = reader.groups(key + '/ccs')
+            graph._ccs = {label: set(group)
+                          for label, group in zip(labels, groups)}
+        cache = getattr(graph, '__networkx_cache__', None)
+        if cache is not None:
+            cache.clear()
+        return graph
+
+
+class Snapshot(object):
+    """
+    Saving and loading of the graph state for warm starting a session.
+
+    CommandLine:
+        python -m ibeis.algo.graph.mixin_snapshot Snapshot
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.graph.mixin_snapshot import *  # NOQA
+        >>> from ibeis.algo.graph import demo
+        >>> import ibeis
+        >>> infr = demo.demodata_infr(num_pccs=10, p_incon=.3, size=4)
+        >>> infr.ensure_task_probs(list(infr.edges()))
+        >>> infr.prioritize()
+        >>> infr.add_feedback((1, 5), POSTV)
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'tests')
+        >>> fpath = os.path.join(dpath, 'infr_snapshot.npz')
+        >>> infr.save_snapshot(fpath)
+        >>> infr2 = ibeis.AnnotInference.load_snapshot(fpath)
+        >>> assert infr2.snapshot_state_equal(infr)
+        >>> # Both copies continue identically
+        >>> infr.add_feedback((2, 6), NEGTV)
+        >>> infr2.add_feedback((2, 6), NEGTV)
+        >>> assert infr2.snapshot_state_equal(infr)
+        >>> assert infr2._peek_many(5) == infr._peek_many(5)
+        >>> print(infr2)
+        <AnnotInference(nNodes=40, nEdges=..., nCCs=...)>
+    """
+
+    def save_snapshot(infr, fpath):
+        """
+        Writes the graph state to ``fpath``.
+
+        The snapshot holds the annotation graph and its attributes, the
+        review graphs, the positive union-find, the redundancy and error
+        bookkeeping, the priority queue, the feedback, and the cached edge
+        task probabilities. Verifiers, rankers and the review generator are
+        not stored.
+
+        If the inference is attached to a database, all feedback must
+        already be written to staging. The latest staging review is recorded
+        so replay_staging_feedback can apply newer reviews after loading.
+        """
+        staging_rowid = None
+        if infr.ibs is not None:
+            if len(infr.internal_feedback) > 0:
+                raise ValueError(
+                    'Write internal feedback to staging before saving a '
+                    'snapshot (see write_ibeis_staging_feedback)')
+            review_ids = infr._get_staging_review_rowids()
+            staging_rowid = max(review_ids) if len(review_ids) else 0
+        infr.print('save_snapshot fpath={}'.format(fpath), 1)
+        writer = _SnapshotWriter()
+        writer.json('meta', {
+            'version': SNAPSHOT_VERSION,
+            'name': infr.name,
+            'dirty': infr.dirty,
+            'readonly': infr.readonly,
+            'nid_counter': infr.nid_counter,
+            'review_counter': infr.review_counter,
+            'staging_rowid': staging_rowid,
+            'params': infr.params,
+            'task_thresh': infr.task_thresh,
+            'ranker_params': infr.ranker_params,
+            'verifier_params': infr.verifier_params,
+            'tasks': list(infr.task_probs.keys()),
+        })
+        writer.array('aids', infr.aids, dtype=np.int64)
+        writer.array('orig_name_labels', infr.orig_name_labels,
+                     dtype=np.int64)
+        writer.graph('graph', infr.graph)
+        for key, graph in infr.review_graphs.items():
+            writer.graph('review/' + key, graph, node_attrs=False)
+        writer.graph('recover_graph', infr.recover_graph, node_attrs=False)
+        writer.graph('neg_redun_metagraph', infr.neg_redun_metagraph)
+        writer.graph('neg_metagraph', infr.neg_metagraph)
+        writer.array('pos_redun_nids', sorted(infr.pos_redun_nids),
+                     dtype=np.int64)
+        writer.groups('nid_to_errors', list(infr.nid_to_errors.keys()),
+                      [ut.flatten(sorted(errors))
+                       for errors in infr.nid_to_errors.values()])
+        writer.groups('recovery_ccs', None, infr.recovery_ccs)
+        # The queue maps edges to (-priority, tiebreaker)
+        queue_items = list(infr.queue._dict.items())
+        writer.edges('queue/edges', [edge for edge, _ in queue_items])
+        writer.array('queue/priority', [val[0] for _, val in queue_items],
+                     dtype=np.float64)
+        tiebreakers = [val[1] for _, val in queue_items]
+        if any(tie != edge for tie, (edge, _) in zip(tiebreakers, queue_items)):
+            writer.json('queue/tiebreakers', tiebreakers)
+        for key in ['external_feedback', 'internal_feedback']:
+            feedback = getattr(infr, key)
+            writer.edges(key + '/edges', [
+                edge for edge, items in feedback.items() for _ in items])
+            writer.table(key + '/items', list(it.chain.from_iterable(
+                feedback.values())))
+        writer.edges('edge_truth/edges', list(infr.edge_truth.keys()))
+        writer.header['edge_truth'] = writer.column(
+            'edge_truth/truth', list(infr.edge_truth.values()))
+        for task, probs in infr.task_probs.items():
+            writer.edges('task_probs/' + task + '/edges', list(probs.keys()))
+            writer.table('task_probs/' + task + '/probs', list(probs.values()))
+        writer.save(fpath)
+        infr.staging_rowid = staging_rowid
+
+    @classmethod
+    def load_snapshot(AnnotInference, fpath, ibs=None, verbose=False):
+        """
+        Creates an AnnotInference from a snapshot written by save_snapshot.
+        """
+        reader = _SnapshotReader(fpath)
+        meta = reader.json('meta')
+        if meta['version'] != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported snapshot version=%r' % (
+                meta['version'],))
+        infr = AnnotInference(ibs, aids=[], autoinit=False, verbose=verbose)
+        infr.print('load_snapshot fpath={}'.format(fpath), 1)
+        infr.aids = reader.array('aids').tolist()
+        infr.aids_set = set(infr.aids)
+        infr.orig_name_labels = reader.array('orig_name_labels').tolist()
+        infr.name = meta['name']
+        infr.dirty = meta['dirty']
+        infr.readonly = meta['readonly']
+        infr.nid_counter = meta['nid_counter']
+        infr.review_counter = meta['review_counter']
+        infr.staging_rowid = meta['staging_rowid']
+        infr.params.update(meta['params'])
+        infr.task_thresh = meta['task_thresh']
+        infr.ranker_params = meta['ranker_params']
+        infr.verifier_params = meta['verifier_params']
+
+        infr.graph = reader.graph('graph', infr._graph_cls())
+        infr.review_graphs = {
+            POSTV: infr._dyn_graph_cls(),
+            NEGTV: infr._graph_cls(),
+            INCMP: infr._graph_cls(),
+            UNKWN: infr._graph_cls(),
+            UNREV: infr._graph_cls(),
+        }
+        for key, graph in infr.review_graphs.items():
+            reader.graph('review/' + key, graph)
+        reader.graph('recover_graph', infr.recover_graph)
+        reader.graph('neg_redun_metagraph', infr.neg_redun_metagraph)
+        reader.graph('neg_metagraph', infr.neg_metagraph)
+        infr.pos_redun_nids = set(reader.array('pos_redun_nids').tolist())
+        labels, groups = reader.groups('nid_to_errors')
+        infr.nid_to_errors = {
+            nid: set(zip(flat[0::2], flat[1::2]))
+            for nid, flat in zip(labels, groups)
+        }
+        infr.recovery_ccs = [set(cc) for cc in
+                             reader.groups('recovery_ccs')[1]]
+        queue_edges = reader.edges('queue/edges')
+        priorities = reader.array('queue/priority').tolist()
+        if 'queue/tiebreakers' in reader.arrays:
+            tiebreakers = list(map(tuple, reader.json('queue/tiebreakers')))
+        else:
+            tiebreakers = queue_edges
+        infr.queue = ut.PriorityQueue()
+        infr.queue.update(list(zip(queue_edges, zip(priorities, tiebreakers))))
+        for key in ['external_feedback', 'internal_feedback']:
+            feedback = ut.ddict(list)
+            items = reader.table(key + '/items')
+            for edge, item in zip(reader.edges(key + '/edges'), items):
+                feedback[edge].append(item)
+            setattr(infr, key, feedback)
+        truths = reader.column('edge_truth/truth', reader.header['edge_truth'],
+                               None)
+        infr.edge_truth = ut.dzip(reader.edges('edge_truth/edges'), truths)
+        infr.task_probs = ut.ddict(dict)
+        for task in meta['tasks']:
+            infr.task_probs[task] = ut.dzip(
+                reader.edges('task_probs/' + task + '/edges'),
+                reader.table('task_probs/' + task + '/probs'))
+        return infr
+
+    def replay_staging_feedback(infr):
+        """
+        Applies the staging reviews that were added after the snapshot was
+        saved, in the order they were made. The replayed reviews become
+        external feedback because they are already in staging.
+
+        Returns:
+            int: number of replayed reviews
+        """
+        assert infr.ibs is not None, 'need a database to replay staging'
+        review_ids = infr._get_staging_review_rowids()
+        last_rowid = infr.staging_rowid or 0
+        new_ids = sorted([rowid for rowid in review_ids if rowid > last_rowid])
+        infr.print('replay %d staged reviews' % (len(new_ids),), 1)
+        prev_internal = infr.internal_feedback
+        infr.internal_feedback = ut.ddict(list)
+        for edge, item in infr._read_ibeis_staging_items(new_ids):
+            item = ut.delete_dict_keys(item.copy(), ['num_reviews'])
+            infr.add_feedback(edge, **item)
+        for edge, feedbacks in infr.internal_feedback.items():
+            infr.external_feedback[edge].extend(feedbacks)
+        infr.internal_feedback = prev_internal
+        if len(new_ids) > 0:
+            infr.staging_rowid = max(new_ids)
+        return len(new_ids)
+
+    def snapshot_state_equal(infr, other):
+        """
+        Checks that two inference objects have the same snapshot state
+        """
+        def graph_state(graph):
+            state = (list(graph.nodes(data=True)),
+                     [(u, list(graph.adj[u].items())) for u in graph.nodes()])
+            if isinstance(graph, nx_dynamic_graph.DynConnGraph):
+                state += (graph._union_find.parents,
+                          graph._union_find.weights, graph._ccs)
+            return state
+
+        def state(infr_):
+            return (
+                infr_.aids, infr_.orig_name_labels, infr_.nid_counter,
+                infr_.dirty, infr_.readonly, infr_.params,
+                infr_.review_counter,
+                graph_state(infr_.graph),
+                {key: graph_state(graph)
+                 for key, graph in infr_.review_graphs.items()},
+                graph_state(infr_.recover_graph),
+                graph_state(infr_.neg_redun_metagraph),
+                graph_state(infr_.neg_metagraph),
+                infr_.pos_redun_nids, infr_.nid_to_errors, infr_.recovery_ccs,
+                infr_.queue._dict, dict(infr_.external_feedback),
+                dict(infr_.internal_feedback), infr_.edge_truth,
+                dict(infr_.task_probs),
+            )
+        return state(infr) == state(other)
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.graph.mixin_snapshot
+        python -m ibeis.algo.graph.mixin_snapshot --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
@@ -20,6 +20,16 @@ class GraphHelperMixin(ut.NiceRepr):
     def has_edges(self, edges):
         return (self.has_edge(*edge) for edge in edges)
 
+    def gen_edge_values(self, key, edges=None, default=ut.NoParam,
+                        on_missing='error', on_keyerr='default'):
+        return ut.util_graph.nx_gen_edge_values(
+            self, key, edges, default=default, on_missing=on_missing,
+            on_keyerr=on_keyerr)
+
+    def set_edge_attrs(self, key, edge_to_prop):
+        """ Sets key of the edges in a dict. Missing edges are ignored. """
+        nx.set_edge_attributes(self, name=key, values=edge_to_prop)
+
     def edges(self, nbunch=None, data=False, default=None):
         # Force edges to always be returned in upper triangular form
         edges = super(GraphHelperMixin, self).edges(nbunch, data, default)
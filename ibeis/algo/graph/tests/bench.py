@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import utool as ut
+
+
+def _use_graph_backend(backend):
+    """
+    Sets the graph classes of AnnotInference and returns the previous ones
+    """
+    from ibeis.algo.graph import array_graph, nx_dynamic_graph
+    from ibeis.algo.graph.core import AnnotInference
+    backend_classes = {
+        'networkx': (nx_dynamic_graph.NiceGraph,
+                     nx_dynamic_graph.DynConnGraph),
+        'array': (array_graph.ArrayGraph, array_graph.ArrayDynConnGraph),
+    }
+    prev = (AnnotInference._graph_cls, AnnotInference._dyn_graph_cls)
+    if backend is not None:
+        (AnnotInference._graph_cls,
+         AnnotInference._dyn_graph_cls) = backend_classes[backend]
+    return prev
+
+
+def _simulated_infr(num_pccs, ensure_full=False):
+    """ Demo inference with empty review graphs and scored candidate edges """
+    from ibeis.algo.graph import demo
+    infr = demo.demodata_infr(num_pccs=num_pccs, size=5, size_std=1,
+                              p_incon=0)
+    infr.verbose = 0
+    infr.init_simulation(oracle_accuracy=.95, name='bench')
+    infr.clear_feedback()
+    infr.clear_name_labels()
+    infr.clear_edges()
+    if ensure_full:
+        infr.ensure_full()
+    infr.refresh_candidate_edges()
+    infr.init_refresh()
+    return infr
+
+
+def _replay_reviews(infr, max_reviews=None):
+    """ Pops and reviews edges with the simulation oracle until done """
+    decisions = []
+    while max_reviews is None or len(decisions) < max_reviews:
+        try:
+            edge, priority = infr.pop()
+        except StopIteration:
+            break
+        feedback = infr.request_oracle_review(edge)
+        infr.add_feedback(edge, **feedback)
+        decisions.append((edge, feedback['evidence_decision']))
+    return decisions
+
+
+def bench_review_graph_backends():
+    r"""
+    Replays simulated reviews (the oracle of mixin_simulation) through
+    AnnotInference once with the networkx review graphs and once with the
+    array review graphs (``--array-graph``). Reports the setup time, the time
+    per review, and the traced memory of an inference whose annotation graph
+    holds every candidate edge. Both backends must make the same reviews.
+
+    CommandLine:
+        python -m ibeis.algo.graph.tests.bench bench_review_graph_backends
+        python -m ibeis.algo.graph.tests.bench bench_review_graph_backends --num-pccs=500 --max-reviews=2000
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from ibeis.algo.graph.tests.bench import *  # NOQA
+        >>> result = bench_review_graph_backends()
+        >>> print(result)
+    """
+    import gc
+    import tracemalloc
+    num_pccs = ut.get_argval('--num-pccs', type_=int, default=150)
+    max_reviews = ut.get_argval('--max-reviews', type_=int, default=None)
+    mem_pccs = ut.get_argval('--mem-pccs', type_=int, default=100)
+
+    backends = ['networkx', 'array']
+    results = ut.odict()
+    all_decisions = []
+    prev = _use_graph_backend(None)
+    try:
+        for backend in backends:
+            _use_graph_backend(backend)
+            with ut.Timer('setup ' + backend) as setup_timer:
+                infr = _simulated_infr(num_pccs)
+            with ut.Timer('replay ' + backend) as replay_timer:
+                decisions = _replay_reviews(infr, max_reviews)
+            all_decisions.append(decisions)
+            num_edges = infr.graph.number_of_edges()
+            del infr
+
+            # Memory of a fully connected annotation graph
+            gc.collect()
+            tracemalloc.start()
+            infr = _simulated_infr(mem_pccs, ensure_full=True)
+            gc.collect()
+            mem_edges = infr.graph.number_of_edges()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del infr
+
+            results[backend] = ut.odict([
+                ('num_reviews', len(decisions)),
+                ('num_edges', num_edges),
+                ('setup_sec', setup_timer.ellapsed),
+                ('ms_per_review', 1000 * replay_timer.ellapsed /
+                 max(len(decisions), 1)),
+                ('mem_num_edges', mem_edges),
+                ('mem_mb', current / 2 ** 20),
+                ('peak_mem_mb', peak / 2 ** 20),
+            ])
+    finally:
+        from ibeis.algo.graph.core import AnnotInference
+        AnnotInference._graph_cls, AnnotInference._dyn_graph_cls = prev
+    assert all_decisions[0] == all_decisions[1], (
+        'backends made different reviews')
+    result = ut.repr4(results, precision=4)
+    return result
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.graph.tests.bench
+        python -m ibeis.algo.graph.tests.bench --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
@@ -0,0 +1,60 @@
+def _graph_state(graph):
+    nodes = sorted(graph.nodes(data=True))
+    edges = sorted((tuple(sorted((u, v))), sorted(d.items()))
+                   for u, v, d in graph.edges(data=True))
+    return nodes, edges
+
+
+def test_array_graph_simulation_matches_networkx():
+    """
+    Test that the array graph backend makes the same reviews and ends in the
+    same review state as the networkx backend
+    """
+    from ibeis.algo.graph.tests import bench
+    states = []
+    prev = bench._use_graph_backend(None)
+    try:
+        for backend in ['networkx', 'array']:
+            bench._use_graph_backend(backend)
+            infr = bench._simulated_infr(num_pccs=8)
+            decisions = bench._replay_reviews(infr)
+            review_graphs = {
+                key: _graph_state(graph)
+                for key, graph in infr.review_graphs.items()}
+            graph_nodes, graph_edges = _graph_state(infr.graph)
+            # timestamps come from the wall clock
+            graph_edges = [(e, [kv for kv in d if not kv[0].startswith('timestamp')])
+                           for e, d in graph_edges]
+            states.append({
+                'decisions': decisions,
+                'graph': (graph_nodes, graph_edges),
+                'review_graphs': review_graphs,
+                'pccs': sorted(map(sorted, infr.positive_components())),
+                'neg_metagraph': _graph_state(infr.neg_metagraph),
+            })
+    finally:
+        from ibeis.algo.graph.core import AnnotInference
+        AnnotInference._graph_cls, AnnotInference._dyn_graph_cls = prev
+    assert len(states[0]['decisions']) > 0
+    for key in states[0]:
+        assert states[0][key] == states[1][key], key
+
+
+def test_array_graph_remove_and_compact():
+    """
+    Test that edge attributes survive node removal and compaction
+    """
+    from ibeis.algo.graph.array_graph import ArrayDynConnGraph
+    G = ArrayDynConnGraph()
+    n = 3000
+    G.add_edges_from(((u, u + 1) for u in range(n)), decision='match')
+    G.add_edges_from(((u, u + 2) for u in range(0, n, 3)), weight=1.5)
+    G.remove_nodes_from(range(0, n, 2))
+    G.add_edge(3, 5, decision='nomatch')
+    assert G.edges[3, 5] == {'decision': 'nomatch', 'weight': 1.5}
+    assert not G.has_edge(0, 1)
+    assert G.number_of_edges() == sum(1 for _ in G.edges())
+    for u, v, d in G.edges(data=True):
+        assert G.has_edge(v, u)
+        assert G[v][u] == d
+    assert G.number_of_components() == len(list(G.connected_components()))
@@ -12,6 +12,7 @@ from ibeis.algo.hots import hstypes
 from ibeis.algo.hots import old_chip_match
 from ibeis.algo.hots import scoring
 from ibeis.algo.hots import name_scoring
+from ibeis.algo.hots import packed_matches
 from ibeis.algo.hots import _pipeline_helpers as plh  # NOQA
 print, rrr, profile = ut.inject2(__name__)
 
@@ -171,6 +172,37 @@ def prepare_dict_uuids(class_dict, ibs):
     return class_dict
 
 
+# Per-daid list attributes that can be views into a PackedMatches column
+PACKED_LIST_ATTRS = ('fm_list', 'fsv_list', 'fk_list', 'fs_list')
+
+
+class _PackedListAttr(object):
+    """
+    Descriptor for a per-daid list attribute such as ``cm.fm_list``.
+
+    When the chipmatch is packed the list is built lazily from the flat
+    column as a list of views. The list itself is kept in the instance
+    ``__dict__`` under the same name, so pickled state is unchanged.
+    Assigning a new list unpacks the chipmatch first.
+    """
+    def __init__(self, attr, col):
+        self.attr = attr
+        self.col = col
+
+    def __get__(self, cm, objtype=None):
+        if cm is None:
+            return self
+        value = cm.__dict__.get(self.attr)
+        if value is None and cm._packed is not None:
+            value = cm._packed.split(self.col)
+            cm.__dict__[self.attr] = value
+        return value
+
+    def __set__(self, cm, value):
+        cm.unpack()
+        cm.__dict__[self.attr] = value
+
+
 class _ChipMatchVisualization(object):
     """
     Abstract class containing the visualization function for ChipMatch
@@ -774,8 +806,12 @@ class _ChipMatchScorers(object):
             >>> assert annot_score_list[gt_flags].max() > annot_score_list[~gt_flags].max()
             >>> assert annot_score_list[gt_flags].max() > 10.0
         """
-        fs_list = cm.get_fsv_prod_list()
-        csum_scores = np.array([np.sum(fs) for fs in fs_list])
+        if cm._packed is not None:
+            flat_fs = cm._packed.cols['fsv'].prod(axis=1)
+            csum_scores = cm._packed.segment_sum(flat_fs)
+        else:
+            fs_list = cm.get_fsv_prod_list()
+            csum_scores = np.array([np.sum(fs) for fs in fs_list])
         cm.algo_annot_scores['csum'] = csum_scores
 
     @profile
@@ -911,6 +947,12 @@ class MatchBaseIO(object):
 
     def __getstate__(cm):
         state_dict = cm.__dict__
+        if state_dict.get('_packed') is not None:
+            # Save the flat arrays instead of the per-daid views
+            state_dict = state_dict.copy()
+            for attr in PACKED_LIST_ATTRS:
+                state_dict[attr] = None
+            state_dict['_packed'] = cm._packed.__getstate__()
         return state_dict
 
     def __setstate__(cm, state_dict):
@@ -932,6 +974,9 @@ class MatchBaseIO(object):
             del state_dict['special_annot_scores']
             del state_dict['special_name_scores']
         cm.__dict__.update(state_dict)
+        if isinstance(state_dict.get('_packed'), dict):
+            cm.__dict__['_packed'] = packed_matches.PackedMatches.from_state(
+                state_dict['_packed'])
 
     def copy(self):
         cls = self.__class__
@@ -1548,6 +1593,8 @@ class _ChipMatchConvenienceGetter(object):
             >>> print(result)
         """
         import vtool_ibeis as vt
+        if cm._packed is not None:
+            return cm._get_flat_fm_info_packed(flags)
         if flags is None:
             flags = [True] * len(cm.daid_list)
             # flags = cm.score_list > 0
@@ -1570,10 +1617,32 @@ class _ChipMatchConvenienceGetter(object):
             default_shape=(0,), default_dtype=hstypes.INDEX_TYPE)
         return info_
 
+    def _get_flat_fm_info_packed(cm, flags=None):
+        packed = cm._packed
+        daid_list = np.asarray(cm.daid_list, dtype=hstypes.INDEX_TYPE)
+        if flags is not None:
+            idx_list = np.flatnonzero(flags)
+            packed = packed.take(idx_list)
+            daid_list = daid_list.take(idx_list)
+        nfilt = len(cm.fsv_col_lbls)
+        info_ = {}
+        if packed.num_matches > 0:
+            info_['fsv'] = packed.cols['fsv']
+            info_['fm'] = packed.cols['fm']
+        else:
+            info_['fsv'] = np.empty((0, nfilt))
+            info_['fm'] = np.empty((0, 2), dtype=hstypes.FM_DTYPE)
+        info_['aid1'] = np.full(packed.num_matches, cm.qaid,
+                                dtype=hstypes.INDEX_TYPE)
+        info_['aid2'] = np.repeat(daid_list, packed.lens)
+        return info_
+
     def get_num_feat_score_cols(cm):
         return len(cm.fsv_col_lbls)
 
     def get_fsv_prod_list(cm):
+        if cm._packed is not None:
+            return cm._packed.split(cm._packed.cols['fsv'].prod(axis=1))
         return [fsv.prod(axis=1) for fsv in cm.fsv_list]
 
     def get_annot_fm(cm, daid):
@@ -2086,6 +2155,13 @@ class ChipMatch(_ChipMatchVisualization,
     completely replace the old structure
     """
 
+    # Feature correspondences may be stored packed (see pack)
+    _packed = None
+    fm_list = _PackedListAttr('fm_list', 'fm')
+    fsv_list = _PackedListAttr('fsv_list', 'fsv')
+    fk_list = _PackedListAttr('fk_list', 'fk')
+    fs_list = _PackedListAttr('fs_list', 'fs')
+
     # Standard Contstructor
 
     def __init__(cm, *args, **kwargs):
@@ -2165,6 +2241,88 @@ class ChipMatch(_ChipMatchVisualization,
             if DEBUG_CHIPMATCH:
                 cm.assert_self(verbose=True)
 
+    @classmethod
+    def from_packed(ChipMatch, qaid, daid_list, packed, **kwargs):
+        """
+        Constructs a packed ChipMatch directly from a PackedMatches object
+        """
+        cm = ChipMatch(qaid, daid_list, **kwargs)
+        cm._set_packed(packed)
+        return cm
+
+    def _set_packed(cm, packed):
+        for attr in PACKED_LIST_ATTRS:
+            cm.__dict__[attr] = None
+        cm.__dict__['_packed'] = packed
+
+    @property
+    def is_packed(cm):
+        return cm._packed is not None
+
+    def pack(cm):
+        r"""
+        Switches the feature correspondences to the flat CSR layout of
+        PackedMatches. fm_list, fsv_list, fk_list and fs_list become lazy
+        views into the flat arrays, and csum / nsum scoring, subsetting and
+        serialization work on the flat arrays directly. Assigning any of
+        those lists unpacks the chipmatch again.
+
+        Returns:
+            ibeis.ChipMatch: cm (inplace)
+
+        CommandLine:
+            python -m ibeis.algo.hots.chip_match ChipMatch.pack
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from ibeis.algo.hots.chip_match import *  # NOQA
+            >>> from ibeis.algo import packed_state
+            >>> rng = np.random.RandomState(0)
+            >>> daid_list = np.arange(2, 12)
+            >>> fm_list = [rng.randint(0, 40, (n, 2)).astype(hstypes.FM_DTYPE)
+            >>>            for n in rng.randint(0, 8, len(daid_list))]
+            >>> fsv_list = [rng.rand(len(fm), 2).astype(hstypes.FS_DTYPE)
+            >>>             for fm in fm_list]
+            >>> cm1 = ChipMatch(1, daid_list, fm_list, fsv_list,
+            >>>                 dnid_list=daid_list // 3, qnid=1,
+            >>>                 fsv_col_lbls=['lnbnn', 'fg'])
+            >>> cm2 = cm1.copy().pack()
+            >>> assert cm2.is_packed and cm2 == cm1
+            >>> for cm in [cm1, cm2]:
+            >>>     cm.evaluate_csum_annot_score()
+            >>> assert np.allclose(cm1.algo_annot_scores['csum'], cm2.algo_annot_scores['csum'])
+            >>> nsum1 = name_scoring.compute_fmech_score(cm1)
+            >>> nsum2 = name_scoring.compute_fmech_score(cm2)
+            >>> assert np.allclose(nsum1, nsum2)
+            >>> sub1, sub2 = cm1.take_annots([5, 0, 3]), cm2.take_annots([5, 0, 3])
+            >>> assert sub2.is_packed and sub1 == sub2
+            >>> info1, info2 = cm1.get_flat_fm_info(), cm2.get_flat_fm_info()
+            >>> assert all(np.all(info1[key] == info2[key]) for key in info1)
+            >>> header, data = packed_state.pack_state(cm2.__getstate__())
+            >>> cm3 = ChipMatch()
+            >>> cm3.__setstate__(packed_state.unpack_state(header, data))
+            >>> assert cm3.is_packed and cm3 == cm1
+            >>> cm3.fsv_list = [fsv * 2 for fsv in cm3.fsv_list]
+            >>> assert not cm3.is_packed and cm3.fm_list[1] is not None
+        """
+        fm_list = cm.__dict__.get('fm_list')
+        if cm._packed is None and fm_list is not None and len(fm_list) > 0:
+            packed = packed_matches.PackedMatches.from_lists(
+                **{attr[:-5]: cm.__dict__.get(attr)
+                   for attr in PACKED_LIST_ATTRS})
+            cm._set_packed(packed)
+        return cm
+
+    def unpack(cm):
+        """
+        Materializes the per-daid lists and drops the packed arrays
+        """
+        if cm._packed is not None:
+            for attr in PACKED_LIST_ATTRS:
+                getattr(cm, attr)
+            del cm.__dict__['_packed']
+        return cm
+
     def arraycast_self(cm):
         """
         Ensures internal structure is in numpy array formats
@@ -2293,10 +2451,15 @@ class ChipMatch(_ChipMatchVisualization,
         # <feat correspondence>
         nVs = 0 if fsv_col_lbls is None else len(fsv_col_lbls)
 
-        fm_list  = extend_nplists(cm.fm_list, num, (0, 2), hstypes.FM_DTYPE)
-        fk_list  = extend_nplists(cm.fk_list, num, (0), hstypes.FK_DTYPE)
-        fs_list  = extend_nplists(cm.fs_list, num, (0), hstypes.FS_DTYPE)
-        fsv_list = extend_nplists(cm.fsv_list, num, (0, nVs), hstypes.FS_DTYPE)
+        if cm._packed is not None:
+            packed = cm._packed.extend(num)
+            fm_list = fk_list = fs_list = fsv_list = None
+        else:
+            packed = None
+            fm_list  = extend_nplists(cm.fm_list, num, (0, 2), hstypes.FM_DTYPE)
+            fk_list  = extend_nplists(cm.fk_list, num, (0), hstypes.FK_DTYPE)
+            fs_list  = extend_nplists(cm.fs_list, num, (0), hstypes.FS_DTYPE)
+            fsv_list = extend_nplists(cm.fsv_list, num, (0, nVs), hstypes.FS_DTYPE)
         H_list   = extend_pylist(cm.H_list, num, None)
 
         filtnorm_aids = filtnorm_op(cm.filtnorm_aids, extend_nplists, num, (0),
@@ -2310,7 +2473,10 @@ class ChipMatch(_ChipMatchVisualization,
             fsv_col_lbls, dnid_list, qnid, unique_nids, name_score_list,
             annot_score_list, filtnorm_fxs=filtnorm_fxs,
             filtnorm_aids=filtnorm_aids, autoinit=False)
-        out.fs_list = fs_list
+        if packed is not None:
+            out._set_packed(packed)
+        else:
+            out.fs_list = fs_list
         # attrs should be dicts
         for key in cm.algo_annot_scores.keys():
             out.algo_annot_scores[key] = extend_scores(cm.algo_annot_scores[key], num)
@@ -2361,6 +2527,9 @@ class ChipMatch(_ChipMatchVisualization,
         new_attrs['qaid'] = cm_list[0].qaid
         new_attrs['qnid'] = cm_list[0].qnid
         new_attrs['fsv_col_lbls'] = cm_list[0].fsv_col_lbls
+        all_packed = all([cm._packed is not None for cm in cm_list])
+        if all_packed:
+            attrs = ut.setdiff(attrs, PACKED_LIST_ATTRS)
         for attr in attrs:
             values = ut.list_getattr(cm_list, attr)
             if ut.list_all_eq_to(values, None):
@@ -2368,6 +2537,9 @@ class ChipMatch(_ChipMatchVisualization,
             else:
                 new_attrs[attr] = ut.flatten(values)
         out = ChipMatch(**new_attrs)
+        if all_packed:
+            out._set_packed(packed_matches.PackedMatches.concat(
+                [cm._packed for cm in cm_list]))
         out._update_daid_index()
         out._update_unique_nid_index()
         return out
@@ -2419,9 +2591,12 @@ class ChipMatch(_ChipMatchVisualization,
         out.daid_list     = vt.take2(cm.daid_list, idx_list)
         out.dnid_list     = safeop(vt.take2, cm.dnid_list, idx_list)
         out.H_list        = safeop(ut.take, cm.H_list, idx_list)
-        out.fm_list       = safeop(ut.take, cm.fm_list, idx_list)
-        out.fsv_list      = safeop(ut.take, cm.fsv_list, idx_list)
-        out.fk_list       = safeop(ut.take, cm.fk_list, idx_list)
+        if cm._packed is not None:
+            out._set_packed(cm._packed.take(idx_list))
+        else:
+            out.fm_list       = safeop(ut.take, cm.fm_list, idx_list)
+            out.fsv_list      = safeop(ut.take, cm.fsv_list, idx_list)
+            out.fk_list       = safeop(ut.take, cm.fk_list, idx_list)
         out.filtnorm_aids = filtnorm_op(cm.filtnorm_aids, ut.take, idx_list)
         out.filtnorm_fxs  = filtnorm_op(cm.filtnorm_fxs, ut.take, idx_list)
 
@@ -2495,10 +2670,13 @@ class ChipMatch(_ChipMatchVisualization,
         out = cm.compress_annots(flags, inplace=inplace, keepscores=keepscores)
         indicies_list2 = ut.compress(indicies_list, flags)
 
-        out.fm_list = safeop(vt.ziptake, out.fm_list, indicies_list2, axis=0)
-        out.fs_list = safeop(vt.ziptake, out.fs_list, indicies_list2, axis=0)
-        out.fsv_list = safeop(vt.ziptake, out.fsv_list, indicies_list2, axis=0)
-        out.fk_list = safeop(vt.ziptake, out.fk_list, indicies_list2, axis=0)
+        if out._packed is not None:
+            out._set_packed(out._packed.ziptake(indicies_list2))
+        else:
+            out.fm_list = safeop(vt.ziptake, out.fm_list, indicies_list2, axis=0)
+            out.fs_list = safeop(vt.ziptake, out.fs_list, indicies_list2, axis=0)
+            out.fsv_list = safeop(vt.ziptake, out.fsv_list, indicies_list2, axis=0)
+            out.fk_list = safeop(vt.ziptake, out.fk_list, indicies_list2, axis=0)
 
         out.filtnorm_aids = filtnorm_op(out.filtnorm_aids, vt.ziptake, indicies_list2, axis=0)
         out.filtnorm_fxs = filtnorm_op(out.filtnorm_fxs, vt.ziptake, indicies_list2, axis=0)
@@ -2523,7 +2701,19 @@ class ChipMatch(_ChipMatchVisualization,
         assert inplace, 'this is always inplace right now'
         assert filtkey not in cm.fsv_col_lbls, 'already have filtkey=%r' % (cm.filtkey,)
         cm.fsv_col_lbls.append(filtkey)
-        cm.fsv_list = vt.zipcat(cm.fsv_list, filtweight_list, axis=1)
+        if cm._packed is not None:
+            fsv = cm._packed.cols['fsv']
+            if len(filtweight_list) > 0:
+                flat_weight = np.concatenate(filtweight_list)
+            else:
+                flat_weight = np.empty(0)
+            if fsv.ndim == 1:
+                fsv = fsv.reshape(0, len(cm.fsv_col_lbls) - 1)
+            cm._packed.cols['fsv'] = np.concatenate(
+                [fsv, flat_weight[:, None]], axis=1)
+            cm.__dict__['fsv_list'] = None
+        else:
+            cm.fsv_list = vt.zipcat(cm.fsv_list, filtweight_list, axis=1)
 
     def compress_top_feature_matches(cm, num=10, rng=np.random, use_random=True):
         """
@@ -2548,6 +2738,13 @@ class ChipMatch(_ChipMatchVisualization,
 
         # cm.take_feature_matches()
 
+        if cm._packed is not None:
+            packed = cm._packed.ziptake(score_sortx_filt)
+            packed.cols['fs'] = None
+            cm._set_packed(packed)
+            cm.H_list = None
+            return
+
         cm.fsv_list = vt.ziptake(cm.fsv_list, score_sortx_filt, axis=0)
         cm.fm_list = vt.ziptake(cm.fm_list, score_sortx_filt, axis=0)
         cm.fk_list = vt.ziptake(cm.fk_list, score_sortx_filt, axis=0)
@@ -2680,6 +2877,8 @@ class ChipMatch(_ChipMatchVisualization,
             >>> # print(result)
         """
         data = cm.__dict__.copy()
+        if data.pop('_packed', None) is not None:
+            data.update({attr: getattr(cm, attr) for attr in PACKED_LIST_ATTRS})
         # can't encode dictionaries with integer keys
         # this means you need to rebuild indexes on reconstruction
         ut.delete_dict_keys(data, ['daid2_idx', 'nid2_nidx'])
@@ -0,0 +1,167 @@
+"""
+Packed, pickle-free storage for ChipMatch results.
+
+Previously every query result was written to its own cPickle file under the
+qres cache directory, so large experiments left one file per (qaid, config)
+and a cold cache pass was dominated by file metadata and unpickling. A
+ChipMatchStore keeps all results of one (pipeline cfgstr, data hashid) in a
+single SQLite file. Each row holds one ChipMatch and is keyed by its qaid and
+query uuid. The row is a small JSON header describing the attributes plus one
+byte buffer with their arrays laid end to end (see
+:func:`ibeis.algo.packed_state.pack_state`). Ragged lists such as ``fm_list``
+and ``fsv_list`` are concatenated into one array with a lengths array, so
+decoding a result is a handful of ``np.frombuffer`` views.
+
+CommandLine:
+    python -m ibeis.algo.hots.chipmatch_store --allexamples
+"""
+import sqlite3
+import numpy as np
+import utool as ut
+from ibeis.algo.packed_state import pack_state, unpack_state
+print, rrr, profile = ut.inject2(__name__)
+
+
+class ChipMatchStore(object):
+    r"""
+    A single SQLite file holding many packed ChipMatch objects.
+
+    Args:
+        fpath (str): path to the store
+
+    CommandLine:
+        python -m ibeis.algo.hots.chipmatch_store ChipMatchStore
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.chipmatch_store import *  # NOQA
+        >>> from ibeis.algo.hots import chip_match
+        >>> from os.path import join
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'testfiles')
+        >>> fpath = join(dpath, 'test_cm_store.sqlite3')
+        >>> ut.delete(fpath, verbose=False)
+        >>> rng = np.random.RandomState(0)
+        >>> cm_list = []
+        >>> for qaid in [1, 2, 3]:
+        >>>     daid_list = [4, 5, 6]
+        >>>     fm_list = [rng.randint(0, 100, (n, 2)).astype(np.int32) for n in [5, 0, 3]]
+        >>>     fsv_list = [rng.rand(len(fm), 2) for fm in fm_list]
+        >>>     cm = chip_match.ChipMatch(qaid, daid_list, fm_list, fsv_list,
+        >>>                               dnid_list=[1, 1, 2], qnid=1,
+        >>>                               fsv_col_lbls=['lnbnn', 'fg'])
+        >>>     cm.score_list = rng.rand(3)
+        >>>     cm_list.append(cm)
+        >>> with ChipMatchStore(fpath) as store:
+        >>>     store.save_many(cm_list, ['u1', 'u2', 'u3'])
+        >>> with ChipMatchStore(fpath) as store:
+        >>>     cm2 = store.load(2, 'u2')
+        >>>     qaid_to_cm = store.load_many([1, 2, 3], ['u1', 'stale', 'u3'])
+        >>>     all_cms = store.load_all()
+        >>> assert cm2 == cm_list[1]
+        >>> assert np.all(cm2.score_list == cm_list[1].score_list)
+        >>> print('hits = %r' % (sorted(qaid_to_cm.keys()),))
+        hits = [1, 3]
+        >>> assert all([all_cms[cm.qaid] == cm for cm in cm_list])
+        >>> ut.delete(fpath, verbose=False)
+    """
+
+    def __init__(store, fpath):
+        store.fpath = fpath
+        store.conn = sqlite3.connect(fpath, timeout=60)
+        store.conn.execute('PRAGMA journal_mode=WAL')
+        store.conn.execute('PRAGMA synchronous=NORMAL')
+        with store.conn:
+            store.conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS chipmatch (
+                    qaid   INTEGER NOT NULL,
+                    qauuid TEXT NOT NULL,
+                    header TEXT NOT NULL,
+                    data   BLOB NOT NULL,
+                    PRIMARY KEY (qaid, qauuid)
+                )
+                ''')
+
+    def __enter__(store):
+        return store
+
+    def __exit__(store, type_, value, trace):
+        store.close()
+
+    def __len__(store):
+        return store.conn.execute('SELECT COUNT(*) FROM chipmatch').fetchone()[0]
+
+    def close(store):
+        if store.conn is not None:
+            store.conn.close()
+            store.conn = None
+
+    def _new_cm(store, header, data):
+        from ibeis.algo.hots import chip_match
+        cm = chip_match.ChipMatch()
+        cm.__setstate__(unpack_state(header, data))
+        return cm
+
+    def save_many(store, cm_list, qauuid_list=None):
+        """ Writes (or overwrites) results in one transaction """
+        if qauuid_list is None:
+            qauuid_list = [''] * len(cm_list)
+        rows = []
+        for cm, qauuid in zip(cm_list, qauuid_list):
+            header, data = pack_state(cm.__getstate__())
+            rows.append((int(cm.qaid), str(qauuid), header,
+                         sqlite3.Binary(data)))
+        with store.conn:
+            store.conn.executemany(
+                'INSERT OR REPLACE INTO chipmatch (qaid, qauuid, header, data) '
+                'VALUES (?, ?, ?, ?)', rows)
+
+    def load(store, qaid, qauuid=''):
+        """ Random access to a single result. Raises KeyError on a miss. """
+        row = store.conn.execute(
+            'SELECT header, data FROM chipmatch WHERE qaid=? AND qauuid=?',
+            (int(qaid), str(qauuid))).fetchone()
+        if row is None:
+            raise KeyError(qaid)
+        return store._new_cm(*row)
+
+    def load_many(store, qaid_list, qauuid_list=None):
+        """ Returns a dict from qaid to ChipMatch containing only the hits """
+        if qauuid_list is None:
+            qauuid_list = [''] * len(qaid_list)
+        wanted = {(int(qaid), str(qauuid))
+                  for qaid, qauuid in zip(qaid_list, qauuid_list)}
+        qaid_to_cm = {}
+        unique_qaids = sorted({qaid for qaid, _ in wanted})
+        # Stay under the SQLite host parameter limit
+        for chunk in ut.ichunks(unique_qaids, 900):
+            query = (
+                'SELECT qaid, qauuid, header, data FROM chipmatch '
+                'WHERE qaid IN (%s)' % (','.join(['?'] * len(chunk)),))
+            for qaid, qauuid, header, data in store.conn.execute(query, chunk):
+                if (qaid, qauuid) in wanted:
+                    qaid_to_cm[qaid] = store._new_cm(header, data)
+        return qaid_to_cm
+
+    def load_all(store):
+        """ Bulk loads every stored result as a dict from qaid to ChipMatch """
+        cursor = store.conn.execute('SELECT header, data FROM chipmatch')
+        cm_list = [store._new_cm(header, data) for header, data in cursor]
+        return {cm.qaid: cm for cm in cm_list}
+
+    def delete(store, qaid_list):
+        with store.conn:
+            store.conn.executemany('DELETE FROM chipmatch WHERE qaid=?',
+                                   [(int(qaid),) for qaid in qaid_list])
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.hots.chipmatch_store
+        python -m ibeis.algo.hots.chipmatch_store --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
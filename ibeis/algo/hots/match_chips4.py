@@ -5,8 +5,6 @@ Runs functions in pipeline to get query reuslts and does some caching.
 from __future__ import absolute_import, division, print_function, unicode_literals
 import ubelt as ub
 import utool as ut
-from os.path import exists
-from ibeis.algo.hots import chip_match
 from ibeis.algo.hots import pipeline
 (print, rrr, profile) = ut.inject2(__name__)
 
@@ -21,6 +19,7 @@ SAVE_CACHE     = not ut.get_argflag('--nocache-save')
 #MIN_BIGCACHE_BUNDLE = 150
 MIN_BIGCACHE_BUNDLE = 64
 HOTS_BATCH_SIZE = ut.get_argval('--hots-batch-size', type_=int, default=None)
+HOTS_N_WORKERS = ut.get_argval('--hots-workers', type_=int, default=None)
 
 
 #----------------------
@@ -30,12 +29,13 @@ HOTS_BATCH_SIZE = ut.get_argval('--hots-batch-size', type_=int, default=None)
 @profile
 def submit_query_request(qreq_, use_cache=None, use_bigcache=None,
                          verbose=None, save_qcache=None, use_supercache=None,
-                         invalidate_supercache=None):
+                         invalidate_supercache=None, n_workers=None):
     """
     Called from qreq_.execute
 
     Checks a big cache for qaid2_cm.  If cache miss, tries to load each cm
     individually.  On an individual cache miss, it preforms the query.
+    If n_workers > 1 the query chunks are executed in a process pool.
 
     CommandLine:
         python -m ibeis.algo.hots.match_chips4 submit_query_request
@@ -54,16 +54,9 @@ def submit_query_request(qreq_, use_cache=None, use_bigcache=None,
         >>> cm_list = submit_query_request(qreq_=qreq_)
     """
     # Get flag defaults if necessary
-    if verbose is None:
-        verbose = pipeline.VERB_PIPELINE
-    if use_cache is None:
-        use_cache = USE_CACHE
-    if save_qcache is None:
-        save_qcache = SAVE_CACHE
-    if use_bigcache is None:
-        use_bigcache = USE_BIGCACHE
-    if use_supercache is None:
-        use_supercache = USE_SUPERCACHE
+    (verbose, use_cache, save_qcache, use_bigcache,
+     use_supercache) = _cache_flag_defaults(verbose, use_cache, save_qcache,
+                                            use_bigcache, use_supercache)
     # Create new query request object to store temporary state
     if verbose:
         #print('[mc4] --- Submit QueryRequest_ --- ')
@@ -82,37 +75,77 @@ def submit_query_request(qreq_, use_cache=None, use_bigcache=None,
         cm_list = [None for qaid in qreq_.qaids]
     else:
         # --- BIG CACHE ---
-        # Do not use bigcache single queries
-        is_big = len(qreq_.qaids) > MIN_BIGCACHE_BUNDLE
-        use_bigcache_ = (use_bigcache and use_cache and is_big)
-        if (use_bigcache_ or save_qcache):
-            cacher = qreq_.get_big_cacher()
-            if use_bigcache_:
-                try:
-                    qaid2_cm = cacher.load()
-                    cm_list = [qaid2_cm[qaid] for qaid in qreq_.qaids]
-                except (IOError, AttributeError):
-                    pass
-                else:
-                    return cm_list
+        cm_list = _load_bigcache(qreq_, use_cache, use_bigcache)
+        if cm_list is not None:
+            return cm_list
         # ------------
         # Execute query request
         qaid2_cm = execute_query_and_save_L1(qreq_, use_cache, save_qcache,
                                              verbose=verbose,
                                              use_supercache=use_supercache,
-                                             invalidate_supercache=invalidate_supercache)
+                                             invalidate_supercache=invalidate_supercache,
+                                             n_workers=n_workers)
         # ------------
-        if save_qcache and is_big:
-            cacher.save(qaid2_cm)
-
         cm_list = [qaid2_cm[qaid] for qaid in qreq_.qaids]
+        if save_qcache:
+            _save_bigcache(qreq_, cm_list)
     return cm_list
 
 
+def _cache_flag_defaults(verbose, use_cache, save_qcache, use_bigcache,
+                         use_supercache):
+    """ Replaces unspecified cache flags with the module defaults """
+    if verbose is None:
+        verbose = pipeline.VERB_PIPELINE
+    if use_cache is None:
+        use_cache = USE_CACHE
+    if save_qcache is None:
+        save_qcache = SAVE_CACHE
+    if use_bigcache is None:
+        use_bigcache = USE_BIGCACHE
+    if use_supercache is None:
+        use_supercache = USE_SUPERCACHE
+    return verbose, use_cache, save_qcache, use_bigcache, use_supercache
+
+
+def _load_bigcache(qreq_, use_cache, use_bigcache):
+    """ Returns the cm_list of the big cache or None on a cache miss """
+    # Do not use bigcache single queries
+    is_big = len(qreq_.qaids) > MIN_BIGCACHE_BUNDLE
+    if use_bigcache and use_cache and is_big:
+        try:
+            with qreq_.get_big_chipmatch_store() as store:
+                qaid2_cm = store.load_all()
+            return [qaid2_cm[qaid] for qaid in qreq_.qaids]
+        except (IOError, AttributeError, KeyError):
+            pass
+    return None
+
+
+def _save_bigcache(qreq_, cm_list):
+    if len(qreq_.qaids) > MIN_BIGCACHE_BUNDLE:
+        with qreq_.get_big_chipmatch_store() as store:
+            store.save_many(cm_list)
+
+
+def _load_qcache(qreq_, use_supercache):
+    """ Returns a dict with the cached chip match of each query that has one """
+    qauuid_list = list(qreq_.get_qreq_pcc_uuids(qreq_.qaids))
+    with qreq_.get_chipmatch_store(super_qres_cache=use_supercache) as store:
+        return store.load_many(qreq_.qaids, qauuid_list)
+
+
+def _save_qcache(qreq_, cm_list, use_supercache):
+    qaids = [cm.qaid for cm in cm_list]
+    qauuid_list = list(qreq_.get_qreq_pcc_uuids(qaids))
+    with qreq_.get_chipmatch_store(super_qres_cache=use_supercache) as store:
+        store.save_many(cm_list, qauuid_list)
+
+
 @profile
 def execute_query_and_save_L1(qreq_, use_cache, save_qcache, verbose=True,
                               batch_size=None, use_supercache=False,
-                              invalidate_supercache=False):
+                              invalidate_supercache=False, n_workers=None):
     """
     Args:
         qreq_ (ibeis.QueryRequest):
@@ -190,20 +223,15 @@ def execute_query_and_save_L1(qreq_, use_cache, save_qcache, verbose=True,
     #     >>> qaid2_cm = execute_query_and_save_L1(qreq_, use_cache,
     #     >>>                                      save_qcache, verbose,
     #     >>>                                      batch_size=3)
-    #     >>> cm = qaid2_cm[1]
-    #     >>> ut.delete(cm.get_fpath(qreq_))
-    #     >>> cm = qaid2_cm[4]
-    #     >>> ut.delete(cm.get_fpath(qreq_))
-    #     >>> cm = qaid2_cm[5]
-    #     >>> ut.delete(cm.get_fpath(qreq_))
-    #     >>> cm = qaid2_cm[6]
-    #     >>> ut.delete(cm.get_fpath(qreq_))
+    #     >>> with qreq_.get_chipmatch_store() as store:
+    #     >>>     store.delete([1, 4, 5, 6])
     #     >>> print('Re-execute')
     #     >>> qaid2_cm_ = execute_query_and_save_L1(qreq_, use_cache,
     #     >>>                                       save_qcache, verbose,
     #     >>>                                       batch_size=3)
     #     >>> assert all([qaid2_cm_[qaid] == qaid2_cm[qaid] for qaid in qreq_.qaids])
-    #     >>> [ut.delete(fpath) for fpath in qreq_.get_chipmatch_fpaths(qreq_.qaids)]
+    #     >>> with qreq_.get_chipmatch_store() as store:
+    #     >>>     store.delete(qreq_.qaids)
 
     Ignore:
         other = cm_ = qaid2_cm_[qaid]
@@ -221,39 +249,8 @@ def execute_query_and_save_L1(qreq_, use_cache, save_qcache, verbose=True,
         if use_supercache:
             print('[mc4] supercache-query is on')
         # Try loading as many cached results as possible
-        qaid2_cm_hit = {}
         external_qaids = qreq_.qaids
-        fpath_list = list(qreq_.get_chipmatch_fpaths(external_qaids, super_qres_cache=use_supercache))
-        exists_flags = [exists(fpath) for fpath in fpath_list]
-        qaids_hit = ut.compress(external_qaids, exists_flags)
-        fpaths_hit = ut.compress(fpath_list, exists_flags)
-        fpath_iter = ut.ProgIter(
-            fpaths_hit, length=len(fpaths_hit), enabled=len(fpaths_hit) > 1,
-            label='loading cache hits', adjust=True, freq=1)
-        try:
-            cm_hit_list = [
-                chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
-                for fpath in fpath_iter
-            ]
-            assert all([qaid == cm.qaid for qaid, cm in zip(qaids_hit, cm_hit_list)]), (
-                'inconsistent qaid and cm.qaid')
-            qaid2_cm_hit = {cm.qaid: cm for cm in cm_hit_list}
-        except chip_match.NeedRecomputeError:
-            print('NeedRecomputeError: Some cached chips need to recompute')
-            fpath_iter = ut.ProgIter(
-                fpaths_hit, length=len(fpaths_hit), enabled=len(fpaths_hit) > 1,
-                label='checking chipmatch cache', adjust=True, freq=1)
-            # Recompute those that fail loading
-            qaid2_cm_hit = {}
-            for fpath in fpath_iter:
-                try:
-                    cm = chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
-                except chip_match.NeedRecomputeError:
-                    pass
-                else:
-                    qaid2_cm_hit[cm.qaid] = cm
-            print('%d / %d cached matches need to be recomputed' % (
-                len(qaids_hit) - len(qaid2_cm_hit), len(qaids_hit)))
+        qaid2_cm_hit = _load_qcache(qreq_, use_supercache)
         if len(qaid2_cm_hit) == len(external_qaids):
             return qaid2_cm_hit
         else:
@@ -267,7 +264,8 @@ def execute_query_and_save_L1(qreq_, use_cache, save_qcache, verbose=True,
         if ut.VERBOSE:
             print('[mc4] cache-query is off')
         qaid2_cm_hit = {}
-    qaid2_cm = execute_query2(qreq_, verbose, save_qcache, batch_size, use_supercache)
+    qaid2_cm = execute_query2(qreq_, verbose, save_qcache, batch_size,
+                              use_supercache, n_workers=n_workers)
     # Merge cache hits with computed misses
     if len(qaid2_cm_hit) > 0:
         qaid2_cm.update(qaid2_cm_hit)
@@ -276,10 +274,34 @@ def execute_query_and_save_L1(qreq_, use_cache, save_qcache, verbose=True,
 
 
 @profile
-def execute_query2(qreq_, verbose, save_qcache, batch_size=None, use_supercache=False):
+def execute_query2(qreq_, verbose, save_qcache, batch_size=None,
+                   use_supercache=False, n_workers=None):
     """
     Breaks up query request into several subrequests
     to process "more efficiently" and safer as well.
+
+    If n_workers > 1 the subrequests are executed by a pool of forked
+    processes. The indexer is loaded once in this process before the pool is
+    created, so the workers share it (copy-on-write or memmapped support
+    data) instead of rebuilding it. Each worker opens its own controller.
+    Chip matches are saved here as each chunk completes.
+
+    CommandLine:
+        python -m ibeis.algo.hots.match_chips4 execute_query2
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.match_chips4 import *  # NOQA
+        >>> import ibeis
+        >>> qreq_ = ibeis.testdata_qreq_(defaultdb='testdb1',
+        >>>                              a='default:qsize=4')
+        >>> qaid2_cm1 = execute_query2(qreq_, False, False, batch_size=1)
+        >>> qreq_ = ibeis.testdata_qreq_(defaultdb='testdb1',
+        >>>                              a='default:qsize=4')
+        >>> qaid2_cm2 = execute_query2(qreq_, False, False, batch_size=1,
+        >>>                            n_workers=2)
+        >>> assert sorted(qaid2_cm1.keys()) == sorted(qaid2_cm2.keys())
+        >>> assert all([qaid2_cm1[qaid] == qaid2_cm2[qaid] for qaid in qaid2_cm1])
     """
     if qreq_.prog_hook is not None:
         preload_hook, query_hook = qreq_.prog_hook.subdivide(spacing=[0, .15, .8])
@@ -302,30 +324,41 @@ def execute_query2(qreq_, verbose, save_qcache, batch_size=None, use_supercache=
             hots_batch_size = HOTS_BATCH_SIZE
     else:
         hots_batch_size = batch_size
+    if n_workers is None:
+        if HOTS_N_WORKERS is None:
+            n_workers = getattr(qreq_.ibs.cfg.other_cfg, 'hots_n_workers', 1)
+        else:
+            n_workers = HOTS_N_WORKERS
+    if n_workers is not None and n_workers > 1 and not _can_fork():
+        print('[mc4] forking is unavailable. Executing queries serially')
+        n_workers = 1
+    if n_workers is not None and n_workers > 1:
+        # Make sure each worker gets at least one chunk
+        hots_batch_size = max(1, min(
+            hots_batch_size, ut.get_num_chunks(len(all_qaids), n_workers)))
     chunksize = 1 if qreq_.qparams.vsone else hots_batch_size
 
     # Iterate over vsone queries in chunks.
     n_total_chunks = ut.get_num_chunks(len(all_qaids), chunksize)
     qaid_chunk_iter = ut.ichunks(all_qaids, chunksize)
-    _qreq_iter = (qreq_.shallowcopy(qaids=qaids) for qaids in qaid_chunk_iter)
-    sub_qreq_iter = ut.ProgIter(_qreq_iter, length=n_total_chunks, freq=1,
-                                label='[mc4] query chunk: ',
-                                prog_hook=qreq_.prog_hook)
-    for sub_qreq_ in sub_qreq_iter:
-        if ut.VERBOSE:
-            print('Generating vsmany chunk')
-        sub_cm_list = pipeline.request_ibeis_query_L0(qreq_.ibs, sub_qreq_,
-                                                      verbose=verbose)
-        assert len(sub_qreq_.qaids) == len(sub_cm_list), 'not aligned'
+    if n_workers is not None and n_workers > 1 and n_total_chunks > 1:
+        sub_result_iter = _parallel_query_chunks(
+            qreq_, qaid_chunk_iter, n_workers, verbose)
+    else:
+        _qreq_iter = (qreq_.shallowcopy(qaids=qaids) for qaids in qaid_chunk_iter)
+        sub_result_iter = (
+            (sub_qreq_.qaids, pipeline.request_ibeis_query_L0(
+                qreq_.ibs, sub_qreq_, verbose=verbose))
+            for sub_qreq_ in _qreq_iter)
+    sub_result_iter = ut.ProgIter(sub_result_iter, length=n_total_chunks, freq=1,
+                                  label='[mc4] query chunk: ',
+                                  prog_hook=qreq_.prog_hook)
+    for sub_qaids, sub_cm_list in sub_result_iter:
+        assert len(sub_qaids) == len(sub_cm_list), 'not aligned'
         assert all([qaid == cm.qaid for qaid, cm in
-                    zip(sub_qreq_.qaids, sub_cm_list)]), 'not corresonding'
+                    zip(sub_qaids, sub_cm_list)]), 'not corresonding'
         if save_qcache:
-            fpath_list = list(qreq_.get_chipmatch_fpaths(sub_qreq_.qaids, super_qres_cache=use_supercache))
-            _iter = zip(sub_cm_list, fpath_list)
-            _iter = ut.ProgIter(_iter, length=len(sub_cm_list),
-                                label='saving chip matches', adjust=True, freq=1)
-            for cm, fpath in _iter:
-                cm.save_to_fpath(fpath, verbose=False)
+            _save_qcache(qreq_, sub_cm_list, use_supercache)
         else:
             if ut.VERBOSE:
                 print('[mc4] not saving vsmany chunk')
@@ -333,6 +366,187 @@ def execute_query2(qreq_, verbose, save_qcache, batch_size=None, use_supercache=
     return qaid2_cm
 
 
+@profile
+def submit_query_request_grid(qreq_list, use_cache=None, use_bigcache=None,
+                              verbose=None, save_qcache=None,
+                              use_supercache=None):
+    """
+    Like submit_query_request, but for several query requests that differ
+    only in pipeline config (e.g. the cells of an experiment grid).
+
+    Each request is first looked up in the big and per-query caches. The
+    remaining requests are executed together by
+    pipeline.request_ibeis_query_grid, so neighbor, weighting and
+    verification stages they have in common are only computed once.
+    Requests with partial cache hits are recomputed in full.
+
+    Returns:
+        list: a cm_list for each query request
+
+    CommandLine:
+        python -m ibeis.algo.hots.match_chips4 submit_query_request_grid
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.match_chips4 import *  # NOQA
+        >>> import ibeis
+        >>> pcfgs = ['default:sv_on=True', 'default:sv_on=False']
+        >>> qreq_list = [ibeis.testdata_qreq_(defaultdb='testdb1', p=p,
+        >>>                                   a='default:qsize=4')
+        >>>              for p in pcfgs]
+        >>> cm_lists = submit_query_request_grid(qreq_list, use_cache=False,
+        >>>                                      save_qcache=False)
+        >>> for qreq_, cm_list in zip(qreq_list, cm_lists):
+        >>>     qaid2_cm = execute_query2(qreq_, False, False)
+        >>>     assert all([qaid2_cm[cm.qaid] == cm for cm in cm_list])
+    """
+    (verbose, use_cache, save_qcache, use_bigcache,
+     use_supercache) = _cache_flag_defaults(verbose, use_cache, save_qcache,
+                                            use_bigcache, use_supercache)
+
+    cm_lists = [None] * len(qreq_list)
+    miss_xs = []
+    for x, qreq_ in enumerate(qreq_list):
+        if (len(qreq_.daids) == 0 or len(qreq_.qaids) == 0 or
+                qreq_.qparams.pipeline_root != 'vsmany'):
+            cm_lists[x] = submit_query_request(
+                qreq_, use_cache=use_cache, use_bigcache=use_bigcache,
+                verbose=verbose, save_qcache=save_qcache,
+                use_supercache=use_supercache)
+            continue
+        cm_list = _load_bigcache(qreq_, use_cache, use_bigcache)
+        if cm_list is None and use_cache:
+            qaid2_cm = _load_qcache(qreq_, use_supercache)
+            if len(qaid2_cm) == len(qreq_.qaids):
+                cm_list = [qaid2_cm[qaid] for qaid in qreq_.qaids]
+        if cm_list is None:
+            miss_xs.append(x)
+        else:
+            cm_lists[x] = cm_list
+
+    # Requests are executed together in chunks of the same query aids
+    qaids_list = [tuple(qreq_list[x].qaids) for x in miss_xs]
+    for xs in ut.group_items(miss_xs, qaids_list).values():
+        sub_qreq_list = ut.take(qreq_list, xs)
+        qaid2_cm_list = execute_query_grid2(sub_qreq_list, verbose,
+                                            save_qcache, use_supercache)
+        for x, qreq_, qaid2_cm in zip(xs, sub_qreq_list, qaid2_cm_list):
+            cm_list = [qaid2_cm[qaid] for qaid in qreq_.qaids]
+            if save_qcache:
+                _save_bigcache(qreq_, cm_list)
+            cm_lists[x] = cm_list
+    return cm_lists
+
+
+@profile
+def execute_query_grid2(qreq_list, verbose, save_qcache, use_supercache=False,
+                        batch_size=None):
+    """
+    Executes query requests with the same query aids chunk by chunk, sharing
+    pipeline stages between them. Chunks are executed serially.
+
+    Returns:
+        list: a qaid2_cm dict for each query request
+    """
+    for qreq_ in qreq_list:
+        qreq_.lazy_preload(verbose=verbose and ut.NOT_QUIET)
+    ibs = qreq_list[0].ibs
+    all_qaids = qreq_list[0].qaids
+    if batch_size is None:
+        if HOTS_BATCH_SIZE is None:
+            batch_size = ibs.cfg.other_cfg.hots_batch_size
+        else:
+            batch_size = HOTS_BATCH_SIZE
+    print('len(missed_qaids) = %r, len(pipecfgs) = %r' % (
+        len(all_qaids), len(qreq_list)))
+    qaid2_cm_list = [{} for _ in qreq_list]
+    n_total_chunks = ut.get_num_chunks(len(all_qaids), batch_size)
+    qaid_chunk_iter = ut.ProgIter(ut.ichunks(all_qaids, batch_size),
+                                  length=n_total_chunks, freq=1,
+                                  label='[mc4] query grid chunk: ')
+    for qaids in qaid_chunk_iter:
+        sub_qreq_list = [qreq_.shallowcopy(qaids=qaids) for qreq_ in qreq_list]
+        sub_cm_lists = pipeline.request_ibeis_query_grid(ibs, sub_qreq_list,
+                                                         verbose=verbose)
+        for qreq_, qaid2_cm, sub_cm_list in zip(qreq_list, qaid2_cm_list,
+                                                 sub_cm_lists):
+            assert all([qaid == cm.qaid for qaid, cm in
+                        zip(qaids, sub_cm_list)]), 'not corresonding'
+            if save_qcache:
+                _save_qcache(qreq_, sub_cm_list, use_supercache)
+            qaid2_cm.update({cm.qaid: cm for cm in sub_cm_list})
+    return qaid2_cm_list
+
+
+def _can_fork():
+    import multiprocessing
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+# Query request of a forked query worker
+_WORKER_QREQ = None
+
+
+def _init_query_worker(qreq_, dbdir):
+    """
+    SQLite connections can not be used across a fork, so each worker opens
+    its own controller and rebuilds the query request on it. The inherited
+    controller is never touched.
+    """
+    global _WORKER_QREQ
+    import ibeis
+    from ibeis.algo.hots.query_request import QueryRequest
+    ibs = ibeis.opendb(dbdir=dbdir, web=False, use_cache=False)
+    state = qreq_.__getstate__()
+    state['ibs'] = ibs
+    worker_qreq_ = QueryRequest()
+    worker_qreq_.__setstate__(state)
+    # Reuse the indexer loaded before the fork
+    worker_qreq_.indexer = qreq_.indexer
+    _WORKER_QREQ = worker_qreq_
+
+
+def _query_chunk_worker(qaids):
+    qreq_ = _WORKER_QREQ
+    sub_qreq_ = qreq_.shallowcopy(qaids=qaids)
+    sub_qreq_.indexer = qreq_.indexer
+    sub_qreq_.prog_hook = None
+    sub_cm_list = pipeline.request_ibeis_query_L0(qreq_.ibs, sub_qreq_,
+                                                  verbose=False)
+    return sub_qreq_.qaids, sub_cm_list
+
+
+def _parallel_query_chunks(qreq_, qaid_chunk_iter, n_workers, verbose):
+    """
+    Yields (qaids, cm_list) for each chunk in the order the chunks finish.
+    """
+    import multiprocessing
+    from concurrent import futures
+    # Load the indexer before forking so every worker shares it
+    qreq_.load_indexer(verbose=verbose)
+    prog_hook = qreq_.prog_hook
+    # The progress hook is driven from this process only
+    qreq_.prog_hook = None
+    if verbose:
+        print('[mc4] executing query chunks with %d workers' % (n_workers,))
+    executor = futures.ProcessPoolExecutor(
+        n_workers, mp_context=multiprocessing.get_context('fork'),
+        initializer=_init_query_worker,
+        initargs=(qreq_, qreq_.ibs.get_dbdir()))
+    fs_list = []
+    try:
+        fs_list = [executor.submit(_query_chunk_worker, qaids)
+                   for qaids in qaid_chunk_iter]
+        for fs in futures.as_completed(fs_list):
+            yield fs.result()
+    finally:
+        qreq_.prog_hook = prog_hook
+        # Dont wait on pending chunks if the caller stopped early or failed
+        for fs in fs_list:
+            fs.cancel()
+        executor.shutdown(wait=True)
+
+
 if __name__ == '__main__':
     """
     python -m ibeis.algo.hots.match_chips4
@@ -110,12 +110,6 @@ def compute_fmech_score(cm, qreq_=None, hack_single_ori=False):
             )
         except AttributeError:
             hack_single_ori =  True
-    # The core for each feature match
-    #
-    # The query feature index for each feature match
-    fm_list = cm.fm_list
-    fs_list = cm.get_fsv_prod_list()
-    fx1_list = [fm.T[0] for fm in fm_list]
     if hack_single_ori:
         # Group keypoints with the same xy-coordinate.
         # Combine these feature so each only recieves one vote
@@ -123,6 +117,17 @@ def compute_fmech_score(cm, qreq_=None, hack_single_ori=False):
             cm.qaid, config2_=qreq_.extern_query_config2)
         xys1_ = vt.get_xys(kpts1).T
         fx1_to_comboid = vt.compute_unique_arr_dataids(xys1_)
+    else:
+        fx1_to_comboid = None
+    if cm.is_packed:
+        return _compute_fmech_score_packed(cm, fx1_to_comboid)
+    # The core for each feature match
+    #
+    # The query feature index for each feature match
+    fm_list = cm.fm_list
+    fs_list = cm.get_fsv_prod_list()
+    fx1_list = [fm.T[0] for fm in fm_list]
+    if fx1_to_comboid is not None:
         fcombo_ids = [fx1_to_comboid.take(fx1) for fx1 in fx1_list]
     else:
         # use the feature index itself as a combo id
@@ -160,6 +165,43 @@ def compute_fmech_score(cm, qreq_=None, hack_single_ori=False):
     return nsum_score_list
 
 
+def _compute_fmech_score_packed(cm, fx1_to_comboid=None):
+    """
+    fmech on a packed chipmatch using segment reductions over the flat match
+    arrays instead of a loop over names.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.name_scoring import *  # NOQA
+        >>> cm = testdata_chipmatch().pack()
+        >>> nsum_score_list = compute_fmech_score(cm)
+        >>> assert np.all(nsum_score_list == [ 4.,  7.,  5.])
+    """
+    packed = cm._packed
+    fs = packed.cols['fsv'].prod(axis=1)
+    fx1 = packed.cols['fm'].T[0]
+    combo_ids = fx1 if fx1_to_comboid is None else fx1_to_comboid.take(fx1)
+    # Name index of every feature match
+    name_groupxs = cm.name_groupxs
+    annot_nidxs = np.empty(packed.num_annots, dtype=np.intp)
+    for nidx, idxs in enumerate(name_groupxs):
+        annot_nidxs[idxs] = nidx
+    match_nidxs = annot_nidxs.take(packed.segment_ids())
+    # Features (with the same id) can't vote for this name twice, so only
+    # the best scoring match of each (name, combo id) pair is summed.
+    sortx = np.lexsort((-fs, combo_ids, match_nidxs))
+    sorted_nidxs = match_nidxs.take(sortx)
+    sorted_combo = combo_ids.take(sortx)
+    is_first = np.ones(len(sortx), dtype=bool)
+    is_first[1:] = ((sorted_nidxs[1:] != sorted_nidxs[:-1]) |
+                    (sorted_combo[1:] != sorted_combo[:-1]))
+    votex = sortx.compress(is_first)
+    nsum_score_list = np.bincount(match_nidxs.take(votex),
+                                  weights=fs.take(votex),
+                                  minlength=len(name_groupxs))
+    return nsum_score_list
+
+
 @profile
 def get_chipmatch_namescore_nonvoting_feature_flags(cm, qreq_=None):
     """
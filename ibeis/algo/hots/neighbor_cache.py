@@ -0,0 +1,507 @@
+"""
+Consolidated storage for the nearest neighbor mid-pipeline cache.
+
+The neighbor cache used to write one ``nnobj_<cacheid>`` pickle per query
+annotation, so re-running an experiment with different downstream params
+opened and unpickled thousands of small files. A NeighborCache keeps the
+neighbors of every query that share an ``nn_mid_cacheid`` (data, nn, feature
+and flann configs) in one append-only data file plus an SQLite index. The
+``idxs``, ``dists`` and ``qfxs`` arrays of a query are stored back to back,
+so a batch of hits is one index lookup and a sequential pass over a memory
+map of the data file.
+
+Index rows remember when they were last used. When a store grows past its
+byte budget the least recently used rows are evicted and the data file is
+compacted, and :func:`prune_neighbor_cachedir` drops whole stores that have
+not been used recently when the cache directory grows past its budget.
+
+Compaction writes a new data file instead of rewriting the old one. The
+index records the generation number of the current data file, so a reader
+always opens the file that matches the offsets it read.
+
+CommandLine:
+    python -m ibeis.algo.hots.neighbor_cache --allexamples
+"""
+import os
+import sqlite3
+import time
+from os.path import join, exists
+import numpy as np
+import utool as ut
+print, rrr, profile = ut.inject2(__name__)
+
+
+# Arrays are aligned within the data file so frombuffer views are aligned too
+_ALIGN = 16
+# Byte budget of a single store and of the whole neighbor cache directory
+NN_CACHE_MAX_BYTES = ut.get_argval('--nn-cache-bytes', type_=int,
+                                   default=4 * 2 ** 30)
+# Stores used within this many seconds are never pruned
+NN_CACHE_PRUNE_MIN_AGE = 10 * 60
+
+
+def _padded(nbytes):
+    return nbytes + (-nbytes) % _ALIGN
+
+
+def _data_fpath_list(fpath):
+    """ The data files of every generation of a store """
+    prefix = os.path.basename(os.path.splitext(fpath)[0])
+    return ut.glob(os.path.dirname(fpath), prefix + '.*.bin')
+
+
+def _store_fpath_list(fpath):
+    """ All existing files of a store """
+    return [fpath_ for fpath_ in [fpath, fpath + '-wal', fpath + '-shm']
+            if exists(fpath_)] + _data_fpath_list(fpath)
+
+
+class NeighborCache(object):
+    r"""
+    The nearest neighbors of many queries in one data file and index.
+
+    Args:
+        fpath (str): path to the index. The data is stored next to it in a
+            ``.<generation>.bin`` file.
+        max_bytes (int): evict least recently used rows above this size
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_cache NeighborCache
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_cache import *  # NOQA
+        >>> from ibeis.algo.hots.pipeline import Neighbors
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'testfiles')
+        >>> fpath = join(dpath, 'test_nn_cache.sqlite3')
+        >>> NeighborCache.delete_files(fpath)
+        >>> rng = np.random.RandomState(0)
+        >>> nns_list = [
+        >>>     Neighbors(qaid, rng.randint(0, 1000, (n, 5)),
+        >>>               rng.rand(n, 5).astype(np.float32),
+        >>>               np.arange(n))
+        >>>     for qaid, n in [(1, 7), (2, 0), (3, 3)]]
+        >>> cacheid_list = ['nnobj_a', 'nnobj_b', 'nnobj_c']
+        >>> with NeighborCache(fpath) as store:
+        >>>     store.save_many(cacheid_list, nns_list)
+        >>> with NeighborCache(fpath) as store:
+        >>>     hits = store.load_many(['nnobj_a', 'nnobj_x', 'nnobj_c'])
+        >>>     print('hits = %r' % (sorted(hits.keys()),))
+        >>>     nn = hits['nnobj_c']
+        >>>     assert nn.qaid == 3 and nn.neighb_idxs.flags.writeable
+        >>>     assert np.all(nn.neighb_idxs == nns_list[2].neighb_idxs)
+        >>>     assert np.all(nn.neighb_dists == nns_list[2].neighb_dists)
+        >>>     assert nn.neighb_dists.dtype == np.float32
+        >>>     assert np.all(nn.qfx_list == nns_list[2].qfx_list)
+        >>>     assert store.load_many(['nnobj_b'])['nnobj_b'].neighb_idxs.shape == (0, 5)
+        >>>     # Only the most recently used row fits in the budget
+        >>>     store.max_bytes = store.nbytes(['nnobj_b']) + 1
+        >>>     store.evict()
+        >>>     print('left = %r' % (sorted(store.load_many(cacheid_list).keys()),))
+        >>>     # eviction compacted the data into a new file
+        >>>     assert store.data_nbytes() == store.nbytes()
+        >>>     assert store.generation() == 1
+        >>>     assert len(_data_fpath_list(fpath)) == 1
+        >>>     store.max_bytes = 2 ** 30
+        >>>     store.save_many(cacheid_list[0:1], nns_list[0:1])
+        >>>     nn = store.load_many(['nnobj_a'])['nnobj_a']
+        >>>     assert np.all(nn.neighb_idxs == nns_list[0].neighb_idxs)
+        hits = ['nnobj_a', 'nnobj_c']
+        left = ['nnobj_b']
+        >>> NeighborCache.delete_files(fpath)
+    """
+
+    def __init__(store, fpath, max_bytes=None):
+        store.fpath = fpath
+        store.max_bytes = NN_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        store.conn = sqlite3.connect(fpath, timeout=60)
+        store.conn.execute('PRAGMA journal_mode=WAL')
+        store.conn.execute('PRAGMA synchronous=NORMAL')
+        with store.conn:
+            store.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS neighbors (
+                    cacheid    TEXT PRIMARY KEY,
+                    qaid       INTEGER NOT NULL,
+                    num_qfxs   INTEGER NOT NULL,
+                    num_nbrs   INTEGER NOT NULL,
+                    idx_dtype  TEXT NOT NULL,
+                    dist_dtype TEXT NOT NULL,
+                    qfx_dtype  TEXT,
+                    offset     INTEGER NOT NULL,
+                    nbytes     INTEGER NOT NULL,
+                    atime      REAL NOT NULL
+                )
+                """)
+            store.conn.execute(
+                'CREATE INDEX IF NOT EXISTS neighbors_atime '
+                'ON neighbors (atime)')
+            store.conn.execute(
+                'CREATE TABLE IF NOT EXISTS generation '
+                '(generation INTEGER NOT NULL)')
+            store.conn.execute(
+                'INSERT INTO generation (generation) SELECT 0 '
+                'WHERE NOT EXISTS (SELECT 1 FROM generation)')
+
+    @staticmethod
+    def delete_files(fpath):
+        """ Removes the index and data files of a store """
+        for fpath_ in _store_fpath_list(fpath):
+            ut.delete(fpath_, verbose=False)
+
+    def __enter__(store):
+        return store
+
+    def __exit__(store, type_, value, trace):
+        store.close()
+
+    def __len__(store):
+        return store.conn.execute('SELECT COUNT(*) FROM neighbors').fetchone()[0]
+
+    def close(store):
+        if store.conn is not None:
+            store.conn.close()
+            store.conn = None
+
+    def nbytes(store, cacheid_list=None):
+        """ Total size of the live rows (or of the given rows) """
+        if cacheid_list is None:
+            query = 'SELECT COALESCE(SUM(nbytes), 0) FROM neighbors'
+            return store.conn.execute(query).fetchone()[0]
+        total = 0
+        for chunk in ut.ichunks(list(cacheid_list), 900):
+            query = ('SELECT COALESCE(SUM(nbytes), 0) FROM neighbors '
+                     'WHERE cacheid IN (%s)' % (','.join(['?'] * len(chunk)),))
+            total += store.conn.execute(query, chunk).fetchone()[0]
+        return total
+
+    def generation(store):
+        """ Generation number of the current data file """
+        query = 'SELECT generation FROM generation'
+        return store.conn.execute(query).fetchone()[0]
+
+    def data_fpath(store, generation=None):
+        if generation is None:
+            generation = store.generation()
+        return '%s.%d.bin' % (os.path.splitext(store.fpath)[0], generation)
+
+    def data_nbytes(store):
+        """ Size of the data file including evicted and replaced rows """
+        data_fpath = store.data_fpath()
+        if not exists(data_fpath):
+            return 0
+        return os.path.getsize(data_fpath)
+
+    @staticmethod
+    def _pack(nns):
+        idxs = np.ascontiguousarray(nns.neighb_idxs)
+        dists = np.ascontiguousarray(nns.neighb_dists)
+        qfxs = (None if nns.qfx_list is None else
+                np.ascontiguousarray(nns.qfx_list))
+        chunks = []
+        for arr in [idxs, dists] + ([] if qfxs is None else [qfxs]):
+            chunks.append(arr.tobytes())
+            chunks.append(b'\x00' * (_padded(arr.nbytes) - arr.nbytes))
+        info = (int(nns.qaid), idxs.shape[0], idxs.shape[1], idxs.dtype.str,
+                dists.dtype.str, None if qfxs is None else qfxs.dtype.str)
+        return info, b''.join(chunks)
+
+    @staticmethod
+    def _unpack(buf, offset, qaid, num_qfxs, num_nbrs, idx_dtype, dist_dtype,
+                qfx_dtype):
+        from ibeis.algo.hots.pipeline import Neighbors
+        shape = (num_qfxs, num_nbrs)
+        count = num_qfxs * num_nbrs
+        idx_dtype, dist_dtype = np.dtype(idx_dtype), np.dtype(dist_dtype)
+        idxs = np.frombuffer(buf, dtype=idx_dtype, count=count,
+                             offset=offset).reshape(shape)
+        offset += _padded(idxs.nbytes)
+        dists = np.frombuffer(buf, dtype=dist_dtype, count=count,
+                              offset=offset).reshape(shape)
+        offset += _padded(dists.nbytes)
+        if qfx_dtype is None:
+            qfxs = None
+        else:
+            qfxs = np.frombuffer(buf, dtype=np.dtype(qfx_dtype),
+                                 count=num_qfxs, offset=offset)
+        return Neighbors(qaid, idxs, dists, qfxs)
+
+    def save_many(store, cacheid_list, nns_list):
+        """
+        Appends (or replaces) neighbors, then evicts least recently used rows
+        if the store is over budget.
+        """
+        atime = time.time()
+        packed_list = [store._pack(nns) for nns in nns_list]
+        # The write lock of the index also serializes appends to the data
+        store.conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = []
+            with open(store.data_fpath(), 'ab') as file_:
+                offset = file_.tell()
+                for cacheid, (info, data) in zip(cacheid_list, packed_list):
+                    file_.write(data)
+                    rows.append((str(cacheid),) + info +
+                                (offset, len(data), atime))
+                    offset += len(data)
+            store.conn.executemany(
+                'INSERT OR REPLACE INTO neighbors (cacheid, qaid, num_qfxs, '
+                'num_nbrs, idx_dtype, dist_dtype, qfx_dtype, offset, nbytes, '
+                'atime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        except Exception:
+            store.conn.rollback()
+            raise
+        else:
+            store.conn.commit()
+        store.evict()
+
+    @profile
+    def load_many(store, cacheid_list):
+        """ Returns a dict from cacheid to Neighbors containing only the hits """
+        unique_cacheids = sorted(set(map(str, cacheid_list)))
+        try:
+            cacheid_to_nns = store._read(*store._lookup(unique_cacheids))
+        except IOError:
+            # A compaction removed the data file of the generation we read
+            cacheid_to_nns = store._read(*store._lookup(unique_cacheids))
+        # Mark the hits as recently used
+        atime = time.time()
+        with store.conn:
+            store.conn.executemany(
+                'UPDATE neighbors SET atime=? WHERE cacheid=?',
+                [(atime, cacheid) for cacheid in cacheid_to_nns])
+        return cacheid_to_nns
+
+    def _lookup(store, unique_cacheids):
+        """
+        Reads the index rows and the generation of their data file from a
+        single snapshot of the index
+        """
+        rows = []
+        store.conn.execute('BEGIN')
+        try:
+            generation = store.generation()
+            # Stay under the SQLite host parameter limit
+            for chunk in ut.ichunks(unique_cacheids, 900):
+                query = (
+                    'SELECT cacheid, offset, nbytes, qaid, num_qfxs, '
+                    'num_nbrs, idx_dtype, dist_dtype, qfx_dtype '
+                    'FROM neighbors WHERE cacheid IN (%s)' % (
+                        ','.join(['?'] * len(chunk)),))
+                rows.extend(store.conn.execute(query, chunk))
+        finally:
+            store.conn.rollback()
+        return generation, rows
+
+    def _read(store, generation, rows):
+        cacheid_to_nns = {}
+        if len(rows) == 0:
+            return cacheid_to_nns
+        # Read the hits in file order, one read per contiguous run of rows.
+        # The arrays are writable views into the read buffers.
+        rows.sort(key=lambda row: row[1])
+        run_list = [[rows[0]]]
+        for row in rows[1:]:
+            prev = run_list[-1][-1]
+            if row[1] == prev[1] + prev[2]:
+                run_list[-1].append(row)
+            else:
+                run_list.append([row])
+        with open(store.data_fpath(generation), 'rb') as file_:
+            for run in run_list:
+                start = run[0][1]
+                buf = np.empty(run[-1][1] + run[-1][2] - start, dtype=np.uint8)
+                file_.seek(start)
+                file_.readinto(buf)
+                for cacheid, offset, nbytes, *info in run:
+                    cacheid_to_nns[cacheid] = store._unpack(
+                        buf, offset - start, *info)
+        return cacheid_to_nns
+
+    def evict(store):
+        """
+        Deletes least recently used rows until the store fits its budget, and
+        compacts the data file once less than half of it is live.
+        """
+        total = store.nbytes()
+        evict_ids = []
+        if total > store.max_bytes:
+            cursor = store.conn.execute(
+                'SELECT cacheid, nbytes FROM neighbors ORDER BY atime, cacheid')
+            for cacheid, nbytes in cursor:
+                if total <= store.max_bytes:
+                    break
+                evict_ids.append((cacheid,))
+                total -= nbytes
+            with store.conn:
+                store.conn.executemany('DELETE FROM neighbors WHERE cacheid=?',
+                                       evict_ids)
+        if store.data_nbytes() > 2 * total:
+            store.compact()
+        return len(evict_ids)
+
+    def compact(store):
+        """
+        Copies the live rows into the data file of the next generation. The
+        old data file is deleted once the index points at the new one;
+        readers that still hold its offsets retry from the index.
+        """
+        store.conn.execute('BEGIN IMMEDIATE')
+        try:
+            generation = store.generation()
+            old_fpath = store.data_fpath(generation)
+            new_fpath = store.data_fpath(generation + 1)
+            rows = store.conn.execute(
+                'SELECT cacheid, offset, nbytes FROM neighbors '
+                'ORDER BY offset').fetchall()
+            new_offsets = []
+            with open(new_fpath, 'wb') as file_:
+                # np.memmap can not map an empty file
+                if exists(old_fpath) and os.path.getsize(old_fpath) > 0:
+                    data = np.memmap(old_fpath, dtype=np.uint8, mode='r')
+                else:
+                    data = np.empty(0, dtype=np.uint8)
+                for cacheid, offset, nbytes in rows:
+                    new_offsets.append((file_.tell(), cacheid))
+                    file_.write(data[offset:offset + nbytes].tobytes())
+                del data
+            store.conn.executemany(
+                'UPDATE neighbors SET offset=? WHERE cacheid=?', new_offsets)
+            store.conn.execute('UPDATE generation SET generation=?',
+                               (generation + 1,))
+        except Exception:
+            store.conn.rollback()
+            if exists(new_fpath):
+                ut.delete(new_fpath, verbose=False)
+            raise
+        else:
+            store.conn.commit()
+        if exists(old_fpath):
+            ut.delete(old_fpath, verbose=False)
+
+    def delete(store, cacheid_list):
+        with store.conn:
+            store.conn.executemany('DELETE FROM neighbors WHERE cacheid=?',
+                                   [(str(cacheid),) for cacheid in cacheid_list])
+
+
+def _is_write_locked(fpath):
+    """ True if another connection is writing to the index of a store """
+    conn = sqlite3.connect(fpath, timeout=0)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError:
+        return True
+    else:
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def prune_neighbor_cachedir(dpath, max_bytes=None, keep=(), min_age=None):
+    """
+    Deletes the least recently used neighbor stores in ``dpath`` until the
+    directory fits in ``max_bytes``. Stores in ``keep``, stores used within
+    the last ``min_age`` seconds and stores that are being written to are
+    never deleted.
+
+    Returns:
+        list: the deleted store paths
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_cache prune_neighbor_cachedir
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_cache import *  # NOQA
+        >>> from ibeis.algo.hots.pipeline import Neighbors
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'testfiles', 'nnprune')
+        >>> ut.delete(dpath, verbose=False)
+        >>> ut.ensuredir(dpath)
+        >>> nns = Neighbors(1, np.zeros((100, 5), dtype=np.int32),
+        >>>                 np.zeros((100, 5), dtype=np.float32), None)
+        >>> fpath_list = [join(dpath, 'nnstore_%d.sqlite3' % x) for x in range(3)]
+        >>> for fpath in fpath_list:
+        >>>     with NeighborCache(fpath) as store:
+        >>>         store.save_many(['nnobj_1'], [nns])
+        >>> # Nothing was used long enough ago
+        >>> assert prune_neighbor_cachedir(dpath, max_bytes=0) == []
+        >>> # A store that is being written to is skipped
+        >>> writer = NeighborCache(fpath_list[0])
+        >>> writer.conn.execute('BEGIN IMMEDIATE')
+        >>> deleted = prune_neighbor_cachedir(dpath, max_bytes=0, min_age=0,
+        >>>                                   keep=fpath_list[2:3])
+        >>> writer.close()
+        >>> assert deleted == fpath_list[1:2], deleted
+        >>> assert exists(fpath_list[0]) and exists(fpath_list[2])
+        >>> ut.delete(dpath, verbose=False)
+    """
+    if max_bytes is None:
+        max_bytes = NN_CACHE_MAX_BYTES
+    if min_age is None:
+        min_age = NN_CACHE_PRUNE_MIN_AGE
+    fpath_list = ut.glob(dpath, 'nnstore_*.sqlite3')
+    keep = set(keep)
+
+    sizes = {fpath: sum(map(os.path.getsize, _store_fpath_list(fpath)))
+             for fpath in fpath_list}
+    total = sum(sizes.values())
+    deleted = []
+
+    def _last_used(fpath):
+        # hits write their atime to the index (or its write ahead log)
+        return max(map(os.path.getmtime, _store_fpath_list(fpath)))
+
+    now = time.time()
+    for fpath in sorted(fpath_list, key=_last_used):
+        if total <= max_bytes:
+            break
+        if fpath in keep or now - _last_used(fpath) < min_age:
+            continue
+        if _is_write_locked(fpath):
+            continue
+        NeighborCache.delete_files(fpath)
+        total -= sizes[fpath]
+        deleted.append(fpath)
+    return deleted
+
+
+@profile
+def tryload_neighbors_with_compute(dpath, nn_mid_cacheid, cacheid_list,
+                                   compute_fn, *args):
+    """
+    Like ut.tryload_cache_list_with_compute, but bulk loads the hits from
+    and appends the misses to the NeighborCache of ``nn_mid_cacheid``.
+
+    ``compute_fn(ismiss_list, *args)`` must return the neighbors of the
+    missed queries.
+    """
+    fpath = join(dpath, 'nnstore_%s.sqlite3' % (ut.hashstr27(nn_mid_cacheid),))
+    with NeighborCache(fpath) as store:
+        cacheid_to_nns = store.load_many(cacheid_list)
+        ismiss_list = [cacheid not in cacheid_to_nns for cacheid in cacheid_list]
+        num_total = len(cacheid_list)
+        num_miss = sum(ismiss_list)
+        print('[nncache] %d/%d cache hits in %s' % (
+            num_total - num_miss, num_total, ut.tail(fpath)))
+        if num_miss > 0:
+            newdata_list = compute_fn(ismiss_list, *args)
+            miss_cacheids = ut.compress(cacheid_list, ismiss_list)
+            store.save_many(miss_cacheids, newdata_list)
+            cacheid_to_nns.update(zip(miss_cacheids, newdata_list))
+    if num_miss > 0:
+        prune_neighbor_cachedir(dpath, keep=[fpath])
+    return [cacheid_to_nns[cacheid] for cacheid in cacheid_list]
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_cache
+        python -m ibeis.algo.hots.neighbor_cache --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
@@ -5,12 +5,14 @@ multi_index.py as well
 
 https://github.com/spotify/annoy
 """
+import os
+import copy
 import six
 import numpy as np
 import utool as ut
 import vtool_ibeis as vt
 from vtool_ibeis._pyflann_backend import pyflann as pyflann
-from os.path import basename
+from os.path import basename, exists, join
 from ibeis.algo.hots import hstypes
 from ibeis.algo.hots import _pipeline_helpers as plh  # NOQA
 (print, rrr, profile) = ut.inject2(__name__)
@@ -19,6 +21,9 @@ USE_HOTSPOTTER_CACHE = not ut.get_argflag('--nocache-hs')
 NOSAVE_FLANN = ut.get_argflag('--nosave-flann')
 NOCACHE_FLANN = ut.get_argflag('--nocache-flann') and USE_HOTSPOTTER_CACHE
 
+# Names of the support arrays that are written to disk for memory mapping
+SUPPORT_KEYS = ['ax2_aid', 'idx2_vec', 'idx2_fgw', 'idx2_ax', 'idx2_fx']
+
 
 def get_support_data(qreq_, daid_list):
     """
@@ -183,6 +188,136 @@ def invert_index(vecs_list, fgws_list, ax_list, fxs_list, verbose=ut.NOT_QUIET):
     return idx2_vec, idx2_fgw, idx2_ax, idx2_fx
 
 
+def invert_index_memmap(vecs_list, fgws_list, ax_list, fxs_list, dpath,
+                        ax2_aid=None, verbose=ut.NOT_QUIET):
+    r"""
+    Like :func:`invert_index`, but the stacked arrays are written directly to
+    raw ``.npy`` files in ``dpath`` one annotation at a time and are returned
+    as read-only memory maps. The full descriptor matrix is never held in
+    memory and multiple processes can share the same page cached copy.
+
+    Args:
+        vecs_list (list):
+        fgws_list (list):
+        ax_list (list):
+        fxs_list (list):
+        dpath (str): directory to write the support arrays into
+        ax2_aid (ndarray): if specified, also written to ``dpath``
+        verbose (bool):  verbosity flag(default = True)
+
+    Returns:
+        tuple: (idx2_vec, idx2_fgw, idx2_ax, idx2_fx)
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index invert_index_memmap
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index import *  # NOQA
+        >>> import tempfile
+        >>> rng = np.random.RandomState(42)
+        >>> nFeat_list = [3, 0, 4, 1]
+        >>> vecs_list = [rng.randint(0, 255, (n, 16)).astype(np.uint8) for n in nFeat_list]
+        >>> fgws_list = [rng.rand(n).astype(np.float32) for n in nFeat_list]
+        >>> fxs_list = [np.arange(n) for n in nFeat_list]
+        >>> ax_list = np.arange(len(vecs_list))
+        >>> dpath = join(tempfile.mkdtemp(), 'support')
+        >>> tup1 = invert_index(vecs_list, fgws_list, ax_list, fxs_list, verbose=False)
+        >>> tup2 = invert_index_memmap(vecs_list, fgws_list, ax_list, fxs_list, dpath, verbose=False)
+        >>> assert all(np.all(a1 == a2) for a1, a2 in zip(tup1, tup2))
+        >>> assert not tup2[0].flags.writeable
+        >>> result = 'output depth_profile = %s' % (ut.depth_profile(tup2),)
+        >>> print(result)
+        output depth_profile = [(8, 16), 8, 8, 8]
+    """
+    nFeat_list = np.array(list(map(len, vecs_list)), dtype=np.int64)
+    nFeats = int(nFeat_list.sum())
+    dim = vecs_list[0].shape[1] if len(vecs_list) > 0 else 0
+    vec_dtype = vecs_list[0].dtype if len(vecs_list) > 0 else hstypes.VEC_TYPE
+    fgw_dtype = (None if fgws_list is None else
+                 np.result_type(*[fgws.dtype for fgws in fgws_list]))
+    if ut.VERYVERBOSE or verbose:
+        print('[nnindex] writing nVecs={} from nAnnots={} to disk'.format(
+            nFeats, len(ax_list)))
+    # Write into a temporary directory so other processes never see a
+    # partially written support set.
+    temp_dpath = dpath + '.tmp%d' % (os.getpid(),)
+    ut.ensuredir(temp_dpath)
+    open_memmap = np.lib.format.open_memmap
+    idx2_vec = open_memmap(join(temp_dpath, 'idx2_vec.npy'), mode='w+',
+                           dtype=vec_dtype, shape=(nFeats, dim))
+    idx2_ax = open_memmap(join(temp_dpath, 'idx2_ax.npy'), mode='w+',
+                          dtype=np.int32, shape=(nFeats,))
+    idx2_fx = open_memmap(join(temp_dpath, 'idx2_fx.npy'), mode='w+',
+                          dtype=np.int32, shape=(nFeats,))
+    if fgws_list is not None:
+        idx2_fgw = open_memmap(join(temp_dpath, 'idx2_fgw.npy'), mode='w+',
+                               dtype=fgw_dtype, shape=(nFeats,))
+    offset = 0
+    for count, (ax, nFeat) in enumerate(zip(ax_list, nFeat_list)):
+        if nFeat == 0:
+            continue
+        sl_ = slice(offset, offset + nFeat)
+        idx2_vec[sl_] = vecs_list[count]
+        idx2_ax[sl_] = ax
+        idx2_fx[sl_] = fxs_list[count]
+        if fgws_list is not None:
+            idx2_fgw[sl_] = fgws_list[count]
+        offset += nFeat
+    written = [idx2_vec, idx2_ax, idx2_fx]
+    if fgws_list is not None:
+        written.append(idx2_fgw)
+    for arr in written:
+        arr.flush()
+    del written, idx2_vec, idx2_ax, idx2_fx
+    if fgws_list is not None:
+        del idx2_fgw
+    if ax2_aid is not None:
+        np.save(join(temp_dpath, 'ax2_aid.npy'), np.asarray(ax2_aid))
+    _commit_support_dpath(temp_dpath, dpath)
+    support = load_support_arrays(dpath)
+    return (support['idx2_vec'], support['idx2_fgw'], support['idx2_ax'],
+            support['idx2_fx'])
+
+
+def _commit_support_dpath(temp_dpath, dpath):
+    """ atomically moves a finished temporary support directory into place """
+    try:
+        os.rename(temp_dpath, dpath)
+    except OSError:
+        if not exists(dpath):
+            raise
+        # Another process finished writing the same support data first
+        ut.delete(temp_dpath, verbose=False)
+
+
+def load_support_arrays(dpath, mmap_mode='r'):
+    r"""
+    Opens the support arrays written by :func:`invert_index_memmap` or
+    :func:`NeighborIndex.save_support`.
+
+    Args:
+        dpath (str): support directory
+        mmap_mode (str): passed to np.load (default = 'r')
+
+    Returns:
+        dict: maps each key in SUPPORT_KEYS to an array or None if it was not
+            written. Arrays are ndarray views into the mapped files.
+    """
+    support = {}
+    for key in SUPPORT_KEYS:
+        fpath = join(dpath, key + '.npy')
+        if exists(fpath):
+            arr = np.load(fpath, mmap_mode=mmap_mode)
+            if isinstance(arr, np.memmap):
+                # Plain views make take / slice results plain ndarrays too
+                arr = arr.view(np.ndarray)
+        else:
+            arr = None
+        support[key] = arr
+    return support
+
+
 @six.add_metaclass(ut.ReloadingMetaclass)
 class NeighborIndex(object):
     r"""
@@ -223,13 +358,18 @@ class NeighborIndex(object):
         nnindexer.num_indexed = None
         nnindexer.flann_fpath = None
         nnindexer.max_distance_sqrd = None  # max possible distance^2 for normalization
+        nnindexer.support_dpath = None  # directory of memory mapped support data
 
-    def init_support(indexer, aid_list, vecs_list, fgws_list, fxs_list, verbose=True):
+    def init_support(indexer, aid_list, vecs_list, fgws_list, fxs_list,
+                     verbose=True, support_dpath=None):
         r"""
         prepares inverted indicies and FLANN data structure
 
         flattens vecs_list and builds a reverse index from the flattened indices
         (idx) to the original aids and fxs
+
+        If support_dpath is specified the flattened arrays are written to that
+        directory and memory mapped instead of being stacked in memory.
         """
         assert indexer.flann is None, 'already initalized'
 
@@ -240,14 +380,21 @@ class NeighborIndex(object):
                                         'Cannot invert index without features!')
         # Create indexes into the input aids
         ax_list = np.arange(len(aid_list))
+        ax2_aid = np.array(aid_list)
 
         # Invert indicies
-        tup = invert_index(vecs_list, fgws_list, ax_list, fxs_list,
-                           verbose=verbose)
+        if support_dpath is None:
+            tup = invert_index(vecs_list, fgws_list, ax_list, fxs_list,
+                               verbose=verbose)
+        else:
+            tup = invert_index_memmap(vecs_list, fgws_list, ax_list, fxs_list,
+                                      support_dpath, ax2_aid=ax2_aid,
+                                      verbose=verbose)
         idx2_vec, idx2_fgw, idx2_ax, idx2_fx = tup
+        indexer._set_support(ax2_aid, idx2_vec, idx2_fgw, idx2_ax, idx2_fx)
+        indexer.support_dpath = support_dpath
 
-        ax2_aid = np.array(aid_list)
-
+    def _set_support(indexer, ax2_aid, idx2_vec, idx2_fgw, idx2_ax, idx2_fx):
         indexer.flann    = pyflann.FLANN()  # Approximate search structure
         indexer.ax2_aid  = ax2_aid   # (A x 1) Mapping to original annot ids
         indexer.idx2_vec = idx2_vec  # (M x D) Descriptors to index
@@ -266,6 +413,73 @@ class NeighborIndex(object):
             # changed')
             indexer.max_distance_sqrd = None
 
+    def get_support_dpath(indexer, cachedir):
+        """ directory where the memory mapped support data is stored """
+        cfgstr_hashid = ut.hashstr27(indexer.cfgstr)
+        return join(cachedir, indexer.prefix1 + '_support_' + cfgstr_hashid)
+
+    def load_support(indexer, support_dpath, verbose=True):
+        r"""
+        Memory maps support data previously written by `init_support` or
+        `save_support`. Returns False if it does not exist.
+
+        CommandLine:
+            python -m ibeis.algo.hots.neighbor_index load_support
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from ibeis.algo.hots.neighbor_index import *  # NOQA
+            >>> import tempfile
+            >>> rng = np.random.RandomState(0)
+            >>> aid_list = [1, 2, 3]
+            >>> vecs_list = [rng.randint(0, 255, (n, 128)).astype(np.uint8) for n in [10, 20, 30]]
+            >>> fxs_list = [np.arange(len(vecs)) for vecs in vecs_list]
+            >>> dpath = join(tempfile.mkdtemp(), 'support')
+            >>> indexer1 = NeighborIndex(None, 'test')
+            >>> indexer1.init_support(aid_list, vecs_list, None, fxs_list, support_dpath=dpath)
+            >>> indexer1.reindex()
+            >>> indexer2 = NeighborIndex(None, 'test')
+            >>> assert indexer2.load_support(dpath)
+            >>> indexer2.reindex()
+            >>> qfx2_vec = vecs_list[1][0:5]
+            >>> qfx2_idx1, qfx2_dist1 = indexer1.knn(qfx2_vec, 2)
+            >>> qfx2_idx2, qfx2_dist2 = indexer2.knn(qfx2_vec, 2)
+            >>> assert np.all(qfx2_idx1 == qfx2_idx2)
+            >>> assert np.all(indexer2.get_nn_aids(qfx2_idx2)[:, 0] == 2)
+            >>> assert not indexer2.idx2_vec.flags.writeable
+        """
+        assert indexer.flann is None, 'already initalized'
+        if not exists(join(support_dpath, 'ax2_aid.npy')):
+            return False
+        support = load_support_arrays(support_dpath)
+        if verbose:
+            print('[nnindex] memory mapped nVecs=%d from %r' % (
+                len(support['idx2_vec']), ut.path_ndir_split(support_dpath, n=2)))
+        indexer._set_support(**support)
+        indexer.support_dpath = support_dpath
+        return True
+
+    def save_support(indexer, support_dpath):
+        r"""
+        Writes the current support data to raw .npy files so it can be memory
+        mapped with `load_support`.
+        """
+        temp_dpath = support_dpath + '.tmp%d' % (os.getpid(),)
+        ut.ensuredir(temp_dpath)
+        for key in SUPPORT_KEYS:
+            arr = getattr(indexer, key)
+            if arr is not None:
+                np.save(join(temp_dpath, key + '.npy'), arr)
+        _commit_support_dpath(temp_dpath, support_dpath)
+
+    def _ensure_writable_support(indexer):
+        """ memory mapped support is read-only. Copy it before mutating. """
+        for key in SUPPORT_KEYS:
+            arr = getattr(indexer, key)
+            if arr is not None and not arr.flags.writeable:
+                setattr(indexer, key, np.array(arr))
+        indexer.support_dpath = None
+
     def add_ibeis_support(nnindexer, qreq_, new_daid_list,
                           verbose=ut.NOT_QUIET):
         r"""
@@ -354,6 +568,7 @@ class NeighborIndex(object):
         # FIXME:
         #nnindexer.ax2_aid
         if True:
+            nnindexer._ensure_writable_support()
             nnindexer.ax2_aid[remove_ax_list] = -1
             nnindexer.idx2_fx[remove_idx_list] = -1
             nnindexer.idx2_vec[remove_idx_list] = 0
@@ -433,6 +648,8 @@ class NeighborIndex(object):
         nnindexer.aid2_ax = ut.make_index_lookup(nnindexer.ax2_aid)
         if nnindexer.idx2_fgw is not None:
             nnindexer.idx2_fgw = _idx2_fgw
+        # The stacked support no longer corresponds to the files on disk
+        nnindexer.support_dpath = None
         #nnindexer.idx2_kpts   = None
         #nnindexer.idx2_oris   = None
         # Add new points to flann structure
@@ -758,10 +975,7 @@ class NeighborIndex(object):
             # hack to try and make things a little bit faster
             invalid_axs = np.array(ut.take(indexer.aid2_ax, impossible_aids))
             # pad += (len(invalid_axs) * 2)
-            def get_neighbors(vecs, temp_K):
-                return indexer.flann.nn_index(vecs, temp_K,
-                                              checks=indexer.checks,
-                                              cores=indexer.cores)
+            get_neighbors = indexer.nn_index_raw
             get_axs = indexer.get_nn_axs
             try:
                 (qfx2_idx, qfx2_raw_dist) = requery_knn.requery_knn(
@@ -777,6 +991,11 @@ class NeighborIndex(object):
                 qfx2_dist = qfx2_raw_dist
         return qfx2_idx, qfx2_dist
 
+    def nn_index_raw(indexer, qfx2_vec, K):
+        """ unnormalized flann search without any corner case handling """
+        return indexer.flann.nn_index(qfx2_vec, K, checks=indexer.checks,
+                                      cores=indexer.cores)
+
     def batch_knn(indexer, vecs, K, chunksize=4096, label='batch knn'):
         """
         Works like `indexer.knn` but the input is split into batches and
@@ -935,6 +1154,968 @@ class NeighborIndex(object):
         return qfx2_nid
 
 
+@six.add_metaclass(ut.ReloadingMetaclass)
+class ShardedNeighborIndex(ut.NiceRepr):
+    r"""
+    Covers a set of database annotations with several independent
+    NeighborIndex shards. Each query is searched against every shard (in a
+    thread pool, FLANN releases the GIL) and the per-shard results are merged
+    by distance.
+
+    The global index space is the concatenation of the shard index spaces, so
+    when the shards are built over consecutive chunks of the same annotation
+    list the merged neighbors are identical to those of a single index for
+    exact search (e.g. the linear algorithm).
+
+    Args:
+        shards (list): list of initialized and indexed NeighborIndex objects
+        cfgstr (str): configuration id
+        n_workers (int): number of threads used to search the shards.
+            If None, uses one per shard up to the number of cpus.
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index ShardedNeighborIndex
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> aid_list = list(range(1, 11))
+        >>> vecs_list = [rng.randint(0, 256, (rng.randint(5, 40), 128)).astype(np.uint8)
+        >>>              for _ in aid_list]
+        >>> fgws_list = [rng.rand(len(vecs)).astype(np.float32) for vecs in vecs_list]
+        >>> fxs_list = [np.arange(len(vecs)) for vecs in vecs_list]
+        >>> flann_params = {'algorithm': 'linear'}
+        >>> indexer = NeighborIndex(flann_params.copy(), 'mono')
+        >>> indexer.init_support(aid_list, vecs_list, fgws_list, fxs_list, verbose=False)
+        >>> indexer.reindex(verbose=False)
+        >>> sharded = ShardedNeighborIndex.from_support(
+        >>>     aid_list, vecs_list, fgws_list, fxs_list, flann_params,
+        >>>     shard_size=3, verbose=False)
+        >>> qfx2_vec = rng.randint(0, 256, (50, 128)).astype(np.uint8)
+        >>> qfx2_idx1, qfx2_dist1 = indexer.knn(qfx2_vec, 5)
+        >>> qfx2_idx2, qfx2_dist2 = sharded.knn(qfx2_vec, 5)
+        >>> assert np.all(qfx2_dist1 == qfx2_dist2)
+        >>> assert np.all(qfx2_idx1 == qfx2_idx2)
+        >>> assert np.all(indexer.get_nn_aids(qfx2_idx1) == sharded.get_nn_aids(qfx2_idx2))
+        >>> assert np.all(indexer.get_nn_featxs(qfx2_idx1) == sharded.get_nn_featxs(qfx2_idx2))
+        >>> assert np.all(indexer.get_nn_fgws(qfx2_idx1) == sharded.get_nn_fgws(qfx2_idx2))
+        >>> assert np.all(indexer.get_nn_vecs(qfx2_idx1) == sharded.get_nn_vecs(qfx2_idx2))
+        >>> assert np.all(indexer.get_nn_axs(qfx2_idx1) == sharded.get_nn_axs(qfx2_idx2))
+        >>> assert len(sharded.shards) == 4
+        >>> assert sharded.num_indexed == indexer.num_indexed
+    """
+
+    def __init__(sharded, shards, cfgstr=None, n_workers=None):
+        assert len(shards) > 0, 'need at least one shard'
+        sharded.shards = shards
+        sharded.cfgstr = cfgstr
+        sharded.n_workers = n_workers
+        sharded._executor = None
+        # process that owns the executor threads
+        sharded._executor_pid = None
+        # Offsets of each shard in the global idx and ax spaces
+        nVecs_list = [shard.num_indexed for shard in shards]
+        nAnnots_list = [len(shard.ax2_aid) for shard in shards]
+        sharded.idx_offsets = np.cumsum([0] + nVecs_list)[:-1]
+        sharded.ax_offsets = np.cumsum([0] + nAnnots_list)[:-1]
+        sharded.num_indexed = sum(nVecs_list)
+        sharded.ax2_aid = np.hstack([shard.ax2_aid for shard in shards])
+        sharded.aid2_ax = ut.make_index_lookup(sharded.ax2_aid)
+        sharded.max_distance_sqrd = shards[0].max_distance_sqrd
+        sharded.flann_params = shards[0].flann_params
+        sharded.checks = shards[0].checks
+        sharded.flann_fpath = [shard.flann_fpath for shard in shards]
+
+    def __nice__(sharded):
+        return ' nShards=%r nA=%r nV=%r' % (
+            len(sharded.shards), len(sharded.ax2_aid), sharded.num_indexed)
+
+    @classmethod
+    def from_support(cls, aid_list, vecs_list, fgws_list, fxs_list,
+                     flann_params, shard_size, cfgstr=None, n_workers=None,
+                     verbose=True):
+        """
+        Builds (without caching) one NeighborIndex per chunk of `shard_size`
+        annotations.
+        """
+        if fgws_list is None:
+            fgws_list = [None] * len(aid_list)
+        shards = []
+        chunk_iter = zip(ut.ichunks(aid_list, shard_size),
+                         ut.ichunks(vecs_list, shard_size),
+                         ut.ichunks(fgws_list, shard_size),
+                         ut.ichunks(fxs_list, shard_size))
+        for shardx, chunk in enumerate(chunk_iter):
+            aids, vecs, fgws, fxs = chunk
+            if fgws[0] is None:
+                fgws = None
+            shard = NeighborIndex(flann_params.copy(), '%s_shard%d' % (cfgstr, shardx))
+            shard.init_support(aids, vecs, fgws, fxs, verbose=verbose)
+            shard.reindex(verbose=verbose)
+            shards.append(shard)
+        return cls(shards, cfgstr=cfgstr, n_workers=n_workers)
+
+    def __getstate__(sharded):
+        state = sharded.__dict__.copy()
+        state['_executor'] = None
+        state['_executor_pid'] = None
+        return state
+
+    def _map_shards(sharded, func, *args):
+        """ applies func(shard, *args) to every shard, possibly in parallel """
+        n_workers = sharded.n_workers
+        if n_workers is None:
+            n_workers = min(len(sharded.shards), ut.num_cpus())
+        if n_workers <= 1 or len(sharded.shards) == 1:
+            return [func(shard, *args) for shard in sharded.shards]
+        if sharded._executor is None or sharded._executor_pid != os.getpid():
+            # The threads of an executor made before a fork do not exist in
+            # the child, so a forked process makes its own executor.
+            import concurrent.futures
+            sharded._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=n_workers)
+            sharded._executor_pid = os.getpid()
+        futures = [sharded._executor.submit(func, shard, *args)
+                   for shard in sharded.shards]
+        return [future.result() for future in futures]
+
+    def close(sharded):
+        if sharded._executor is not None:
+            if sharded._executor_pid == os.getpid():
+                sharded._executor.shutdown()
+            sharded._executor = None
+            sharded._executor_pid = None
+
+    @staticmethod
+    def _shard_nn_index_raw(shard, qfx2_vec, K):
+        K_ = min(K, shard.num_indexed)
+        if K_ == 0:
+            return (np.empty((len(qfx2_vec), 0), dtype=np.int32),
+                    np.empty((len(qfx2_vec), 0), dtype=np.float32))
+        (qfx2_idx, qfx2_raw_dist) = shard.nn_index_raw(qfx2_vec, K_)
+        # flann squeezes the results when K == 1
+        qfx2_idx = qfx2_idx.reshape(len(qfx2_vec), K_)
+        qfx2_raw_dist = qfx2_raw_dist.reshape(len(qfx2_vec), K_)
+        return qfx2_idx, qfx2_raw_dist
+
+    @profile
+    def nn_index_raw(sharded, qfx2_vec, K):
+        """
+        Searches every shard for K neighbors and merges the results by
+        distance (ties broken by global index).
+        """
+        results = sharded._map_shards(sharded._shard_nn_index_raw, qfx2_vec, K)
+        qfx2_idx = np.hstack([
+            idxs + offset
+            for (idxs, _), offset in zip(results, sharded.idx_offsets)
+        ]).astype(np.int32)
+        qfx2_raw_dist = np.hstack([dists for _, dists in results])
+        # k-way merge of the sorted per-shard results
+        sortx = np.lexsort((qfx2_idx, qfx2_raw_dist), axis=-1)[:, 0:K]
+        qfx2_idx = np.take_along_axis(qfx2_idx, sortx, axis=1)
+        qfx2_raw_dist = np.take_along_axis(qfx2_raw_dist, sortx, axis=1)
+        return qfx2_idx, qfx2_raw_dist
+
+    @profile
+    def knn(sharded, qfx2_vec, K):
+        """
+        Returns the indices and normalized squared distance to the nearest K
+        neighbors over all shards. See `NeighborIndex.knn`.
+        """
+        if K == 0:
+            (qfx2_idx, qfx2_dist) = sharded.empty_neighbors(len(qfx2_vec), 0)
+        elif K > sharded.num_indexed:
+            (qfx2_idx, qfx2_dist) = sharded.empty_neighbors(len(qfx2_vec), 0)
+        elif len(qfx2_vec) == 0:
+            (qfx2_idx, qfx2_dist) = sharded.empty_neighbors(0, K)
+        else:
+            (qfx2_idx, qfx2_raw_dist) = sharded.nn_index_raw(qfx2_vec, K)
+            if sharded.max_distance_sqrd is not None:
+                qfx2_dist = np.divide(qfx2_raw_dist, sharded.max_distance_sqrd)
+            else:
+                qfx2_dist = qfx2_raw_dist
+        return (qfx2_idx, qfx2_dist)
+
+    # These only depend on the methods defined here
+    requery_knn = NeighborIndex.requery_knn
+    batch_knn = NeighborIndex.batch_knn
+    empty_neighbors = NeighborIndex.empty_neighbors
+    num_indexed_annots = NeighborIndex.num_indexed_annots
+    get_indexed_aids = NeighborIndex.get_indexed_aids
+    get_nn_nids = NeighborIndex.get_nn_nids
+
+    def get_dtype(sharded):
+        return sharded.shards[0].get_dtype()
+
+    def num_indexed_vecs(sharded):
+        return sharded.num_indexed
+
+    def _take_support(sharded, key, qfx2_nnidx, offsets=None):
+        """ gathers a support array from the shards owning each global idx """
+        qfx2_nnidx = np.asarray(qfx2_nnidx)
+        flat_idxs = qfx2_nnidx.ravel()
+        shardxs = np.searchsorted(sharded.idx_offsets, flat_idxs,
+                                  side='right') - 1
+        arr0 = getattr(sharded.shards[0], key)
+        flat_vals = np.empty((len(flat_idxs),) + arr0.shape[1:],
+                             dtype=arr0.dtype)
+        for shardx, shard in enumerate(sharded.shards):
+            flags = shardxs == shardx
+            if not np.any(flags):
+                continue
+            local_idxs = flat_idxs[flags] - sharded.idx_offsets[shardx]
+            vals = getattr(shard, key).take(local_idxs, axis=0)
+            if offsets is not None:
+                vals = vals + offsets[shardx]
+            flat_vals[flags] = vals
+        return flat_vals.reshape(qfx2_nnidx.shape + arr0.shape[1:])
+
+    def get_nn_vecs(sharded, qfx2_nnidx):
+        r""" gets matching vectors """
+        return sharded._take_support('idx2_vec', qfx2_nnidx)
+
+    def get_nn_axs(sharded, qfx2_nnidx):
+        r""" gets matching global annotation indices """
+        return sharded._take_support('idx2_ax', qfx2_nnidx,
+                                     offsets=sharded.ax_offsets)
+
+    def get_nn_aids(sharded, qfx2_nnidx):
+        r""" gets matching annotation ids """
+        return sharded.ax2_aid.take(sharded.get_nn_axs(qfx2_nnidx))
+
+    def get_nn_featxs(sharded, qfx2_nnidx):
+        r""" gets matching feature indices w.r.t. the source annotation """
+        return sharded._take_support('idx2_fx', qfx2_nnidx)
+
+    def get_nn_fgws(sharded, qfx2_nnidx):
+        r""" gets forground weights of neighbors """
+        if sharded.shards[0].idx2_fgw is None:
+            return np.ones(np.shape(qfx2_nnidx))
+        return sharded._take_support('idx2_fgw', qfx2_nnidx)
+
+
+def brute_force_knn(qfx2_vec, data_vecs, K, chunksize=None):
+    r"""
+    Exact nearest neighbors by exhaustive search. Distances are squared
+    euclidean distances in the same units FLANN returns.
+
+    Args:
+        qfx2_vec (ndarray): (N x D) query vectors
+        data_vecs (ndarray): (M x D) data vectors
+        K (int): number of neighbors. Clipped to M.
+        chunksize (int): number of query vectors per distance block. Defaults
+            to a value that bounds the block to about 4M distances.
+
+    Returns:
+        tuple: (qfx2_idx, qfx2_raw_dist) each (N x min(K, M)), sorted by
+            distance, ties broken by index
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index brute_force_knn
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> data_vecs = rng.randint(0, 256, (100, 128)).astype(np.uint8)
+        >>> qfx2_vec = rng.randint(0, 256, (7, 128)).astype(np.uint8)
+        >>> flann = pyflann.FLANN()
+        >>> flann.build_index(data_vecs, algorithm='linear')
+        >>> qfx2_idx1, qfx2_dist1 = flann.nn_index(qfx2_vec, 4)
+        >>> qfx2_idx2, qfx2_dist2 = brute_force_knn(qfx2_vec, data_vecs, 4, chunksize=3)
+        >>> assert np.all(qfx2_idx1 == qfx2_idx2)
+        >>> assert np.all(qfx2_dist1 == qfx2_dist2)
+    """
+    num_data = len(data_vecs)
+    K_ = min(K, num_data)
+    qfx2_idx = np.empty((len(qfx2_vec), K_), dtype=np.int32)
+    qfx2_raw_dist = np.empty((len(qfx2_vec), K_), dtype=np.float32)
+    if K_ == 0 or len(qfx2_vec) == 0:
+        return qfx2_idx, qfx2_raw_dist
+    # float64 keeps the distances between uint8 descriptors exact
+    data = data_vecs.astype(np.float64)
+    data_sqrd = (data ** 2).sum(axis=1)
+    if chunksize is None:
+        chunksize = max(1, (2 ** 22) // num_data)
+    for sl_ in ut.ichunk_slices(len(qfx2_vec), chunksize):
+        qvecs = qfx2_vec[sl_].astype(np.float64)
+        dists = (qvecs ** 2).sum(axis=1)[:, None] + data_sqrd[None, :]
+        dists -= 2 * qvecs.dot(data.T)
+        np.maximum(dists, 0, out=dists)
+        if K_ < num_data:
+            partx = np.argpartition(dists, K_ - 1, axis=1)[:, 0:K_]
+        else:
+            partx = np.tile(np.arange(num_data), (len(qvecs), 1))
+        part_dists = np.take_along_axis(dists, partx, axis=1)
+        sortx = np.lexsort((partx, part_dists), axis=-1)
+        qfx2_idx[sl_] = np.take_along_axis(partx, sortx, axis=1)
+        qfx2_raw_dist[sl_] = np.take_along_axis(part_dists, sortx, axis=1)
+    return qfx2_idx, qfx2_raw_dist
+
+
+class QueryArena(ut.NiceRepr):
+    r"""
+    Reusable buffer that packs the (optionally filtered) query vectors of many
+    annotations into one contiguous array. The buffer only grows until it is
+    released, so packing successive chunks of a query request does not
+    reallocate. An arena must not be shared between threads.
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index QueryArena
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index import *  # NOQA
+        >>> vecs_list = [np.full((3, 2), x, dtype=np.uint8) for x in [1, 2, 3]]
+        >>> flags_list = [np.array([1, 0, 1], dtype=bool), None,
+        >>>               np.array([0, 0, 0], dtype=bool)]
+        >>> arena = QueryArena()
+        >>> vecs, fxs, offsets = arena.pack(vecs_list, flags_list)
+        >>> print(arena)
+        <QueryArena(capacity=5)>
+        >>> print('fxs = %r' % (fxs.tolist(),))
+        fxs = [0, 2, 0, 1, 2]
+        >>> print('offsets = %r' % (offsets.tolist(),))
+        offsets = [0, 2, 5, 5]
+        >>> print('vecs = %r' % (vecs.T[0].tolist(),))
+        vecs = [1, 1, 2, 2, 2]
+        >>> vecs2 = arena.pack(vecs_list[0:1])[0]
+        >>> assert vecs2.base is vecs.base
+        >>> arena.release(max_nbytes=10)
+        >>> print(arena)
+        <QueryArena(capacity=5)>
+        >>> arena.release(max_nbytes=8)
+        >>> print(arena)
+        <QueryArena(capacity=0)>
+    """
+    def __init__(arena):
+        arena.buf = None
+
+    def __nice__(arena):
+        return 'capacity=%d' % (0 if arena.buf is None else len(arena.buf),)
+
+    def reserve(arena, num, dim, dtype):
+        """ Returns a view of ``num`` rows, growing the buffer if needed """
+        buf = arena.buf
+        if (buf is None or len(buf) < num or buf.shape[1] != dim or
+              buf.dtype != dtype):
+            capacity = num
+            if buf is not None and buf.shape[1] == dim and buf.dtype == dtype:
+                capacity = max(num, int(len(buf) * 1.5))
+            arena.buf = buf = np.empty((capacity, dim), dtype=dtype)
+        return buf[0:num]
+
+    def release(arena, max_nbytes=0):
+        """ Frees the buffer if it is larger than ``max_nbytes`` """
+        if arena.buf is not None and arena.buf.nbytes > max_nbytes:
+            arena.buf = None
+
+    def pack(arena, vecs_list, flags_list=None):
+        """
+        Copies the rows of each ``vecs_list[i]`` selected by
+        ``flags_list[i]`` (None keeps every row) into the buffer.
+
+        Returns:
+            tuple: (vecs, fxs, offsets) where ``vecs`` is a view of the
+                buffer, ``fxs`` are the original row indices and the rows of
+                annotation ``i`` are ``offsets[i]:offsets[i + 1]``. ``fxs``
+                is freshly allocated, so views of it outlive the next pack.
+        """
+        if flags_list is None:
+            flags_list = [None] * len(vecs_list)
+        lens = [len(vecs) if flags is None else int(flags.sum())
+                for vecs, flags in zip(vecs_list, flags_list)]
+        offsets = np.zeros(len(lens) + 1, dtype=np.intp)
+        np.cumsum(lens, out=offsets[1:])
+        total = int(offsets[-1])
+        first = vecs_list[0] if len(vecs_list) > 0 else np.empty((0, 128))
+        vecs = arena.reserve(total, first.shape[1], first.dtype)
+        fxs = np.empty(total, dtype=np.intp)
+        bounds = offsets.tolist()
+        for qvecs, flags, start, stop in zip(vecs_list, flags_list,
+                                             bounds[:-1], bounds[1:]):
+            if flags is None:
+                vecs[start:stop] = qvecs
+                fxs[start:stop] = np.arange(stop - start)
+            else:
+                np.compress(flags, qvecs, axis=0, out=vecs[start:stop])
+                fxs[start:stop] = np.flatnonzero(flags)
+        return vecs, fxs, offsets
+
+
+def packed_knn(indexer, vecs, offsets, num_neighbors_list):
+    r"""
+    Nearest neighbors for several annotations whose query vectors are packed
+    into one array (see QueryArena). Annotations asking for the same number of
+    neighbors are searched together, so there is one multi-threaded FLANN call
+    per distinct K instead of one per annotation.
+
+    FLANN is approximate and its search depends on K, so the annotations are
+    not searched once at the maximum K and truncated; that would change the
+    results.
+
+    Args:
+        indexer (NeighborIndex): any indexer with a ``knn`` method
+        vecs (ndarray): packed query vectors
+        offsets (ndarray): rows of annotation ``i`` are
+            ``offsets[i]:offsets[i + 1]``
+        num_neighbors_list (list): K for each annotation
+
+    Returns:
+        list: ``(qfx2_idx, qfx2_dist)`` for each annotation. The arrays are
+            views into one result array per distinct K.
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index packed_knn
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index import *  # NOQA
+        >>> indexer, qreq_, ibs = testdata_nnindexer()
+        >>> vecs_list = qreq_.internal_qannots.vecs
+        >>> num_neighbors_list = [3 + (x % 2) for x in range(len(vecs_list))]
+        >>> vecs, fxs, offsets = QueryArena().pack(vecs_list)
+        >>> idx_dist_list = packed_knn(indexer, vecs, offsets, num_neighbors_list)
+        >>> for qfx2_vec, K, (idxs, dists) in zip(vecs_list, num_neighbors_list,
+        >>>                                       idx_dist_list):
+        >>>     idxs1, dists1 = indexer.knn(qfx2_vec, K)
+        >>>     assert np.all(idxs == idxs1) and np.all(dists == dists1)
+    """
+    num_neighbors_list = np.asarray(num_neighbors_list, dtype=np.intp)
+    idx_dist_list = [None] * len(num_neighbors_list)
+    lens = np.diff(offsets)
+    for K in np.unique(num_neighbors_list).tolist():
+        qxs = np.flatnonzero((num_neighbors_list == K) & (lens > 0))
+        if len(qxs) > 0:
+            # Gather the group into one array, a view if it is already
+            # contiguous in the packed order
+            starts = offsets.take(qxs)
+            stops = offsets.take(qxs + 1)
+            if np.all(starts[1:] == stops[:-1]):
+                group_vecs = vecs[starts[0]:stops[-1]]
+            else:
+                group_vecs = np.concatenate(
+                    [vecs[start:stop] for start, stop in zip(starts, stops)])
+            idxs, dists = indexer.knn(group_vecs, K)
+            group_bounds = np.cumsum(np.hstack([[0], stops - starts])).tolist()
+            for qx, start, stop in zip(qxs.tolist(), group_bounds[:-1],
+                                       group_bounds[1:]):
+                idx_dist_list[qx] = (idxs[start:stop], dists[start:stop])
+    # Annotations without any query vectors get the indexer's empty result
+    for qx in np.flatnonzero(lens == 0).tolist():
+        idx_dist_list[qx] = indexer.knn(vecs[0:0], int(num_neighbors_list[qx]))
+    return idx_dist_list
+
+
+@six.add_metaclass(ut.ReloadingMetaclass)
+class IncrementalNeighborIndex(ut.NiceRepr):
+    r"""
+    Wraps a built NeighborIndex so annotations can be added and removed
+    without touching the FLANN structure.
+
+    * Added annotations go into an append-only delta buffer that is searched
+      exactly by brute force.
+    * Removed annotations are tombstoned. Their neighbors are filtered out of
+      the results and the base index is re-searched with a larger K if too
+      few live neighbors remain.
+    * When the delta buffer exceeds ``delta_thresh`` or the tombstones exceed
+      ``tombstone_thresh`` (both as fractions of the base vectors), a new
+      FLANN index over the live vectors is built in a background thread.
+      The new index is swapped in by `maybe_compact` / `finish_compaction`,
+      never while a query is running.
+
+    The global idx / ax spaces are the base spaces followed by the delta
+    spaces, so they stay valid until the next compaction swap.
+
+    Args:
+        base (NeighborIndex): initialized and indexed neighbor index
+        delta_thresh (float): delta vecs / base vecs before compaction
+        tombstone_thresh (float): removed vecs / base vecs before compaction
+        background (bool): if False compaction runs synchronously
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index IncrementalNeighborIndex
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index import *  # NOQA
+        >>> rng = np.random.RandomState(0)
+        >>> def make_data(aid_list):
+        >>>     vecs_list = [rng.randint(0, 256, (rng.randint(5, 40), 128)).astype(np.uint8)
+        >>>                  for _ in aid_list]
+        >>>     fxs_list = [np.arange(len(vecs)) for vecs in vecs_list]
+        >>>     return vecs_list, None, fxs_list
+        >>> flann_params = {'algorithm': 'linear'}
+        >>> base = NeighborIndex(flann_params.copy(), 'base')
+        >>> base_data = make_data([1, 2, 3, 4])
+        >>> base.init_support([1, 2, 3, 4], *base_data, verbose=False)
+        >>> base.reindex(verbose=False)
+        >>> inc = IncrementalNeighborIndex(base, delta_thresh=10, tombstone_thresh=10)
+        >>> new_data = make_data([5, 6])
+        >>> inc.add_support([5, 6], *new_data, verbose=False)
+        >>> inc.remove_support([2, 5], verbose=False)
+        >>> qfx2_vec = np.vstack([base_data[0][1], new_data[0][0], new_data[0][1]])
+        >>> qfx2_idx, qfx2_dist = inc.knn(qfx2_vec, 3)
+        >>> qfx2_aid = inc.get_nn_aids(qfx2_idx)
+        >>> assert not np.any(np.isin(qfx2_aid, [2, 5])), 'tombstoned'
+        >>> assert np.all(qfx2_aid[-len(new_data[0][1]):, 0] == 6), 'delta is searched'
+        >>> # Compare against a monolithic index over the live annotations
+        >>> mono = NeighborIndex(flann_params.copy(), 'mono')
+        >>> mono.init_support([1, 3, 4, 6], [base_data[0][0], base_data[0][2],
+        >>>                   base_data[0][3], new_data[0][1]], None,
+        >>>                   [base_data[2][0], base_data[2][2],
+        >>>                    base_data[2][3], new_data[2][1]], verbose=False)
+        >>> mono.reindex(verbose=False)
+        >>> qfx2_idx2, qfx2_dist2 = mono.knn(qfx2_vec, 3)
+        >>> assert np.all(qfx2_dist == qfx2_dist2)
+        >>> assert np.all(qfx2_aid == mono.get_nn_aids(qfx2_idx2))
+        >>> # Changes to a fork do not touch the original
+        >>> inc2 = inc.fork()
+        >>> inc2.remove_support([1], verbose=False)
+        >>> inc2.add_support([7], *make_data([7]), verbose=False)
+        >>> assert sorted(inc.get_indexed_aids()) == [1, 3, 4, 6]
+        >>> assert sorted(inc2.get_indexed_aids()) == [3, 4, 6, 7]
+        >>> # Compaction moves everything into the base index
+        >>> inc.start_compaction()
+        >>> assert inc.finish_compaction(wait=True)
+        >>> assert inc.get_metrics()['num_delta_vecs'] == 0
+        >>> assert inc.get_metrics()['num_tombstoned_vecs'] == 0
+        >>> assert sorted(inc.get_indexed_aids()) == [1, 3, 4, 6]
+        >>> qfx2_idx3, qfx2_dist3 = inc.knn(qfx2_vec, 3)
+        >>> assert np.all(qfx2_dist == qfx2_dist3)
+    """
+
+    def __init__(inc, base, delta_thresh=.1, tombstone_thresh=.1,
+                 background=True):
+        inc.cfgstr = base.cfgstr
+        inc.delta_thresh = delta_thresh
+        inc.tombstone_thresh = tombstone_thresh
+        inc.background = background
+        inc.metrics = ut.odict([
+            ('num_knn_calls', 0),
+            ('num_query_vecs', 0),
+            ('knn_seconds', 0.0),
+            ('num_brute_force_dists', 0),
+            ('num_tombstone_requeries', 0),
+            ('num_compactions', 0),
+            ('last_compaction_seconds', None),
+            ('total_compaction_seconds', 0.0),
+        ])
+        inc._compaction = None
+        inc._removed_log = []
+        inc._set_base(base)
+
+    def _set_base(inc, base, delta=None, base_alive=None):
+        inc.base = base
+        inc.max_distance_sqrd = base.max_distance_sqrd
+        inc.flann_params = base.flann_params
+        inc.checks = base.checks
+        inc.flann_fpath = base.flann_fpath
+        inc.ax2_nvecs_base = np.bincount(base.idx2_ax,
+                                         minlength=len(base.ax2_aid))
+        if base_alive is None:
+            base_alive = base.ax2_aid != -1
+        inc.base_alive = base_alive
+        if delta is None:
+            delta = ([], [], [], [], [])
+        (inc.delta_aids, inc.delta_vecs_list, inc.delta_fgws_list,
+         inc.delta_fxs_list, inc.delta_alive) = delta
+        inc._update_delta()
+
+    def __nice__(inc):
+        metrics = inc.get_metrics()
+        return ' nA=%r nBaseV=%r nDeltaV=%r nDeadV=%r' % (
+            metrics['num_live_annots'], metrics['num_base_vecs'],
+            metrics['num_delta_vecs'], metrics['num_tombstoned_vecs'])
+
+    def _update_delta(inc):
+        """ restacks the delta buffer and rebuilds the global lookups """
+        base = inc.base
+        num_delta = len(inc.delta_aids)
+        if num_delta > 0:
+            tup = invert_index(inc.delta_vecs_list,
+                               (None if base.idx2_fgw is None else
+                                inc.delta_fgws_list),
+                               np.arange(num_delta), inc.delta_fxs_list,
+                               verbose=False)
+        else:
+            dim = base.idx2_vec.shape[1]
+            tup = (np.empty((0, dim), dtype=base.idx2_vec.dtype),
+                   None if base.idx2_fgw is None else np.empty(0, np.float32),
+                   np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32))
+        (inc.delta_idx2_vec, inc.delta_idx2_fgw, inc.delta_idx2_ax,
+         inc.delta_idx2_fx) = tup
+        inc.ax_offset = len(base.ax2_aid)
+        inc.idx_offset = base.num_indexed
+        inc.num_indexed = inc.idx_offset + len(inc.delta_idx2_vec)
+        delta_ax2_aid = np.array(inc.delta_aids, dtype=base.ax2_aid.dtype)
+        inc.ax2_aid = np.hstack([base.ax2_aid, delta_ax2_aid])
+        ax2_alive = np.hstack([inc.base_alive,
+                               np.array(inc.delta_alive, dtype=bool)])
+        inc.ax2_aid[~ax2_alive] = -1
+        inc.aid2_ax = ut.make_index_lookup(inc.ax2_aid)
+        delta_live_flags = ax2_alive[inc.ax_offset:][inc.delta_idx2_ax]
+        inc.delta_live_idxs = np.nonzero(delta_live_flags)[0]
+
+    def get_metrics(inc):
+        r"""
+        Returns:
+            dict: counters and the current size of each part of the index
+        """
+        delta_nvecs = np.array(list(map(len, inc.delta_vecs_list)), dtype=int)
+        delta_alive = np.array(inc.delta_alive, dtype=bool)
+        num_base_vecs = inc.base.num_indexed
+        num_delta_vecs = int(delta_nvecs.sum())
+        num_tombstoned_vecs = int(
+            inc.ax2_nvecs_base[~inc.base_alive].sum() +
+            delta_nvecs[~delta_alive].sum())
+        metrics = inc.metrics.copy()
+        metrics['num_live_annots'] = int((inc.ax2_aid != -1).sum())
+        metrics['num_base_vecs'] = num_base_vecs
+        metrics['num_delta_annots'] = len(inc.delta_aids)
+        metrics['num_delta_vecs'] = num_delta_vecs
+        metrics['num_tombstoned_annots'] = int(
+            (~inc.base_alive).sum() + (~delta_alive).sum())
+        metrics['num_tombstoned_vecs'] = num_tombstoned_vecs
+        metrics['delta_fraction'] = num_delta_vecs / max(num_base_vecs, 1)
+        metrics['tombstone_fraction'] = (num_tombstoned_vecs /
+                                         max(num_base_vecs, 1))
+        metrics['compaction_running'] = inc._compaction is not None
+        return metrics
+
+    def fork(inc):
+        """
+        Returns a copy that can be modified without changing this indexer.
+        The base index is shared. A running compaction is handed over to the
+        copy.
+        """
+        new = copy.copy(inc)
+        new.metrics = inc.metrics.copy()
+        new.base_alive = inc.base_alive.copy()
+        new.delta_aids = list(inc.delta_aids)
+        new.delta_vecs_list = list(inc.delta_vecs_list)
+        new.delta_fgws_list = list(inc.delta_fgws_list)
+        new.delta_fxs_list = list(inc.delta_fxs_list)
+        new.delta_alive = list(inc.delta_alive)
+        new._removed_log = list(inc._removed_log)
+        inc._compaction = None
+        return new
+
+    def compaction_done(inc):
+        """ True if a compaction is waiting to be swapped in """
+        compaction = inc._compaction
+        if compaction is None:
+            return False
+        thread = compaction['thread']
+        return thread is None or not thread.is_alive()
+
+    # ---- Modification ----
+
+    def add_support(inc, new_daid_list, new_vecs_list, new_fgws_list,
+                    new_fxs_list, verbose=ut.NOT_QUIET):
+        """ appends annotations to the brute force delta buffer """
+        if new_fgws_list is None:
+            new_fgws_list = [None] * len(new_daid_list)
+        inc.delta_aids.extend(new_daid_list)
+        inc.delta_vecs_list.extend(new_vecs_list)
+        inc.delta_fgws_list.extend(new_fgws_list)
+        inc.delta_fxs_list.extend(new_fxs_list)
+        inc.delta_alive.extend([True] * len(new_daid_list))
+        inc._update_delta()
+        if verbose:
+            print('[nnindex] Added %d annots to the delta buffer' % (
+                len(new_daid_list),))
+        inc._maybe_start_compaction(verbose=verbose)
+
+    def remove_support(inc, remove_daid_list, verbose=ut.NOT_QUIET):
+        """ tombstones annotations. The FLANN structure is not modified. """
+        flags = np.isin(inc.ax2_aid, remove_daid_list)
+        base_flags = flags[0:inc.ax_offset]
+        inc.base_alive = np.logical_and(inc.base_alive, ~base_flags)
+        for dx in np.nonzero(flags[inc.ax_offset:])[0]:
+            inc.delta_alive[dx] = False
+        if inc._compaction is not None:
+            # Only needed to re-tombstone these in the compacted index
+            inc._removed_log.extend(remove_daid_list)
+        inc._update_delta()
+        if verbose:
+            print('[nnindex] Tombstoned %d / %d annots' % (
+                flags.sum(), len(remove_daid_list)))
+        inc._maybe_start_compaction(verbose=verbose)
+
+    def add_ibeis_support(inc, qreq_, new_daid_list, verbose=ut.NOT_QUIET):
+        indexed_aids = set(inc.get_indexed_aids())
+        new_daid_list_ = [aid for aid in new_daid_list
+                          if aid not in indexed_aids]
+        if len(new_daid_list_) > 0:
+            tup = get_support_data(qreq_, new_daid_list_)
+            inc.add_support(new_daid_list_, *tup, verbose=verbose)
+
+    def remove_ibeis_support(inc, qreq_, remove_daid_list,
+                             verbose=ut.NOT_QUIET):
+        inc.remove_support(remove_daid_list, verbose=verbose)
+
+    # ---- Compaction ----
+
+    def needs_compaction(inc):
+        metrics = inc.get_metrics()
+        return (metrics['delta_fraction'] > inc.delta_thresh or
+                metrics['tombstone_fraction'] > inc.tombstone_thresh)
+
+    def _maybe_start_compaction(inc, verbose=False):
+        if inc._compaction is None and inc.needs_compaction():
+            if verbose:
+                print('[nnindex] Starting compaction')
+            inc.start_compaction()
+
+    def maybe_compact(inc, verbose=ut.NOT_QUIET):
+        """
+        Swaps in a finished compaction and starts a new one if needed.
+        Call between queries.
+
+        Returns:
+            bool: True if a new base index was swapped in
+        """
+        swapped = inc.finish_compaction(wait=False)
+        inc._maybe_start_compaction(verbose=verbose)
+        return swapped
+
+    def start_compaction(inc):
+        """ builds a new FLANN index over all live vectors """
+        assert inc._compaction is None, 'compaction already running'
+        snapshot = dict(
+            base=inc.base,
+            base_alive=inc.base_alive.copy(),
+            num_delta=len(inc.delta_aids),
+            delta_alive=list(inc.delta_alive),
+            delta_idx2_vec=inc.delta_idx2_vec,
+            delta_idx2_fgw=inc.delta_idx2_fgw,
+            delta_idx2_ax=inc.delta_idx2_ax,
+            delta_idx2_fx=inc.delta_idx2_fx,
+            delta_aids=list(inc.delta_aids),
+        )
+        compaction = {'snapshot': snapshot, 'result': None, 'error': None}
+        inc._compaction = compaction
+        inc._removed_log = []
+        if inc.background:
+            compaction['thread'] = ut.spawn_background_daemon_thread(
+                _compaction_worker, compaction)
+        else:
+            compaction['thread'] = None
+            _compaction_worker(compaction)
+
+    def finish_compaction(inc, wait=False):
+        """
+        Returns:
+            bool: True if a new base index was swapped in
+        """
+        compaction = inc._compaction
+        if compaction is None:
+            return False
+        thread = compaction['thread']
+        if thread is not None:
+            if thread.is_alive() and not wait:
+                return False
+            thread.join()
+        inc._compaction = None
+        if compaction['error'] is not None:
+            raise compaction['error']
+        new_base, seconds = compaction['result']
+        snapshot = compaction['snapshot']
+        num_delta = snapshot['num_delta']
+        # Annotations added since the snapshot stay in the delta buffer
+        delta = (inc.delta_aids[num_delta:], inc.delta_vecs_list[num_delta:],
+                 inc.delta_fgws_list[num_delta:],
+                 inc.delta_fxs_list[num_delta:], inc.delta_alive[num_delta:])
+        # Annotations removed since the snapshot are tombstoned again
+        base_alive = ~np.isin(new_base.ax2_aid, inc._removed_log)
+        inc._removed_log = []
+        inc._set_base(new_base, delta, base_alive)
+        # Compaction does not change the live annotations, so inc.cfgstr
+        # still describes them. The new base only has a cfgstr once saved.
+        inc.metrics['num_compactions'] += 1
+        inc.metrics['last_compaction_seconds'] = seconds
+        inc.metrics['total_compaction_seconds'] += seconds
+        return True
+
+    # ---- Search ----
+
+    def _base_nn_index_raw(inc, qfx2_vec, K):
+        """ searches the base index ignoring tombstoned annotations """
+        base = inc.base
+        num_base = base.num_indexed
+        num_base_live = int(inc.ax2_nvecs_base[inc.base_alive].sum())
+        K_live = min(K, num_base_live)
+        has_dead = num_base_live < num_base
+        K_ = min(K + K_live if has_dead else K, num_base)
+        while True:
+            qfx2_idx, qfx2_raw_dist = base.nn_index_raw(qfx2_vec, K_)
+            qfx2_idx = qfx2_idx.reshape(len(qfx2_vec), K_)
+            qfx2_raw_dist = qfx2_raw_dist.reshape(len(qfx2_vec), K_)
+            if not has_dead:
+                break
+            qfx2_alive = inc.base_alive[base.idx2_ax.take(qfx2_idx)]
+            if K_ == num_base or np.all(qfx2_alive.sum(axis=1) >= K_live):
+                qfx2_raw_dist = np.where(qfx2_alive, qfx2_raw_dist, np.inf)
+                break
+            inc.metrics['num_tombstone_requeries'] += 1
+            K_ = min(K_ * 2, num_base)
+        return qfx2_idx, qfx2_raw_dist
+
+    @profile
+    def nn_index_raw(inc, qfx2_vec, K):
+        """
+        Merges the base (FLANN) and delta (brute force) results. Tombstoned
+        annotations are never returned. K is clipped to the number of live
+        vectors.
+        """
+        K = min(K, inc.num_live_vecs())
+        idx_list = []
+        dist_list = []
+        if inc.base.num_indexed > 0 and np.any(inc.base_alive):
+            qfx2_idx, qfx2_raw_dist = inc._base_nn_index_raw(qfx2_vec, K)
+            idx_list.append(qfx2_idx)
+            dist_list.append(qfx2_raw_dist)
+        live_idxs = inc.delta_live_idxs
+        if len(live_idxs) > 0:
+            live_vecs = inc.delta_idx2_vec.take(live_idxs, axis=0)
+            qfx2_didx, qfx2_draw_dist = brute_force_knn(qfx2_vec, live_vecs, K)
+            inc.metrics['num_brute_force_dists'] += len(qfx2_vec) * len(live_idxs)
+            idx_list.append(live_idxs.take(qfx2_didx) + inc.idx_offset)
+            dist_list.append(qfx2_draw_dist)
+        qfx2_idx = np.hstack(idx_list).astype(np.int32)
+        qfx2_raw_dist = np.hstack(dist_list)
+        sortx = np.lexsort((qfx2_idx, qfx2_raw_dist), axis=-1)[:, 0:K]
+        qfx2_idx = np.take_along_axis(qfx2_idx, sortx, axis=1)
+        qfx2_raw_dist = np.take_along_axis(qfx2_raw_dist, sortx, axis=1)
+        return qfx2_idx, qfx2_raw_dist
+
+    @profile
+    def knn(inc, qfx2_vec, K):
+        """
+        Returns the indices and normalized squared distance to the nearest K
+        live neighbors. See `NeighborIndex.knn`.
+        """
+        with ut.Timer(verbose=False) as timer:
+            if K == 0:
+                (qfx2_idx, qfx2_dist) = inc.empty_neighbors(len(qfx2_vec), 0)
+            elif K > inc.num_live_vecs():
+                (qfx2_idx, qfx2_dist) = inc.empty_neighbors(len(qfx2_vec), 0)
+            elif len(qfx2_vec) == 0:
+                (qfx2_idx, qfx2_dist) = inc.empty_neighbors(0, K)
+            else:
+                (qfx2_idx, qfx2_raw_dist) = inc.nn_index_raw(qfx2_vec, K)
+                if inc.max_distance_sqrd is not None:
+                    qfx2_dist = np.divide(qfx2_raw_dist, inc.max_distance_sqrd)
+                else:
+                    qfx2_dist = qfx2_raw_dist
+        inc.metrics['num_knn_calls'] += 1
+        inc.metrics['num_query_vecs'] += len(qfx2_vec)
+        inc.metrics['knn_seconds'] += timer.ellapsed
+        return (qfx2_idx, qfx2_dist)
+
+    requery_knn = NeighborIndex.requery_knn
+    batch_knn = NeighborIndex.batch_knn
+    empty_neighbors = NeighborIndex.empty_neighbors
+    num_indexed_annots = NeighborIndex.num_indexed_annots
+    get_indexed_aids = NeighborIndex.get_indexed_aids
+    get_nn_nids = NeighborIndex.get_nn_nids
+
+    def num_live_vecs(inc):
+        return (int(inc.ax2_nvecs_base[inc.base_alive].sum()) +
+                len(inc.delta_live_idxs))
+
+    def num_indexed_vecs(inc):
+        return inc.num_indexed
+
+    def get_dtype(inc):
+        return inc.base.get_dtype()
+
+    def _take_support(inc, key, qfx2_nnidx, delta_offset=0):
+        """ gathers a support array from the base or the delta buffer """
+        qfx2_nnidx = np.asarray(qfx2_nnidx)
+        flat_idxs = qfx2_nnidx.ravel()
+        base_arr = getattr(inc.base, key)
+        delta_arr = getattr(inc, 'delta_' + key)
+        flat_vals = np.empty((len(flat_idxs),) + base_arr.shape[1:],
+                             dtype=base_arr.dtype)
+        is_delta = flat_idxs >= inc.idx_offset
+        flat_vals[~is_delta] = base_arr.take(flat_idxs[~is_delta], axis=0)
+        delta_idxs = flat_idxs[is_delta] - inc.idx_offset
+        flat_vals[is_delta] = delta_arr.take(delta_idxs, axis=0) + delta_offset
+        return flat_vals.reshape(qfx2_nnidx.shape + base_arr.shape[1:])
+
+    def get_nn_vecs(inc, qfx2_nnidx):
+        r""" gets matching vectors """
+        return inc._take_support('idx2_vec', qfx2_nnidx)
+
+    def get_nn_axs(inc, qfx2_nnidx):
+        r""" gets matching global annotation indices """
+        return inc._take_support('idx2_ax', qfx2_nnidx,
+                                 delta_offset=inc.ax_offset)
+
+    def get_nn_aids(inc, qfx2_nnidx):
+        r""" gets matching annotation ids """
+        return inc.ax2_aid.take(inc.get_nn_axs(qfx2_nnidx))
+
+    def get_nn_featxs(inc, qfx2_nnidx):
+        r""" gets matching feature indices w.r.t. the source annotation """
+        return inc._take_support('idx2_fx', qfx2_nnidx)
+
+    def get_nn_fgws(inc, qfx2_nnidx):
+        r""" gets forground weights of neighbors """
+        if inc.base.idx2_fgw is None:
+            return np.ones(np.shape(qfx2_nnidx))
+        return inc._take_support('idx2_fgw', qfx2_nnidx)
+
+
+def _compaction_worker(compaction):
+    """ builds a compacted NeighborIndex from an IncrementalNeighborIndex snapshot """
+    try:
+        with ut.Timer(verbose=False) as timer:
+            snapshot = compaction['snapshot']
+            base = snapshot['base']
+            base_alive = snapshot['base_alive']
+            num_delta = snapshot['num_delta']
+            delta_alive = np.array(snapshot['delta_alive'], dtype=bool)
+            # Renumber the live annotations
+            base_axs = np.nonzero(base_alive)[0]
+            delta_axs = np.nonzero(delta_alive)[0]
+            ax2_aid = np.hstack([
+                base.ax2_aid.take(base_axs),
+                np.array(snapshot['delta_aids'], dtype=base.ax2_aid.dtype).take(delta_axs)
+            ])
+            base_ax_map = np.full(len(base_alive), -1, dtype=np.int32)
+            base_ax_map[base_axs] = np.arange(len(base_axs))
+            delta_ax_map = np.full(num_delta, -1, dtype=np.int32)
+            delta_ax_map[delta_axs] = np.arange(len(delta_axs)) + len(base_axs)
+            base_flags = base_alive[base.idx2_ax]
+            delta_flags = delta_alive[snapshot['delta_idx2_ax']]
+            idx2_vec = np.vstack([base.idx2_vec[base_flags],
+                                  snapshot['delta_idx2_vec'][delta_flags]])
+            idx2_ax = np.hstack([
+                base_ax_map[base.idx2_ax[base_flags]],
+                delta_ax_map[snapshot['delta_idx2_ax'][delta_flags]]
+            ]).astype(np.int32)
+            idx2_fx = np.hstack([
+                base.idx2_fx[base_flags],
+                snapshot['delta_idx2_fx'][delta_flags]]).astype(np.int32)
+            if base.idx2_fgw is None:
+                idx2_fgw = None
+            else:
+                idx2_fgw = np.hstack([
+                    base.idx2_fgw[base_flags],
+                    snapshot['delta_idx2_fgw'][delta_flags]])
+            new_base = NeighborIndex(base.flann_params.copy(), None)
+            new_base._set_support(ax2_aid, idx2_vec, idx2_fgw, idx2_ax,
+                                  idx2_fx)
+            new_base.reindex(verbose=False)
+        compaction['result'] = (new_base, timer.ellapsed)
+    except Exception as ex:
+        compaction['error'] = ex
+
+
 def in1d_shape(arr1, arr2):
     return np.in1d(arr1, arr2).reshape(arr1.shape)
 
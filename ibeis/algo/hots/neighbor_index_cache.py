@@ -5,6 +5,8 @@ from os.path import join
 import utool as ut
 from ibeis.algo.hots import _pipeline_helpers as plh  # NOQA
 from ibeis.algo.hots.neighbor_index import NeighborIndex, get_support_data
+from ibeis.algo.hots.neighbor_index import ShardedNeighborIndex
+from ibeis.algo.hots.neighbor_index import IncrementalNeighborIndex
 (print, rrr, profile) = ut.inject2(__name__)
 
 
@@ -19,6 +21,8 @@ CURRENT_THREAD = None
 # Global map to keep track of UUID lists with prebuild indexers.
 UUID_MAP = ut.ddict(dict)
 NEIGHBOR_CACHE = ut.get_lru_cache(MAX_NEIGHBOR_CACHE_SIZE)
+# Incremental indexers are keyed without the data hash and updated in place
+INCREMENTAL_CACHE = {}
 
 
 class UUIDMapHyrbridCache(object):
@@ -170,6 +174,7 @@ def build_nnindex_cfgstr(qreq_, daid_list):
 def clear_memcache():
     global NEIGHBOR_CACHE
     NEIGHBOR_CACHE.clear()
+    INCREMENTAL_CACHE.clear()
 
 
 def clear_uuid_cache(qreq_):
@@ -243,6 +248,150 @@ def request_ibeis_nnindexer(qreq_, verbose=True, **kwargs):
     return nnindexer
 
 
+def request_ibeis_sharded_nnindexer(qreq_, verbose=True, use_memcache=True,
+                                    force_rebuild=False, memtrack=None,
+                                    prog_hook=None):
+    """
+    CALLED BY QUERYREQUST::LOAD_INDEXER when index_method='sharded'
+
+    Splits the sorted internal daids into chunks of `shard_size` annotations
+    and requests a disk cached indexer for each chunk. Adding annotations with
+    new (larger) aids only invalidates the last shard, so only that shard is
+    rebuilt.
+
+    Args:
+        qreq_ (QueryRequest): hyper-parameters
+
+    Returns:
+        ShardedNeighborIndex: nnindexer
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index_cache request_ibeis_sharded_nnindexer
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index_cache import *  # NOQA
+        >>> import ibeis
+        >>> qreq_ = ibeis.testdata_qreq_(
+        >>>     defaultdb='testdb1', p='default:index_method=sharded,shard_size=4')
+        >>> nnindexer = request_ibeis_sharded_nnindexer(qreq_)
+        >>> assert len(nnindexer.shards) == ut.get_num_chunks(len(qreq_.daids), 4)
+    """
+    global NEIGHBOR_CACHE
+    daid_list = sorted(qreq_.get_internal_daids())
+    shard_size = qreq_.qparams.shard_size
+    nnindex_cfgstr = '_SHARDED(%d)' % (shard_size,) + build_nnindex_cfgstr(
+        qreq_, daid_list)
+    if not force_rebuild and use_memcache and NEIGHBOR_CACHE.has_key(nnindex_cfgstr):  # NOQA (has_key is for a lru cache)
+        if ut.VERYVERBOSE or ut.VERBOSE:
+            print('... sharded nnindex memcache hit: cfgstr=%s' % (nnindex_cfgstr,))
+        return NEIGHBOR_CACHE[nnindex_cfgstr]
+    shard_daids_list = list(ut.ichunks(daid_list, shard_size))
+    if verbose:
+        print('[nnindex] Requesting %d shards of size %d' % (
+            len(shard_daids_list), shard_size))
+    shards = []
+    for count, shard_daids in enumerate(shard_daids_list):
+        if prog_hook is not None:
+            prog_hook.set_progress(count, len(shard_daids_list),
+                                   'Loading indexer shards')
+        # The shards bypass the memcache, otherwise they would evict each other
+        shard = request_diskcached_ibeis_nnindexer(
+            qreq_, shard_daids, verbose=verbose, force_rebuild=force_rebuild,
+            memtrack=memtrack)
+        shards.append(shard)
+    nnindexer = ShardedNeighborIndex(shards, cfgstr=nnindex_cfgstr,
+                                     n_workers=qreq_.qparams.shard_workers)
+    if use_memcache:
+        NEIGHBOR_CACHE[nnindex_cfgstr] = nnindexer
+    return nnindexer
+
+
+def request_ibeis_incremental_nnindexer(qreq_, verbose=True,
+                                        use_memcache=True, force_rebuild=False,
+                                        memtrack=None, prog_hook=None):
+    """
+    CALLED BY QUERYREQUST::LOAD_INDEXER when index_method='incremental'
+
+    Keeps the latest IncrementalNeighborIndex per database / feature
+    configuration. The first request builds (or loads) the flann index for the
+    requested daids. Later requests with other daids fork that indexer and
+    add and tombstone the difference instead of building a new index. An
+    indexer returned to a request is never modified afterwards, so earlier
+    requests keep searching their own daids. Finished background compactions
+    are swapped into the fork and their flann index is written to disk.
+
+    Args:
+        qreq_ (QueryRequest): hyper-parameters
+
+    Returns:
+        IncrementalNeighborIndex: nnindexer
+
+    CommandLine:
+        python -m ibeis.algo.hots.neighbor_index_cache request_ibeis_incremental_nnindexer
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.neighbor_index_cache import *  # NOQA
+        >>> import ibeis
+        >>> qreq1 = ibeis.testdata_qreq_(
+        >>>     defaultdb='testdb1', p='default:index_method=incremental',
+        >>>     a='default:dsize=3')
+        >>> nnindexer1 = request_ibeis_incremental_nnindexer(qreq1)
+        >>> qreq2 = ibeis.testdata_qreq_(
+        >>>     defaultdb='testdb1', p='default:index_method=incremental')
+        >>> nnindexer2 = request_ibeis_incremental_nnindexer(qreq2)
+        >>> assert nnindexer1 is not nnindexer2
+        >>> assert nnindexer1.base is nnindexer2.base
+        >>> assert sorted(nnindexer1.get_indexed_aids()) == sorted(qreq1.daids)
+        >>> assert sorted(nnindexer2.get_indexed_aids()) == sorted(qreq2.daids)
+        >>> assert request_ibeis_incremental_nnindexer(qreq2) is nnindexer2
+    """
+    daid_list = qreq_.get_internal_daids()
+    incremental_cfgstr = ''.join((
+        qreq_.ibs.get_dbname(), qreq_.qparams.flann_cfgstr,
+        qreq_.qparams.featweight_cfgstr, qreq_.qparams.feat_cfgstr,
+        qreq_.qparams.chip_cfgstr))
+    nnindexer = INCREMENTAL_CACHE.get(incremental_cfgstr, None)
+    if force_rebuild or not use_memcache or nnindexer is None:
+        base = request_diskcached_ibeis_nnindexer(
+            qreq_, daid_list, verbose=verbose, force_rebuild=force_rebuild,
+            memtrack=memtrack, prog_hook=prog_hook)
+        nnindexer = IncrementalNeighborIndex(
+            base, delta_thresh=qreq_.qparams.delta_thresh,
+            tombstone_thresh=qreq_.qparams.tombstone_thresh)
+        if use_memcache:
+            INCREMENTAL_CACHE[incremental_cfgstr] = nnindexer
+        return nnindexer
+    indexed_aids = set(nnindexer.get_indexed_aids())
+    requested_aids = set(daid_list)
+    if indexed_aids == requested_aids and not nnindexer.compaction_done():
+        return nnindexer
+    # Earlier requests may still hold the cached indexer
+    nnindexer = nnindexer.fork()
+    if nnindexer.finish_compaction():
+        # Write the compacted index so a restart does not need to rebuild it
+        base = nnindexer.base
+        base_aids = base.ax2_aid.tolist()
+        base.cfgstr = build_nnindex_cfgstr(qreq_, base_aids)
+        base.save(qreq_.ibs.get_flann_cachedir(), verbose=verbose)
+        daids_hashid = get_data_cfgstr(qreq_.ibs, base_aids)
+        visual_uuid_list = qreq_.ibs.get_annot_visual_uuids(base_aids)
+        UUID_MAP_CACHE.write_uuid_map_dict(
+            get_nnindexer_uuid_map_fpath(qreq_), visual_uuid_list,
+            daids_hashid)
+    remove_daid_list = sorted(indexed_aids - requested_aids)
+    new_daid_list = sorted(requested_aids - indexed_aids)
+    if len(remove_daid_list) > 0:
+        nnindexer.remove_ibeis_support(qreq_, remove_daid_list,
+                                       verbose=verbose)
+    if len(new_daid_list) > 0:
+        nnindexer.add_ibeis_support(qreq_, new_daid_list, verbose=verbose)
+    nnindexer.cfgstr = build_nnindex_cfgstr(qreq_, daid_list)
+    INCREMENTAL_CACHE[incremental_cfgstr] = nnindexer
+    return nnindexer
+
+
 def request_augmented_ibeis_nnindexer(qreq_, daid_list, verbose=True,
                                       use_memcache=True, force_rebuild=False,
                                       memtrack=None):
@@ -464,22 +613,32 @@ def request_diskcached_ibeis_nnindexer(qreq_, daid_list, nnindex_cfgstr=None,
     flann_params['checks'] = qreq_.qparams.checks
     #if memtrack is not None:
     #    memtrack.report('[PRE SUPPORT]')
-    # Get annot descriptors to index
-    if prog_hook is not None:
-        prog_hook.set_progress(1, 3, 'Loading support data for indexer')
-    print('[nnindex] Loading support data for indexer')
-    vecs_list, fgws_list, fxs_list = get_support_data(qreq_, daid_list)
-    if memtrack is not None:
-        memtrack.report('[AFTER GET SUPPORT DATA]')
-    try:
-        nnindexer = new_neighbor_index(
-            daid_list, vecs_list, fgws_list, fxs_list, flann_params, cachedir,
-            cfgstr=cfgstr, verbose=verbose, force_rebuild=force_rebuild,
-            memtrack=memtrack, prog_hook=prog_hook)
-    except Exception as ex:
-        ut.printex(ex, True, msg_='cannot build inverted index',
-                        key_list=['ibs.get_infostr()'])
-        raise
+    use_memmap = qreq_.qparams.use_memmap
+    nnindexer = None
+    if use_memmap and not force_rebuild:
+        # Descriptors may already be on disk. If so there is no need to read
+        # them from the feature tables.
+        nnindexer = load_memmap_neighbor_index(
+            flann_params, cachedir, cfgstr, verbose=verbose, memtrack=memtrack,
+            prog_hook=prog_hook)
+    if nnindexer is None:
+        # Get annot descriptors to index
+        if prog_hook is not None:
+            prog_hook.set_progress(1, 3, 'Loading support data for indexer')
+        print('[nnindex] Loading support data for indexer')
+        vecs_list, fgws_list, fxs_list = get_support_data(qreq_, daid_list)
+        if memtrack is not None:
+            memtrack.report('[AFTER GET SUPPORT DATA]')
+        try:
+            nnindexer = new_neighbor_index(
+                daid_list, vecs_list, fgws_list, fxs_list, flann_params,
+                cachedir, cfgstr=cfgstr, verbose=verbose,
+                force_rebuild=force_rebuild, memtrack=memtrack,
+                prog_hook=prog_hook, use_memmap=use_memmap)
+        except Exception as ex:
+            ut.printex(ex, True, msg_='cannot build inverted index',
+                            key_list=['ibs.get_infostr()'])
+            raise
     # Record these uuids in the disk based uuid map so they can be augmented if
     # needed
     min_reindex_thresh = qreq_.qparams.min_reindex_thresh
@@ -556,7 +715,7 @@ def get_data_cfgstr(ibs, daid_list):
 
 def new_neighbor_index(daid_list, vecs_list, fgws_list, fxs_list, flann_params, cachedir,
                        cfgstr, force_rebuild=False, verbose=True,
-                       memtrack=None, prog_hook=None):
+                       memtrack=None, prog_hook=None, use_memmap=False):
     r"""
     constructs neighbor index independent of ibeis
 
@@ -568,6 +727,8 @@ def new_neighbor_index(daid_list, vecs_list, fgws_list, fxs_list, flann_params,
         flann_cachedir (None):
         nnindex_cfgstr (str):
         use_memcache (bool):
+        use_memmap (bool): if True the support data is written to the
+            cachedir and memory mapped.
 
     Returns:
         nnindexer
@@ -596,8 +757,15 @@ def new_neighbor_index(daid_list, vecs_list, fgws_list, fxs_list, flann_params,
     nnindexer = NeighborIndex(flann_params, cfgstr)
     #if memtrack is not None:
     #    memtrack.report('CREATEED NEIGHTOB INDEX')
+    if use_memmap:
+        support_dpath = nnindexer.get_support_dpath(cachedir)
+        if force_rebuild:
+            ut.delete(support_dpath, verbose=False)
+    else:
+        support_dpath = None
     # Initialize neighbor with unindexed data
-    nnindexer.init_support(daid_list, vecs_list, fgws_list, fxs_list, verbose=verbose)
+    nnindexer.init_support(daid_list, vecs_list, fgws_list, fxs_list,
+                           verbose=verbose, support_dpath=support_dpath)
     if memtrack is not None:
         memtrack.report('AFTER INIT SUPPORT')
     # Load or build the indexing structure
@@ -609,6 +777,27 @@ def new_neighbor_index(daid_list, vecs_list, fgws_list, fxs_list, flann_params,
     return nnindexer
 
 
+def load_memmap_neighbor_index(flann_params, cachedir, cfgstr, verbose=True,
+                               memtrack=None, prog_hook=None):
+    r"""
+    Constructs a neighbor index from support data that was previously written
+    to the cachedir by `new_neighbor_index` with use_memmap=True. The data is
+    memory mapped so all processes using the same index share one copy.
+
+    Returns:
+        NeighborIndex: nnindexer or None if the support data is not cached
+    """
+    nnindexer = NeighborIndex(flann_params, cfgstr)
+    support_dpath = nnindexer.get_support_dpath(cachedir)
+    if not nnindexer.load_support(support_dpath, verbose=verbose):
+        return None
+    if memtrack is not None:
+        memtrack.report('AFTER LOAD SUPPORT')
+    nnindexer.ensure_indexer(cachedir, verbose=verbose, memtrack=memtrack,
+                             prog_hook=prog_hook)
+    return nnindexer
+
+
 def testdata_nnindexer(dbname='testdb1', with_indexer=True, use_memcache=True):
     r"""
 
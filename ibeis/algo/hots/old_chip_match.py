@@ -82,7 +82,7 @@ class _OldStyleChipMatchSimulator(object):
 
     def __getitem__(cm, index):
         if isinstance(index, six.string_types):
-            return cm.__dict__[index]
+            return getattr(cm, index)
         else:
             return getattr(cm, cm._oldfields[index])
 
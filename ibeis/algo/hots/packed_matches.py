@@ -0,0 +1,217 @@
+"""
+Compressed sparse row (CSR) layout for the feature correspondences of a
+ChipMatch.
+
+A ChipMatch normally keeps one small ndarray per database annotation in each
+of ``fm_list``, ``fsv_list``, ``fk_list`` and ``fs_list``. Against a large
+database a single vsmany result has thousands of daids, and the per-list
+overhead dominates scoring, subsetting and serialization. PackedMatches keeps
+each of those columns as one flat array and the per-annotation boundaries in
+a single ``offsets`` array, so the matches of annotation ``i`` are the rows
+``offsets[i]:offsets[i + 1]``. Per-annotation reductions become segment
+reductions over the flat arrays.
+
+CommandLine:
+    python -m ibeis.algo.hots.packed_matches --allexamples
+"""
+import numpy as np
+import utool as ut
+print, rrr, profile = ut.inject2(__name__)
+
+
+class PackedMatches(ut.NiceRepr):
+    r"""
+    Flat feature match columns with per-annotation offsets.
+
+    Args:
+        offsets (ndarray): ``num_annots + 1`` row offsets
+        **cols: flat arrays (or None) for each of ``PackedMatches.COLUMNS``
+
+    CommandLine:
+        python -m ibeis.algo.hots.packed_matches PackedMatches
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.packed_matches import *  # NOQA
+        >>> fm_list = [np.array([[0, 1], [2, 3]]), np.empty((0, 2), dtype=int),
+        >>>            np.array([[4, 5], [6, 7], [8, 9]])]
+        >>> fsv_list = [np.array([[1.], [2.]]), np.empty((0, 1)),
+        >>>             np.array([[3.], [4.], [5.]])]
+        >>> packed = PackedMatches.from_lists(fm=fm_list, fsv=fsv_list)
+        >>> print(packed)
+        <PackedMatches(nAnnots=3, nMatches=5)>
+        >>> print('offsets = %r' % (packed.offsets.tolist(),))
+        offsets = [0, 2, 2, 5]
+        >>> print('csum = %r' % (packed.segment_sum(packed.cols['fsv'].T[0]).tolist(),))
+        csum = [3.0, 0.0, 12.0]
+        >>> sub = packed.take([2, 0])
+        >>> print('sub_fm = %r' % ([fm.tolist() for fm in sub.split('fm')],))
+        sub_fm = [[[4, 5], [6, 7], [8, 9]], [[0, 1], [2, 3]]]
+        >>> sub = packed.ziptake([[1], [], [2, 0]])
+        >>> print('sub_fsv = %r' % (sub.cols['fsv'].T[0].tolist(),))
+        sub_fsv = [2.0, 5.0, 3.0]
+        >>> both = PackedMatches.concat([packed, packed.extend(2)])
+        >>> print('lens = %r' % (both.lens.tolist(),))
+        lens = [2, 0, 3, 2, 0, 3, 0, 0]
+    """
+    COLUMNS = ('fm', 'fsv', 'fk', 'fs')
+
+    def __init__(packed, offsets, **cols):
+        packed.offsets = np.asarray(offsets, dtype=np.intp)
+        packed.cols = {key: cols.get(key, None) for key in packed.COLUMNS}
+
+    def __nice__(packed):
+        return 'nAnnots=%d, nMatches=%d' % (packed.num_annots,
+                                           packed.num_matches)
+
+    def __getstate__(packed):
+        state = {'offsets': packed.offsets}
+        state.update(packed.cols)
+        return state
+
+    def __setstate__(packed, state):
+        state = state.copy()
+        packed.__init__(state.pop('offsets'), **state)
+
+    @classmethod
+    def from_state(PackedMatches, state):
+        packed = PackedMatches.__new__(PackedMatches)
+        packed.__setstate__(state)
+        return packed
+
+    @classmethod
+    def from_lists(PackedMatches, **lists):
+        """
+        Packs aligned lists of per-annotation arrays. None lists stay None.
+        """
+        list_ = ut.filter_Nones(lists.values())[0]
+        lens = np.array([len(arr) for arr in list_], dtype=np.intp)
+        offsets = np.zeros(len(lens) + 1, dtype=np.intp)
+        np.cumsum(lens, out=offsets[1:])
+        cols = {
+            key: (None if arrs is None else
+                  np.concatenate(arrs, axis=0) if len(arrs) > 0 else
+                  np.empty(0))
+            for key, arrs in lists.items()
+        }
+        return PackedMatches(offsets, **cols)
+
+    @classmethod
+    def from_groupxs(PackedMatches, groupxs, **flat_cols):
+        """
+        Packs flat columns grouped by ``groupxs`` (e.g. from
+        vt.group_indices) with a single take per column.
+        """
+        lens = np.array([len(idxs) for idxs in groupxs], dtype=np.intp)
+        offsets = np.zeros(len(lens) + 1, dtype=np.intp)
+        np.cumsum(lens, out=offsets[1:])
+        if len(groupxs) > 0:
+            rowx = np.concatenate(groupxs)
+        else:
+            rowx = np.empty(0, dtype=np.intp)
+        cols = {key: None if arr is None else arr.take(rowx, axis=0)
+                for key, arr in flat_cols.items()}
+        return PackedMatches(offsets, **cols)
+
+    @classmethod
+    def concat(PackedMatches, packed_list):
+        """ Stacks the annotations of several packed matches in order """
+        lens = np.hstack([packed.lens for packed in packed_list])
+        offsets = np.zeros(len(lens) + 1, dtype=np.intp)
+        np.cumsum(lens, out=offsets[1:])
+        cols = {}
+        for key in PackedMatches.COLUMNS:
+            arrs = [packed.cols[key] for packed in packed_list]
+            if any(arr is None for arr in arrs):
+                cols[key] = None
+            else:
+                cols[key] = np.concatenate(
+                    [arr for arr in arrs if len(arr) > 0] or arrs[0:1], axis=0)
+        return PackedMatches(offsets, **cols)
+
+    @property
+    def num_annots(packed):
+        return len(packed.offsets) - 1
+
+    @property
+    def num_matches(packed):
+        return int(packed.offsets[-1])
+
+    @property
+    def lens(packed):
+        return np.diff(packed.offsets)
+
+    def segment_ids(packed):
+        """ The annotation index of each flat row """
+        return np.repeat(np.arange(packed.num_annots), packed.lens)
+
+    def segment_sum(packed, values):
+        """ Sums flat per-match ``values`` within each annotation """
+        sums = np.bincount(packed.segment_ids(), weights=values,
+                           minlength=packed.num_annots)
+        return sums.astype(np.result_type(values.dtype, np.float32),
+                           copy=False)
+
+    def split(packed, arr):
+        """
+        Returns per-annotation views of a column name or a flat array
+        aligned with the rows.
+        """
+        if isinstance(arr, str):
+            arr = packed.cols[arr]
+            if arr is None:
+                return None
+        bounds = packed.offsets.tolist()
+        return [arr[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def take_rows(packed, rowx, lens):
+        """ New packed matches with flat rows ``rowx`` grouped by ``lens`` """
+        offsets = np.zeros(len(lens) + 1, dtype=np.intp)
+        np.cumsum(lens, out=offsets[1:])
+        cols = {key: None if arr is None else arr.take(rowx, axis=0)
+                for key, arr in packed.cols.items()}
+        return PackedMatches(offsets, **cols)
+
+    def take(packed, idx_list):
+        """ Keeps the annotations at ``idx_list`` (in that order) """
+        idx_list = np.asarray(idx_list, dtype=np.intp)
+        lens = packed.lens.take(idx_list)
+        starts = packed.offsets.take(idx_list)
+        new_starts = np.cumsum(lens) - lens
+        rowx = np.repeat(starts - new_starts, lens) + np.arange(lens.sum())
+        return packed.take_rows(rowx, lens)
+
+    def ziptake(packed, indices_list):
+        """
+        Keeps the local match indices ``indices_list[i]`` of each annotation,
+        like vt.ziptake over the per-annotation lists.
+        """
+        assert len(indices_list) == packed.num_annots, 'must correspond'
+        indices_list = [np.asarray(indices, dtype=np.intp)
+                        for indices in indices_list]
+        lens = np.array([len(indices) for indices in indices_list],
+                        dtype=np.intp)
+        if len(indices_list) > 0:
+            rowx = np.concatenate(indices_list) + np.repeat(
+                packed.offsets[:-1], lens)
+        else:
+            rowx = np.empty(0, dtype=np.intp)
+        return packed.take_rows(rowx, lens)
+
+    def extend(packed, num):
+        """ Appends ``num`` annotations without any matches """
+        offsets = np.append(packed.offsets,
+                            np.full(num, packed.offsets[-1], dtype=np.intp))
+        return PackedMatches(offsets, **packed.cols)
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.hots.packed_matches
+        python -m ibeis.algo.hots.packed_matches --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
@@ -47,9 +47,13 @@ import numpy as np
 import vtool_ibeis as vt
 from ibeis.algo.hots import hstypes
 from ibeis.algo.hots import chip_match
+from ibeis.algo.hots import packed_matches
 from ibeis.algo.hots import nn_weights
+from ibeis.algo.hots import neighbor_cache
+from ibeis.algo.hots import neighbor_index
 from ibeis.algo.hots import scoring
 from ibeis.algo.hots import _pipeline_helpers as plh  # NOQA
+import threading
 from collections import namedtuple
 import utool as ut
 print, rrr, profile = ut.inject2(__name__)
@@ -66,12 +70,18 @@ VERB_PIPELINE =  NOT_QUIET and (ut.VERBOSE or ut.get_argflag(('--verbose-pipelin
 VERYVERBOSE_PIPELINE = ut.get_argflag(('--very-verbose-pipeline', '--very-verb-pipe'))
 
 USE_HOTSPOTTER_CACHE = not ut.get_argflag('--nocache-hs') and ut.USE_CACHE
+# The neighbor cache is opt in (see neighbor_cache.NeighborCache)
 USE_NN_MID_CACHE = (
-    (True and ut.is_developer()) and
+    ut.get_argflag(('--nn-mid-cache', '--cache-nnmid')) and
     not ut.get_argflag('--nocache-nnmid') and
     USE_HOTSPOTTER_CACHE
 )
-USE_NN_MID_CACHE = False
+# Build chipmatches in the flat CSR layout (see ChipMatch.pack)
+PACKED_CHIPMATCH = ut.get_argflag(('--packed-cm', '--packed-chipmatch'))
+# Search the query vectors of a chunk together (see packed_nn_compute)
+USE_PACKED_KNN = not ut.get_argflag(('--nopacked-knn', '--no-packed-knn'))
+# Larger query arenas are freed after use instead of being kept for reuse
+QUERY_ARENA_MAX_BYTES = 64 * 2 ** 20
 
 
 NN_LBL      = 'Assign NN:       '
@@ -81,6 +91,8 @@ BUILDCM_LBL = 'Build Chipmatch: '
 SVER_LVL    = 'SVER:            '
 
 PROGKW = dict(freq=1, time_thresh=30.0, adjust=True)
+# Number of shortlist pairs of one query verified by each sver task
+SVER_PAIRS_PER_TASK = 8
 
 
 # Internal tuples denoting return types
@@ -239,6 +251,187 @@ def request_ibeis_query_L0(ibs, qreq_, verbose=VERB_PIPELINE):
 
     return cm_list
 
+
+def get_pipeline_stage_cfgstrs(qreq_):
+    r"""
+    Returns cfgstrs identifying the outputs of the upstream stages of
+    ``request_ibeis_query_L0``. Each cfgstr extends the previous one, so
+    two query requests with the same stage cfgstr produce identical results
+    up to and including that stage.
+
+    * nn_cfgstr - neighbors and the baseline filter. Includes the nnweight
+      params that determine the impossible daids.
+    * weight_cfgstr - neighbor weights and the built chipmatches.
+    * sv_cfgstr - spatially verified chipmatches. The shortlist is ranked by
+      score_method, so it is part of the key when verification is on.
+
+    Returns:
+        tuple: (nn_cfgstr, weight_cfgstr, sv_cfgstr)
+
+    CommandLine:
+        python -m ibeis.algo.hots.pipeline get_pipeline_stage_cfgstrs
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.pipeline import *  # NOQA
+        >>> import ibeis
+        >>> qreq1_ = ibeis.testdata_qreq_(p='default:score_method=nsum,sv_on=False')
+        >>> qreq2_ = ibeis.testdata_qreq_(p='default:score_method=csum,sv_on=False')
+        >>> qreq3_ = ibeis.testdata_qreq_(p='default:score_method=csum,sv_on=True')
+        >>> qreq4_ = ibeis.testdata_qreq_(p='default:can_match_samename=False')
+        >>> keys1, keys2, keys3, keys4 = [
+        >>>     get_pipeline_stage_cfgstrs(qreq_)
+        >>>     for qreq_ in [qreq1_, qreq2_, qreq3_, qreq4_]]
+        >>> assert keys1 == keys2
+        >>> assert keys1[0:2] == keys3[0:2] and keys1[2] != keys3[2]
+        >>> assert keys1[0] != keys4[0]
+    """
+    qparams = qreq_.qparams
+    nn_cfgstr = ''.join([
+        qreq_.get_cfgstr(with_input=True, with_data=True, with_pipe=False),
+        '_', qparams.pipeline_root,
+        qparams.nn_cfgstr,
+        '_IMPOSSIBLE(sameimg=%r,samename=%r)' % (
+            qparams.can_match_sameimg, qparams.can_match_samename),
+        qparams.flann_cfgstr,
+        qparams.featweight_cfgstr,
+        qparams.feat_cfgstr,
+        qparams.chip_cfgstr,
+        '_HACK(augment_queryside)' if qparams.query_rotation_heuristic else '',
+    ])
+    weight_cfgstr = nn_cfgstr + qparams.nnweight_cfgstr
+    if not qparams.sv_on or qparams.xy_thresh is None:
+        sv_cfgstr = weight_cfgstr + '_SV(OFF)'
+    else:
+        sv_cfgstr = ''.join([weight_cfgstr, qparams.sv_cfgstr,
+                             '_shortlist(%s)' % (qparams.score_method,)])
+    return nn_cfgstr, weight_cfgstr, sv_cfgstr
+
+
+@profile
+def request_ibeis_query_grid(ibs, qreq_list, verbose=VERB_PIPELINE):
+    r"""
+    Runs ``request_ibeis_query_L0`` for several query requests over the same
+    annotations that differ only in pipeline config.
+
+    The requests are planned as a tree keyed on
+    ``get_pipeline_stage_cfgstrs``. Each distinct neighbor, weighting and
+    verification stage is computed once and its output is fanned out to the
+    downstream stages that use it. Consumers other than the last get a copy,
+    so the results are identical to running each request by itself.
+
+    Note:
+        Make sure this mirrors the vsmany branch of request_ibeis_query_L0.
+
+    Args:
+        ibs (ibeis.IBEISController): IBEIS database object to be queried.
+        qreq_list (list): query requests sharing their query and data aids
+
+    Returns:
+        list: a cm_list for each query request
+
+    CommandLine:
+        python -m ibeis.algo.hots.pipeline request_ibeis_query_grid
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.pipeline import *  # NOQA
+        >>> import ibeis
+        >>> pcfgs = ['default:score_method=nsum,sv_on=True',
+        >>>          'default:score_method=csum,sv_on=True',
+        >>>          'default:score_method=csum,sv_on=False',
+        >>>          'default:score_method=nsum,sv_on=False,fg_on=False']
+        >>> qreq_list = [ibeis.testdata_qreq_(
+        >>>     p=p, a=['default:qindex=0:2,dindex=0:10']) for p in pcfgs]
+        >>> ibs = qreq_list[0].ibs
+        >>> cm_lists = request_ibeis_query_grid(ibs, qreq_list)
+        >>> qreq_list2 = [ibeis.testdata_qreq_(
+        >>>     p=p, a=['default:qindex=0:2,dindex=0:10']) for p in pcfgs]
+        >>> cm_lists2 = [request_ibeis_query_L0(ibs, qreq_)
+        >>>              for qreq_ in qreq_list2]
+        >>> for cm_list, cm_list2 in zip(cm_lists, cm_lists2):
+        >>>     assert all([cm == cm2 for cm, cm2 in zip(cm_list, cm_list2)])
+    """
+    stage_keys = [
+        get_pipeline_stage_cfgstrs(qreq_)
+        if qreq_.qparams.pipeline_root == 'vsmany' else None
+        for qreq_ in qreq_list
+    ]
+    # The number of downstream consumers of each stage output. Keys of
+    # different stages never collide because they extend one another.
+    children = ut.ddict(set)
+    for keys in ut.filter_Nones(stage_keys):
+        nn_key, weight_key, sv_key = keys
+        children[nn_key].add(weight_key)
+        children[weight_key].add(sv_key)
+    num_consumers = {key: len(child_keys)
+                     for key, child_keys in children.items()}
+    num_consumers.update(ut.dict_hist(
+        keys[2] for keys in ut.filter_Nones(stage_keys)))
+    stage_outputs = {}
+
+    def _consume(key, copy_func):
+        # the last consumer takes ownership of the stored output
+        num_consumers[key] -= 1
+        if num_consumers[key] == 0:
+            return stage_outputs.pop(key)
+        return copy_func(stage_outputs[key])
+
+    def _copy_nns(nn_output):
+        # weight_neighbors replaces neighb_dists, so each consumer gets its
+        # own Neighbors objects (the arrays themselves are not modified)
+        nns_list, nnvalid0_list, indexer = nn_output
+        nns_list = [Neighbors(nns.qaid, nns.neighb_idxs, nns.neighb_dists,
+                              nns.qfx_list) for nns in nns_list]
+        return nns_list, nnvalid0_list, indexer
+
+    def _copy_cms(cm_list):
+        return [cm.copy() for cm in cm_list]
+
+    cm_lists = [None] * len(qreq_list)
+    # Depth first over the plan, so only one path of outputs is kept
+    order = sorted(range(len(qreq_list)), key=lambda x: stage_keys[x] or ())
+    for x in order:
+        qreq_ = qreq_list[x]
+        if stage_keys[x] is None:
+            cm_lists[x] = request_ibeis_query_L0(ibs, qreq_, verbose=verbose)
+            continue
+        nn_key, weight_key, sv_key = stage_keys[x]
+        ibs.assert_valid_aids(qreq_.get_internal_qaids(), msg='pipeline qaids')
+        ibs.assert_valid_aids(qreq_.get_internal_daids(), msg='pipeline daids')
+        qreq_.lazy_preload(verbose=(verbose and ut.NOT_QUIET))
+        if sv_key not in stage_outputs:
+            if weight_key not in stage_outputs:
+                if nn_key not in stage_outputs:
+                    impossible_daids_list, Kpad_list = build_impossible_daids_list(qreq_)
+                    nns_list = nearest_neighbors(qreq_, Kpad_list,
+                                                 impossible_daids_list,
+                                                 verbose=verbose)
+                    nnvalid0_list = baseline_neighbor_filter(
+                        qreq_, nns_list, impossible_daids_list,
+                        verbose=verbose)
+                    stage_outputs[nn_key] = (nns_list, nnvalid0_list,
+                                             qreq_.indexer)
+                nns_list, nnvalid0_list, indexer = _consume(nn_key, _copy_nns)
+                # The indexer only depends on the neighbor stage config
+                if qreq_.indexer is None:
+                    qreq_.indexer = indexer
+                weight_ret = weight_neighbors(qreq_, nns_list, nnvalid0_list,
+                                              verbose=verbose)
+                stage_outputs[weight_key] = build_chipmatches(
+                    qreq_, nns_list, nnvalid0_list, *weight_ret,
+                    verbose=verbose)
+                del nns_list, nnvalid0_list, weight_ret
+            cm_list_FILT = _consume(weight_key, _copy_cms)
+            stage_outputs[sv_key] = spatial_verification(qreq_, cm_list_FILT,
+                                                         verbose=verbose)
+            del cm_list_FILT
+        cm_list = _consume(sv_key, _copy_cms)
+        # Final Scoring
+        scoring.score_chipmatch_list(qreq_, cm_list, qreq_.qparams.score_method)
+        cm_lists[x] = cm_list
+    return cm_lists
+
 #============================
 # 0) Nearest Neighbors
 #============================
@@ -340,12 +533,52 @@ def build_impossible_daids_list(qreq_, verbose=VERB_PIPELINE):
 #============================
 
 
+def get_nn_mid_cacheid(qreq_, HACK_KCFG=True):
+    """
+    The part of the neighbor cacheid shared by all queries of a request
+    (data, nn, feature and flann configs).
+    """
+    from ibeis.algo import Config
+    chip_cfgstr    = qreq_.qparams.chip_cfgstr
+    feat_cfgstr    = qreq_.qparams.feat_cfgstr
+    flann_cfgstr   = qreq_.qparams.flann_cfgstr
+    requery   = qreq_.qparams.requery
+    # assert requery is False, 'can not be on yet'
+
+    internal_daids = qreq_.get_internal_daids()
+    if requery:
+        assert qreq_.qparams.vsmany
+        data_hashid = qreq_.get_data_hashid()
+    else:
+        data_hashid = qreq_.ibs.get_annot_hashid_visual_uuid(
+            internal_daids, prefix='D')
+
+    if HACK_KCFG:
+        # hack config so we consolidate different k values
+        # (ie, K=2,Knorm=1 == K=1,Knorm=2)
+        nn_cfgstr = Config.NNConfig(**qreq_.qparams).get_cfgstr(
+            ignore_keys={'K', 'Knorm', 'use_k_padding'})
+    else:
+        nn_cfgstr      = qreq_.qparams.nn_cfgstr
+
+    aug_cfgstr = ('aug_quryside' if qreq_.qparams.query_rotation_heuristic
+                  else '')
+    nn_mid_cacheid = ''.join([data_hashid, nn_cfgstr, chip_cfgstr, feat_cfgstr,
+                              flann_cfgstr, aug_cfgstr])
+    if ut.VERBOSE:
+        print('nn_mid_cacheid = %r' % (nn_mid_cacheid,))
+    return nn_mid_cacheid
+
+
 @profile
 def nearest_neighbor_cacheid2(qreq_, Kpad_list):
     r"""
     Returns a hacky cacheid for neighbor configs.
     DEPRICATE: This will be replaced by dtool_ibeis caching
 
+    The per-query cacheids are the row keys of the NeighborCache store of
+    ``get_nn_mid_cacheid(qreq_)``.
+
     Args:
         qreq_ (QueryRequest):  query request object with hyper-parameters
         Kpad_list (list):
@@ -394,21 +627,8 @@ def nearest_neighbor_cacheid2(qreq_, Kpad_list):
             'nnobj_a2aef668-20c1-1897-d8f3-09a47a73f26a_DVUUIDS((5)oavtblnlrtocnrpm)_NN(single,cks800)_Chip(sz700,maxwh)_Feat(hesaff+sift)_FLANN(8_kdtrees)_truek6',
         ]
     """
-    from ibeis.algo import Config
-    chip_cfgstr    = qreq_.qparams.chip_cfgstr
-    feat_cfgstr    = qreq_.qparams.feat_cfgstr
-    flann_cfgstr   = qreq_.qparams.flann_cfgstr
     requery   = qreq_.qparams.requery
-    # assert requery is False, 'can not be on yet'
-
-    internal_daids = qreq_.get_internal_daids()
     internal_qaids = qreq_.get_internal_qaids()
-    if requery:
-        assert qreq_.qparams.vsmany
-        data_hashid = qreq_.get_data_hashid()
-    else:
-        data_hashid = qreq_.ibs.get_annot_hashid_visual_uuid(
-            internal_daids, prefix='D')
     if requery:
         query_hashid_list = qreq_.get_qreq_pcc_uuids(internal_qaids)
     else:
@@ -416,19 +636,7 @@ def nearest_neighbor_cacheid2(qreq_, Kpad_list):
         query_hashid_list = qreq_.get_qreq_annot_visual_uuids(internal_qaids)
 
     HACK_KCFG = True
-    if HACK_KCFG:
-        # hack config so we consolidate different k values
-        # (ie, K=2,Knorm=1 == K=1,Knorm=2)
-        nn_cfgstr = Config.NNConfig(**qreq_.qparams).get_cfgstr(
-            ignore_keys={'K', 'Knorm', 'use_k_padding'})
-    else:
-        nn_cfgstr      = qreq_.qparams.nn_cfgstr
-
-    aug_cfgstr = ('aug_quryside' if qreq_.qparams.query_rotation_heuristic
-                  else '')
-    nn_mid_cacheid = ''.join([data_hashid, nn_cfgstr, chip_cfgstr, feat_cfgstr,
-                              flann_cfgstr, aug_cfgstr])
-    print('nn_mid_cacheid = %r' % (nn_mid_cacheid,))
+    nn_mid_cacheid = get_nn_mid_cacheid(qreq_, HACK_KCFG)
 
     if HACK_KCFG:
         kbase = qreq_.qparams.K + int(qreq_.qparams.Knorm)
@@ -480,6 +688,13 @@ def cachemiss_nn_compute_fn(flags_list, qreq_, Kpad_list,
         num_neighbors_list = [K + Knorm] * len(Kpad_list)
         Kpad_list = 2 * np.array(Kpad_list)
     config2_ = qreq_.get_internal_query_config2()
+    if not requery and USE_PACKED_KNN:
+        if qreq_.prog_hook is not None:
+            # Keep the subhooks of later stages aligned
+            qreq_.prog_hook.next_subhook()
+        nns_list = packed_nn_compute(qreq_, internal_qannots,
+                                     num_neighbors_list, config2_)
+        return nns_list
     qvecs_list = internal_qannots.vecs
 
     qfxs_list = [np.arange(len(qvecs)) for qvecs in qvecs_list]
@@ -557,6 +772,84 @@ def cachemiss_nn_compute_fn(flags_list, qreq_, Kpad_list,
     return nns_list
 
 
+# Each thread packs its queries into its own arena
+_QUERY_ARENAS = threading.local()
+
+
+def _get_query_arena():
+    arena = getattr(_QUERY_ARENAS, 'arena', None)
+    if arena is None:
+        arena = _QUERY_ARENAS.arena = neighbor_index.QueryArena()
+    return arena
+
+
+@profile
+def packed_nn_compute(qreq_, internal_qannots, num_neighbors_list, config2_):
+    """
+    Computes the neighbors of a chunk of query annotations with one FLANN
+    search per distinct K. The scale and foreground filters are applied as
+    the vectors are copied into a reusable per-thread QueryArena, and the
+    returned Neighbors hold views of the batched results. Gives the same
+    neighbors as the per-annotation loop in cachemiss_nn_compute_fn.
+
+    CommandLine:
+        python -m ibeis.algo.hots.pipeline packed_nn_compute
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.pipeline import *  # NOQA
+        >>> import ibeis
+        >>> qreq_ = ibeis.testdata_qreq_(defaultdb='testdb1', p='default:fgw_thresh=.1')
+        >>> qreq_.load_indexer()
+        >>> internal_qannots = qreq_.internal_qannots
+        >>> config2_ = qreq_.get_internal_query_config2()
+        >>> num_neighbors_list = [3 + (x % 2) for x in range(len(internal_qannots))]
+        >>> nns_list = packed_nn_compute(qreq_, internal_qannots,
+        >>>                              num_neighbors_list, config2_)
+        >>> qfgw_list = internal_qannots.fgweights
+        >>> for nns, qvecs, qfgw, K in zip(nns_list, internal_qannots.vecs,
+        >>>                                qfgw_list, num_neighbors_list):
+        >>>     qfxs = np.flatnonzero(qfgw >= .1)
+        >>>     idxs, dists = qreq_.indexer.knn(qvecs.take(qfxs, axis=0), K)
+        >>>     assert np.all(nns.qfx_list == qfxs)
+        >>>     assert np.all(nns.neighb_idxs == idxs)
+        >>>     assert np.all(nns.neighb_dists == dists)
+    """
+    flags_list = None
+    if config2_.minscale_thresh is not None or config2_.maxscale_thresh is not None:
+        min_ = -np.inf if config2_.minscale_thresh is None else config2_.minscale_thresh
+        max_ = np.inf if config2_.maxscale_thresh is None else config2_.maxscale_thresh
+        scales_list = [vt.get_scales(kpts) for kpts in internal_qannots.kpts]
+        flags_list = [np.logical_and(scales >= min_, scales <= max_)
+                      for scales in scales_list]
+    if config2_.fgw_thresh is not None:
+        fgw_thresh = config2_.fgw_thresh
+        flags_list2 = [fgws >= fgw_thresh for fgws in internal_qannots.fgweights]
+        if flags_list is None:
+            flags_list = flags_list2
+        else:
+            flags_list = [np.logical_and(flags1, flags2)
+                          for flags1, flags2 in zip(flags_list, flags_list2)]
+    # Pack in order of K so each search group is a contiguous view
+    sortx = ut.argsort(num_neighbors_list)
+    qvecs_list = ut.take(internal_qannots.vecs, sortx)
+    if flags_list is not None:
+        flags_list = ut.take(flags_list, sortx)
+    arena = _get_query_arena()
+    vecs, fxs, offsets = arena.pack(qvecs_list, flags_list)
+    idx_dist_list = neighbor_index.packed_knn(
+        qreq_.indexer, vecs, offsets, ut.take(num_neighbors_list, sortx))
+    del vecs
+    arena.release(max_nbytes=QUERY_ARENA_MAX_BYTES)
+    bounds = offsets.tolist()
+    qaid_list = ut.take(internal_qannots.aid, sortx)
+    nns_list = [None] * len(sortx)
+    for qx, qaid, start, stop, (idxs, dists) in zip(
+            sortx, qaid_list, bounds[:-1], bounds[1:], idx_dist_list):
+        nns_list[qx] = Neighbors(qaid, idxs, dists, fxs[start:stop])
+    return nns_list
+
+
 @profile
 def nearest_neighbors(qreq_, Kpad_list, impossible_daids_list=None,
                       verbose=VERB_PIPELINE):
@@ -682,15 +975,16 @@ def nearest_neighbors(qreq_, Kpad_list, impossible_daids_list=None,
     if use_cache:
         nn_cachedir, nn_mid_cacheid_list = nearest_neighbor_cacheid2(
             qreq_, Kpad_list)
+        # All queries of the request share one consolidated store
+        nns_list = neighbor_cache.tryload_neighbors_with_compute(
+            nn_cachedir, get_nn_mid_cacheid(qreq_), nn_mid_cacheid_list,
+            cachemiss_nn_compute_fn, qreq_, Kpad_list, impossible_daids_list,
+            K, Knorm, requery, verbose)
     else:
-        # hacks
-        nn_mid_cacheid_list = [None] * len(qreq_.get_internal_qaids())
-        nn_cachedir = None
-
-    nns_list = ut.tryload_cache_list_with_compute(
-        use_cache, nn_cachedir, 'neighbs4', nn_mid_cacheid_list,
-        cachemiss_nn_compute_fn, qreq_, Kpad_list, impossible_daids_list, K,
-        Knorm, requery, verbose)
+        ismiss_list = [True] * len(qreq_.get_internal_qaids())
+        nns_list = cachemiss_nn_compute_fn(
+            ismiss_list, qreq_, Kpad_list, impossible_daids_list, K, Knorm,
+            requery, verbose)
     return nns_list
 
 
@@ -1152,9 +1446,13 @@ def get_sparse_matchinfo_nonagg(qreq_, nns, neighb_valid0,
     # valid_fm = np.ascontiguousarray(valid_fm)
     daid_list, daid_groupxs = vt.group_indices(valid_daid)
 
-    fm_list  = vt.apply_grouping(valid_fm, daid_groupxs)
-    fsv_list = vt.apply_grouping(valid_scorevec, daid_groupxs)
-    fk_list  = vt.apply_grouping(valid_rank, daid_groupxs)
+    if PACKED_CHIPMATCH:
+        packed = packed_matches.PackedMatches.from_groupxs(
+            daid_groupxs, fm=valid_fm, fsv=valid_scorevec, fk=valid_rank)
+    else:
+        fm_list  = vt.apply_grouping(valid_fm, daid_groupxs)
+        fsv_list = vt.apply_grouping(valid_scorevec, daid_groupxs)
+        fk_list  = vt.apply_grouping(valid_rank, daid_groupxs)
 
     filtnorm_aids = [
         None  # [None] * len(daid_groupxs)
@@ -1169,10 +1467,15 @@ def get_sparse_matchinfo_nonagg(qreq_, nns, neighb_valid0,
     assert len(filtnorm_aids) == len(fsv_col_lbls), 'bad normer'
     assert len(filtnorm_fxs) == len(fsv_col_lbls), 'bad normer'
 
-    cm = chip_match.ChipMatch(nns.qaid, daid_list, fm_list, fsv_list, fk_list,
-                              fsv_col_lbls=fsv_col_lbls,
-                              filtnorm_aids=filtnorm_aids,
-                              filtnorm_fxs=filtnorm_fxs)
+    if PACKED_CHIPMATCH:
+        cm = chip_match.ChipMatch.from_packed(
+            nns.qaid, daid_list, packed, fsv_col_lbls=fsv_col_lbls,
+            filtnorm_aids=filtnorm_aids, filtnorm_fxs=filtnorm_fxs)
+    else:
+        cm = chip_match.ChipMatch(nns.qaid, daid_list, fm_list, fsv_list, fk_list,
+                                  fsv_col_lbls=fsv_col_lbls,
+                                  filtnorm_aids=filtnorm_aids,
+                                  filtnorm_fxs=filtnorm_fxs)
     return cm
 
 
@@ -1253,14 +1556,163 @@ def _spatial_verification(qreq_, cm_list, verbose=VERB_PIPELINE):
                                                      nAnnotPerName,
                                                      score_method)
     prog_hook = None if qreq_.prog_hook is None else qreq_.prog_hook.next_subhook()
-    cm_progiter = ut.ProgressIter(cm_shortlist, length=len(cm_shortlist),
-                                  prog_hook=prog_hook, lbl=SVER_LVL, **PROGKW)
-
-    cm_list_SVER = [sver_single_chipmatch(qreq_, cm) for cm in cm_progiter]
+    cm_list_SVER = sver_chipmatch_list(qreq_, cm_shortlist,
+                                       n_workers=qreq_.qparams.sver_workers,
+                                       prog_hook=prog_hook)
     # rescore after verification?
     return cm_list_SVER
 
 
+#@profile
+def sver_chipmatch_list(qreq_, cm_list, n_workers=None, prog_hook=None):
+    r"""
+    Spatially verifies the shortlists of many chipmatches at once
+
+    The keypoints, chip extents, and inlier weights of every (qaid, daid) pair
+    in cm_list are looked up in bulk. The pairs are then verified in chunks
+    by a pool of n_workers processes and the inliers are scattered back into
+    each chipmatch. The result is the same as calling sver_single_chipmatch
+    on each chipmatch.
+
+    Args:
+        qreq_ (QueryRequest):  query request object with hyper-parameters
+        cm_list (list): chipmatches with shortlisted daids
+        n_workers (int): number of processes. None or 1 runs serially.
+        prog_hook (None): progress hook
+
+    Returns:
+        list: cm_list_SVER
+
+    CommandLine:
+        python -m ibeis.algo.hots.pipeline sver_chipmatch_list
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.hots.pipeline import *  # NOQA
+        >>> ibs, qreq_, cm_list = plh.testdata_pre_sver('testdb1', qaid_list=[1, 2, 3])
+        >>> scoring.score_chipmatch_list(qreq_, cm_list, qreq_.qparams.prescore_method)  # HACK
+        >>> cm_list1 = [sver_single_chipmatch(qreq_, cm) for cm in cm_list]
+        >>> cm_list2 = sver_chipmatch_list(qreq_, cm_list, n_workers=2)
+        >>> assert all([cm1 == cm2 for cm1, cm2 in zip(cm_list1, cm_list2)])
+    """
+    import multiprocessing
+    use_chip_extent = qreq_.qparams.use_chip_extent
+    sver_params = (
+        qreq_.qparams.xy_thresh,
+        qreq_.qparams.scale_thresh,
+        qreq_.qparams.ori_thresh,
+        qreq_.qparams.min_nInliers,
+        qreq_.qparams.full_homog_checks,
+        qreq_.qparams.refine_method,
+    )
+    # Bulk lookups for every annotation in the batch
+    unique_qaids = ut.unique([cm.qaid for cm in cm_list])
+    unique_daids = ut.unique(ut.flatten([cm.daid_list for cm in cm_list]))
+    qaid2_kpts = dict(zip(unique_qaids, [
+        kpts.astype(np.float64)
+        for kpts in qreq_.get_qreq_qannot_kpts(unique_qaids)]))
+    daid2_kpts = dict(zip(unique_daids,
+                          qreq_.get_qreq_dannot_kpts(unique_daids)))
+    if use_chip_extent and len(unique_daids) > 0:
+        daid2_dlen_sqrd = dict(zip(unique_daids, qreq_.ibs.get_annot_chip_dlensqrd(
+            unique_daids, config2_=qreq_.extern_data_config2)))
+    config2_ = qreq_.extern_query_config2
+    if qreq_.qparams.weight_inliers and len(unique_qaids) > 0:
+        if config2_.get('fg_on'):
+            qweights_list = [
+                qweights.astype(np.float64)
+                for qweights in qreq_.ibs.get_annot_fgweights(
+                    unique_qaids, ensure=True, config2_=config2_)]
+        else:
+            num_list = qreq_.ibs.get_annot_num_feats(unique_qaids,
+                                                     config2_=config2_)
+            qweights_list = [np.ones(num, np.float64) for num in num_list]
+        qaid2_weights = dict(zip(unique_qaids, qweights_list))
+
+    # Build chunks of (kpts2, fm, dlen_sqrd2, match_weights) pairs that share
+    # a query annotation
+    dlen_sqrd_lists = []
+    job_list = []
+    args_list = []
+    for cmx, cm in enumerate(cm_list):
+        kpts1 = qaid2_kpts[cm.qaid]
+        kpts2_list = ut.take(daid2_kpts, cm.daid_list)
+        if use_chip_extent:
+            top_dlen_sqrd_list = ut.take(daid2_dlen_sqrd, cm.daid_list)
+        else:
+            top_dlen_sqrd_list = compute_matching_dlen_extent(
+                qreq_, cm.fm_list, kpts2_list)
+        dlen_sqrd_lists.append(top_dlen_sqrd_list)
+        if qreq_.qparams.weight_inliers:
+            qweights = qaid2_weights[cm.qaid]
+            match_weight_list = [qweights.take(fm.T[0]) for fm in cm.fm_list]
+        else:
+            match_weight_list = [np.ones(len(fm), dtype=np.float64)
+                                 for fm in cm.fm_list]
+        pairxs = [px for px, fm in enumerate(cm.fm_list) if len(fm) > 0]
+        for chunk_pairxs in ut.ichunks(pairxs, SVER_PAIRS_PER_TASK):
+            pair_list = [(kpts2_list[px], cm.fm_list[px],
+                          top_dlen_sqrd_list[px], match_weight_list[px])
+                         for px in chunk_pairxs]
+            job_list.append((cmx, chunk_pairxs))
+            args_list.append((kpts1, pair_list) + sver_params)
+
+    # Daemonic processes (e.g. pool workers) cannot start their own pool
+    force_serial = (n_workers is None or n_workers <= 1 or
+                    qreq_.ibs.force_serial or
+                    multiprocessing.current_process().daemon)
+    svtups_list = [[None] * len(cm.daid_list) for cm in cm_list]
+    if len(args_list) > 0:
+        progkw = dict(prog_hook=prog_hook, lbl=SVER_LVL, **PROGKW)
+        result_gen = ut.generate2(_sver_pairs_worker, args_list,
+                                  nTasks=len(args_list), ordered=True,
+                                  force_serial=force_serial, nprocs=n_workers,
+                                  progkw=progkw, verbose=False)
+        for (cmx, chunk_pairxs), chunk_svtups in zip(job_list, result_gen):
+            for px, sv_tup in zip(chunk_pairxs, chunk_svtups):
+                svtups_list[cmx][px] = sv_tup
+
+    cm_list_SVER = [
+        _finish_sver_chipmatch(
+            qreq_, cm, svtup_list,
+            top_dlen_sqrd_list[-1] if len(top_dlen_sqrd_list) > 0 else None)
+        for cm, svtup_list, top_dlen_sqrd_list in
+        zip(cm_list, svtups_list, dlen_sqrd_lists)
+    ]
+    return cm_list_SVER
+
+
+def _sver_pairs_worker(kpts1, pair_list, xy_thresh, scale_thresh, ori_thresh,
+                       min_nInliers, full_homog_checks, refine_method):
+    """ verifies a chunk of pairs that share a query annotation """
+    return [
+        _sver_pair(kpts1, kpts2, fm, xy_thresh, scale_thresh, ori_thresh,
+                   dlen_sqrd2, min_nInliers, match_weights, full_homog_checks,
+                   refine_method)
+        for kpts2, fm, dlen_sqrd2, match_weights in pair_list
+    ]
+
+
+def _sver_pair(kpts1, kpts2, fm, xy_thresh, scale_thresh, ori_thresh,
+               dlen_sqrd2, min_nInliers, match_weights, full_homog_checks,
+               refine_method):
+    try:
+        # Compute homography from chip2 to chip1 returned homography
+        # maps image1 space into image2 space image1 is a query chip
+        # and image2 is a database chip
+        sv_tup = vt.spatially_verify_kpts(
+            kpts1, kpts2, fm, xy_thresh, scale_thresh, ori_thresh,
+            dlen_sqrd2, min_nInliers, match_weights=match_weights,
+            full_homog_checks=full_homog_checks, refine_method=refine_method,
+            returnAff=True)
+    except Exception as ex:
+        ut.printex(ex, 'Unknown error in spatial verification.',
+                   keys=['kpts1', 'kpts2',  'fm', 'xy_thresh',
+                         'scale_thresh', 'dlen_sqrd2', 'min_nInliers'])
+        sv_tup = None
+    return sv_tup
+
+
 #@profile
 def sver_single_chipmatch(qreq_, cm, verbose=False):
     r"""
@@ -1374,7 +1826,6 @@ def sver_single_chipmatch(qreq_, cm, verbose=False):
     min_nInliers          = qreq_.qparams.min_nInliers
     full_homog_checks     = qreq_.qparams.full_homog_checks
     refine_method         = qreq_.qparams.refine_method
-    sver_output_weighting = qreq_.qparams.sver_output_weighting
     # Precompute sver cmtup_old
     kpts1 = qreq_.get_qreq_qannot_kpts(qaid).astype(np.float64)
     kpts2_list = qreq_.get_qreq_dannot_kpts(cm.daid_list)
@@ -1408,41 +1859,24 @@ def sver_single_chipmatch(qreq_, cm, verbose=False):
             # skip results without any matches
             sv_tup = None
         else:
-
-            # sver_testdata = dict(
-            #     kpts1=kpts1,
-            #     kpts2=kpts2,
-            #     fm=fm,
-            #     xy_thresh=xy_thresh,
-            #     scale_thresh=scale_thresh,
-            #     ori_thresh=ori_thresh,
-            #     dlen_sqrd2=dlen_sqrd2,
-            #     min_nInliers=min_nInliers,
-            #     match_weights=match_weights,
-            #     full_homog_checks=full_homog_checks,
-            #     refine_method=refine_method
-            # )
-
-            # locals().update(ut.load_data('sver_testdata.pkl'))
-
-            try:
-                # Compute homography from chip2 to chip1 returned homography
-                # maps image1 space into image2 space image1 is a query chip
-                # and image2 is a database chip
-                sv_tup = vt.spatially_verify_kpts(
-                    kpts1, kpts2, fm, xy_thresh, scale_thresh, ori_thresh,
-                    dlen_sqrd2, min_nInliers, match_weights=match_weights,
-                    full_homog_checks=full_homog_checks, refine_method=refine_method,
-                    returnAff=True)
-            except Exception as ex:
-                ut.printex(ex, 'Unknown error in spatial verification.',
-                           keys=['kpts1', 'kpts2',  'fm', 'xy_thresh',
-                                 'scale_thresh', 'dlen_sqrd2', 'min_nInliers'])
-                sv_tup = None
+            sv_tup = _sver_pair(
+                kpts1, kpts2, fm, xy_thresh, scale_thresh, ori_thresh,
+                dlen_sqrd2, min_nInliers, match_weights, full_homog_checks,
+                refine_method)
         svtup_list.append(sv_tup)
 
     # <SENTINAL>
 
+    last_dlen_sqrd2 = (top_dlen_sqrd_list[-1]
+                       if len(top_dlen_sqrd_list) > 0 else None)
+    cmSV = _finish_sver_chipmatch(qreq_, cm, svtup_list, last_dlen_sqrd2)
+    return cmSV
+
+
+def _finish_sver_chipmatch(qreq_, cm, svtup_list, dlen_sqrd2):
+    """
+    Builds the verified chipmatch from one svtup (or None) per daid
+    """
     # New way
     inliers_list = []
     for sv_tup in svtup_list:
@@ -1462,10 +1896,11 @@ def sver_single_chipmatch(qreq_, cm, verbose=False):
     H_list_SV = ut.get_list_column(svtup_list_, 2)
     cmSV.H_list = H_list_SV
 
-    if sver_output_weighting:
+    if qreq_.qparams.sver_output_weighting:
         homog_err_weight_list = []
-        xy_thresh_sqrd = dlen_sqrd2 * xy_thresh
+        xy_thresh = qreq_.qparams.xy_thresh
         for sv_tup in svtup_list_:
+            xy_thresh_sqrd = dlen_sqrd2 * xy_thresh
             (homog_inliers, homog_errors) = sv_tup[0:2]
             homog_xy_errors = homog_errors[0].take(homog_inliers, axis=0)
             homog_err_weight = (1.0 - np.sqrt(homog_xy_errors / xy_thresh_sqrd))
@@ -16,6 +16,7 @@ from ibeis.algo.hots import neighbor_index_cache
 from ibeis.util import util_decor
 from ibeis.algo.hots import query_params
 from ibeis.algo.hots import chip_match
+from ibeis.algo.hots import chipmatch_store
 from ibeis.algo.hots import _pipeline_helpers as plh  # NOQA
 (print, rrr, profile) = ut.inject2(__name__)
 
@@ -1129,6 +1130,18 @@ class QueryRequest(ut.NiceRepr):
                 indexer = neighbor_index_cache.request_ibeis_nnindexer(
                     qreq_, verbose=verbose, prog_hook=prog_hook,
                     **qreq_._indexer_request_params)
+            elif index_method == 'sharded':
+                if ut.VERYVERBOSE or verbose:
+                    print('[qreq] loading sharded indexer')
+                indexer = neighbor_index_cache.request_ibeis_sharded_nnindexer(
+                    qreq_, verbose=verbose, prog_hook=prog_hook,
+                    **qreq_._indexer_request_params)
+            elif index_method == 'incremental':
+                if ut.VERYVERBOSE or verbose:
+                    print('[qreq] loading incremental indexer')
+                indexer = neighbor_index_cache.request_ibeis_incremental_nnindexer(
+                    qreq_, verbose=verbose, prog_hook=prog_hook,
+                    **qreq_._indexer_request_params)
             else:
                 raise ValueError('unknown index_method=%r' % (index_method,))
             qreq_.indexer = indexer
@@ -1162,7 +1175,34 @@ class QueryRequest(ut.NiceRepr):
             fpath = join(dpath, fname)
             yield fpath
 
-    def execute(qreq_, qaids=None, prog_hook=None, use_cache=None, invalidate_supercache=None):
+    def get_chipmatch_store(qreq_, super_qres_cache=False):
+        r"""
+        Opens the packed store holding the chipmatches of this configuration.
+        Results inside are keyed by qaid and query semantic uuid.
+
+        Returns:
+            ibeis.algo.hots.chipmatch_store.ChipMatchStore
+        """
+        dpath = qreq_.get_qresdir()
+        if super_qres_cache:
+            fname = 'qres_cm_supercache_store.sqlite3'
+        else:
+            cfgstr = qreq_.get_cfgstr(with_input=False, with_data=True, with_pipe=True)
+            fname = 'cm_store_%s.sqlite3' % (ut.hashstr27(cfgstr),)
+        return chipmatch_store.ChipMatchStore(join(dpath, fname))
+
+    def get_big_chipmatch_store(qreq_):
+        """
+        Opens the store backing the bigcache, which holds every result of
+        this query request (params + data + query).
+        """
+        bc_dpath, bc_fname, bc_cfgstr = qreq_.get_bigcache_info()
+        ut.ensuredir(bc_dpath)
+        fname = bc_fname + '_' + ut.hashstr27(bc_cfgstr) + '.sqlite3'
+        return chipmatch_store.ChipMatchStore(join(bc_dpath, fname))
+
+    def execute(qreq_, qaids=None, prog_hook=None, use_cache=None,
+                invalidate_supercache=None, n_workers=None):
         r"""
         Runs the hotspotter pipeline and returns chip match objects.
 
@@ -1184,7 +1224,8 @@ class QueryRequest(ut.NiceRepr):
         if qaids is not None:
             shallow_qreq_ = qreq_.shallowcopy(qaids=qaids)
             cm_list = shallow_qreq_.execute(prog_hook=prog_hook, use_cache=use_cache,
-                                            invalidate_supercache=invalidate_supercache)
+                                            invalidate_supercache=invalidate_supercache,
+                                            n_workers=n_workers)
             #cm_list = qreq_.ibs.query_chips(
             #    qreq_=shallow_qreq_, use_bigcache=False )
         else:
@@ -1194,7 +1235,8 @@ class QueryRequest(ut.NiceRepr):
             cm_list = mc4.submit_query_request(
                 qreq_, use_cache=use_cache, use_bigcache=use_cache, verbose=True,
                 save_qcache=use_cache, use_supercache=use_cache,
-                invalidate_supercache=invalidate_supercache)
+                invalidate_supercache=invalidate_supercache,
+                n_workers=n_workers)
         return cm_list
 
 
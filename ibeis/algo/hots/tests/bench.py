@@ -28,6 +28,172 @@ def benchmark_knn():
                                   verbose=verbose)
 
 
+def benchmark_packed_knn():
+    r"""
+    Compares the per-annotation nearest neighbor loop with the packed search
+    (one FLANN call per distinct K over a reusable query arena). Reports the
+    time and the peak traced memory of each.
+
+    CommandLine:
+        python ~/code/ibeis/ibeis/algo/hots/tests/bench.py benchmark_packed_knn
+        python ~/code/ibeis/ibeis/algo/hots/tests/bench.py benchmark_packed_knn --db PZ_MTEST --qsize 100
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_packed_knn()
+        >>> print(result)
+    """
+    import tracemalloc
+    import numpy as np
+    from ibeis.algo.hots import _pipeline_helpers as plh
+    from ibeis.algo.hots import pipeline
+    import ibeis
+    qsize = ut.get_argval('--qsize', type_=int, default=20)
+    qreq_ = ibeis.testdata_qreq_(
+        defaultdb='testdb1', t='default:fgw_thresh=.1',
+        a='default:qsize=%d' % (qsize,), verbose=1
+    )
+    locals_ = plh.testrun_pipeline_upto(qreq_, 'nearest_neighbors')
+    Kpad_list, impossible_daids_list = ut.dict_take(
+       locals_, ['Kpad_list', 'impossible_daids_list'])
+    flags_list = [True] * len(Kpad_list)
+    qparams = qreq_.qparams
+
+    def _run(use_packed):
+        pipeline.USE_PACKED_KNN = use_packed
+        tracemalloc.start()
+        with ut.Timer('packed=%r' % (use_packed,)) as timer:
+            nns_list = pipeline.cachemiss_nn_compute_fn(
+                flags_list, qreq_, Kpad_list, impossible_daids_list,
+                qparams.K, qparams.Knorm, False, False)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return nns_list, timer.ellapsed, peak
+
+    prev = pipeline.USE_PACKED_KNN
+    try:
+        # Warm the annotation caches and the arena before timing
+        _run(True)
+        nns_list1, time1, peak1 = _run(False)
+        nns_list2, time2, peak2 = _run(True)
+    finally:
+        pipeline.USE_PACKED_KNN = prev
+    for nns1, nns2 in zip(nns_list1, nns_list2):
+        assert np.all(nns1.qfx_list == nns2.qfx_list)
+        assert np.all(nns1.neighb_idxs == nns2.neighb_idxs)
+        assert np.all(nns1.neighb_dists == nns2.neighb_dists)
+    num_vecs = sum([len(nns.qfx_list) for nns in nns_list1])
+    print('Searched %d vectors from %d queries' % (num_vecs, len(nns_list1)))
+    result = ut.repr2(ut.odict([
+        ('loop_seconds', time1),
+        ('packed_seconds', time2),
+        ('loop_vecs_per_second', num_vecs / max(time1, 1E-9)),
+        ('packed_vecs_per_second', num_vecs / max(time2, 1E-9)),
+        ('loop_peak_bytes', peak1),
+        ('packed_peak_bytes', peak2),
+    ]), precision=4)
+    return result
+
+
+def benchmark_sver():
+    r"""
+    Compares per-chipmatch spatial verification with the batched engine
+
+    CommandLine:
+        python ~/code/ibeis/ibeis/algo/hots/tests/bench.py benchmark_sver
+        python ~/code/ibeis/ibeis/algo/hots/tests/bench.py benchmark_sver --db PZ_MTEST --workers 4
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_sver()
+        >>> print(result)
+    """
+    from ibeis.algo.hots import _pipeline_helpers as plh
+    from ibeis.algo.hots import pipeline
+    from ibeis.algo.hots import scoring
+    import ibeis
+    n_workers = ut.get_argval('--workers', type_=int, default=ut.num_cpus())
+    qreq_ = ibeis.testdata_qreq_(
+        defaultdb='testdb1', t='default', a='default:qsize=20', verbose=1
+    )
+    locals_ = plh.testrun_pipeline_upto(qreq_, 'spatial_verification')
+    cm_list = locals_['cm_list_FILT']
+    scoring.score_chipmatch_list(qreq_, cm_list, qreq_.qparams.prescore_method)
+    cm_shortlist = scoring.make_chipmatch_shortlists(
+        qreq_, cm_list, qreq_.qparams.nNameShortlistSVER,
+        qreq_.qparams.nAnnotPerNameSVER, qreq_.qparams.score_method)
+    num_pairs = sum([len(cm.daid_list) for cm in cm_shortlist])
+    print('Verifying %d pairs from %d queries' % (num_pairs, len(cm_shortlist)))
+
+    with ut.Timer('per chipmatch') as t1:
+        cm_list1 = [pipeline.sver_single_chipmatch(qreq_, cm)
+                    for cm in cm_shortlist]
+    with ut.Timer('batched serial') as t2:
+        cm_list2 = pipeline.sver_chipmatch_list(qreq_, cm_shortlist)
+    with ut.Timer('batched %d workers' % (n_workers,)) as t3:
+        cm_list3 = pipeline.sver_chipmatch_list(qreq_, cm_shortlist,
+                                                n_workers=n_workers)
+    assert all([cm1 == cm2 for cm1, cm2 in zip(cm_list1, cm_list2)])
+    assert all([cm1 == cm3 for cm1, cm3 in zip(cm_list1, cm_list3)])
+    result = ut.repr2(ut.odict([
+        ('per_chipmatch', t1.ellapsed),
+        ('batched_serial', t2.ellapsed),
+        ('batched_parallel', t3.ellapsed),
+    ]), precision=4)
+    return result
+
+
+def benchmark_pairwise_vsone():
+    r"""
+    Compares serial and parallel computation of the pairwise_match table
+
+    CommandLine:
+        python ~/code/ibeis/ibeis/algo/hots/tests/bench.py benchmark_pairwise_vsone
+        python ~/code/ibeis/ibeis/algo/hots/tests/bench.py benchmark_pairwise_vsone --db PZ_MTEST --workers 4
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from bench import *  # NOQA
+        >>> result = benchmark_pairwise_vsone()
+        >>> print(result)
+    """
+    import itertools
+    import numpy as np
+    import ibeis
+    from ibeis import core_annots
+    n_workers = ut.get_argval('--workers', type_=int, default=ut.num_cpus())
+    ibs = ibeis.opendb(defaultdb='testdb1')
+    aids = ibs.get_valid_aids()[0:30]
+    qaids, daids = map(list, zip(*itertools.combinations(aids, 2)))
+    config = core_annots.VsOneConfig()
+    print('Matching %d pairs of %d annots' % (len(qaids), len(aids)))
+
+    def _compute(workers):
+        core_annots.VSONE_WORKERS = workers
+        return [match for (match,) in core_annots.compute_pairwise_vsone(
+            ibs.depc_annot, qaids, daids, config)]
+
+    old_workers = core_annots.VSONE_WORKERS
+    # Builds the FLANN indexes both runs load from the cache
+    _compute(1)
+    with ut.Timer('serial') as t1:
+        match_list1 = _compute(1)
+    with ut.Timer('%d workers' % (n_workers,)) as t2:
+        match_list2 = _compute(n_workers)
+    core_annots.VSONE_WORKERS = old_workers
+    for match1, match2 in zip(match_list1, match_list2):
+        assert np.all(match1.fm == match2.fm)
+        assert np.all(match1.fs == match2.fs)
+        assert np.all(match1.H_12 == match2.H_12)
+    result = ut.repr2(ut.odict([
+        ('serial', t1.ellapsed),
+        ('parallel', t2.ellapsed),
+    ]), precision=4)
+    return result
+
+
 if __name__ == '__main__':
     r"""
     CommandLine:
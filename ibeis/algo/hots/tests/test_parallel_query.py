@@ -0,0 +1,70 @@
+import numpy as np
+
+
+_SHARDED = None
+
+
+def _forked_knn(qfx2_vec):
+    return _SHARDED.knn(qfx2_vec, 3)
+
+
+def _demo_sharded():
+    from ibeis.algo.hots.neighbor_index import ShardedNeighborIndex
+    rng = np.random.RandomState(0)
+    aid_list = list(range(1, 11))
+    vecs_list = [rng.randint(0, 256, (20, 128)).astype(np.uint8)
+                 for _ in aid_list]
+    fxs_list = [np.arange(len(vecs)) for vecs in vecs_list]
+    sharded = ShardedNeighborIndex.from_support(
+        aid_list, vecs_list, None, fxs_list, {'algorithm': 'linear'},
+        shard_size=3, n_workers=2, verbose=False)
+    qfx2_vec = rng.randint(0, 256, (10, 128)).astype(np.uint8)
+    return sharded, qfx2_vec
+
+
+def test_sharded_knn_after_fork():
+    """
+    Test that a forked process can query a sharded indexer whose thread
+    pool was started in the parent
+    """
+    import multiprocessing
+    from concurrent import futures
+    global _SHARDED
+    sharded, qfx2_vec = _demo_sharded()
+    # starts the thread pool in this process
+    qfx2_idx, qfx2_dist = sharded.knn(qfx2_vec, 3)
+    assert sharded._executor is not None
+    _SHARDED = sharded
+    executor = futures.ProcessPoolExecutor(
+        1, mp_context=multiprocessing.get_context('fork'))
+    try:
+        future = executor.submit(_forked_knn, qfx2_vec)
+        qfx2_idx2, qfx2_dist2 = future.result(timeout=60)
+    finally:
+        _SHARDED = None
+        executor.shutdown(wait=True)
+        sharded.close()
+    assert np.all(qfx2_idx == qfx2_idx2)
+    assert np.all(qfx2_dist == qfx2_dist2)
+
+
+def test_parallel_query_sharded():
+    """
+    Test that query workers can use a sharded indexer that was already
+    queried in the parent
+    """
+    import ibeis
+    from ibeis.algo.hots import match_chips4 as mc4
+    p = 'default:index_method=sharded,shard_size=4'
+    qreq1 = ibeis.testdata_qreq_(defaultdb='testdb1', a='default:qsize=4',
+                                 p=p)
+    qaid2_cm1 = mc4.execute_query2(qreq1, False, False, batch_size=1)
+    qreq2 = ibeis.testdata_qreq_(defaultdb='testdb1', a='default:qsize=4',
+                                 p=p)
+    # the cached indexer already started its thread pool in this process
+    qreq2.load_indexer(verbose=False)
+    assert qreq2.indexer._executor is not None
+    qaid2_cm2 = mc4.execute_query2(qreq2, False, False, batch_size=1,
+                                   n_workers=2)
+    assert sorted(qaid2_cm1.keys()) == sorted(qaid2_cm2.keys())
+    assert all([qaid2_cm1[qaid] == qaid2_cm2[qaid] for qaid in qaid2_cm1])
@@ -0,0 +1,194 @@
+"""
+Pickle-free encoding of nested state dicts of numpy arrays.
+
+A state dict is encoded as a small JSON header describing the attributes plus
+one byte buffer with their arrays laid end to end. Ragged lists of arrays such
+as the ``fm_list`` of a ChipMatch are concatenated into one array with a
+lengths array, so decoding is a handful of ``np.frombuffer`` views. Used by
+the ChipMatch store (:mod:`ibeis.algo.hots.chipmatch_store`) and the
+pairwise_match encoding (:mod:`ibeis.algo.verif.match_codec`).
+
+CommandLine:
+    python -m ibeis.algo.packed_state --allexamples
+"""
+import json
+import numpy as np
+import utool as ut
+print, rrr, profile = ut.inject2(__name__)
+
+
+# Arrays are aligned within a record so frombuffer views are aligned too
+_ALIGN = 16
+
+
+class _Packer(object):
+    """ Accumulates the array buffer of a single record """
+
+    def __init__(packer):
+        packer.chunks = []
+        packer.nbytes = 0
+
+    def add(packer, arr):
+        arr = np.ascontiguousarray(arr)
+        pad = (-packer.nbytes) % _ALIGN
+        if pad:
+            packer.chunks.append(b'\x00' * pad)
+            packer.nbytes += pad
+        offset = packer.nbytes
+        packer.chunks.append(arr.tobytes())
+        packer.nbytes += arr.nbytes
+        return offset
+
+    def tobytes(packer):
+        return b''.join(packer.chunks)
+
+
+def _is_ragged(value):
+    """ True for a non-empty list of numeric arrays that can be stacked """
+    if len(value) == 0:
+        return False
+    first = value[0]
+    if not isinstance(first, np.ndarray) or first.ndim == 0:
+        return False
+    if first.dtype.hasobject:
+        return False
+    dtype, trailing = first.dtype, first.shape[1:]
+    return all([
+        isinstance(item, np.ndarray) and item.dtype == dtype and
+        item.ndim == first.ndim and item.shape[1:] == trailing
+        for item in value
+    ])
+
+
+def _encode(value, packer):
+    if value is None:
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return ['p', value]
+    if isinstance(value, np.generic):
+        arr = np.asarray(value)
+        return ['s', arr.dtype.str, packer.add(arr)]
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return ['o', list(value.shape),
+                    [_encode(item, packer) for item in value.ravel()]]
+        return ['a', value.dtype.str, list(value.shape), packer.add(value)]
+    if isinstance(value, (list, tuple)):
+        is_tuple = isinstance(value, tuple)
+        if _is_ragged(value):
+            first = value[0]
+            lens = np.array([len(item) for item in value], dtype=np.int64)
+            flat = np.concatenate(value, axis=0)
+            return ['r', first.dtype.str, list(first.shape[1:]),
+                    packer.add(flat), packer.add(lens), len(value), is_tuple]
+        return ['l', is_tuple, [_encode(item, packer) for item in value]]
+    if isinstance(value, dict):
+        return ['d', [[_encode(key, packer), _encode(val, packer)]
+                      for key, val in value.items()]]
+    raise TypeError('Cannot pack value of type %r' % (type(value),))
+
+
+def _decode(node, buf):
+    if node is None:
+        return None
+    kind = node[0]
+    if kind == 'p':
+        return node[1]
+    if kind == 's':
+        return np.frombuffer(buf, dtype=np.dtype(node[1]), count=1,
+                             offset=node[2])[0]
+    if kind == 'a':
+        dtype, shape, offset = np.dtype(node[1]), tuple(node[2]), node[3]
+        count = int(np.prod(shape))
+        return np.frombuffer(buf, dtype=dtype, count=count,
+                             offset=offset).reshape(shape)
+    if kind == 'o':
+        shape, items = tuple(node[1]), node[2]
+        arr = np.empty(len(items), dtype=object)
+        arr[:] = [_decode(item, buf) for item in items]
+        return arr.reshape(shape)
+    if kind == 'r':
+        dtype, trailing, offset, lens_offset, num, is_tuple = node[1:]
+        dtype = np.dtype(dtype)
+        lens = np.frombuffer(buf, dtype=np.int64, count=num,
+                             offset=lens_offset)
+        total = int(lens.sum())
+        rowsize = int(np.prod(trailing))
+        flat = np.frombuffer(buf, dtype=dtype, count=total * rowsize,
+                             offset=offset).reshape((total,) + tuple(trailing))
+        stops = np.cumsum(lens)
+        items = [flat[stop - n:stop] for stop, n in zip(stops, lens)]
+        return tuple(items) if is_tuple else items
+    if kind == 'l':
+        items = [_decode(item, buf) for item in node[2]]
+        return tuple(items) if node[1] else items
+    if kind == 'd':
+        return {_decode(key, buf): _decode(val, buf) for key, val in node[1]}
+    raise ValueError('Unknown packed node kind %r' % (kind,))
+
+
+def pack_state(state_dict):
+    r"""
+    Encodes a state dict (e.g. of a ChipMatch) without pickling.
+
+    Args:
+        state_dict (dict): attributes of the object
+
+    Returns:
+        tuple: (header, data) where header is a JSON str and data is bytes
+
+    CommandLine:
+        python -m ibeis.algo.packed_state pack_state
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.packed_state import *  # NOQA
+        >>> state = {
+        >>>     'qaid': np.int32(3), 'qnid': None, 'score': 1.5,
+        >>>     'fm_list': [np.arange(6, dtype=np.int32).reshape(3, 2),
+        >>>                 np.zeros((0, 2), dtype=np.int32)],
+        >>>     'H_list': [None, np.eye(3)],
+        >>>     'daid2_idx': {np.int32(7): 0, np.int32(9): 1},
+        >>>     'fsv_col_lbls': ['lnbnn', 'fg'],
+        >>> }
+        >>> header, data = pack_state(state)
+        >>> state2 = unpack_state(header, data)
+        >>> assert state2['fm_list'][0].flags.writeable
+        >>> assert state2['fm_list'][1].shape == (0, 2)
+        >>> assert np.all(state2['fm_list'][0] == state['fm_list'][0])
+        >>> assert state2['H_list'][0] is None
+        >>> assert np.all(state2['H_list'][1] == np.eye(3))
+        >>> assert type(state2['qaid']) is np.int32
+        >>> print('qaid = %d' % (state2['qaid'],))
+        >>> print('daid2_idx = %r' % (sorted((int(k), v) for k, v in state2['daid2_idx'].items()),))
+        >>> print('fsv_col_lbls = %r' % (state2['fsv_col_lbls'],))
+        qaid = 3
+        daid2_idx = [(7, 0), (9, 1)]
+        fsv_col_lbls = ['lnbnn', 'fg']
+    """
+    packer = _Packer()
+    root = [[key, _encode(val, packer)] for key, val in state_dict.items()]
+    header = json.dumps(root, separators=(',', ':'))
+    return header, packer.tobytes()
+
+
+def unpack_state(header, data):
+    """
+    Inverse of :func:`pack_state`. The arrays of a record share one writable
+    buffer.
+    """
+    buf = bytearray(data)
+    root = json.loads(header)
+    return {key: _decode(node, buf) for key, node in root}
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.packed_state
+        python -m ibeis.algo.packed_state --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
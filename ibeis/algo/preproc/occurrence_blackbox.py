@@ -419,6 +419,191 @@ def cluster_timespace_sec(posixtimes, latlons, thresh_sec=5, km_per_sec=KM_PER_S
     return X_labels
 
 
+def cluster_timespace_sec_streaming(posixtimes, latlons, thresh_sec=5,
+                                    km_per_sec=KM_PER_SEC):
+    """
+    Single linkage clustering of time/space data without a full pairwise
+    distance matrix.
+
+    Points are sorted by time and each point is only compared to the later
+    points within ``thresh_sec`` seconds, because the time difference alone
+    is a lower bound on the timespace distance. The pairs in a window are
+    found with searchsorted and their distances are computed in vectorized
+    batches, then linked points are grouped with connected components. Points
+    without locations are split directly at time gaps, which is linear after
+    the sort.
+
+    The clusters are the same as :func:`cluster_timespace_sec` for the same
+    threshold. Labels are numbered from 1 in order of first appearance.
+
+    Args:
+        posixtimes (ndarray): time of each point in seconds
+        latlons (ndarray): Nx2 array of (lat, lon)
+        thresh_sec (float) : threshold in seconds
+        km_per_sec (float): reasonable animal walking speed
+
+    CommandLine:
+        python -m ibeis.algo.preproc.occurrence_blackbox cluster_timespace_sec_streaming
+
+    Doctest:
+        >>> from ibeis.algo.preproc.occurrence_blackbox import *  # NOQA
+        >>> X_data = np.array([
+        >>>     (0, 42.727985, -73.683994),  # MRC
+        >>>     (0, 42.657414, -73.774448),  # Park1
+        >>>     (0, 42.658333, -73.770993),  # Park2
+        >>>     (0, 42.654384, -73.768919),  # Park3
+        >>>     (0, 42.655039, -73.769048),  # Park4
+        >>>     (0, 42.657872, -73.764148),  # Park5
+        >>>     (0, 42.876974, -73.819311),  # CP1
+        >>>     (0, 42.862946, -73.804977),  # CP2
+        >>>     (0, 42.849809, -73.758486),  # CP3
+        >>> ])
+        >>> posixtimes = X_data.T[0]
+        >>> latlons = X_data.T[1:3].T
+        >>> thresh_sec = 250  # seconds
+        >>> X_labels = cluster_timespace_sec_streaming(posixtimes, latlons, thresh_sec)
+        >>> result = 'X_labels = {}'.format(ut.repr2(X_labels))
+        >>> print(result)
+        X_labels = np.array([1, 2, 2, 2, 2, 3, 4, 5, 6])
+        >>> X_labels1 = cluster_timespace_sec(posixtimes, latlons, thresh_sec)
+        >>> assert np.all(relabel_by_first_appearance(X_labels1) == X_labels)
+
+    Doctest:
+        >>> from ibeis.algo.preproc.occurrence_blackbox import *  # NOQA
+        >>> # Compare against the pdist path on random data with missing values
+        >>> rng = np.random.RandomState(0)
+        >>> n = 400
+        >>> posixtimes = np.sort(rng.rand(n)) * 60 * 60 * 24 + 1.4e9
+        >>> latlons = rng.rand(n, 2) * .1 + [42.6, -73.8]
+        >>> posixtimes[rng.rand(n) < .1] = np.nan
+        >>> latlons[rng.rand(n) < .1] = np.nan
+        >>> for thresh_sec in [60, 600, 1600]:
+        >>>     X_labels1 = cluster_timespace_sec(posixtimes, latlons, thresh_sec)
+        >>>     X_labels2 = cluster_timespace_sec_streaming(posixtimes, latlons, thresh_sec)
+        >>>     assert np.all(relabel_by_first_appearance(X_labels1) == X_labels2)
+        >>> # Without locations clusters are runs of times closer than thresh
+        >>> X_labels3 = cluster_timespace_sec_streaming(posixtimes, None, 600)
+        >>> has_time = ~np.isnan(posixtimes)
+        >>> expected = np.cumsum(np.hstack([[1], np.diff(posixtimes[has_time]) > 600]))
+        >>> assert np.all(relabel_by_first_appearance(X_labels3[has_time]) == expected)
+    """
+    X_data, dist_func, columns = prepare_data(posixtimes, latlons, km_per_sec,
+                                              'seconds')
+    if X_data is None:
+        return None
+
+    # Cluster nan distributions differently
+    X_bools = ~np.isnan(X_data)
+    group_id = (X_bools * np.power(2, [2, 1, 0])).sum(axis=1)
+    import vtool_ibeis as vt
+    unique_ids, groupxs = vt.group_indices(group_id)
+    grouped_labels = []
+    for xs in groupxs:
+        X_part = X_data.take(xs, axis=0)
+        if 'time' in columns and not np.isnan(X_part[0, 0]):
+            labels = _cluster_part_streaming(X_part, dist_func, columns,
+                                             thresh_sec, km_per_sec)
+        else:
+            # Without times there is no window to restrict comparisons to
+            labels = _cluster_part(X_part, dist_func, columns, thresh_sec,
+                                   km_per_sec)
+        grouped_labels.append((labels, xs))
+    X_labels = _recombine_labels(grouped_labels)
+    return relabel_by_first_appearance(X_labels)
+
+
+def relabel_by_first_appearance(X_labels):
+    """
+    Renumbers labels from 1 in the order that each label first appears
+
+    Doctest:
+        >>> from ibeis.algo.preproc.occurrence_blackbox import *  # NOQA
+        >>> print(relabel_by_first_appearance(np.array([5, 5, 2, 9, 2])).tolist())
+        [1, 1, 2, 3, 2]
+    """
+    X_labels = np.asarray(X_labels)
+    unique_labels, first_idxs, inverse = np.unique(
+        X_labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(unique_labels), dtype=int)
+    rank[first_idxs.argsort()] = np.arange(1, len(unique_labels) + 1)
+    return rank[inverse.ravel()]
+
+
+def _cluster_part_streaming(X_part, dist_func, columns, thresh_sec, km_per_sec,
+                            batch_size=2 ** 20):
+    """
+    Single linkage clusters of points that all have a time (and either all or
+    none have a location).
+
+    Without locations the clusters are split at time gaps larger than
+    thresh_sec. Otherwise the pairs of points within thresh_sec seconds of
+    each other are generated with searchsorted, their distances are computed
+    in batches of at most ``batch_size`` pairs, and the linked pairs are
+    grouped with scipy connected components.
+    """
+    import scipy.sparse
+    import scipy.sparse.csgraph
+    n = len(X_part)
+    sortx = X_part.T[0].argsort(kind='mergesort')
+    X_sorted = X_part.take(sortx, axis=0)
+    times = X_sorted.T[0]
+    have_gps = X_sorted.shape[1] == 3 and not np.isnan(X_sorted[0, 1])
+    if not have_gps:
+        # In one dimension single linkage only joins consecutive points
+        sorted_labels = np.cumsum(np.hstack([[0], np.diff(times) > thresh_sec]))
+    else:
+        lats = np.radians(X_sorted.T[1])
+        lons = np.radians(X_sorted.T[2])
+        # Vectorized haversine distances can differ from dist_func by a few
+        # ulps, so decisions this close to the threshold are redone with
+        # dist_func.
+        tol = 1e-9 * max(1.0, thresh_sec)
+        # Every point closer than thresh_sec is within the time window
+        time_tol = 4 * np.spacing(np.abs(times).max() + thresh_sec)
+        stops = np.searchsorted(times, times + (thresh_sec + time_tol),
+                                side='right')
+        # Number of later points in the window of each point
+        counts = np.maximum(stops - np.arange(n) - 1, 0)
+        cumsum = np.cumsum(counts)
+        total = int(cumsum[-1]) if n > 0 else 0
+        # Split the points into runs with at most batch_size pairs
+        bounds = np.searchsorted(cumsum, np.arange(batch_size, total,
+                                                   batch_size), side='left')
+        bounds = np.unique(np.hstack([[0], bounds + 1, [n]]).clip(0, n))
+        linked_i = []
+        linked_j = []
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            num = counts[a:b]
+            ii = np.repeat(np.arange(a, b), num)
+            if len(ii) == 0:
+                continue
+            # j runs from i + 1 to stops[i] - 1 for each i
+            offsets = np.arange(len(ii)) - np.repeat(np.cumsum(num) - num, num)
+            jj = ii + 1 + offsets
+            dists = np.abs(times[jj] - times[ii])
+            km_dists = haversine_rad(lats[ii], lons[ii], lats[jj], lons[jj])
+            dists = (km_dists / km_per_sec) + dists
+            islinked = dists <= thresh_sec
+            for k in np.flatnonzero(np.abs(dists - thresh_sec) <= tol):
+                islinked[k] = dist_func(X_sorted[ii[k]],
+                                        X_sorted[jj[k]]) <= thresh_sec
+            linked_i.append(ii[islinked])
+            linked_j.append(jj[islinked])
+        if linked_i:
+            linked_i = np.hstack(linked_i)
+            linked_j = np.hstack(linked_j)
+        else:
+            linked_i = linked_j = np.empty(0, dtype=int)
+        graph = scipy.sparse.coo_matrix(
+            (np.ones(len(linked_i), dtype=np.int8), (linked_i, linked_j)),
+            shape=(n, n))
+        _, sorted_labels = scipy.sparse.csgraph.connected_components(
+            graph, directed=False)
+    X_labels = np.empty(n, dtype=int)
+    X_labels[sortx] = sorted_labels
+    return relabel_by_first_appearance(X_labels)
+
+
 def _recombine_labels(chunk_labels):
     """
     Ensure each group has different indices
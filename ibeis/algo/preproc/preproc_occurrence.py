@@ -107,7 +107,7 @@ def compute_occurrence_groups(ibs, gid_list, config={}, use_gps=False,
     for key in datas.keys():
         val = datas[key]
         gids, latlons, posixtimes = val
-        labels = occurrence_blackbox.cluster_timespace_sec(
+        labels = occurrence_blackbox.cluster_timespace_sec_streaming(
             latlons, posixtimes, thresh_sec, km_per_sec=km_per_sec)
         if labels is None:
             labels = np.zeros(len(gids), dtype=int)
@@ -283,6 +283,7 @@ class InvertedAnnots(InvertedAnnotsExtras):
         inva.int_rvec = None
         inva.config = None
         inva.vocab_rowid = None
+        inva.word_stacks = None
 
     @property
     def wx_list(inva):
@@ -430,6 +431,91 @@ class InvertedAnnots(InvertedAnnotsExtras):
             gamma_list.append(gammaX)
         return gamma_list
 
+    def compute_word_stacks(inva):
+        """
+        Groups the aggregated residual vectors of all annotations by word so
+        a query word can be scored against every database annotation that
+        contains it with one array operation.
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from ibeis.algo.smk.inverted_index import *  # NOQA
+            >>> inva = testdata_random_inva(n_annots=5, n_words=7)
+            >>> stacks = inva.compute_word_stacks()
+            >>> print(stacks)
+            <WordStacks(nWords=7, nRows=20)>
+            >>> wx = inva.wx_lists[2][1]
+            >>> aidxs, rvecs, flags = stacks.word_slice(wx)
+            >>> assert ut.issorted(aidxs) and 2 in aidxs
+            >>> idx = ut.make_index_lookup(inva.wx_lists[2])[wx]
+            >>> row = aidxs.tolist().index(2)
+            >>> assert np.all(rvecs[row] == inva.agg_rvecs[2][idx])
+            >>> assert flags[row] == inva.agg_flags[2][idx, 0]
+        """
+        with ut.Timer('Building word stacks'):
+            stacks = WordStacks.from_inva(inva)
+        return stacks
+
+
+@ut.reloadable_class
+class WordStacks(ut.NiceRepr):
+    """
+    The aggregated residual vectors of an InvertedAnnots stacked by word.
+
+    Rows ``offsets[sx]:offsets[sx + 1]`` belong to word ``wxs[sx]`` and are
+    sorted by annotation index. ``aidxs`` index into ``inva.aids`` and
+    ``gammas`` is indexed by annotation index.
+    """
+    def __init__(stacks):
+        stacks.wxs = None
+        stacks.offsets = None
+        stacks.aidxs = None
+        stacks.rvecs = None
+        stacks.flags = None
+        stacks.gammas = None
+        stacks.int_rvec = None
+        stacks.wx_to_sx = None
+
+    def __nice__(stacks):
+        return 'nWords=%d, nRows=%d' % (len(stacks.wxs), len(stacks.aidxs))
+
+    @classmethod
+    def from_inva(cls, inva):
+        stacks = cls()
+        n_words_per = np.array(ut.lmap(len, inva.wx_lists), dtype=np.int64)
+        flat_aidxs = np.repeat(np.arange(len(inva.aids)), n_words_per)
+        if len(flat_aidxs) == 0:
+            flat_wxs = np.empty(0, dtype=np.int32)
+        else:
+            flat_wxs = np.hstack(inva.wx_lists)
+        sortx = np.lexsort((flat_aidxs, flat_wxs))
+        flat_wxs = flat_wxs.take(sortx)
+        stacks.aidxs = flat_aidxs.take(sortx)
+        if len(sortx) > 0:
+            stacks.rvecs = np.vstack(inva.agg_rvecs).take(sortx, axis=0)
+            stacks.flags = np.vstack(inva.agg_flags).T[0].take(sortx)
+        else:
+            stacks.rvecs = np.empty((0, 0))
+            stacks.flags = np.empty(0, dtype=bool)
+        stacks.wxs, starts = np.unique(flat_wxs, return_index=True)
+        stacks.offsets = np.append(starts, len(flat_wxs))
+        stacks.wx_to_sx = ut.make_index_lookup(stacks.wxs.tolist())
+        if inva.gamma_list is not None:
+            stacks.gammas = np.array(inva.gamma_list)
+        stacks.int_rvec = inva.int_rvec
+        return stacks
+
+    def word_slice(stacks, wx):
+        """
+        Returns:
+            tuple: (aidxs, rvecs, flags) of the annotations containing word wx
+        """
+        sx = stacks.wx_to_sx.get(wx, None)
+        if sx is None:
+            return (stacks.aidxs[0:0], stacks.rvecs[0:0], stacks.flags[0:0])
+        sl = slice(stacks.offsets[sx], stacks.offsets[sx + 1])
+        return stacks.aidxs[sl], stacks.rvecs[sl], stacks.flags[sl]
+
 
 @ut.reloadable_class
 class SingleAnnot(ut.NiceRepr):
@@ -700,6 +786,41 @@ def residual_worker(argtup):
     return tup
 
 
+def testdata_random_inva(n_annots=10, n_words=16, dim=8, words_per=4,
+                         int_rvec=True, rng=0):
+    """
+    Builds an InvertedAnnots with random aggregated residual vectors, word
+    weights and gammas. Does not need a database.
+    """
+    rng = ut.ensure_rng(rng)
+    inva = InvertedAnnots()
+    inva.aids = list(range(1, n_annots + 1))
+    inva.wx_lists = [
+        np.array(sorted(rng.choice(n_words, min(words_per, n_words), replace=False)),
+                 dtype=np.int32)
+        for _ in range(n_annots)
+    ]
+    inva.fxs_lists = [[np.array([fx], dtype=np.uint16) for fx in range(len(wxs))]
+                      for wxs in inva.wx_lists]
+    inva.maws_lists = [[np.ones(1, dtype=np.float32) for _ in wxs]
+                       for wxs in inva.wx_lists]
+    rvecs_list = []
+    for wxs in inva.wx_lists:
+        rvecs = rng.randn(len(wxs), dim)
+        rvecs /= np.linalg.norm(rvecs, axis=1)[:, None]
+        if int_rvec:
+            rvecs = smk_funcs.cast_residual_integer(rvecs)
+        rvecs_list.append(rvecs)
+    inva.agg_rvecs = rvecs_list
+    inva.agg_flags = [rng.rand(len(wxs), 1) > .9 for wxs in inva.wx_lists]
+    inva.aid_to_idx = ut.make_index_lookup(inva.aids)
+    inva.int_rvec = int_rvec
+    inva.wx_to_aids = inva.compute_inverted_list()
+    inva.wx_to_weight = inva.compute_word_weights('idf')
+    inva.gamma_list = inva.compute_gammas(3.0, 0.0)
+    return inva
+
+
 def testdata_inva():
     """
     from ibeis.algo.smk.inverted_index import *  # NOQA
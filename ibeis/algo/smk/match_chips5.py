@@ -2,8 +2,9 @@
 TODO: semantic_uuids should be replaced with PCC-like hashes pertaining to
 annotation clusters if any form of name scoring is used.
 """
-from os.path import exists, join
+from os.path import join
 from ibeis.algo.hots import chip_match
+from ibeis.algo.hots import chipmatch_store
 import utool as ut
 import numpy as np
 from ibeis.util import util_decor
@@ -109,6 +110,24 @@ class EstimatorRequest(ut.NiceRepr):
         fpath_list = [join(dpath, fname) for fname in fname_list]
         return fpath_list
 
+    def get_chipmatch_store(qreq_):
+        r"""
+        Opens the packed chipmatch store of this configuration. Results are
+        keyed by qaid and query semantic uuid.
+        """
+        cfgstr = qreq_.get_cfgstr(with_input=False, with_data=True, with_pipe=True)
+        dpath = ut.ensuredir((qreq_.cachedir, 'mc5_cms'))
+        fname = 'cm_store_%s.sqlite3' % (ut.hashstr27(cfgstr),)
+        return chipmatch_store.ChipMatchStore(join(dpath, fname))
+
+    def get_bulk_chipmatch_store(qreq_):
+        """ Store holding every result of this request (params + data + query) """
+        bc_dpath = ut.ensuredir((qreq_.cachedir, 'bulk_mc5'))
+        bc_fname = 'bulk_mc5_' + '_'.join(qreq_.get_nice_parts())
+        bc_cfgstr = qreq_.get_cfgstr(with_input=True)
+        fname = bc_fname + '_' + ut.hashstr27(bc_cfgstr) + '.sqlite3'
+        return chipmatch_store.ChipMatchStore(join(bc_dpath, fname))
+
     def get_nice_parts(qreq_):
         parts = []
         parts.append(qreq_.ibs.get_dbname())
@@ -168,16 +187,15 @@ def execute_bulk(qreq_):
                len(qreq_.qaids) > qreq_.min_bulk_size)
     if bulk_on:
         # Try and load directly from a big cache
-        bc_dpath = ut.ensuredir((qreq_.cachedir, 'bulk_mc5'))
-        bc_fname = 'bulk_mc5_' + '_'.join(qreq_.get_nice_parts())
-        bc_cfgstr = qreq_.get_cfgstr(with_input=True)
-        try:
-            cm_list = ut.load_cache(bc_dpath, bc_fname, bc_cfgstr)
-            print('... bulk cache hit %r/%r' % (len(qreq_), len(qreq_)))
-        except (IOError, AttributeError):
-            # Fallback to smallcache
-            cm_list = execute_singles(qreq_)
-            ut.save_cache(bc_dpath, bc_fname, bc_cfgstr, cm_list)
+        with qreq_.get_bulk_chipmatch_store() as store:
+            qaid_to_cm = store.load_all()
+            try:
+                cm_list = ut.take(qaid_to_cm, qreq_.qaids)
+                print('... bulk cache hit %r/%r' % (len(qreq_), len(qreq_)))
+            except KeyError:
+                # Fallback to smallcache
+                cm_list = execute_singles(qreq_)
+                store.save_many(cm_list)
     else:
         # Fallback to smallcache
         cm_list = execute_singles(qreq_)
@@ -187,41 +205,9 @@ def execute_bulk(qreq_):
 def _load_singles(qreq_):
     # Find existing cached chip matches
     # Try loading as many as possible
-    fpath_list = qreq_.get_chipmatch_fpaths(qreq_.qaids)
-    exists_flags = [exists(fpath) for fpath in fpath_list]
-    qaids_hit = ut.compress(qreq_.qaids, exists_flags)
-    fpaths_hit = ut.compress(fpath_list, exists_flags)
-    # First, try a fast reload assuming no errors
-    fpath_iter = ut.ProgIter(
-        fpaths_hit, length=len(fpaths_hit), enabled=len(fpaths_hit) > 1,
-        label='loading cache hits', adjust=True, freq=1)
-    try:
-        qaid_to_hit = {
-            qaid: chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
-            for qaid, fpath in zip(qaids_hit, fpath_iter)
-        }
-    except chip_match.NeedRecomputeError as ex:
-        # Fallback to a slow reload
-        ut.printex(ex, 'Some cached results need to recompute', iswarning=True)
-        qaid_to_hit = _load_singles_fallback(fpaths_hit)
-    return qaid_to_hit
-
-
-def _load_singles_fallback(fpaths_hit):
-    fpath_iter = ut.ProgIter(
-        fpaths_hit, enabled=len(fpaths_hit) > 1,
-        label='checking chipmatch cache', adjust=True, freq=1)
-    # Recompute those that fail loading
-    qaid_to_hit = {}
-    for fpath in fpath_iter:
-        try:
-            cm = chip_match.ChipMatch.load_from_fpath(fpath, verbose=False)
-        except chip_match.NeedRecomputeError:
-            pass
-        else:
-            qaid_to_hit[cm.qaid] = cm
-    print('%d / %d cached matches need to be recomputed' % (
-        len(fpaths_hit) - len(qaid_to_hit), len(fpaths_hit)))
+    qauuid_list = qreq_.ibs.get_annot_semantic_uuids(qreq_.qaids)
+    with qreq_.get_chipmatch_store() as store:
+        qaid_to_hit = store.load_many(qreq_.qaids, qauuid_list)
     return qaid_to_hit
 
 
@@ -270,13 +256,9 @@ def execute_and_save(qreq_miss):
         assert len(cm_batch) == len(qaids), 'bad alignment'
         assert all([qaid == cm.qaid for qaid, cm in zip(qaids, cm_batch)])
 
-        # TODO: we already computed the fpaths
-        # should be able to pass them in
-        fpath_list = sub_qreq.get_chipmatch_fpaths(qaids)
-        _prog = ut.ProgPartial(length=len(cm_batch), adjust=True, freq=1,
-                               label='saving chip matches', bs=True)
-        for cm, fpath in _prog(zip(cm_batch, fpath_list)):
-            cm.save_to_fpath(fpath, verbose=False)
+        qauuid_list = sub_qreq.ibs.get_annot_semantic_uuids(qaids)
+        with sub_qreq.get_chipmatch_store() as store:
+            store.save_many(cm_batch, qauuid_list)
         qaid_to_cm.update({cm.qaid: cm for cm in cm_batch})
 
     return qaid_to_cm
@@ -23,7 +23,6 @@ from ibeis.algo.smk import match_chips5 as mc5
 from ibeis.algo.smk import vocab_indexer
 from ibeis.algo.smk import inverted_index
 from ibeis.algo.smk import smk_funcs
-from ibeis import core_annots
 from ibeis.algo import Config as old_config
 (print, rrr, profile) = ut.inject2(__name__)
 
@@ -48,14 +47,19 @@ class SMKRequestConfig(dtool_ibeis.Config):
         ut.ParamInfo('word_weight_method', 'idf', shortprefix='wwm'),  # hack for query only multiple assignment
         ut.ParamInfo('smk_version', 3),
     ]
-    _sub_config_list = [
-        core_annots.ChipConfig,
-        core_annots.FeatConfig,
-        old_config.SpatialVerifyConfig,
-        vocab_indexer.VocabConfig,
-        inverted_index.InvertedIndexConfig,
-        MatchHeuristicsConfig,
-    ]
+
+    def get_sub_config_list(cfg):
+        # core_annots imports ibeis.algo, so its configs are looked up here
+        # instead of when this module is imported
+        from ibeis import core_annots
+        return [
+            core_annots.ChipConfig,
+            core_annots.FeatConfig,
+            old_config.SpatialVerifyConfig,
+            vocab_indexer.VocabConfig,
+            inverted_index.InvertedIndexConfig,
+            MatchHeuristicsConfig,
+        ]
 
 
 @ut.reloadable_class
@@ -272,6 +276,9 @@ class SMKRequest(mc5.EstimatorRequest):
         qinva.gamma_list = qgamma_cacher.ensure(
             lambda: qinva.compute_gammas(alpha, thresh))
 
+        if qreq_.qparams['agg']:
+            dinva.word_stacks = dinva.compute_word_stacks()
+
         qreq_.qinva = qinva
         qreq_.dinva = dinva
 
@@ -402,10 +409,15 @@ class SMK(ut.NiceRepr):
             daid = correct_aids[0]
 
         if agg:
-            for daid in _prog(valid_daids):
-                Y = qreq_.dinva.get_annot(daid)
-                item = match_kernel_agg(X, Y, wx_to_weight, alpha, thresh)
-                shortlist.insert(item)
+            # Score every valid daid at once, then only build match items for
+            # the annotations that make it into the shortlist.
+            scores = match_kernel_agg_batch(X, qreq_.dinva, valid_daids,
+                                            wx_to_weight, alpha, thresh)
+            shortlist = [
+                match_kernel_agg(X, qreq_.dinva.get_annot(valid_daids[idx]),
+                                 wx_to_weight, alpha, thresh)
+                for idx in _prog(shortlist_indices(scores, shortsize))
+            ]
         else:
             for daid in _prog(valid_daids):
                 Y = qreq_.dinva.get_annot(daid)
@@ -479,6 +491,131 @@ def match_kernel_agg(X, Y, wx_to_weight, alpha, thresh):
     return item
 
 
+@profile
+def match_kernel_agg_batch(X, dinva, daids, wx_to_weight, alpha, thresh):
+    r"""
+    Computes the same scores as ``match_kernel_agg(X, Y, ...)[0]`` for every
+    annotation in daids. The residual vectors of each query word are scored
+    against all database annotations containing that word at once using
+    ``dinva.word_stacks``.
+
+    Returns:
+        ndarray: scores aligned with daids
+
+    CommandLine:
+        python -m ibeis.algo.smk.smk_pipeline match_kernel_agg_batch
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.smk.smk_pipeline import *  # NOQA
+        >>> from ibeis.algo.smk import inverted_index
+        >>> dinva = inverted_index.testdata_random_inva(200, 64, 16, 20, rng=0)
+        >>> qinva = inverted_index.testdata_random_inva(3, 64, 16, 20, rng=1)
+        >>> qinva.wx_to_weight = dinva.wx_to_weight
+        >>> qinva.gamma_list = qinva.compute_gammas(3.0, 0.0)
+        >>> dinva.word_stacks = dinva.compute_word_stacks()
+        >>> X = qinva.get_annot(qinva.aids[0])
+        >>> daids = np.array(dinva.aids[::-1])
+        >>> scores = match_kernel_agg_batch(X, dinva, daids,
+        >>>                                 dinva.wx_to_weight, 3.0, 0.0)
+        >>> scores1 = np.array([
+        >>>     match_kernel_agg(X, dinva.get_annot(daid), dinva.wx_to_weight,
+        >>>                      3.0, 0.0)[0]
+        >>>     for daid in daids])
+        >>> assert scores.dtype == scores1.dtype
+        >>> assert np.all(scores == scores1)
+    """
+    stacks = dinva.word_stacks
+    if stacks is None:
+        stacks = dinva.word_stacks = dinva.compute_word_stacks()
+    daids = np.asarray(daids)
+    # Map annotation indexes in the inverted index to positions in daids
+    aidx_to_pos = np.full(len(dinva.aids), -1, dtype=np.int64)
+    aidx_to_pos[list(ub.take(dinva.aid_to_idx, daids))] = np.arange(len(daids))
+
+    PhisX, flagsX = X.Phis_flags(np.arange(len(X.wx_list)))
+    flagsX = flagsX.T[0]
+    gammaX = X.gamma
+
+    pos_list = []
+    wx_list = []
+    score_list = []
+    for xidx, wx in enumerate(X.wx_list):
+        aidxs, PhisY, flagsY = stacks.word_slice(wx)
+        pos = aidx_to_pos.take(aidxs)
+        isvalid = pos >= 0
+        if not np.any(isvalid):
+            continue
+        pos = pos.compress(isvalid)
+        PhisY = PhisY.compress(isvalid, axis=0)
+        flagsY = flagsY.compress(isvalid)
+        if stacks.int_rvec:
+            PhisY = smk_funcs.uncast_residual_integer(PhisY)
+        # Same operations as smk_funcs.match_scores_agg, one row per daid
+        u = (PhisX[xidx][None, :] * PhisY).sum(axis=1)
+        u[np.logical_or(flagsX[xidx], flagsY)] = 1
+        scores = smk_funcs.selectivity(u, alpha, thresh, out=u)
+        gammaXY = gammaX * stacks.gammas.take(aidxs.compress(isvalid))
+        scores *= (np.array([wx_to_weight[wx]]) * gammaXY)
+        pos_list.append(pos)
+        wx_list.append(np.full(len(pos), wx))
+        score_list.append(scores)
+
+    if len(score_list) == 0:
+        return np.zeros(len(daids), dtype=np.float32)
+    flat_pos = np.hstack(pos_list)
+    flat_wxs = np.hstack(wx_list)
+    flat_scores = np.hstack(score_list)
+    # Sum each daid's word scores in increasing word order like the single
+    # pair kernel does. Rows with the same number of words are summed
+    # together along a contiguous axis, which uses the same reduction order as
+    # ndarray.sum so the totals match bit for bit.
+    sortx = np.lexsort((flat_wxs, flat_pos))
+    flat_pos = flat_pos.take(sortx)
+    flat_scores = flat_scores.take(sortx)
+    unique_pos, starts, counts = np.unique(flat_pos, return_index=True,
+                                           return_counts=True)
+    out = np.zeros(len(daids), dtype=flat_scores.dtype)
+    for count in np.unique(counts):
+        rowxs = np.flatnonzero(counts == count)
+        idxs = starts.take(rowxs)[:, None] + np.arange(count)
+        out[unique_pos.take(rowxs)] = flat_scores.take(idxs).sum(axis=1)
+    return out
+
+
+def shortlist_indices(scores, shortsize=None):
+    """
+    Returns the indexes of the top ``shortsize`` scores ordered exactly like
+    the items of a ``ut.Shortlist`` that the scores were inserted into in
+    order: increasing score, with ties ordered by decreasing index.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.smk.smk_pipeline import *  # NOQA
+        >>> scores = np.array([3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5])
+        >>> print(shortlist_indices(scores, 4).tolist())
+        [8, 4, 7, 5]
+        >>> shortlist = ut.Shortlist(4)
+        >>> for idx, score in enumerate(scores):
+        >>>     shortlist.insert((score, idx))
+        >>> print([idx for score, idx in shortlist])
+        [8, 4, 7, 5]
+        >>> print(shortlist_indices(scores).tolist())
+        [3, 1, 6, 9, 0, 2, 10, 8, 4, 7, 5]
+    """
+    n = len(scores)
+    if shortsize and n > shortsize:
+        kth = n - shortsize
+        cutoff = scores[np.argpartition(scores, kth)[kth]]
+        candxs = np.flatnonzero(scores >= cutoff)
+    else:
+        candxs = np.arange(n)
+    order = candxs.take(np.lexsort((-candxs, scores.take(candxs))))
+    if shortsize:
+        order = order[-shortsize:]
+    return order
+
+
 def match_kernel_sep(X, Y, wx_to_weight, alpha, thresh):
     gammaXY = X.gamma * Y.gamma
     # Words in common define matches
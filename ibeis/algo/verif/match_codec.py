@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Compact on-disk encoding for the vt.PairwiseMatch rows of the
+``pairwise_match`` depcache table.
+
+The depcache used to pickle the whole state dict of every match, so reading a
+cached row meant unpickling nested ordered dicts just to recover the feature
+correspondences and their score columns. A match file now holds only what the
+match itself computed:
+
+    * ``fm`` in the narrowest unsigned dtype that fits the feature indices
+    * one contiguous typed column per local measure (ratio, distances, sver
+      errors, ...). ``fs`` is written as a reference when it equals one of
+      these columns, which it does for the default ratio scoring. The
+      decoded ``fs`` is a copy, so it never shares memory with the column.
+    * the homographies and any global measures
+    * the aids of both annotations
+
+The record is a fixed size preamble, a JSON header and one aligned byte
+buffer (see :func:`ibeis.algo.packed_state.pack_state`), so decoding
+is a handful of ``np.frombuffer`` views. The annotation metadata is not
+stored. Loaded matches only know their aids; callers re-attach lazy annots
+(see :meth:`PairwiseFeatureExtractor._exec_pairwise_match`).
+
+Files written by older versions are whole pickled state dicts. They are still
+read through the pickle path, so an existing cache does not need to be
+recomputed.
+
+CommandLine:
+    python -m ibeis.algo.verif.match_codec --allexamples
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import struct
+import uuid
+import numpy as np
+import utool as ut
+import vtool_ibeis as vt
+from ibeis.algo import packed_state
+print, rrr, profile = ut.inject2(__name__)
+
+
+MAGIC = b'VSM1'
+# magic, header length in bytes
+_PREAMBLE = struct.Struct('<4sI')
+# The data buffer starts at a multiple of this so its arrays stay aligned
+_ALIGN = 16
+
+
+def _narrow_fm(fm):
+    """ Smallest unsigned dtype holding the feature indices of fm """
+    if fm.size == 0 or fm.min() < 0:
+        return fm
+    max_idx = fm.max()
+    for dtype in [np.uint16, np.uint32]:
+        if max_idx <= np.iinfo(dtype).max:
+            return fm.astype(dtype)
+    return fm
+
+
+def _find_alias(fs, local_measures):
+    """ Key of the local measure column that fs is a copy of, if any """
+    if fs is None:
+        return None
+    for key, col in local_measures.items():
+        if col is fs:
+            return key
+        if (isinstance(col, np.ndarray) and col.dtype == fs.dtype and
+             col.shape == fs.shape and np.array_equal(col, fs)):
+            return key
+    return None
+
+
+def _annot_aid(annot):
+    if annot is not None and 'aid' in annot:
+        aid = annot['aid']
+        # ensure ibeis integer aids are stored as plain JSON ints
+        return int(aid) if isinstance(aid, np.integer) else aid
+    return None
+
+
+def match_to_state(match):
+    """ Column-oriented state of a vt.PairwiseMatch """
+    local_measures = match.local_measures
+    fs_alias = _find_alias(match.fs, local_measures)
+    fm = match.fm
+    state = {
+        'aid1': _annot_aid(match.annot1),
+        'aid2': _annot_aid(match.annot2),
+        'fm': None if fm is None else _narrow_fm(fm),
+        'fm_dtype': None if fm is None else fm.dtype.str,
+        'fs': None if fs_alias is not None else match.fs,
+        'fs_alias': fs_alias,
+        'H_12': match.H_12,
+        'H_21': match.H_21,
+        'local_measures': dict(local_measures),
+        'global_measures': dict(match.global_measures),
+    }
+    return state
+
+
+def state_to_match(state):
+    """ Inverse of :func:`match_to_state`. The annots only know their aid. """
+    annot1 = {} if state['aid1'] is None else {'aid': state['aid1']}
+    annot2 = {} if state['aid2'] is None else {'aid': state['aid2']}
+    match = vt.PairwiseMatch(annot1, annot2)
+    local_measures = ut.odict(state['local_measures'])
+    fm = state['fm']
+    if fm is not None and fm.dtype.str != state['fm_dtype']:
+        fm = fm.astype(np.dtype(state['fm_dtype']))
+    match.fm = fm
+    if state['fs_alias'] is not None:
+        match.fs = local_measures[state['fs_alias']].copy()
+    else:
+        match.fs = state['fs']
+    match.H_12 = state['H_12']
+    match.H_21 = state['H_21']
+    match.local_measures = local_measures
+    match.global_measures = ut.odict(state['global_measures'])
+    return match
+
+
+def encode_match(match):
+    r"""
+    Args:
+        match (vt.PairwiseMatch):
+
+    Returns:
+        bytes: the encoded record
+
+    CommandLine:
+        python -m ibeis.algo.verif.match_codec encode_match
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.verif.match_codec import *  # NOQA
+        >>> import pickle
+        >>> match = testdata_match(num=500)
+        >>> data = encode_match(match)
+        >>> match2 = decode_match(data)
+        >>> assert match2.annot1['aid'] == 1 and match2.annot2['aid'] == 2
+        >>> assert match2.fm.dtype == match.fm.dtype
+        >>> assert np.all(match2.fm == match.fm)
+        >>> assert np.all(match2.fs == match.fs)
+        >>> assert not np.shares_memory(match2.fs, match2.local_measures['ratio_score'])
+        >>> assert np.all(match2.H_12 == match.H_12) and match2.H_21 is None
+        >>> assert list(match2.local_measures) == list(match.local_measures)
+        >>> assert all(np.all(match2.local_measures[k] == v)
+        >>>            for k, v in match.local_measures.items())
+        >>> assert match2.global_measures == match.global_measures
+        >>> nbytes_old = len(pickle.dumps(match.__getstate__(), protocol=4))
+        >>> print('smaller = %r' % (len(data) < nbytes_old,))
+        smaller = True
+    """
+    header, data = packed_state.pack_state(match_to_state(match))
+    header = header.encode('utf8')
+    pad = (-(_PREAMBLE.size + len(header))) % _ALIGN
+    return b''.join([_PREAMBLE.pack(MAGIC, len(header) + pad), header,
+                     b' ' * pad, data])
+
+
+def decode_match(raw):
+    """ Inverse of :func:`encode_match` """
+    magic, header_len = _PREAMBLE.unpack_from(raw, 0)
+    if magic != MAGIC:
+        raise ValueError('Not an encoded PairwiseMatch')
+    start = _PREAMBLE.size
+    header = bytes(raw[start:start + header_len]).decode('utf8')
+    data = memoryview(raw)[start + header_len:]
+    state = packed_state.unpack_state(header, data)
+    return state_to_match(state)
+
+
+def write_match(fpath, match):
+    """ Writes the encoded match through a temporary file """
+    tmp_fpath = fpath + '.%s.tmp' % (uuid.uuid4().hex,)
+    with open(tmp_fpath, 'wb') as file_:
+        file_.write(encode_match(match))
+    os.replace(tmp_fpath, fpath)
+
+
+def read_match(fpath):
+    """ Reads an encoded match, or a pickled one written by older versions """
+    with open(fpath, 'rb') as file_:
+        raw = file_.read()
+    if raw[:len(MAGIC)] != MAGIC:
+        state = ut.load_data(fpath, verbose=False)
+        match = vt.PairwiseMatch()
+        match.__setstate__(state)
+        return match
+    return decode_match(raw)
+
+
+def testdata_match(num=100, rng=0):
+    """ A random match shaped like the output of PairwiseMatch.apply_all """
+    rng = np.random.RandomState(rng)
+    match = vt.PairwiseMatch({'aid': 1}, {'aid': 2})
+    match.fm = rng.randint(0, 2000, (num, 2)).astype(np.int32)
+    ratio = rng.rand(num)
+    match.local_measures = ut.odict([
+        ('match_dist', rng.rand(num)),
+        ('norm_dist', rng.rand(num)),
+        ('ratio', ratio),
+        ('ratio_score', 1.0 - ratio),
+        ('sver_err_xy', rng.rand(num)),
+        ('sver_err_scale', rng.rand(num)),
+        ('sver_err_ori', rng.rand(num)),
+    ])
+    match.fs = match.local_measures['ratio_score'].copy()
+    match.H_12 = np.eye(3) + rng.rand(3, 3) * .01
+    return match
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.verif.match_codec
+        python -m ibeis.algo.verif.match_codec --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
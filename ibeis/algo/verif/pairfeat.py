@@ -26,7 +26,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import utool as ut
 import vtool_ibeis as vt
 import numpy as np
-import ubelt as ub
 import pandas as pd
 import dtool_ibeis as dt
 from os.path import join
@@ -35,6 +34,20 @@ from ibeis.core_annots import ChipConfig
 print, rrr, profile = ut.inject2(__name__)
 
 
+# Number of uncached edges whose features are computed and saved at a time
+PAIRFEAT_CHUNKSIZE = ut.get_argval('--pairfeat-chunksize', type_=int,
+                                   default=256)
+
+# Annot view attribute holding the value of each global measure
+_GLOBAL_VIEW_ATTRS = {
+    'view': 'viewpoint_int',
+    'yaw': 'yaw',
+    'qual': 'qual',
+    'gps': 'gps',
+    'time': 'time',
+}
+
+
 class PairFeatureConfig(dt.Config):
     """
     Config for building pairwise feature dimensions
@@ -162,11 +175,21 @@ class PairwiseFeatureExtractor(object):
             feats = extr._postprocess_feats(feats)
         return feats
 
-    def _exec_pairwise_match(extr, edges, prog_hook=None):
+    def _exec_pairwise_match(extr, edges, prog_hook=None, preload=True):
         """
         Performs one-vs-one matching between pairs of annotations.
         This establishes the feature correspondences.
 
+        Cached matches only store their aids. The annotation metadata is
+        re-attached as lazy dicts.
+
+        Args:
+            edges (list): aid pairs
+            prog_hook (None): (default = None)
+            preload (bool or list): annot view attributes (e.g. kpts) to load
+                in bulk up front. True loads everything vsone needs and False
+                loads attributes when they are first used. (default = True)
+
         CommandLine:
             python -m ibeis.algo.verif.pairfeat _exec_pairwise_match --show
 
@@ -205,7 +228,6 @@ class PairwiseFeatureExtractor(object):
         from ibeis import core_annots
         config = ut.hashdict(match_config)
         qannot_cfg = dannot_cfg = config
-        preload = True
         configured_lazy_annots = core_annots.make_configured_annots(
             ibs, qaids, daids, qannot_cfg, dannot_cfg, preload=preload)
         for qaid, daid, match in zip(qaids, daids, match_list):
@@ -314,7 +336,12 @@ class PairwiseFeatureExtractor(object):
             raise ValueError('specify global keys')
             # global_keys = ['view_int', 'qual', 'gps', 'time']
             # global_keys = ['view', 'qual', 'gps', 'time']
-        matches = extr._exec_pairwise_match(edges, prog_hook=prog_hook)
+        # Bulk load only the annot attributes the measures below read
+        preload = ['chip_size', 'kpts'] + [
+            _GLOBAL_VIEW_ATTRS[key] for key in extr.global_keys
+            if key in _GLOBAL_VIEW_ATTRS]
+        matches = extr._exec_pairwise_match(edges, prog_hook=prog_hook,
+                                            preload=preload)
         if extr.need_lnbnn:
             extr._enrich_matches_lnbnn(matches, inplace=True)
         if extr.verbose:
@@ -425,16 +452,13 @@ class PairwiseFeatureExtractor(object):
             X[pd.isnull(X)] = (2 ** 30) - 1
         return matches, X
 
-    def _make_cfgstr(extr, edges):
+    def _make_cfgstr(extr):
+        """ Identifies everything other than the edge the features depend on """
         ibs = extr.ibs
-        edge_uuids = ibs.unflat_map(ibs.get_annot_visual_uuids, edges)
-        edge_hashid = ut.hashid_arr(edge_uuids, 'edges')
-
         _cfg_lbl = ut.partial(ut.repr2, si=True, itemsep='', kvsep=':')
         match_configclass = ibs.depc_annot.configclass_dict['pairwise_match']
 
         cfgstr = '_'.join([
-            edge_hashid,
             _cfg_lbl(extr.match_config),
             _cfg_lbl(extr.pairfeat_cfg),
             'global(' + _cfg_lbl(extr.global_keys) + ')',
@@ -442,6 +466,15 @@ class PairwiseFeatureExtractor(object):
         ])
         return cfgstr
 
+    def _make_feat_store(extr):
+        """ Opens the per-edge feature store of this configuration """
+        from ibeis.algo.verif import pairfeat_store
+        cache_dir = join(extr.ibs.get_cachedir(), 'infr_bulk_cache')
+        ut.ensuredir(cache_dir)
+        feat_hashid = ut.hashstr27(extr._make_cfgstr())
+        fpath = join(cache_dir, 'pairfeats_v4_%s.sqlite3' % (feat_hashid,))
+        return pairfeat_store.PairFeatStore(fpath)
+
     def _postprocess_feats(extr, feats):
         # Take the filtered subset of columns
         if extr.feat_dims is not None:
@@ -476,6 +509,12 @@ class PairwiseFeatureExtractor(object):
                 * Pairwise feature construction config
             * Then we can apply the feature to the classifier
 
+        Features are cached per edge, keyed by the visual uuids of its
+        annotations, in a store per configuration (see
+        :class:`ibeis.algo.verif.pairfeat_store.PairFeatStore`). Only edges
+        missing from the store are computed, in chunks that are saved as soon
+        as they are done.
+
         edges = [(1, 2)]
         """
         edges = list(edges)
@@ -489,30 +528,39 @@ class PairwiseFeatureExtractor(object):
             index = nxu.ensure_multi_index([], ('aid1', 'aid2'))
             feats = pd.DataFrame(columns=extr.feat_dims, index=index)
             return feats
+        elif extr.need_lnbnn:
+            # LNBNN enrichment depends on the database, not only on the edge
+            matches, feats = extr._make_pairwise_features(edges)
+            feats = extr._postprocess_feats(feats)
         else:
-            use_cache = not extr.need_lnbnn and len(edges) > 2
-            cache_dir = join(extr.ibs.get_cachedir(), 'infr_bulk_cache')
-            feat_cfgstr = extr._make_cfgstr(edges)
-            cacher = ub.Cacher(
-                'bulk_pairfeats_v3', feat_cfgstr, enabled=use_cache,
-                dpath=cache_dir, verbose=extr.verbose - 3)
-
-            # if cacher.exists() and extr.verbose > 3:
-            #     fpath = cacher.get_fpath()
-            #     print('Load match cache size: {}'.format(
-            #         ut.get_file_nBytes_str(fpath)))
-
-            data = cacher.tryload()
-            if data is None:
-                data = extr._make_pairwise_features(edges)
-                cacher.save(data)
-
-                # if cacher.enabled and extr.verbose > 3:
-                #     fpath = cacher.get_fpath()
-                #     print('Save match cache size: {}'.format(
-                #         ut.get_file_nBytes_str(fpath)))
-
-            matches, feats = data
+            ibs = extr.ibs
+            edge_keys = ibs.unflat_map(ibs.get_annot_visual_uuids, edges)
+            with extr._make_feat_store() as store:
+                hit_flags, hit_feats = store.load_many(edge_keys)
+                miss_edges = ut.unique(
+                    ut.compress(edges, ut.not_list(hit_flags)))
+                if extr.verbose:
+                    print('[pairfeat] Computing {} / {} uncached pairwise '
+                          'features'.format(len(miss_edges), len(edges)))
+                hit_feats.index = nxu.ensure_multi_index(
+                    ut.compress(edges, hit_flags), ('aid1', 'aid2'))
+                parts = [hit_feats]
+                # Save each chunk as soon as it is computed
+                for edge_chunk in ut.ichunks(miss_edges, PAIRFEAT_CHUNKSIZE):
+                    matches, chunk_feats = extr._make_pairwise_features(
+                        edge_chunk)
+                    chunk_keys = ibs.unflat_map(ibs.get_annot_visual_uuids,
+                                                edge_chunk)
+                    store.save_many(chunk_keys, chunk_feats)
+                    parts.append(chunk_feats)
+            feats = pd.concat(parts, sort=False)
+            feats = feats[~feats.index.duplicated()]
+            feats = feats.reindex(
+                nxu.ensure_multi_index(edges, ('aid1', 'aid2')))
+            feats = feats.reindex(sorted(feats.columns), axis=1)
+            if not extr.pairfeat_cfg['use_na']:
+                # Rows computed with different column sets leave holes
+                feats[pd.isnull(feats)] = (2 ** 30) - 1
             feats = extr._postprocess_feats(feats)
         return feats
 
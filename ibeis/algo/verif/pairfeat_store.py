@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Per-edge storage for pairwise feature vectors.
+
+The pairwise features of an edge depend only on its two annotations and on
+the feature configuration. A PairFeatStore keeps the feature rows of one
+configuration in a single SQLite file keyed by the (visual uuid, visual uuid)
+pair of the edge. Any subset of edges can be answered from it, and new rows
+are appended as they are computed.
+
+The columns of a feature row are described once in a ``colset`` table as a
+numpy structured dtype. Each row holds a column set id and the bytes of one
+record, so a bulk load is one ``np.frombuffer`` per column set.
+
+CommandLine:
+    python -m ibeis.algo.verif.pairfeat_store --allexamples
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+import utool as ut
+print, rrr, profile = ut.inject2(__name__)
+
+
+# Values pandas may infer for an object column that can be stored as float64
+_NUMERIC_KINDS = {'empty', 'boolean', 'integer', 'floating',
+                  'mixed-integer-float'}
+
+
+def _record_dtype(feats):
+    """
+    Structured dtype with one field per feature column. Object columns are
+    stored as float64 if they only hold numbers and missing values.
+    """
+    fields = []
+    for name, dtype in zip(feats.columns, feats.dtypes):
+        if pd.api.types.is_object_dtype(dtype):
+            kind = pd.api.types.infer_dtype(feats[name], skipna=True)
+            if kind not in _NUMERIC_KINDS:
+                raise TypeError(
+                    'Cannot store pairwise feature column %r: it holds %s '
+                    'values, not numbers' % (name, kind))
+            dtype = np.dtype(np.float64)
+        elif not pd.api.types.is_numeric_dtype(dtype):
+            raise TypeError(
+                'Cannot store pairwise feature column %r of dtype %s' % (
+                    name, dtype))
+        fields.append((str(name), dtype.str))
+    return fields
+
+
+class PairFeatStore(object):
+    r"""
+    A single SQLite file holding the feature rows of many edges.
+
+    Args:
+        fpath (str): path to the store
+
+    CommandLine:
+        python -m ibeis.algo.verif.pairfeat_store PairFeatStore
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.algo.verif.pairfeat_store import *  # NOQA
+        >>> from os.path import join
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'testfiles')
+        >>> fpath = join(dpath, 'test_pairfeat_store.sqlite3')
+        >>> ut.delete(fpath, verbose=False)
+        >>> feats1 = pd.DataFrame({'len(matches)': [3, 0], 'sum(ratio)': [1.5, 0.]})
+        >>> feats2 = pd.DataFrame({'len(matches)': [7], 'sum(ratio)': [2.5],
+        >>>                        'global(time_delta)': [np.nan]})
+        >>> with PairFeatStore(fpath) as store:
+        >>>     store.save_many([('a', 'b'), ('b', 'c')], feats1)
+        >>>     store.save_many([('a', 'c')], feats2)
+        >>> with PairFeatStore(fpath) as store:
+        >>>     flags, feats = store.load_many([('b', 'c'), ('x', 'y'), ('a', 'c'), ('a', 'b')])
+        >>>     num = len(store)
+        >>> print('num = %r' % (num,))
+        num = 3
+        >>> print('flags = %r' % (flags,))
+        flags = [True, False, True, True]
+        >>> print(feats[['len(matches)', 'sum(ratio)']].values.tolist())
+        [[0.0, 0.0], [7.0, 2.5], [3.0, 1.5]]
+        >>> assert np.isnan(feats['global(time_delta)'].values).all()
+        >>> # Object columns must hold numbers
+        >>> feats3 = pd.DataFrame({'view': [None, 2]}, dtype=object)
+        >>> with PairFeatStore(fpath) as store:
+        >>>     store.save_many([('a', 'd'), ('b', 'd')], feats3)
+        >>>     feats3.loc[0, 'view'] = 'left'
+        >>>     ut.assert_raises(TypeError, store.save_many,
+        >>>                      [('a', 'd'), ('b', 'd')], feats3)
+        >>> ut.delete(fpath, verbose=False)
+    """
+
+    def __init__(store, fpath):
+        store.fpath = fpath
+        store.conn = sqlite3.connect(fpath, timeout=60)
+        store.conn.execute('PRAGMA journal_mode=WAL')
+        store.conn.execute('PRAGMA synchronous=NORMAL')
+        with store.conn:
+            store.conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS colset (
+                    csid  INTEGER PRIMARY KEY,
+                    dtype TEXT NOT NULL UNIQUE
+                )
+                ''')
+            store.conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS pairfeat (
+                    uuid1 TEXT NOT NULL,
+                    uuid2 TEXT NOT NULL,
+                    csid  INTEGER NOT NULL,
+                    data  BLOB NOT NULL,
+                    PRIMARY KEY (uuid1, uuid2)
+                )
+                ''')
+        store._csid_to_dtype = {}
+
+    def __enter__(store):
+        return store
+
+    def __exit__(store, type_, value, trace):
+        store.close()
+
+    def __len__(store):
+        return store.conn.execute('SELECT COUNT(*) FROM pairfeat').fetchone()[0]
+
+    def close(store):
+        if store.conn is not None:
+            store.conn.close()
+            store.conn = None
+
+    def _ensure_colset(store, fields):
+        dtype_text = json.dumps(fields, separators=(',', ':'))
+        store.conn.execute('INSERT OR IGNORE INTO colset (dtype) VALUES (?)',
+                           (dtype_text,))
+        csid = store.conn.execute('SELECT csid FROM colset WHERE dtype=?',
+                                  (dtype_text,)).fetchone()[0]
+        return csid
+
+    def _get_dtype(store, csid):
+        if csid not in store._csid_to_dtype:
+            dtype_text = store.conn.execute(
+                'SELECT dtype FROM colset WHERE csid=?', (csid,)).fetchone()[0]
+            fields = [tuple(field) for field in json.loads(dtype_text)]
+            store._csid_to_dtype[csid] = np.dtype(fields)
+        return store._csid_to_dtype[csid]
+
+    def save_many(store, keys, feats):
+        """
+        Writes (or overwrites) feature rows in one transaction
+
+        Args:
+            keys (list): (uuid1, uuid2) pair for each row of feats
+            feats (pd.DataFrame): one feature vector per row
+        """
+        assert len(keys) == len(feats), 'must have one key per feature row'
+        if len(keys) == 0:
+            return
+        fields = _record_dtype(feats)
+        records = np.empty(len(feats), dtype=np.dtype(fields))
+        for (name, _), column in zip(fields, feats.columns):
+            records[name] = feats[column].values
+        data = records.tobytes()
+        itemsize = records.dtype.itemsize
+        with store.conn:
+            csid = store._ensure_colset(fields)
+            rows = [(str(uuid1), str(uuid2), csid,
+                     sqlite3.Binary(data[x * itemsize:(x + 1) * itemsize]))
+                    for x, (uuid1, uuid2) in enumerate(keys)]
+            store.conn.executemany(
+                'INSERT OR REPLACE INTO pairfeat (uuid1, uuid2, csid, data) '
+                'VALUES (?, ?, ?, ?)', rows)
+
+    def load_many(store, keys):
+        """
+        Args:
+            keys (list): (uuid1, uuid2) pairs
+
+        Returns:
+            tuple: (flags, feats) where flags marks the keys that were found and
+                feats holds their rows in the same order. Columns missing from
+                the column set of a row are NaN.
+        """
+        keys = [(str(uuid1), str(uuid2)) for uuid1, uuid2 in keys]
+        wanted = set(keys)
+        key_to_row = {}
+        unique_uuid1s = sorted({uuid1 for uuid1, _ in wanted})
+        # Stay under the SQLite host parameter limit
+        for chunk in ut.ichunks(unique_uuid1s, 900):
+            query = (
+                'SELECT uuid1, uuid2, csid, data FROM pairfeat '
+                'WHERE uuid1 IN (%s)' % (','.join(['?'] * len(chunk)),))
+            for uuid1, uuid2, csid, data in store.conn.execute(query, chunk):
+                if (uuid1, uuid2) in wanted:
+                    key_to_row[(uuid1, uuid2)] = (csid, data)
+        flags = [key in key_to_row for key in keys]
+        hit_keys = ut.compress(keys, flags)
+
+        # Decode the rows of each column set in bulk
+        hit_csids = [key_to_row[key][0] for key in hit_keys]
+        csid_to_idxs = ut.group_items(range(len(hit_keys)), hit_csids)
+        parts = []
+        for csid, idxs in csid_to_idxs.items():
+            data = b''.join([key_to_row[hit_keys[x]][1] for x in idxs])
+            records = np.frombuffer(data, dtype=store._get_dtype(csid))
+            part = pd.DataFrame.from_records(records)
+            part.index = idxs
+            parts.append(part)
+        if len(parts) == 0:
+            feats = pd.DataFrame(index=pd.RangeIndex(0))
+        else:
+            feats = pd.concat(parts, sort=False).sort_index()
+        return flags, feats
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.algo.verif.pairfeat_store
+        python -m ibeis.algo.verif.pairfeat_store --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
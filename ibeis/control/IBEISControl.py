@@ -112,22 +112,35 @@ python -c "import ibeis" --no-cnn
 UTOOL_NO_CNN=True python -c "import ibeis"
 """
 
-for modname in ut.ProgIter(AUTOLOAD_PLUGIN_MODNAMES, 'loading plugins',
-                           enabled=ut.VERYVERBOSE, adjust=False, freq=1):
-    if isinstance(modname, tuple):
-        flag, modname = modname
-        if ut.get_argflag(flag):
-            continue
-    try:
-        # ut.import_modname(modname)
-        ub.import_module_from_name(modname)
-    except ImportError:
-        if 'ibeis_cnn' in modname:
-            pass
-            # import warnings
-            # warnings.warn('Unable to load plugin: {!r}'.format(modname))
-        else:
-            raise
+_PLUGINS_LOADED = False
+
+
+def load_plugin_modules():
+    """
+    Imports the AUTOLOAD_PLUGIN_MODNAMES modules, which register methods
+    that are injected into every controller.
+
+    This happens when the first controller is created rather than when this
+    module is imported, so importing ibeis does not pull in flask, the web
+    apis and the depcache preprocessors.
+    """
+    global _PLUGINS_LOADED
+    if _PLUGINS_LOADED:
+        return
+    for modname in ut.ProgIter(AUTOLOAD_PLUGIN_MODNAMES, 'loading plugins',
+                               enabled=ut.VERYVERBOSE, adjust=False, freq=1):
+        if isinstance(modname, tuple):
+            flag, modname = modname
+            if ut.get_argflag(flag):
+                continue
+        try:
+            ub.import_module_from_name(modname)
+        except ImportError:
+            if 'ibeis_cnn' in modname:
+                pass
+            else:
+                raise
+    _PLUGINS_LOADED = True
 
 
 # NOTE: new plugin code needs to be hacked in here currently
@@ -294,6 +307,9 @@ class IBEISController(BASE_CLASS):
         ibs.observer_weakref_list = []
         # not completely working decorator cache
         ibs.table_cache = None
+        # Serve feat / featweight arrays from memory mapped column segments
+        ibs.use_columnar_feats = ut.get_argflag('--columnar-feats')
+        ibs._columnar_stores = {}
         ibs._initialize_self()
         ibs._init_dirs(dbdir=dbdir, ensure=ensure)
         # _send_wildbook_request will do nothing if no wildbook address is
@@ -318,7 +334,23 @@ class IBEISController(BASE_CLASS):
         print('[ibs.__init__] END new IBEISController\n')
 
     def reset_table_cache(ibs):
+        old_cache = ibs.table_cache
         ibs.table_cache = accessor_decors.init_tablecache()
+        if old_cache is not None:
+            # Keep the budgets set with set_table_cache_budget
+            ibs.table_cache.set_budget(max_entries=old_cache.max_entries,
+                                       max_bytes=old_cache.max_bytes)
+            for tblname, budget in old_cache.budgets.items():
+                ibs.table_cache.set_budget(tblname, *budget)
+
+    def set_table_cache_budget(ibs, tablename=None, max_entries=None,
+                               max_bytes=None):
+        """
+        Bounds the number of cached rows / bytes of one table (or of every
+        table if tablename is None). None means unbounded.
+        """
+        ibs.table_cache.set_budget(tablename, max_entries=max_entries,
+                                   max_bytes=max_bytes)
 
     def clear_table_cache(ibs, tablename=None):
         print('[ibs] clearing table_cache[%r]' % (tablename,))
@@ -387,14 +419,31 @@ class IBEISController(BASE_CLASS):
 
     def get_cachestats_str(ibs):
         """
-        Returns info about the underlying SQL cache memory
+        Returns info about the underlying SQL cache memory and the hit, miss
+        and eviction counters of each table
+
+        Example:
+            >>> # ENABLE_DOCTEST
+            >>> from ibeis.control.IBEISControl import *  # NOQA
+            >>> import ibeis
+            >>> ibs = ibeis.opendb('testdb1')
+            >>> ibs.table_cache['annotations']['name_rowid'][None][1] = 2
+            >>> print(ibs.get_cachestats_str())
         """
-        total_size_str = ut.get_object_size_str(ibs.table_cache,
-                                                lbl='size(table_cache): ')
         total_size_str = '\nlen(table_cache) = %r' % (len(ibs.table_cache))
-        table_size_str_list = [
-            ut.get_object_size_str(val, lbl='size(table_cache[%s]): ' % (key,))
-            for key, val in six.iteritems(ibs.table_cache)]
+        table_size_str_list = []
+        for key, stats in sorted(ibs.table_cache.get_stats().items()):
+            num_lookups = stats['hits'] + stats['misses']
+            hit_rate = stats['hits'] / num_lookups if num_lookups else 0.0
+            table_size_str_list.append(
+                'table_cache[%s]: entries=%d/%s, nbytes=%s/%s, hits=%d, '
+                'misses=%d, hit_rate=%.2f, evictions=%d' % (
+                    key, stats['entries'], stats['max_entries'],
+                    ut.byte_str2(stats['nbytes']),
+                    (None if stats['max_bytes'] is None else
+                     ut.byte_str2(stats['max_bytes'])),
+                    stats['hits'], stats['misses'], hit_rate,
+                    stats['evictions']))
         cachestats_str = (
             total_size_str + ut.indentjoin(table_size_str_list, '\n  * '))
         return cachestats_str
@@ -414,6 +463,7 @@ class IBEISController(BASE_CLASS):
         if ut.VERBOSE:
             print('[ibs] _initialize_self()')
         ibs.reset_table_cache()
+        load_plugin_modules()
         ut.util_class.inject_all_external_modules(
             ibs, controller_inject.CONTROLLER_CLASSNAME,
             allow_override=ibs.allow_override)
@@ -756,6 +806,9 @@ class IBEISController(BASE_CLASS):
         ibs.depc_part.initialize()
 
     def _close_depcache(ibs):
+        for store in ibs._columnar_stores.values():
+            store.close()
+        ibs._columnar_stores = {}
         ibs.depc_image.close()
         ibs.depc_image = None
         ibs.depc_annot.close()
@@ -1,6 +1,13 @@
+import sys
+import numpy as np
 import utool as ut
 import ubelt as ub
 import builtins
+from collections import OrderedDict
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 from ibeis.util import util_decor
 from utool._internal.meta_util_six import get_funcname
 print, rrr, profile = ut.inject2(__name__)
@@ -15,6 +22,12 @@ DEBUG_API_CACHE = False
 API_CACHE = False
 ASSERT_API_CACHE = False
 
+# Default budget of each table in the table_cache. None means unbounded.
+TABLE_CACHE_MAX_ENTRIES = ut.get_argval('--table-cache-entries', type_=int,
+                                        default=2 ** 17)
+TABLE_CACHE_MAX_BYTES = ut.get_argval('--table-cache-bytes', type_=int,
+                                      default=None)
+
 
 if ut.VERBOSE:
     if ut.in_main_process():
@@ -44,10 +57,11 @@ def default_decorator(input_):
 # DECORATORS::ADDER
 
 
-def init_tablecache():
+def init_tablecache(max_entries=TABLE_CACHE_MAX_ENTRIES,
+                    max_bytes=TABLE_CACHE_MAX_BYTES):
     r"""
     Returns:
-       defaultdict: tablecache
+       TableCache: tablecache
 
     CommandLine:
         python -m ibeis.control.accessor_decors init_tablecache
@@ -60,11 +74,401 @@ def init_tablecache():
     """
     # 4 levels of dictionaries
     # tablename, colname, kwargs, and then rowids
-    tablecache = ub.ddict(lambda: ub.ddict(lambda: ub.ddict(dict)))
+    tablecache = TableCache(max_entries=max_entries, max_bytes=max_bytes)
     return tablecache
 
 
-def cache_getter(tblname, colname=None, cfgkeys=None, force=False, debug=False):
+def _estimate_nbytes(val):
+    """ cheap estimate of the memory held by a cached value """
+    if hasattr(val, 'nbytes'):
+        return int(val.nbytes)
+    nbytes = sys.getsizeof(val)
+    if isinstance(val, (list, tuple)):
+        nbytes += sum(getattr(item, 'nbytes', None) or sys.getsizeof(item)
+                      for item in val)
+    return nbytes
+
+
+class TableCache(dict):
+    """
+    Maps a tablename to the TableColumnCache that holds all cached columns of
+    that table. Each table is bounded by its own entry / byte budget.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.control.accessor_decors import *  # NOQA
+        >>> table_cache = TableCache(max_entries=3)
+        >>> cache_ = table_cache['annotations']['name_rowid'][None]
+        >>> cache_[1], cache_[2], cache_[3] = 10, 20, 30
+        >>> assert cache_.get(1) == 10
+        >>> cache_[4] = 40
+        >>> # rowid 2 was the least recently used
+        >>> assert sorted(cache_.keys()) == [1, 3, 4]
+        >>> assert cache_.get(2) is None
+        >>> other_ = table_cache['annotations']['species_rowid'][None]
+        >>> other_[1] = 1
+        >>> # the budget is shared by all columns of a table
+        >>> assert sorted(cache_.keys()) == [1, 4]
+        >>> stats = table_cache.get_stats()['annotations']
+        >>> keys = ['entries', 'hits', 'misses', 'evictions']
+        >>> print(ut.repr2(ut.dict_subset(stats, keys), nl=0))
+        {'entries': 3, 'hits': 1, 'misses': 1, 'evictions': 2}
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        super(TableCache, self).__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.budgets = {}
+
+    def __missing__(self, tblname):
+        max_entries, max_bytes = self.budgets.get(
+            tblname, (self.max_entries, self.max_bytes))
+        table = self[tblname] = TableColumnCache(
+            tblname, max_entries=max_entries, max_bytes=max_bytes)
+        return table
+
+    def set_budget(self, tblname=None, max_entries=None, max_bytes=None):
+        """
+        Sets the budget of one table, or the default of every table if
+        tblname is None. Existing tables are shrunk to the new budget.
+        """
+        if tblname is None:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.budgets.clear()
+            tables = list(self.values())
+        else:
+            self.budgets[tblname] = (max_entries, max_bytes)
+            tables = [self[tblname]]
+        for table in tables:
+            table.max_entries = max_entries
+            table.max_bytes = max_bytes
+            table._evict()
+
+    def get_stats(self):
+        return {tblname: table.get_stats() for tblname, table in self.items()}
+
+    def __repr__(self):
+        return '<TableCache(ntables=%d)>' % (len(self),)
+
+
+class TableColumnCache(dict):
+    """
+    Maps a colname to a dict of kwargs_hash -> RowidCache for one table.
+    Keeps a single least recently used order over every cached rowid of the
+    table and evicts from it when the table goes over budget.
+    """
+    def __init__(self, tblname, max_entries=None, max_bytes=None):
+        super(TableColumnCache, self).__init__()
+        self.tblname = tblname
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # (colname, kwargs_hash, rowid) -> nbytes in least recently used order
+        self.lru = OrderedDict()
+        self.nbytes = 0
+        # memory of the dense ArrayRowidCaches of this table
+        self.array_nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __missing__(self, colname):
+        kwargs_cache_ = self[colname] = _KwargsCache(self, colname)
+        return kwargs_cache_
+
+    def __delitem__(self, colname):
+        for cache_ in self[colname].values():
+            cache_.clear()
+        super(TableColumnCache, self).__delitem__(colname)
+
+    def _over_bytes(self):
+        return (self.max_bytes is not None and
+                self.nbytes + self.array_nbytes > self.max_bytes)
+
+    def _evict(self):
+        while self.lru and (
+                (self.max_entries is not None and
+                 len(self.lru) > self.max_entries) or self._over_bytes()):
+            (colname, kwargs_hash, rowid), nbytes = self.lru.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+            cache_ = self[colname][kwargs_hash]
+            del cache_._data[rowid]
+        if self._over_bytes():
+            for cache_ in self._array_caches():
+                cache_.release()
+
+    def _array_caches(self):
+        return [cache_ for kwargs_cache_ in self.values()
+                for cache_ in kwargs_cache_.values()
+                if isinstance(cache_, ArrayRowidCache)]
+
+    def get_stats(self):
+        array_caches = self._array_caches()
+        num_array_entries = sum(len(cache_) for cache_ in array_caches)
+        return OrderedDict([
+            ('entries', len(self.lru) + num_array_entries),
+            ('nbytes', self.nbytes + self.array_nbytes),
+            ('hits', self.hits),
+            ('misses', self.misses),
+            ('evictions', self.evictions),
+            ('max_entries', self.max_entries),
+            ('max_bytes', self.max_bytes),
+        ])
+
+
+class _KwargsCache(dict):
+    """
+    kwargs_hash -> RowidCache for one column. If dtype is set the column is
+    scalar and ArrayRowidCaches are used instead.
+    """
+    def __init__(self, table, colname):
+        super(_KwargsCache, self).__init__()
+        self.table = table
+        self.colname = colname
+        self.dtype = None
+
+    def __missing__(self, kwargs_hash):
+        if self.dtype is None:
+            cache_ = RowidCache(self.table, (self.colname, kwargs_hash))
+        else:
+            cache_ = ArrayRowidCache(self.table, self.dtype)
+        self[kwargs_hash] = cache_
+        return cache_
+
+
+class RowidCache(MutableMapping):
+    """
+    rowid -> value cache of one column / kwargs configuration. Reads refresh
+    the rowid in the table's least recently used order and writes may evict
+    the least recently used rowids of the table.
+    """
+    def __init__(self, table, key):
+        self.table = table
+        self.key = key
+        self._data = {}
+
+    def get(self, rowid, default=None):
+        table = self.table
+        try:
+            val = self._data[rowid]
+        except KeyError:
+            table.misses += 1
+            return default
+        table.hits += 1
+        table.lru.move_to_end(self.key + (rowid,))
+        return val
+
+    def __getitem__(self, rowid):
+        return self._data[rowid]
+
+    def __setitem__(self, rowid, val):
+        table = self.table
+        lrukey = self.key + (rowid,)
+        nbytes = _estimate_nbytes(val)
+        table.nbytes += nbytes - table.lru.pop(lrukey, 0)
+        table.lru[lrukey] = nbytes
+        self._data[rowid] = val
+        table._evict()
+
+    def __delitem__(self, rowid):
+        del self._data[rowid]
+        self.table.nbytes -= self.table.lru.pop(self.key + (rowid,))
+
+    def clear(self):
+        for rowid in list(self._data.keys()):
+            del self[rowid]
+
+    def __contains__(self, rowid):
+        return rowid in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def delete_rowids(self, rowid_list):
+        for rowid in rowid_list:
+            if rowid in self._data:
+                del self[rowid]
+
+    def __repr__(self):
+        return repr(self._data)
+
+
+class ArrayRowidCache(MutableMapping):
+    """
+    rowid -> value cache of a scalar column backed by a value array indexed
+    by rowid and a validity bitmap. Lookups and fills of whole rowid lists
+    are vectorized. Like RowidCache, None values are never cached.
+
+    Array caches are dense, so they are not part of the table's least
+    recently used order and are never evicted row by row. Their memory is
+    (itemsize + 1) bytes per rowid up to the largest cached rowid and counts
+    against the table's byte budget. If evicting every row of the least
+    recently used order does not bring the table under budget, the array
+    caches of the table are released as a whole.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.control.accessor_decors import *  # NOQA
+        >>> table_cache = TableCache()
+        >>> kwargs_cache_ = table_cache['annotations']['annot_yaw']
+        >>> kwargs_cache_.dtype = np.float64
+        >>> cache_ = kwargs_cache_[None]
+        >>> getter = lambda rowids: [None if r == 3 else r / 2 for r in rowids]
+        >>> vals_list1 = cache_.take_or_compute([1, 5, 3, 1], getter)
+        >>> vals_list2 = cache_.take_or_compute([5, 3, 40], getter)
+        >>> print(vals_list1, vals_list2)
+        [0.5, 2.5, None, 0.5] [2.5, None, 20.0]
+        >>> cache_.delete_rowids([5])
+        >>> print(sorted(cache_.keys()), cache_.get(1), cache_.get(5))
+        [1, 40] 0.5 None
+        >>> print(sorted(cache_.values()))
+        [0.5, 20.0]
+        >>> # Values of negative rowids are returned but never cached
+        >>> print(cache_.take_or_compute([-1, -2], getter), len(cache_))
+        [-0.5, -1.0] 2
+        >>> # Going over the byte budget releases the arrays
+        >>> table_cache.set_budget('annotations', max_bytes=cache_.nbytes)
+        >>> vals_list3 = cache_.take_or_compute([1, 5000], getter)
+        >>> print(vals_list3, len(cache_), table_cache.get_stats()['annotations']['nbytes'])
+        [0.5, 2500.0] 0 0
+    """
+    def __init__(self, table, dtype, capacity=64):
+        self.table = table
+        self.dtype = np.dtype(dtype)
+        self._values = np.zeros(capacity, dtype=self.dtype)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.table.array_nbytes += self.nbytes
+
+    @property
+    def nbytes(self):
+        return self._values.nbytes + self.valid.nbytes
+
+    def _resize(self, capacity):
+        old_nbytes = self.nbytes
+        values = np.zeros(capacity, dtype=self.dtype)
+        valid = np.zeros(capacity, dtype=bool)
+        num = min(capacity, len(self.valid))
+        values[0:num] = self._values[0:num]
+        valid[0:num] = self.valid[0:num]
+        self._values = values
+        self.valid = valid
+        self.table.array_nbytes += self.nbytes - old_nbytes
+
+    def _ensure_capacity(self, max_rowid):
+        if max_rowid >= len(self.valid):
+            self._resize(max(max_rowid + 1, 2 * len(self.valid)))
+
+    def release(self):
+        """ drops every cached value and frees the arrays """
+        self.table.evictions += len(self)
+        self._resize(0)
+
+    def _lookup(self, rowids):
+        """ returns flags marking which rowids are cached """
+        ishit = np.zeros(len(rowids), dtype=bool)
+        inbounds = (rowids >= 0) & (rowids < len(self.valid))
+        ishit[inbounds] = self.valid[rowids[inbounds]]
+        return ishit
+
+    def _store(self, rowids, vals_list):
+        notnone = np.array([val is not None for val in vals_list],
+                           dtype=bool)
+        if np.any(notnone):
+            store_rowids = rowids[notnone & (rowids >= 0)]
+            if store_rowids.size == 0:
+                # every value belongs to a negative rowid
+                return
+            store_vals = [val for val, flag, rowid in
+                          zip(vals_list, notnone, rowids)
+                          if flag and rowid >= 0]
+            self._ensure_capacity(int(store_rowids.max()))
+            self._values[store_rowids] = np.array(store_vals, dtype=self.dtype)
+            self.valid[store_rowids] = True
+            self.table._evict()
+
+    def take_or_compute(self, rowid_list, getter):
+        """
+        Returns the cached values of rowid_list. The missing values are
+        computed with getter(miss_rowid_list) and cached.
+        """
+        table = self.table
+        rowids = np.asarray(rowid_list)
+        if rowids.dtype.kind not in 'iu':
+            # rowids with Nones cannot index the arrays
+            table.misses += len(rowids)
+            return getter(list(rowid_list))
+        ishit = self._lookup(rowids)
+        num_hit = int(ishit.sum())
+        table.hits += num_hit
+        table.misses += len(rowids) - num_hit
+        if num_hit == len(rowids):
+            return self._values[rowids].tolist()
+        ismiss = ~ishit
+        # Read the hits first, storing the misses may evict them
+        hit_vals = self._values[rowids[ishit]].tolist()
+        miss_rowids = rowids[ismiss]
+        miss_vals = getter(miss_rowids.tolist())
+        self._store(miss_rowids, miss_vals)
+        if num_hit == 0:
+            return list(miss_vals)
+        vals_arr = np.empty(len(rowids), dtype=object)
+        vals_arr[ishit] = hit_vals
+        miss_vals_arr = np.empty(len(miss_rowids), dtype=object)
+        miss_vals_arr[:] = list(miss_vals)
+        vals_arr[ismiss] = miss_vals_arr
+        return vals_arr.tolist()
+
+    def get(self, rowid, default=None):
+        table = self.table
+        if 0 <= rowid < len(self.valid) and self.valid[rowid]:
+            table.hits += 1
+            return self._values[rowid].item()
+        table.misses += 1
+        return default
+
+    def __getitem__(self, rowid):
+        if 0 <= rowid < len(self.valid) and self.valid[rowid]:
+            return self._values[rowid].item()
+        raise KeyError(rowid)
+
+    def __setitem__(self, rowid, val):
+        self._store(np.array([rowid]), [val])
+
+    def __delitem__(self, rowid):
+        if rowid not in self:
+            raise KeyError(rowid)
+        self.valid[rowid] = False
+
+    def delete_rowids(self, rowid_list):
+        rowids = np.asarray(rowid_list)
+        if rowids.dtype.kind not in 'iu':
+            rowids = np.array([rowid for rowid in rowid_list
+                               if rowid is not None], dtype=np.int64)
+        self.valid[rowids[(rowids >= 0) & (rowids < len(self.valid))]] = False
+
+    def clear(self):
+        self.valid[:] = False
+
+    def __contains__(self, rowid):
+        return (isinstance(rowid, (int, np.integer)) and
+                0 <= rowid < len(self.valid) and bool(self.valid[rowid]))
+
+    def __iter__(self):
+        return iter(np.nonzero(self.valid)[0].tolist())
+
+    def __len__(self):
+        return int(self.valid.sum())
+
+    def __repr__(self):
+        return '<ArrayRowidCache(dtype=%s, len=%d)>' % (self.dtype, len(self))
+
+
+def cache_getter(tblname, colname=None, cfgkeys=None, force=False, debug=False,
+                 dtype=None):
     """
     Creates a getter cacher
     the class must have a table_cache property
@@ -73,6 +477,8 @@ def cache_getter(tblname, colname=None, cfgkeys=None, force=False, debug=False):
     Args:
         tblname (str):
         colname (str):
+        dtype (type): if specified the column is scalar and is cached in a
+            value array indexed by rowid (see ArrayRowidCache)
 
     Returns:
         function: closure_getter_cacher
@@ -209,7 +615,14 @@ def cache_getter(tblname, colname=None, cfgkeys=None, force=False, debug=False):
             )
             # There are 3 levels of caches
             # All caches for this table, caches for the this column, and caches for this kwargs configuration
-            cache_ = ibs.table_cache[tblname][colname][kwargs_hash]
+            kwargs_cache_ = ibs.table_cache[tblname][colname]
+            if dtype is not None:
+                kwargs_cache_.dtype = dtype
+                cache_ = kwargs_cache_[kwargs_hash]
+                return cache_.take_or_compute(
+                    rowid_list, lambda miss_rowids: getter_func(
+                        ibs, miss_rowids, **kwargs))
+            cache_ = kwargs_cache_[kwargs_hash]
             # Load cached values for each rowid
             vals_list = [cache_.get(rowid, None) for rowid in rowid_list]
             # Mark rowids with cache misses
@@ -223,6 +636,72 @@ def cache_getter(tblname, colname=None, cfgkeys=None, force=False, debug=False):
     return closure_getter_cacher
 
 
+def benchmark_cache_getter(dbname='testdb1', num=500000):
+    r"""
+    Times the annotation and name accessors without a cache, with the dict
+    cache, and with the array cache (scalar columns only).
+
+    CommandLine:
+        python -m ibeis.control.accessor_decors benchmark_cache_getter
+        python -m ibeis.control.accessor_decors benchmark_cache_getter --db PZ_MTEST --num 500000
+
+    Example:
+        >>> # SCRIPT
+        >>> from ibeis.control.accessor_decors import *  # NOQA
+        >>> dbname = ut.get_argval('--db', default='testdb1')
+        >>> num = ut.get_argval('--num', type_=int, default=500000)
+        >>> result = benchmark_cache_getter(dbname, num)
+        >>> print(result)
+    """
+    import ibeis
+    from ibeis import constants as const
+    ibs = ibeis.opendb(dbname)
+    aid_list = ibs.get_valid_aids()
+    nid_list = ibs.get_valid_nids()
+    # (getter name, rowids, tblname, colname, cfgkeys, dtype)
+    bench_specs = [
+        ('get_annot_name_rowids', aid_list, const.ANNOTATION_TABLE,
+         'name_rowid', ['distinguish_unknowns'], np.int64),
+        ('get_annot_species_rowids', aid_list, const.ANNOTATION_TABLE,
+         'species_rowid', None, np.int64),
+        ('get_annot_yaws', aid_list, const.ANNOTATION_TABLE, 'annot_yaw',
+         None, np.float64),
+        ('get_annot_qualities', aid_list, const.ANNOTATION_TABLE,
+         'annot_quality', None, np.int64),
+        ('get_annot_visual_uuids', aid_list, const.ANNOTATION_TABLE,
+         'annot_visual_uuid', None, None),
+        ('get_name_sex', nid_list, const.NAME_TABLE, 'name_sex', None,
+         np.int64),
+        ('get_name_aids', nid_list, const.NAME_TABLE, 'annot_rowid', None,
+         None),
+    ]
+    results = ut.odict()
+    for funcname, rowids, tblname, colname, cfgkeys, dtype in bench_specs:
+        getter_func = ut.get_method_func(getattr(ibs, funcname))
+        rowid_list = (rowids * int(np.ceil(num / len(rowids))))[0:num]
+        modes = [('uncached', getter_func)]
+        modes.append(('dict', cache_getter(tblname, colname, cfgkeys,
+                                           force=True)(getter_func)))
+        if dtype is not None:
+            modes.append(('array', cache_getter(tblname, colname, cfgkeys,
+                                                force=True,
+                                                dtype=dtype)(getter_func)))
+        expected = getter_func(ibs, rowid_list)
+        for mode, func in modes:
+            ibs.reset_table_cache()
+            ibs.set_table_cache_budget(max_entries=None)
+            # Warm the cache
+            assert func(ibs, rowid_list) == expected
+            timer = ut.Timerit(3, label='%s %s' % (funcname, mode),
+                               verbose=0)
+            for _ in timer:
+                func(ibs, rowid_list)
+            results[(funcname, mode)] = timer.min()
+            print('%s %s: %.4fs' % (funcname, mode, timer.min()))
+    ibs.reset_table_cache()
+    return ut.repr2(results, precision=4)
+
+
 def cache_invalidator(tblname, colnames=None, rowidx=None, force=False):
     """ cacher decorator
 
@@ -271,7 +750,7 @@ def cache_invalidator(tblname, colnames=None, rowidx=None, force=False):
                     # We know the rowids to delete
                     # iterate over all getter kwargs values
                     for cache_ in kwargs_cache_.values():
-                        ut.delete_dict_keys(cache_, rowid_list)
+                        cache_.delete_rowids(rowid_list)
 
             # Preform set/delete action
             if DEBUG_API_CACHE:
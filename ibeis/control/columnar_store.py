@@ -0,0 +1,479 @@
+"""
+Append-only columnar storage for the ndarray columns of a depcache table.
+
+The depcache stores every row of the ``feat`` and ``featweight`` tables as a
+pickled blob in SQLite, so a bulk read of all database descriptors unpickles
+one blob per annotation. A ColumnarStore keeps the same rows as contiguous
+``.npy`` segment files (one file per column per segment) plus an offsets
+table keyed by the depcache rowid. A bulk read then becomes one memory-mapped
+slice per row out of a handful of segments.
+
+Rows are copied from the depcache the first time they are requested. Each
+stored row carries a fingerprint (by default its parent rowids, config,
+length and root uuid). On every read the fingerprint is compared with the
+depcache table, so rows that were deleted or recomputed are read from the
+depcache again. Segments are never modified; a replaced row leaves dead bytes behind.
+Once a store holds more than ``max_segments`` segments,
+:meth:`ColumnarStore.compact` rewrites the live rows into a single segment.
+
+CommandLine:
+    python -m ibeis.control.columnar_store --allexamples
+"""
+import os
+import sqlite3
+import uuid
+import numpy as np
+import utool as ut
+from os.path import join
+print, rrr, profile = ut.inject2(__name__)
+
+
+OFFSETS_FNAME = 'offsets.sqlite3'
+
+
+class ColumnarStore(object):
+    r"""
+    Args:
+        dpath (str): directory holding the segments and the offsets table
+        colnames (tuple): names of the ndarray columns stored per row. All
+            columns of a row must have the same length along axis 0.
+        fetch_func (func): maps a list of rowids to a list of tuples with one
+            ndarray per column. Used to fill rows that are missing or stale.
+        fingerprint_func (func): maps a list of rowids to a list of hashable
+            values that change whenever the row content may have changed.
+            Defaults to None, which never invalidates a stored row.
+        max_segments (int): compact the store when a fill makes it hold more
+            segments than this. None disables compaction. (default = 32)
+
+    CommandLine:
+        python -m ibeis.control.columnar_store ColumnarStore
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.control.columnar_store import *  # NOQA
+        >>> import numpy as np
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'testfiles', 'colstore')
+        >>> ut.delete(dpath, verbose=False)
+        >>> rng = np.random.RandomState(0)
+        >>> table = {rowid: (rng.rand(rowid, 6), rng.randint(0, 255, (rowid, 4)))
+        >>>          for rowid in range(1, 9)}
+        >>> num_fetched = []
+        >>> def fetch_func(rowids):
+        >>>     num_fetched.append(len(rowids))
+        >>>     return [table[rowid] for rowid in rowids]
+        >>> def fingerprint_func(rowids):
+        >>>     return [len(table[rowid][0]) for rowid in rowids]
+        >>> store = ColumnarStore(dpath, ('kpts', 'vecs'), fetch_func,
+        >>>                       fingerprint_func)
+        >>> vecs_list = store.get([3, 1, None, 3], 'vecs')
+        >>> assert vecs_list[2] is None
+        >>> assert np.all(vecs_list[0] == table[3][1])
+        >>> assert isinstance(store.get([3], 'vecs', copy=False)[0], np.memmap)
+        >>> kpts_list = store.get([1, 2, 3, 4], 'kpts')
+        >>> assert all([np.all(k == table[r][0]) for k, r in zip(kpts_list, [1, 2, 3, 4])])
+        >>> # A recomputed row is detected by its fingerprint
+        >>> table[2] = (rng.rand(5, 6), rng.randint(0, 255, (5, 4)))
+        >>> assert np.all(store.get([2], 'vecs')[0] == table[2][1])
+        >>> # Reopening the store reads the offsets back from disk
+        >>> store.close()
+        >>> store = ColumnarStore(dpath, ('kpts', 'vecs'), fetch_func,
+        >>>                       fingerprint_func)
+        >>> assert np.all(store.get([2], 'kpts')[0] == table[2][0])
+        >>> # Returned rows are copies unless copy=False is given
+        >>> kpts_list[0][:] = 0
+        >>> assert np.all(store.get([1], 'kpts')[0] == table[1][0])
+        >>> print('num_fetched = %r' % (num_fetched,))
+        >>> print('num_segments = %r' % (store.get_num_segments(),))
+        num_fetched = [2, 2, 1]
+        num_segments = 3
+        >>> # Compaction keeps the live rows and drops the replaced one
+        >>> store.compact()
+        >>> print('num_segments = %r' % (store.get_num_segments(),))
+        num_segments = 1
+        >>> vecs_list = store.get(list(range(1, 5)), 'vecs')
+        >>> assert all([np.all(v == table[r][1]) for v, r in zip(vecs_list, range(1, 5))])
+        >>> assert num_fetched == [2, 2, 1]
+        >>> store.close()
+        >>> ut.delete(dpath, verbose=False)
+    """
+
+    def __init__(store, dpath, colnames, fetch_func, fingerprint_func=None,
+                 max_segments=32):
+        store.dpath = dpath
+        store.colnames = tuple(colnames)
+        store.fetch_func = fetch_func
+        store.fingerprint_func = fingerprint_func
+        store.max_segments = max_segments
+        # Segment files are immutable, so their maps can be kept open
+        store._column_cache = {}
+        ut.ensuredir(dpath)
+        store.fpath = join(dpath, OFFSETS_FNAME)
+        store.conn = sqlite3.connect(store.fpath, timeout=60,
+                                     check_same_thread=False)
+        store.conn.execute('PRAGMA journal_mode=WAL')
+        store.conn.execute('PRAGMA synchronous=NORMAL')
+        with store.conn:
+            store.conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS segments (
+                    segment_id INTEGER PRIMARY KEY,
+                    num_rows   INTEGER NOT NULL
+                )
+                ''')
+            store.conn.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS offsets (
+                    rowid       INTEGER PRIMARY KEY,
+                    segment_id  INTEGER NOT NULL,
+                    start       INTEGER NOT NULL,
+                    stop        INTEGER NOT NULL,
+                    fingerprint TEXT
+                )
+                ''')
+
+    def __repr__(store):
+        return '<ColumnarStore(%r, %r)>' % (store.dpath, store.colnames)
+
+    def close(store):
+        store._column_cache = {}
+        if store.conn is not None:
+            store.conn.close()
+            store.conn = None
+
+    def clear(store):
+        """ Removes every stored row and segment file """
+        store._column_cache = {}
+        with store.conn:
+            segment_ids = [row[0] for row in store.conn.execute(
+                'SELECT segment_id FROM segments')]
+            store.conn.execute('DELETE FROM offsets')
+            store.conn.execute('DELETE FROM segments')
+        for segment_id in segment_ids:
+            for colname in store.colnames:
+                ut.delete(store._segment_fpath(segment_id, colname),
+                          verbose=False)
+
+    def compact(store):
+        """
+        Rewrites the live rows of every segment into one new segment and
+        deletes the old segment files. Rows keep their rowids and
+        fingerprints; the bytes of replaced rows are dropped.
+
+        The write lock of the offsets table is held from the first read to
+        the last update, so rows appended by other processes are never
+        overwritten or dropped.
+        """
+        store.conn.execute('BEGIN IMMEDIATE')
+        new_fpaths = []
+        try:
+            old_segment_ids = [row[0] for row in store.conn.execute(
+                'SELECT segment_id FROM segments')]
+            if len(old_segment_ids) == 0:
+                store.conn.rollback()
+                return
+            entries = store.conn.execute(
+                'SELECT rowid, segment_id, start, stop FROM offsets '
+                'ORDER BY segment_id, start').fetchall()
+            lens = np.array([stop - start for _, _, start, stop in entries],
+                            dtype=np.int64)
+            stops = np.cumsum(lens)
+            starts = stops - lens
+            cur = store.conn.execute(
+                'INSERT INTO segments (num_rows) VALUES (?)', (len(entries),))
+            segment_id = cur.lastrowid
+            for colname in store.colnames:
+                # Only the dtype and row shape of the column are needed here
+                proto = store._load_column(old_segment_ids[0], colname)
+                shape = (int(lens.sum()),) + proto.shape[1:]
+                fpath = store._segment_fpath(segment_id, colname)
+                tmp_fpath = fpath + '.%s.tmp' % (uuid.uuid4().hex,)
+                # Fill the new segment through a map so no column is ever held
+                # in memory as a whole
+                out = np.lib.format.open_memmap(tmp_fpath, mode='w+',
+                                                dtype=proto.dtype, shape=shape)
+                for (_, old_id, old_start, old_stop), start, stop in zip(
+                        entries, starts, stops):
+                    data = store._load_column(old_id, colname)
+                    out[start:stop] = data[old_start:old_stop]
+                out.flush()
+                del out
+                os.replace(tmp_fpath, fpath)
+                new_fpaths.append(fpath)
+            store.conn.executemany(
+                'UPDATE offsets SET segment_id=?, start=?, stop=? '
+                'WHERE rowid=?',
+                [(segment_id, int(start), int(stop), rowid)
+                 for (rowid, _, _, _), start, stop in zip(
+                     entries, starts, stops)])
+            store.conn.executemany(
+                'DELETE FROM segments WHERE segment_id=?',
+                [(old_id,) for old_id in old_segment_ids])
+        except Exception:
+            store.conn.rollback()
+            for fpath in new_fpaths:
+                ut.delete(fpath, verbose=False)
+            raise
+        else:
+            store.conn.commit()
+        store._column_cache = {}
+        for old_id in old_segment_ids:
+            for colname in store.colnames:
+                ut.delete(store._segment_fpath(old_id, colname),
+                          verbose=False)
+
+    def get_num_segments(store):
+        return store.conn.execute('SELECT COUNT(*) FROM segments').fetchone()[0]
+
+    def _segment_fpath(store, segment_id, colname):
+        return join(store.dpath, 'seg_%06d_%s.npy' % (segment_id, colname))
+
+    def _load_column(store, segment_id, colname):
+        key = (segment_id, colname)
+        data = store._column_cache.get(key, None)
+        if data is None:
+            fpath = store._segment_fpath(segment_id, colname)
+            data = np.load(fpath, mmap_mode='r')
+            store._column_cache[key] = data
+        return data
+
+    def _lookup(store, rowids):
+        """ Returns a dict from rowid to (segment_id, start, stop, fingerprint) """
+        rowid_to_entry = {}
+        # Stay under the SQLite host parameter limit
+        for chunk in ut.ichunks(rowids, 900):
+            query = (
+                'SELECT rowid, segment_id, start, stop, fingerprint '
+                'FROM offsets WHERE rowid IN (%s)' % (
+                    ','.join(['?'] * len(chunk)),))
+            for row in store.conn.execute(query, chunk):
+                rowid_to_entry[row[0]] = row[1:]
+        return rowid_to_entry
+
+    def _fingerprints(store, rowids):
+        if store.fingerprint_func is None:
+            return [None] * len(rowids)
+        return [None if fp is None else repr(fp)
+                for fp in store.fingerprint_func(rowids)]
+
+    def append(store, rowids, rows, fingerprints=None):
+        r"""
+        Writes rows into a new segment and points their offsets at it.
+
+        Args:
+            rowids (list): depcache rowids of the rows
+            rows (list): one tuple per row with an ndarray for each column
+            fingerprints (list): stored fingerprint of each row
+
+        Returns:
+            dict: rowid to (segment_id, start, stop, fingerprint)
+        """
+        if len(rowids) == 0:
+            return {}
+        if fingerprints is None:
+            fingerprints = [None] * len(rowids)
+        lens = np.array([len(row[0]) for row in rows], dtype=np.int64)
+        for colx in range(1, len(store.colnames)):
+            assert all([len(row[colx]) == n for row, n in zip(rows, lens)]), (
+                'columns of a row must have the same length')
+        stops = np.cumsum(lens)
+        starts = stops - lens
+        # The segment and its offsets are added under one write lock so a
+        # compaction in another process never sees a segment without rows
+        store.conn.execute('BEGIN IMMEDIATE')
+        new_fpaths = []
+        try:
+            cur = store.conn.execute(
+                'INSERT INTO segments (num_rows) VALUES (?)', (len(rowids),))
+            segment_id = cur.lastrowid
+            for colx, colname in enumerate(store.colnames):
+                data = np.concatenate([np.asarray(row[colx]) for row in rows],
+                                      axis=0)
+                fpath = store._segment_fpath(segment_id, colname)
+                # Write to a temporary name so readers never see a partial
+                # file
+                tmp_fpath = fpath + '.%s.tmp' % (uuid.uuid4().hex,)
+                with open(tmp_fpath, 'wb') as file_:
+                    np.save(file_, data)
+                os.replace(tmp_fpath, fpath)
+                new_fpaths.append(fpath)
+            entries = [(segment_id, int(start), int(stop), fp)
+                       for start, stop, fp in zip(starts, stops, fingerprints)]
+            store.conn.executemany(
+                'INSERT OR REPLACE INTO offsets '
+                '(rowid, segment_id, start, stop, fingerprint) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(int(rowid),) + entry for rowid, entry in zip(rowids, entries)])
+        except Exception:
+            store.conn.rollback()
+            for fpath in new_fpaths:
+                ut.delete(fpath, verbose=False)
+            raise
+        else:
+            store.conn.commit()
+        return dict(zip(rowids, entries))
+
+    def get(store, rowids, colname, copy=True):
+        r"""
+        Args:
+            rowids (list): depcache rowids. None entries return None.
+            colname (str): one of store.colnames
+            copy (bool): if False the rows are read-only memory mapped slices
+                of the segment files. They must not be written to, and they
+                keep their segment file open. (default = True)
+
+        Returns:
+            list: array of each row
+        """
+        assert colname in store.colnames, 'unknown column %r' % (colname,)
+        unique_rowids = sorted(set([rowid for rowid in rowids
+                                    if rowid is not None]))
+        rowid_to_entry = store._lookup(unique_rowids)
+        fingerprints = store._fingerprints(unique_rowids)
+        dirty_rowids = []
+        dirty_fps = []
+        for rowid, fp in zip(unique_rowids, fingerprints):
+            entry = rowid_to_entry.get(rowid, None)
+            if entry is None or entry[3] != fp:
+                dirty_rowids.append(rowid)
+                dirty_fps.append(fp)
+        if len(dirty_rowids) > 0:
+            if ut.VERBOSE:
+                print('[colstore] filling %d rows of %r' % (
+                    len(dirty_rowids), store.dpath))
+            rows = store.fetch_func(dirty_rowids)
+            rowid_to_entry.update(store.append(dirty_rowids, rows, dirty_fps))
+            if (store.max_segments is not None and
+                  store.get_num_segments() > store.max_segments):
+                store.compact()
+                rowid_to_entry = store._lookup(unique_rowids)
+        try:
+            rowid_to_data = store._read(rowid_to_entry, colname, copy)
+        except IOError:
+            # Another process compacted the store after the lookup
+            rowid_to_entry = store._lookup(unique_rowids)
+            store._column_cache = {}
+            rowid_to_data = store._read(rowid_to_entry, colname, copy)
+        return [None if rowid is None else rowid_to_data[rowid]
+                for rowid in rowids]
+
+    def _read(store, rowid_to_entry, colname, copy):
+        rowid_to_data = {}
+        for rowid, entry in rowid_to_entry.items():
+            segment_id, start, stop = entry[0:3]
+            data = store._load_column(segment_id, colname)
+            rowid_to_data[rowid] = (np.array(data[start:stop]) if copy else
+                                    data[start:stop])
+        return rowid_to_data
+
+
+def new_depc_columnar_store(depc, tablename, colnames, num_colname=None,
+                            num_tablename=None, dpath=None):
+    r"""
+    Builds a ColumnarStore that mirrors ndarray columns of a depcache table.
+    Rows are fingerprinted by their superkey (parent rowids and config rowid),
+    their row length, the hashid of their config and the uuid of their root
+    (the visual uuid of an annotation). A recomputed row that reuses a rowid
+    therefore only keeps its fingerprint if its config and root are the same.
+
+    Args:
+        depc (dtool_ibeis.DependencyCache):
+        tablename (str): depcache table to mirror
+        colnames (tuple): ndarray columns of the table to store
+        num_colname (str): column holding the row length (default = None)
+        num_tablename (str): table of num_colname. Either tablename or one of
+            its parents, which must live in the same database.
+            (default = tablename)
+        dpath (str): defaults to <cache_dpath>/colstore/<tablename>
+
+    Returns:
+        ColumnarStore: store
+
+    CommandLine:
+        python -m ibeis.control.columnar_store new_depc_columnar_store
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.control.columnar_store import *  # NOQA
+        >>> from dtool_ibeis.example_depcache import testdata_depc
+        >>> depc = testdata_depc()
+        >>> kp_rowids = depc.get_rowids('keypoint', [1, 2, 3])
+        >>> store = new_depc_columnar_store(depc, 'keypoint', ('kpts',), 'num')
+        >>> store.clear()
+        >>> kpts_list = store.get(kp_rowids, 'kpts')
+        >>> kpts_list_ = depc.get_native('keypoint', kp_rowids, 'kpts')
+        >>> assert all([np.all(a == b) for a, b in zip(kpts_list, kpts_list_)])
+        >>> fps = store.fingerprint_func(kp_rowids)
+        >>> assert len(set(fps)) == 3 and all([len(fp) == 5 for fp in fps])
+        >>> # A changed root changes the fingerprint of the rows built on it
+        >>> import uuid
+        >>> get_root_uuid = depc.get_root_uuid
+        >>> depc.get_root_uuid = lambda aids: [uuid.uuid4() for aid in aids]
+        >>> assert store.fingerprint_func(kp_rowids) != fps
+        >>> depc.get_root_uuid = get_root_uuid
+        >>> assert store.fingerprint_func(kp_rowids) == fps
+        >>> # Rows of another config have other rowids and are added on demand
+        >>> config = {'adapt_shape': False}
+        >>> kp_rowids2 = depc.get_rowids('keypoint', [1, 2, 3], config=config)
+        >>> kpts_list2 = store.get(kp_rowids2, 'kpts')
+        >>> kpts_list2_ = depc.get('keypoint', [1, 2, 3], 'kpts', config=config)
+        >>> assert all([np.all(a == b) for a, b in zip(kpts_list2, kpts_list2_)])
+        >>> print('num_segments = %r' % (store.get_num_segments(),))
+        num_segments = 2
+        >>> store.clear()
+        >>> store.close()
+    """
+    table = depc[tablename]
+    colnames = tuple(colnames)
+    if dpath is None:
+        dpath = join(depc.cache_dpath, 'colstore', tablename)
+    select_cols = ['%s.%s' % (tablename, colname)
+                   for colname in table.superkey_colnames]
+    join_clause = ''
+    if num_colname is not None:
+        if num_tablename is None or num_tablename == tablename:
+            select_cols.append('%s.%s' % (tablename, num_colname))
+        else:
+            parentx = list(table.parent_id_tablenames).index(num_tablename)
+            parent_colname = table.parent_id_colnames[parentx]
+            join_clause = ' JOIN %s ON %s.rowid = %s.%s' % (
+                num_tablename, num_tablename, tablename, parent_colname)
+            select_cols.append('%s.%s' % (num_tablename, num_colname))
+    # The config table lives in the database of every depcache table
+    select_cols.append('config.config_hashid')
+    join_clause += (' LEFT JOIN config ON config.config_rowid = '
+                    '%s.config_rowid' % (tablename,))
+    query_fmt = 'SELECT %s.rowid, %s FROM %s%s WHERE %s.rowid IN (%%s)' % (
+        tablename, ', '.join(select_cols), tablename, join_clause, tablename)
+
+    def fetch_func(rowids):
+        # Passing a tuple of colnames always returns a tuple per row
+        return depc.get_native(tablename, rowids, colnames)
+
+    def fingerprint_func(rowids):
+        rowid_to_fp = {}
+        for chunk in ut.ichunks(rowids, 900):
+            query = query_fmt % (','.join(['?'] * len(chunk)),)
+            for row in table.db.executeone(query, list(chunk)):
+                rowid_to_fp[row[0]] = tuple(row[1:])
+        found_rowids = list(rowid_to_fp.keys())
+        if len(found_rowids) > 0:
+            root_rowids = depc.get_root_rowids(tablename, found_rowids)
+            root_uuids = depc.get_root_uuid(list(root_rowids))
+            for rowid, root_uuid in zip(found_rowids, root_uuids):
+                rowid_to_fp[rowid] += (root_uuid,)
+        return [rowid_to_fp.get(rowid, None) for rowid in rowids]
+
+    store = ColumnarStore(dpath, colnames, fetch_func, fingerprint_func)
+    return store
+
+
+if __name__ == '__main__':
+    r"""
+    CommandLine:
+        python -m ibeis.control.columnar_store
+        python -m ibeis.control.columnar_store --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
@@ -1795,7 +1795,7 @@ def get_annot_rotated_verts(ibs, aid_list):
 
 @register_ibs_method
 @accessor_decors.getter_1to1
-@accessor_decors.cache_getter(const.ANNOTATION_TABLE, ANNOT_YAW)
+@accessor_decors.cache_getter(const.ANNOTATION_TABLE, ANNOT_YAW, dtype=np.float64)
 @register_api('/api/annot/yaw/', methods=['GET'])
 #@profile
 def get_annot_yaws(ibs, aid_list, assume_unique=False):
@@ -2296,7 +2296,7 @@ def get_annot_part_rowids(ibs, aid_list, is_staged=False):
 @register_ibs_method
 @util_decor.accepts_numpy
 @accessor_decors.getter_1to1
-@accessor_decors.cache_getter(const.ANNOTATION_TABLE, NAME_ROWID, cfgkeys=['distinguish_unknowns'])
+@accessor_decors.cache_getter(const.ANNOTATION_TABLE, NAME_ROWID, cfgkeys=['distinguish_unknowns'], dtype=np.int64)
 # @register_api('/api/annot/name/rowid/', methods=['GET'])
 def get_annot_name_rowids(ibs, aid_list, distinguish_unknowns=True, assume_unique=False):
     r"""
@@ -2476,7 +2476,7 @@ def get_annot_species_texts(ibs, aid_list):
 @register_ibs_method
 @util_decor.accepts_numpy
 @accessor_decors.getter_1to1
-@accessor_decors.cache_getter(const.ANNOTATION_TABLE, SPECIES_ROWID)
+@accessor_decors.cache_getter(const.ANNOTATION_TABLE, SPECIES_ROWID, dtype=np.int64)
 @register_api('/api/annot/species/rowid/', methods=['GET'], __api_plural_check__=False)
 def get_annot_species_rowids(ibs, aid_list):
     r"""
@@ -3224,7 +3224,7 @@ def get_annot_probchip_fpath(ibs, aid_list, config2_=None):
 
 @register_ibs_method
 @accessor_decors.getter_1to1
-@accessor_decors.cache_getter(const.ANNOTATION_TABLE, ANNOT_QUALITY)
+@accessor_decors.cache_getter(const.ANNOTATION_TABLE, ANNOT_QUALITY, dtype=np.int64)
 @register_api('/api/annot/quality/', methods=['GET'])
 def get_annot_qualities(ibs, aid_list, eager=True):
     r"""
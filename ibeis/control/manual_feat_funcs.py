@@ -20,6 +20,72 @@ FEAT_VECS     = 'feature_vecs'
 FEAT_KPTS     = 'feature_keypoints'
 FEAT_NUM_FEAT = 'feature_num_feats'
 
+# ndarray columns that can be served from a ColumnarStore when
+# ibs.use_columnar_feats is set (--columnar-feats)
+COLUMNAR_TABLES = {
+    'feat': ('kpts', 'vecs'),
+    'featweight': ('fwg',),
+}
+
+
+# ----------------
+# COLUMNAR STORAGE
+# ----------------
+
+
+@register_ibs_method
+def get_columnar_store(ibs, tablename):
+    r"""
+    Returns the memory mapped column store that mirrors a depcache table.
+    Rows are copied out of the depcache the first time they are read.
+
+    Args:
+        tablename (str): 'feat' or 'featweight'
+
+    Returns:
+        ibeis.control.columnar_store.ColumnarStore: store
+
+    CommandLine:
+        python -m ibeis.control.manual_feat_funcs get_columnar_store
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.control.manual_feat_funcs import *  # NOQA
+        >>> import numpy as np
+        >>> ibs, config2_ = testdata_ibs()
+        >>> aid_list = ibs.get_valid_aids()[0:3]
+        >>> vecs_list1 = ibs.get_annot_vecs(aid_list, config2_=config2_)
+        >>> ibs.use_columnar_feats = True
+        >>> ibs.get_columnar_store('feat').clear()
+        >>> vecs_list2 = ibs.get_annot_vecs(aid_list, config2_=config2_)
+        >>> ibs.use_columnar_feats = False
+        >>> assert all([np.all(v1 == v2) for v1, v2 in zip(vecs_list1, vecs_list2)])
+    """
+    store = ibs._columnar_stores.get(tablename, None)
+    if store is None:
+        from ibeis.control import columnar_store
+        depc = ibs.depc_annot
+        if tablename not in COLUMNAR_TABLES:
+            raise KeyError('No columnar storage for tablename=%r' % (tablename,))
+        colnames = COLUMNAR_TABLES[tablename]
+        # Both tables are fingerprinted by the feature count of the feat row;
+        # the weights have one entry per feature
+        store = columnar_store.new_depc_columnar_store(
+            depc, tablename, colnames, num_colname='num_feats',
+            num_tablename='feat')
+        ibs._columnar_stores[tablename] = store
+    return store
+
+
+def get_columnar_property(ibs, tablename, aid_list, colname, config2_=None,
+                          ensure=True, eager=True):
+    """ depc.get replacement that reads ndarray columns from the store """
+    rowid_list = ibs.depc_annot.get_rowids(tablename, aid_list,
+                                           config=config2_, ensure=ensure,
+                                           eager=eager)
+    store = ibs.get_columnar_store(tablename)
+    return store.get(rowid_list, colname)
+
 
 # ----------------
 # ROOT LEAF FUNCTIONS
@@ -149,6 +215,9 @@ def get_annot_kpts(ibs, aid_list, ensure=True, eager=True, nInput=None,
         >>> ibeis.viz.interact.interact_chip.ishow_chip(ibs, aid_list[0], config2_=qreq2_.extern_query_config2, ori=True, fnum=2)
         >>> ut.show_if_requested()
     """
+    if ibs.use_columnar_feats:
+        return get_columnar_property(ibs, 'feat', aid_list, 'kpts', config2_,
+                                     ensure=ensure, eager=eager)
     return ibs.depc_annot.get('feat', aid_list, 'kpts', config=config2_,
                                ensure=ensure, eager=eager)
 
@@ -161,6 +230,9 @@ def get_annot_vecs(ibs, aid_list, ensure=True, eager=True, nInput=None,
     Returns:
         vecs_list (list): annotation descriptor vectors
     """
+    if ibs.use_columnar_feats:
+        return get_columnar_property(ibs, 'feat', aid_list, 'vecs', config2_,
+                                     ensure=ensure, eager=eager)
     return ibs.depc_annot.get('feat', aid_list, 'vecs', config=config2_,
                                ensure=ensure, eager=eager)
 
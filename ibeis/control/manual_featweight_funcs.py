@@ -35,6 +35,10 @@ def get_annot_fgweights(ibs, aid_list, config2_=None, ensure=True):
         >>> print('Calculated percent = %0.04f' % (percent_, ))
         >>> assert percent_ > .4 and percent_ < .6, 'should be around .54'
     """
+    if ibs.use_columnar_feats:
+        from ibeis.control import manual_feat_funcs
+        return manual_feat_funcs.get_columnar_property(
+            ibs, 'featweight', aid_list, 'fwg', config2_, ensure=ensure)
     fgws_list = ibs.depc_annot.get('featweight', aid_list, 'fwg',
                                    config=config2_)
     return fgws_list
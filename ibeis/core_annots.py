@@ -46,6 +46,7 @@ Setup:
 """
 from vtool_ibeis import image_filters
 import dtool_ibeis
+import multiprocessing
 import utool as ut
 import vtool_ibeis as vt
 import numpy as np
@@ -440,47 +441,114 @@ def gen_chip_configure_and_compute(ibs, gid_list, rowid_list, bbox_list, theta_l
 
     _parallel_chips = getattr(ibs, '_parallel_chips', True)
 
+    # Group annotations by their parent image so each image is decoded once
+    # and every chip belonging to it is warped from the same buffer.
+    unique_gids, groupxs = group_indices_by_first_appearance(gid_list)
+    M_groups = [ut.take(M_list, idxs) for idxs in groupxs]
+    newsize_groups = [ut.take(newsize_list, idxs) for idxs in groupxs]
+
     if _parallel_chips:
-        gpath_list = ibs.get_image_paths(gid_list)
-        orient_list = ibs.get_image_orientation(gid_list)
-        args_gen = zip(gpath_list, orient_list, M_list, newsize_list)
+        gpath_list = ibs.get_image_paths(unique_gids)
+        orient_list = ibs.get_image_orientation(unique_gids)
+        args_gen = zip(gpath_list, orient_list, M_groups, newsize_groups)
 
         gen_kw = {'filter_list': filter_list, 'warpkw': warpkw}
-        gen = ut.generate2(gen_chip_worker, args_gen, gen_kw, nTasks=len(gpath_list),
-                           force_serial=ibs.force_serial)
-        for chipBGR, width, height, M in gen:
-            yield chipBGR, width, height, M
+        group_gen = ut.generate2(gen_chip_group_worker, args_gen, gen_kw,
+                                 nTasks=len(gpath_list),
+                                 force_serial=ibs.force_serial)
     else:
-        #arg_iter = zip(cfpath_list, gid_list, newsize_list, M_list)
-        arg_iter = zip(gid_list, M_list, newsize_list)
-        arg_list = list(arg_iter)
-
-        last_gid = None
-        for tup in ut.ProgIter(arg_list, lbl='computing chips', bs=True):
-            # FIXME: THE GPATH SHOULD BE PASSED HERE WITH AN ORIENTATION FLAG
-            #cfpath, gid, new_size, M = tup
-            gid, M, new_size = tup
-            # Read parent image # TODO: buffer this?
-            # If the gids are sorted, no need to load the image more than once, if so
-            if gid != last_gid:
+        def _group_gen():
+            arg_iter = zip(unique_gids, M_groups, newsize_groups)
+            for gid, M_group, newsize_group in ut.ProgIter(
+                    arg_iter, nTotal=len(unique_gids),
+                    lbl='computing chips', bs=True):
+                # Read parent image
                 imgBGR = ibs.get_images(gid)
-                last_gid = gid
-            # Warp chip
-            new_size = tuple([
-                int(np.around(val))
-                for val in new_size
-            ])
-            chipBGR = cv2.warpAffine(imgBGR, M[0:2], new_size, **warpkw)
-            # Do intensity normalizations
-            if filter_list:
-                chipBGR = ipreproc.preprocess(chipBGR, filter_list)
-            width, height = vt.get_size(chipBGR)
-            yield (chipBGR, width, height, M)
+                yield [
+                    warp_chip(imgBGR, M, new_size, filter_list, warpkw,
+                              ipreproc)
+                    for M, new_size in zip(M_group, newsize_group)
+                ]
+        group_gen = _group_gen()
 
+    for chipBGR, width, height, M in ungroup_in_order(groupxs, group_gen):
+        yield chipBGR, width, height, M
 
-def gen_chip_worker(gpath, orient, M, new_size, filter_list, warpkw):
-    imgBGR = vt.imread(gpath, orient=orient)
-    # Warp chip
+
+def group_indices_by_first_appearance(gid_list):
+    r"""
+    Groups positions in ``gid_list`` by image, ordering the groups by the
+    position where each image first appears.
+
+    Args:
+        gid_list (list): image rowid of each item
+
+    Returns:
+        tuple: (unique_gids, groupxs)
+
+    CommandLine:
+        python -m ibeis.core_annots group_indices_by_first_appearance
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.core_annots import *  # NOQA
+        >>> gid_list = [3, 1, 3, 2, 1, 3]
+        >>> unique_gids, groupxs = group_indices_by_first_appearance(gid_list)
+        >>> print('unique_gids = %r' % (unique_gids,))
+        >>> print('groupxs = %r' % (groupxs,))
+        unique_gids = [3, 1, 2]
+        groupxs = [[0, 2, 5], [1, 4], [3]]
+    """
+    gid_to_groupx = {}
+    unique_gids = []
+    groupxs = []
+    for index, gid in enumerate(gid_list):
+        groupx = gid_to_groupx.get(gid, None)
+        if groupx is None:
+            gid_to_groupx[gid] = groupx = len(unique_gids)
+            unique_gids.append(gid)
+            groupxs.append([])
+        groupxs[groupx].append(index)
+    return unique_gids, groupxs
+
+
+def ungroup_in_order(groupxs, group_results):
+    r"""
+    Inverse of :func:`group_indices_by_first_appearance`. Consumes per-group
+    result lists and yields the items in their original order as soon as
+    they are available, so sorted inputs are streamed without buffering.
+
+    Args:
+        groupxs (list): original positions of each group
+        group_results (iterable): list of results for each group
+
+    Yields:
+        object: results in original order
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.core_annots import *  # NOQA
+        >>> gid_list = [3, 1, 3, 2, 1, 3]
+        >>> unique_gids, groupxs = group_indices_by_first_appearance(gid_list)
+        >>> group_results = [[(gid, x) for x in xs]
+        >>>                  for gid, xs in zip(unique_gids, groupxs)]
+        >>> result = list(ungroup_in_order(groupxs, group_results))
+        >>> print(result)
+        [(3, 0), (1, 1), (3, 2), (2, 3), (1, 4), (3, 5)]
+    """
+    buffered = {}
+    next_index = 0
+    for idxs, results in zip(groupxs, group_results):
+        assert len(idxs) == len(results), 'group size mismatch'
+        buffered.update(zip(idxs, results))
+        while next_index in buffered:
+            yield buffered.pop(next_index)
+            next_index += 1
+    assert len(buffered) == 0, 'groups did not cover all indices'
+
+
+def warp_chip(imgBGR, M, new_size, filter_list, warpkw, ipreproc=None):
+    """ Warps a single chip out of an already decoded image """
     new_size = tuple([
         int(np.around(val))
         for val in new_size
@@ -488,12 +556,103 @@ def gen_chip_worker(gpath, orient, M, new_size, filter_list, warpkw):
     chipBGR = cv2.warpAffine(imgBGR, M[0:2], new_size, **warpkw)
     # Do intensity normalizations
     if filter_list:
-        ipreproc = image_filters.IntensityPreproc()
+        if ipreproc is None:
+            ipreproc = image_filters.IntensityPreproc()
         chipBGR = ipreproc.preprocess(chipBGR, filter_list)
     width, height = vt.get_size(chipBGR)
     return (chipBGR, width, height, M)
 
 
+def gen_chip_worker(gpath, orient, M, new_size, filter_list, warpkw):
+    imgBGR = vt.imread(gpath, orient=orient)
+    return warp_chip(imgBGR, M, new_size, filter_list, warpkw)
+
+
+def gen_chip_group_worker(gpath, orient, M_list, newsize_list, filter_list,
+                          warpkw):
+    """ Decodes an image once and warps all of its chips """
+    imgBGR = vt.imread(gpath, orient=orient)
+    ipreproc = image_filters.IntensityPreproc() if filter_list else None
+    return [warp_chip(imgBGR, M, new_size, filter_list, warpkw, ipreproc)
+            for M, new_size in zip(M_list, newsize_list)]
+
+
+def benchmark_chip_extraction(num_images=8, annots_per_image=10,
+                              image_size=(6000, 4000), chip_size=(700, 500)):
+    r"""
+    Compares per-annotation chip extraction, which decodes the source image
+    for every chip, with image-grouped extraction on synthetic JPEGs.
+
+    CommandLine:
+        python -m ibeis.core_annots benchmark_chip_extraction
+        python -m ibeis.core_annots benchmark_chip_extraction --num-images=16 --annots-per-image=15
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from ibeis.core_annots import *  # NOQA
+        >>> num_images = ut.get_argval('--num-images', type_=int, default=8)
+        >>> annots_per_image = ut.get_argval('--annots-per-image', type_=int, default=10)
+        >>> result = benchmark_chip_extraction(num_images, annots_per_image)
+        >>> print(result)
+    """
+    import tempfile
+    import shutil
+    from os.path import join
+    rng = np.random.RandomState(0)
+    dpath = tempfile.mkdtemp(prefix='chipbench_')
+    try:
+        w, h = image_size
+        cw, ch = chip_size
+        gpath_list = []
+        for gx in range(num_images):
+            # Smooth noise compresses like a real photo rather than static
+            small = rng.randint(0, 255, (h // 16, w // 16, 3)).astype(np.uint8)
+            img = cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+            gpath = join(dpath, 'img_%04d.jpg' % (gx,))
+            vt.imwrite(gpath, img)
+            gpath_list.append(gpath)
+        gid_list = ut.flatten([[gx] * annots_per_image
+                               for gx in range(num_images)])
+        bbox_list = [(rng.randint(0, w - cw), rng.randint(0, h - ch), cw, ch)
+                     for _ in gid_list]
+        theta_list = rng.rand(len(gid_list)) * .3
+        newsize_list = [(cw // 2, ch // 2)] * len(gid_list)
+        M_list = [vt.get_image_to_chip_transform(bbox, new_size, theta)
+                  for bbox, theta, new_size in
+                  zip(bbox_list, theta_list, newsize_list)]
+        orient = 0
+        warpkw = dict(flags=cv2.INTER_LANCZOS4, borderMode=cv2.BORDER_CONSTANT)
+        num_chips = len(gid_list)
+
+        with ut.Timer('per annotation') as t1:
+            args_gen = zip(ut.take(gpath_list, gid_list), [orient] * num_chips,
+                           M_list, newsize_list)
+            chips1 = [tup[0] for tup in ut.generate2(
+                gen_chip_worker, args_gen,
+                {'filter_list': [], 'warpkw': warpkw}, nTasks=num_chips)]
+        with ut.Timer('grouped by image') as t2:
+            unique_gids, groupxs = group_indices_by_first_appearance(gid_list)
+            args_gen = zip(ut.take(gpath_list, unique_gids),
+                           [orient] * len(unique_gids),
+                           [ut.take(M_list, xs) for xs in groupxs],
+                           [ut.take(newsize_list, xs) for xs in groupxs])
+            group_gen = ut.generate2(
+                gen_chip_group_worker, args_gen,
+                {'filter_list': [], 'warpkw': warpkw},
+                nTasks=len(unique_gids))
+            chips2 = [tup[0] for tup in ungroup_in_order(groupxs, group_gen)]
+        assert all([np.all(c1 == c2) for c1, c2 in zip(chips1, chips2)])
+    finally:
+        shutil.rmtree(dpath)
+    result = ut.repr2(ut.odict([
+        ('num_chips', num_chips),
+        ('per_annot_chips_per_sec', num_chips / t1.ellapsed),
+        ('grouped_chips_per_sec', num_chips / t2.ellapsed),
+        ('speedup', t1.ellapsed / t2.ellapsed),
+    ]), precision=2)
+    return result
+
+
 @register_subprop('chips', 'dlen_sqrd')
 def compute_dlen_sqrd(depc, aid_list, config=None):
     size_list = np.array(
@@ -1328,9 +1487,32 @@ class VsOneConfig(dtool_ibeis.Config):
     ]
 
 
+# Number of processes matching vsone pairs (1 matches serially)
+VSONE_WORKERS = ut.get_argval('--vsone-workers', type_=int, default=1)
+# Pairs per vsone worker task. Chunks too small for two tasks are matched
+# serially.
+VSONE_PAIRS_PER_TASK = 32
+
+
+def _read_pairwise_match(fpath):
+    # ibeis.algo cannot be imported while this module is initializing
+    from ibeis.algo.verif import match_codec
+    return match_codec.read_match(fpath)
+
+
+def _write_pairwise_match(fpath, match):
+    from ibeis.algo.verif import match_codec
+    match_codec.write_match(fpath, match)
+
+
+# Matches are stored in a compact column-oriented encoding instead of pickles
+PairwiseMatchType = dtool_ibeis.ExternType(
+    _read_pairwise_match, _write_pairwise_match, extern_ext='.vsmatch')
+
+
 @derived_attribute(
     tablename='pairwise_match', parents=['annotations', 'annotations'],
-    colnames=['match'], coltypes=[vt.PairwiseMatch],
+    colnames=['match'], coltypes=[PairwiseMatchType],
     configclass=VsOneConfig,
     chunksize=512,
     fname='vsone2',
@@ -1373,13 +1555,183 @@ def compute_pairwise_vsone(depc, qaids, daids, config):
         # annot['norm_xys'] = (vt.get_xys(annot['kpts']) /
         #                      np.array(annot['chip_size'])[:, None])
 
-    for qaid, daid in ut.ProgIter(zip(qaids, daids), length=len(qaids),
-                                  lbl='compute vsone', bs=True, freq=1):
-        annot1 = configured_lazy_annots[qannot_cfg][qaid]
-        annot2 = configured_lazy_annots[dannot_cfg][daid]
-        match = vt.PairwiseMatch(annot1, annot2)
-        match.apply_all(config)
-        yield (match,)
+    n_workers = VSONE_WORKERS
+    # Daemonic processes (e.g. pool workers) cannot start their own pool
+    force_serial = (n_workers <= 1 or ibs.force_serial or
+                    len(qaids) < 2 * VSONE_PAIRS_PER_TASK or
+                    multiprocessing.current_process().daemon)
+    if force_serial:
+        for qaid, daid in ut.ProgIter(zip(qaids, daids), length=len(qaids),
+                                      lbl='compute vsone', bs=True, freq=1):
+            annot1 = configured_lazy_annots[qannot_cfg][qaid]
+            annot2 = configured_lazy_annots[dannot_cfg][daid]
+            match = vt.PairwiseMatch(annot1, annot2)
+            match.apply_all(config)
+            yield (match,)
+    else:
+        match_gen = _parallel_pairwise_vsone(
+            configured_lazy_annots, qaids, daids, qannot_cfg, dannot_cfg,
+            config, n_workers)
+        for match in match_gen:
+            yield (match,)
+
+
+def partition_vsone_pairs(qaids, daids, symmetric=False,
+                          pairs_per_task=None):
+    """
+    Groups pair indices into tasks by query annotation, so the FLANN index
+    of each query is built by a single task, as it would be when matching
+    serially. Groups are kept in order of first appearance and packed into
+    tasks of at least pairs_per_task pairs.
+
+    Symmetric matching also searches the database annotations. Indexes
+    needed by more than one task are returned separately so they can be
+    built once, before the tasks run.
+
+    Returns:
+        tuple: (task_pairxs, shared_aids) - lists of indices into qaids /
+            daids, and the annots whose index is needed by several tasks
+
+    CommandLine:
+        python -m ibeis.core_annots partition_vsone_pairs
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.core_annots import *  # NOQA
+        >>> qaids = [1, 2, 1, 3, 4, 2]
+        >>> daids = [2, 3, 5, 6, 5, 6]
+        >>> print(partition_vsone_pairs(qaids, daids, pairs_per_task=1))
+        ([[0, 2], [1, 5], [3], [4]], [])
+        >>> print(partition_vsone_pairs(qaids, daids, pairs_per_task=3))
+        ([[0, 2, 1, 5], [3, 4]], [])
+        >>> print(partition_vsone_pairs(qaids, daids, True, pairs_per_task=1))
+        ([[0, 2], [1, 5], [3], [4]], [2, 3, 5, 6])
+    """
+    if pairs_per_task is None:
+        pairs_per_task = VSONE_PAIRS_PER_TASK
+    groupxs = ut.ddict(list)
+    for px, qaid in enumerate(qaids):
+        groupxs[qaid].append(px)
+    task_pairxs = []
+    current = []
+    for pairxs in groupxs.values():
+        current.extend(pairxs)
+        if len(current) >= pairs_per_task:
+            task_pairxs.append(current)
+            current = []
+    if len(current) > 0:
+        task_pairxs.append(current)
+
+    shared_aids = []
+    if symmetric:
+        aid_to_tasks = ut.ddict(set)
+        for tx, pairxs in enumerate(task_pairxs):
+            for px in pairxs:
+                aid_to_tasks[qaids[px]].add(tx)
+                aid_to_tasks[daids[px]].add(tx)
+        shared_aids = sorted(aid for aid, txs in aid_to_tasks.items()
+                             if len(txs) > 1)
+    return task_pairxs, shared_aids
+
+
+def _vsone_annot_payload(annot, weight_key):
+    """ the parts of a configured annot needed to match it in a worker """
+    payload = {
+        'aid': annot['aid'],
+        'kpts': annot['kpts'],
+        'vecs': annot['vecs'],
+        'chip_size': annot['chip_size'],
+    }
+    if weight_key is not None:
+        payload[weight_key] = annot[weight_key]
+    return payload
+
+
+def _parallel_pairwise_vsone(configured_lazy_annots, qaids, daids, qannot_cfg,
+                             dannot_cfg, config, n_workers):
+    """
+    Runs vsone matching on partitions of the pairs in a process pool and
+    yields the matches in input order.
+
+    Each task only receives the features of the annots it touches and builds
+    or loads their FLANN indexes itself. Matches are pickled without annots,
+    so the configured annots of this process are reattached before yielding.
+    """
+    cfgdict = {key: config[key] for key in vt.matching.VSONE_PI_DICT
+               if key in config}
+    symmetric, weight_key = vt.PairwiseMatch._take_params(
+        cfgdict, ['symmetric', 'weight'])
+    qannots = configured_lazy_annots[qannot_cfg]
+    dannots = configured_lazy_annots[dannot_cfg]
+    task_pairxs, shared_aids = partition_vsone_pairs(qaids, daids, symmetric)
+
+    if len(shared_aids) > 0:
+        # Build shared indexes once. Tasks load them from the FLANN cache.
+        aid_to_annot = ut.dict_union(dannots, qannots)
+        vecs_gen = ((aid_to_annot[aid]['vecs'],) for aid in shared_aids)
+        for _ in ut.generate2(_vsone_flann_worker, vecs_gen,
+                              nTasks=len(shared_aids), ordered=False,
+                              nprocs=n_workers, verbose=False,
+                              progkw={'lbl': 'vsone flann', 'freq': 1}):
+            pass
+
+    def _args_gen():
+        for pairxs in task_pairxs:
+            task_qaids = ut.take(qaids, pairxs)
+            task_daids = ut.take(daids, pairxs)
+            qpayloads = {aid: _vsone_annot_payload(qannots[aid], weight_key)
+                         for aid in set(task_qaids)}
+            dpayloads = {aid: _vsone_annot_payload(dannots[aid], weight_key)
+                         for aid in set(task_daids)}
+            yield (qpayloads, dpayloads, task_qaids, task_daids, cfgdict)
+
+    result_gen = ut.generate2(_vsone_pairs_worker, _args_gen(),
+                              nTasks=len(task_pairxs), ordered=True,
+                              nprocs=n_workers, verbose=False,
+                              progkw={'lbl': 'compute vsone', 'freq': 1})
+    # Hold finished matches only until the ones before them are yielded
+    finished = {}
+    next_px = 0
+    for pairxs, matches in zip(task_pairxs, result_gen):
+        finished.update(zip(pairxs, matches))
+        while next_px in finished:
+            match = finished.pop(next_px)
+            match.annot1 = qannots[qaids[next_px]]
+            match.annot2 = dannots[daids[next_px]]
+            yield match
+            next_px += 1
+    assert next_px == len(qaids), 'missing vsone matches'
+
+
+def _vsone_pairs_worker(qpayloads, dpayloads, qaids, daids, cfgdict):
+    """ matches a partition of vsone pairs """
+    qannots = {aid: _make_vsone_worker_annot(payload)
+               for aid, payload in qpayloads.items()}
+    dannots = {aid: _make_vsone_worker_annot(payload)
+               for aid, payload in dpayloads.items()}
+    match_list = []
+    for qaid, daid in zip(qaids, daids):
+        match = vt.PairwiseMatch(qannots[qaid], dannots[daid])
+        match.apply_all(cfgdict)
+        match_list.append(match)
+    return match_list
+
+
+def _vsone_flann_worker(vecs):
+    """ builds the cached FLANN index of an annot """
+    annot = ut.LazyDict({'vecs': vecs})
+    vt.matching.ensure_metadata_flann(annot, {})
+    annot['flann']
+
+
+def _make_vsone_worker_annot(payload):
+    annot = ut.LazyDict(payload)
+    # Same as the rchip shape, but does not need the chip to be read
+    width, height = payload['chip_size']
+    annot['dlen_sqrd'] = width ** 2 + height ** 2
+    vt.matching.ensure_metadata_flann(annot, {})
+    vt.matching.ensure_metadata_normxy(annot)
+    return annot
 
 
 def make_configured_annots(ibs, qaids, daids, qannot_cfg, dannot_cfg,
@@ -1428,21 +1780,19 @@ def make_configured_annots(ibs, qaids, daids, qannot_cfg, dannot_cfg,
         # Views are always caching
         configured_annot_views[config] = annots.view()
 
-    if preload:
+    if preload is True:
         precompute_weights = (qannot_cfg['weight'] == 'fgweights' or
                               dannot_cfg['weight'] == 'fgweights')
+        preload = ['chip_size', 'vecs', 'kpts', 'yaw', 'viewpoint_int',
+                   'qual', 'gps', 'time']
+        if precompute_weights:
+            preload.append('fgweights')
+    if preload:
+        # A list of view attributes only loads those columns in bulk
         unique_annot_views = list(configured_annot_views.values())
         for annots in unique_annot_views:
-            annots.chip_size
-            annots.vecs
-            annots.kpts
-            annots.yaw
-            annots.viewpoint_int
-            annots.qual
-            annots.gps
-            annots.time
-            if precompute_weights:
-                annots.fgweights
+            for attr in preload:
+                getattr(annots, attr)
 
     configured_lazy_annots = ut.ddict(dict)
     for config, annots in configured_annot_views.items():
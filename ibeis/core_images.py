@@ -927,20 +927,27 @@ def get_localization_chips(ibs, loc_id_list, target_size=(128, 128)):
         borderMode = cv2.BORDER_CONSTANT
         warpkw = dict(flags=flags, borderMode=borderMode)
 
-        last_gid = None
-        chip_list = []
-        arg_list = list(zip(gid_list, newsize_list, M_list))
-        for tup in ut.ProgIter(arg_list, lbl='computing localization chips', bs=True):
-            gid, new_size, M = tup
-            if gid != last_gid:
+        # Decode each source image once, even when its localizations are not
+        # contiguous in loc_id_list
+        from ibeis import core_annots
+        unique_gids, groupxs = core_annots.group_indices_by_first_appearance(gid_list)
+
+        def _group_gen():
+            arg_iter = zip(unique_gids, groupxs)
+            for gid, idxs in ut.ProgIter(arg_iter, nTotal=len(unique_gids),
+                                         lbl='computing localization chips',
+                                         bs=True):
                 img = ibs.get_images(gid)
-                last_gid = gid
-            chip = cv2.warpAffine(img, M[0:2], tuple(new_size), **warpkw)
-            # cv2.imshow('', chip)
-            # cv2.waitKey()
-            msg = 'Chip shape %r does not agree with target size %r' % (chip.shape, target_size, )
-            assert chip.shape[0] == target_size[0] and chip.shape[1] == target_size[1], msg
-            chip_list.append(chip)
+                group_chip_list = []
+                for idx in idxs:
+                    new_size, M = newsize_list[idx], M_list[idx]
+                    chip = cv2.warpAffine(img, M[0:2], tuple(new_size), **warpkw)
+                    msg = 'Chip shape %r does not agree with target size %r' % (chip.shape, target_size, )
+                    assert chip.shape[0] == target_size[0] and chip.shape[1] == target_size[1], msg
+                    group_chip_list.append(chip)
+                yield group_chip_list
+
+        chip_list = list(core_annots.ungroup_in_order(groupxs, _group_gen()))
     else:
         target_size_list = [target_size] * len(bboxes_list)
         img_list = [ibs.get_images(gid) for gid in gid_list_]
@@ -1142,9 +1149,6 @@ def compute_localizations_chips(depc, loc_id_list, config=None):
     avg = sum(len_list) / len(len_list)
     args = (len(loc_id_list), min(len_list), avg, max(len_list), sum(len_list), )
 
-    # Create image iterator
-    img_list = (ibs.get_images(gid) for gid in gid_list_)
-
     if masking:
         print('Extracting %d localization masks (min: %d, avg: %0.02f, max: %d, total: %d)' % args)
         worker_func = get_localization_masks_worker
@@ -1152,11 +1156,24 @@ def compute_localizations_chips(depc, loc_id_list, config=None):
         print('Extracting %d localization chips (min: %d, avg: %0.02f, max: %d, total: %d)' % args)
         worker_func = get_localization_chips_worker
 
-    arg_iter = zip(gid_list_, img_list, bboxes_list, thetas_list, target_size_list)
-    result_list = ut.util_parallel.generate2(worker_func, arg_iter,
-                                             ordered=True,
-                                             nTasks=len(gid_list_),
-                                             force_serial=True)
+    # Decode each source image once and extract the chips of every
+    # localization that belongs to it
+    from ibeis import core_annots
+    unique_gids, groupxs = core_annots.group_indices_by_first_appearance(gid_list_)
+
+    def _group_gen():
+        arg_iter = zip(unique_gids, groupxs)
+        for gid, idxs in ut.ProgIter(arg_iter, nTotal=len(unique_gids),
+                                     lbl='computing localization chips',
+                                     bs=True):
+            img = ibs.get_images(gid)
+            yield [
+                worker_func(gid, img, bboxes_list[idx], thetas_list[idx],
+                            target_size_list[idx])
+                for idx in idxs
+            ]
+
+    result_list = core_annots.ungroup_in_order(groupxs, _group_gen())
 
     # Return the results
     for gid, chip_list in result_list:
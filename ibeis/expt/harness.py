@@ -3,6 +3,7 @@ Runs many queries and keeps track of some results
 """
 import sys
 import textwrap
+from os.path import exists
 import numpy as np  # NOQA
 import utool as ut
 from ibeis.expt import experiment_helpers
@@ -22,6 +23,9 @@ TEST_INFO = True
 
 # dont actually query. Just print labels and stuff
 DRY_RUN =  ut.get_argflag(('--dryrun', '--dry'))
+# run pipeline stages shared by several configs once (see
+# pipeline.request_ibeis_query_grid)
+SHARE_STAGES = not ut.get_argflag(('--noshare-stages', '--no-stage-sharing'))
 
 
 def run_expt(ibs, acfg_name_list, test_cfg_name_list, use_cache=None,
@@ -125,10 +129,16 @@ def run_expt(ibs, acfg_name_list, test_cfg_name_list, use_cache=None,
 @profile
 def make_single_testres(ibs, qaids, daids, pipecfg_list, cfgx2_lbl,
                         cfgdict_list, lbl, testnameid, use_cache=None,
-                        subindexer_partial=ut.ProgIter):
+                        subindexer_partial=ut.ProgIter, verbose=None):
     """
+    Pipeline configs that share upstream stages are executed together unless
+    --noshare-stages is given. verbose is passed to the shared query
+    execution and defaults to the pipeline verbosity.
+
     CommandLine:
         python -m ibeis run_expt
+        python -m ibeis run_expt -t default:score_method=[nsum,csum],sv_on=[True,False]
+        python -m ibeis run_expt -t default:score_method=[nsum,csum],sv_on=[True,False] --noshare-stages
     """
     cfgslice = None
     if cfgslice is not None:
@@ -170,6 +180,19 @@ def make_single_testres(ibs, qaids, daids, pipecfg_list, cfgx2_lbl,
         # HACK
         prev_feat_cfgstr = None
 
+    st_cachedir, st_cachename = None, None
+    if use_cache:
+        # smaller cache for individual configuration runs
+        st_cachedir = ut.unixjoin(bt_cachedir, 'small_tests')
+        st_cachename = 'smalltest'
+        ut.ensuredir(st_cachedir)
+
+    cfgx2_shared_cmsinfo = {}
+    if SHARE_STAGES and not DRY_RUN and len(cfgx2_qreq_) > 1:
+        cfgx2_shared_cmsinfo = _run_shared_stages(
+            cfgx2_qreq_, use_cache, st_cachedir, st_cachename,
+            verbose=verbose)
+
     cfgx2_cmsinfo = []
     cfgiter = subindexer_partial(range(len(cfgx2_qreq_)), lbl='pipe config',
                                  freq=1, adjust=False)
@@ -196,12 +219,11 @@ def make_single_testres(ibs, qaids, daids, pipecfg_list, cfgx2_lbl,
         with ut.Indenter(indent_prefix):
             # Run the test / read cache
             _need_compute = True
-            if use_cache:
-                # smaller cache for individual configuration runs
+            if cfgx in cfgx2_shared_cmsinfo:
+                cmsinfo = cfgx2_shared_cmsinfo.pop(cfgx)
+                _need_compute = False
+            elif use_cache:
                 st_cfgstr = qreq_.get_cfgstr(with_input=True)
-                st_cachedir = ut.unixjoin(bt_cachedir, 'small_tests')
-                st_cachename = 'smalltest'
-                ut.ensuredir(st_cachedir)
                 try:
                     cmsinfo = ut.load_cache(st_cachedir, st_cachename,
                                             st_cfgstr)
@@ -255,6 +277,52 @@ def make_single_testres(ibs, qaids, daids, pipecfg_list, cfgx2_lbl,
     return testres
 
 
+def _run_shared_stages(cfgx2_qreq_, use_cache, st_cachedir, st_cachename,
+                       verbose=None):
+    """
+    Executes the pipeline configs that are not in the small test cache
+    together, grouped by their nearest neighbor stage. Only one group of
+    chipmatches is held in memory at a time.
+
+    Returns:
+        dict: mapping from cfgx to cmsinfo of the executed configs
+    """
+    from ibeis.algo.hots import pipeline
+    from ibeis.algo.hots import match_chips4 as mc4
+    miss_cfgxs = []
+    for cfgx, qreq_ in enumerate(cfgx2_qreq_):
+        if use_cache and ut.util_cache.USE_CACHE:
+            # Only check for the file; the hits are loaded by the caller
+            st_cfgstr = qreq_.get_cfgstr(with_input=True)
+            # The same path ut.load_cache and ut.save_cache use
+            st_fpath = ut.Cacher(st_cachename, cfgstr=st_cfgstr,
+                                 cache_dir=st_cachedir, ext='.cPkl',
+                                 verbose=False).get_fpath()
+            if exists(st_fpath):
+                continue
+        if qreq_.qparams.pipeline_root == 'vsmany':
+            miss_cfgxs.append(cfgx)
+    nn_cfgstrs = [pipeline.get_pipeline_stage_cfgstrs(cfgx2_qreq_[cfgx])[0]
+                  for cfgx in miss_cfgxs]
+    cfgx2_cmsinfo = {}
+    for cfgxs in ut.group_items(miss_cfgxs, nn_cfgstrs).values():
+        if len(cfgxs) < 2:
+            # nothing to share, run normally
+            continue
+        ut.colorprint('[harn] sharing pipeline stages of configs %r' % (
+            cfgxs,), 'turquoise')
+        qreq_list = ut.take(cfgx2_qreq_, cfgxs)
+        cm_lists = mc4.submit_query_request_grid(qreq_list, verbose=verbose)
+        for cfgx, qreq_, cm_list in zip(cfgxs, qreq_list, cm_lists):
+            cmsinfo = test_result.build_cmsinfo(cm_list, qreq_)
+            if use_cache:
+                st_cfgstr = qreq_.get_cfgstr(with_input=True)
+                ut.save_cache(st_cachedir, st_cachename, st_cfgstr, cmsinfo)
+            cfgx2_cmsinfo[cfgx] = cmsinfo
+        del cm_lists
+    return cfgx2_cmsinfo
+
+
 if __name__ == '__main__':
     """
     CommandLine:
@@ -67,3 +67,28 @@
 #    makeinit.py
 #"""
 ## autogenerated __init__.py for: '/home/joncrall/code/ibeis/ibeis/init'
+
+
+import importlib
+
+
+# ``import ibeis`` used to import these as a side effect. They are now
+# imported on first attribute access, like the subsystems of ibeis itself.
+_SUBMODULES = ['filter_annots', 'main_commands', 'main_helpers', 'sysres']
+
+
+def __getattr__(key):
+    """
+    Lazily resolves the submodules of ibeis.init (PEP 562)
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> import ibeis
+        >>> assert callable(ibeis.init.main_helpers.testdata_qreq_)
+        >>> assert not hasattr(ibeis.init, 'not_a_real_attribute')
+    """
+    if key not in _SUBMODULES:
+        raise AttributeError('module %r has no attribute %r' % (__name__, key))
+    value = importlib.import_module(__name__ + '.' + key)
+    globals()[key] = value
+    return value
@@ -9,8 +9,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from ibeis.control import accessor_decors, controller_inject
 from ibeis.algo.hots import pipeline
 from flask import url_for, request, current_app  # NOQA
-from os.path import join, dirname, abspath, exists
-import cv2
+from os.path import join, dirname, abspath
 import numpy as np   # NOQA
 import utool as ut
 from ibeis.web import appfuncs as appf
@@ -217,18 +216,17 @@ def ensure_review_image(ibs, aid, cm, qreq_, view_orientation='vertical',
         >>> ut.show_if_requested()
     """
     from ibeis.gui import id_review_api
+    from ibeis.web import review_render
     # Get thumb path
-    match_thumb_path = ibs.get_match_thumbdir()
+    cache = review_render.get_review_image_cache(ibs)
     match_thumb_filename = id_review_api.get_match_thumb_fname(cm, aid, qreq_,
                                                                view_orientation=view_orientation,
                                                                draw_matches=draw_matches)
-    match_thumb_filepath = join(match_thumb_path, match_thumb_filename)
     if verbose:
-        print('Checking: %r' % (match_thumb_filepath, ))
+        print('Checking: %r' % (cache.fpath(match_thumb_filename), ))
 
-    if exists(match_thumb_filepath):
-        image = cv2.imread(match_thumb_filepath)
-    else:
+    image = cache.get(match_thumb_filename)
+    if image is None:
         render_config = {
             'dpi'              : 150,
             'draw_fmatches'    : draw_matches,
@@ -251,7 +249,7 @@ def ensure_review_image(ibs, aid, cm, qreq_, view_orientation='vertical',
         else:
             image = cm.render_single_annotmatch(qreq_, aid, **render_config)
         #image = vt.crop_out_imgfill(image, fillval=(255, 255, 255), thresh=64)
-        cv2.imwrite(match_thumb_filepath, image)
+        cache.put(match_thumb_filename, image)
     return image
 
 
@@ -871,6 +869,7 @@ def query_chips_graph_v2(ibs, annot_uuid_list=None,
         >>> query_chips_graph_v2.__globals__['current_app'] = old
     """
     from ibeis.web.graph_server import GraphClient
+    from ibeis.web import review_render
     print('[apis_query] Creating GraphClient')
 
     if annot_uuid_list is None:
@@ -906,6 +905,7 @@ def query_chips_graph_v2(ibs, annot_uuid_list=None,
         if creation_imageset_rowid_list is not None:
             graph_client.imagesets = creation_imageset_rowid_list
         graph_client.aids = aid_list
+        graph_client.render_service = review_render.get_review_render_service(ibs)
 
         config = {
             'manual.n_peek'   : GRAPH_CLIENT_PEEK,
@@ -957,7 +957,7 @@ def query_chips_graph_v2(ibs, annot_uuid_list=None,
 @register_ibs_method
 def review_graph_match_config_v2(ibs, graph_uuid, aid1=None, aid2=None,
                                  view_orientation='vertical', view_version=1):
-    from ibeis.algo.verif import pairfeat
+    from ibeis.web import review_render
     from flask import session
 
     EDGES_KEY = '_EDGES_'
@@ -1010,27 +1010,14 @@ def review_graph_match_config_v2(ibs, graph_uuid, aid1=None, aid2=None,
     annot_uuid_1 = str(ibs.get_annot_uuids(aid_1))
     annot_uuid_2 = str(ibs.get_annot_uuids(aid_2))
 
-    feat_extract_config = {
-        'match_config': ({} if graph_client.extr is None else
-                         graph_client.extr.match_config)
-    }
-    extr = pairfeat.PairwiseFeatureExtractor(ibs, config=feat_extract_config)
-
-    match = extr._exec_pairwise_match([edge])[0]
-
-    image_clean = ensure_review_image_v2(ibs, match,
-                                         view_orientation=view_orientation,
-                                         overlay=False)
-    # image_matches = ensure_review_image_v2(ibs, match, draw_matches=True,
-    #                                        view_orientation=view_orientation)
+    match_config = ({} if graph_client.extr is None else
+                    graph_client.extr.match_config)
+    service = review_render.get_review_render_service(ibs)
 
     print('Using View Version: %r' % (view_version, ))
-    if view_version == 1:
-        image_heatmask = ensure_review_image_v2(ibs, match, draw_heatmask=True,
-                                                view_orientation=view_orientation)
-    else:
-        image_heatmask = ensure_review_image_v2(ibs, match, draw_matches=True,
-                                                view_orientation=view_orientation)
+    image_clean, image_heatmask = service.get_images(
+        edge, match_config, view_orientation=view_orientation,
+        view_version=view_version)
 
     image_clean_src = appf.embed_image_html(image_clean)
     # image_matches_src = appf.embed_image_html(image_matches)
@@ -1105,6 +1092,17 @@ def review_graph_match_html_v2(ibs, graph_uuid, callback_url=None,
     return appf.template('turk', 'identification_insert', **embedded)
 
 
+@register_ibs_method
+@register_api('/api/status/query/graph/v2/render/', methods=['GET'], __api_plural_check__=False)
+def get_review_render_metrics(ibs):
+    """
+    Hit rate and latency of the review image cache and background renderer
+    """
+    from ibeis.web import review_render
+    service = review_render.get_review_render_service(ibs)
+    return service.metrics()
+
+
 @register_api('/api/status/query/graph/v2/', methods=['GET'], __api_plural_check__=False)
 def view_graphs_status(ibs):
     graph_dict = {}
@@ -1353,6 +1351,7 @@ def query_graph_v2_on_request_review(future):
         data_list = future.result()
         if data_list is not None:
             graph_client.update(data_list)
+            graph_client.prerender()
             callback_type = 'review'
         else:
             graph_client.update(None)
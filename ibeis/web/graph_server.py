@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 from ibeis.control import controller_inject
 import utool as ut
+import six
 import concurrent
 import random
 import time
@@ -94,6 +95,30 @@ def test_foo(future):
 
 GRAPH_ACTOR_CLASS = futures_actors.ProcessActor if ut.LINUX or ut.WIN32 else futures_actors.ThreadActor
 
+# Warm start graph sessions from AnnotInference snapshots
+USE_INFR_SNAPSHOT = not ut.get_argflag(('--nosnapshot', '--no-infr-snapshot'))
+
+
+def get_infr_snapshot_fpath(ibs, aids, table, config):
+    """
+    Snapshot path for a graph session. Sessions share a snapshot only if they
+    start from the same annotations, review table and config. Sessions
+    initialized from the annotmatch table also need the same annotmatch rows,
+    because only staging reviews are replayed onto a snapshot.
+    """
+    from os.path import join
+    dpath = ut.ensuredir((ibs.get_cachedir(), 'infr_snapshots'))
+    key = [list(aids), table, sorted(config.items())]
+    if table == 'annotmatch':
+        matches = ibs.annots(aids).matches()
+        key.append(list(zip(
+            matches._rowids, matches.evidence_decision_code,
+            matches.meta_decision_code, matches.case_tags,
+            matches.confidence_code, matches.count,
+            matches.posixtime_modified)))
+    hashstr = ut.hash_data(key)
+    return join(dpath, 'infr_snapshot_%s.npz' % (hashstr,))
+
 
 class GraphActor(GRAPH_ACTOR_CLASS):
     """
@@ -203,23 +228,45 @@ class GraphActor(GRAPH_ACTOR_CLASS):
         ibs = ibeis.opendb(dbdir=dbdir, use_cache=False, web=False,
                            force_serial=True)
 
-        # Create the AnnotInference
-        print('starting via actor with ibs = %r' % (ibs, ))
-        actor.infr = ibeis.AnnotInference(ibs=ibs, aids=aids, autoinit=True)
-        actor.infr.print('started via actor')
-        actor.infr.print('config = {}'.format(ut.repr3(config)))
-        # Configure query_annot_infr
-        for key in config:
-            actor.infr.params[key] = config[key]
-        # Initialize
-        # TODO: Initialize state from staging reviews after annotmatch
-        # timestamps (in case of crash)
-
-        actor.infr.print('Initializing infr tables')
         table = kwargs.get('init', 'staging')
-        actor.infr.reset_feedback(table, apply=True)
-        actor.infr.ensure_mst()
-        actor.infr.apply_nondynamic_update()
+        if isinstance(aids, six.string_types) and aids == 'all':
+            aids = ibs.get_valid_aids()
+
+        snapshot_fpath = None
+        if kwargs.get('use_snapshot', USE_INFR_SNAPSHOT):
+            snapshot_fpath = get_infr_snapshot_fpath(ibs, aids, table, config)
+            actor.infr = actor._load_snapshot(ibs, snapshot_fpath)
+
+        if actor.infr is not None:
+            # Warm start: only replay reviews staged after the snapshot
+            num_replayed = actor.infr.replay_staging_feedback()
+            actor.infr.print('warm started from snapshot, replayed %d reviews'
+                             % (num_replayed,))
+            save_snapshot = num_replayed > 0
+        else:
+            # Create the AnnotInference
+            print('starting via actor with ibs = %r' % (ibs, ))
+            actor.infr = ibeis.AnnotInference(ibs=ibs, aids=aids, autoinit=True)
+            actor.infr.print('started via actor')
+            actor.infr.print('config = {}'.format(ut.repr3(config)))
+            # Configure query_annot_infr
+            for key in config:
+                actor.infr.params[key] = config[key]
+            # Initialize
+            # TODO: Initialize state from staging reviews after annotmatch
+            # timestamps (in case of crash)
+
+            actor.infr.print('Initializing infr tables')
+            actor.infr.reset_feedback(table, apply=True)
+            actor.infr.ensure_mst()
+            actor.infr.apply_nondynamic_update()
+            save_snapshot = True
+
+        if snapshot_fpath is not None and save_snapshot:
+            try:
+                actor.infr.save_snapshot(snapshot_fpath)
+            except Exception as ex:
+                actor.infr.print('Could not save snapshot: {!r}'.format(ex))
 
         actor.infr.print('infr.status() = {}'.format(ut.repr4(actor.infr.status())))
 
@@ -235,6 +282,25 @@ class GraphActor(GRAPH_ACTOR_CLASS):
         actor.infr.start_id_review()
         return 'initialized'
 
+    def _load_snapshot(actor, ibs, snapshot_fpath):
+        """
+        Returns the snapshot AnnotInference if it is usable, otherwise None.
+        A snapshot is stale once the names of its annotations have changed.
+        """
+        import ibeis
+        from os.path import exists
+        if not exists(snapshot_fpath):
+            return None
+        try:
+            infr = ibeis.AnnotInference.load_snapshot(snapshot_fpath, ibs=ibs)
+        except Exception as ex:
+            print('Could not load snapshot: {!r}'.format(ex))
+            return None
+        if infr.orig_name_labels != ibs.get_annot_nids(infr.aids):
+            print('Snapshot is stale: annotation names have changed')
+            return None
+        return infr
+
     def continue_review(actor):
         # This will signal on_request_review with the same data
         user_request = actor.infr.continue_review()
@@ -399,6 +465,7 @@ class GraphClient(object):
         client.imagesets = None
         client.config = None
         client.extr = None
+        client.render_service = None
 
         if autoinit:
             client.initialize()
@@ -518,6 +585,20 @@ class GraphClient(object):
                         client.review_vip = edge
                 client.review_dict[edge] = (priority, edge_data_dict, )
 
+    def prerender(client):
+        """
+        Starts rendering the review images of the queued edges in the
+        background, in the order they will most likely be shown.
+        """
+        if client.render_service is None or not client.review_dict:
+            return
+        edges = list(client.review_dict.keys())
+        if client.review_vip in client.review_dict:
+            edges.remove(client.review_vip)
+            edges.insert(0, client.review_vip)
+        match_config = {} if client.extr is None else client.extr.match_config
+        client.render_service.prerender(edges, match_config)
+
     def check(client, edge):
         if edge not in client.review_dict:
             return None
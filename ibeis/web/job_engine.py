@@ -49,6 +49,15 @@ Notes:
 
     And then running the forground process
         python -m ibeis.web.job_engine job_engine_tester --fg
+
+    Jobs are routed into named lanes (see JOB_LANES and ACTION_LANES). Each
+    lane has a priority, and the engine queue hands work to idle engines by
+    priority with fair sharing between lanes of equal priority. By default a
+    single engine serves every lane; --fast-lane-engines=N adds engines that
+    only take fast lane work. Lane priorities only order the pending jobs, so
+    without fast lane engines a detection job still waits for a running
+    identification query to finish. The tester prints the queue-depth and
+    wait-time metrics of each lane.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 #if False:
@@ -57,9 +66,8 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import utool as ut
 import time
 import zmq
-import uuid  # NOQA
+import uuid
 import numpy as np
-import shelve
 import random
 from os.path import join
 from functools import partial
@@ -78,6 +86,35 @@ URL = 'tcp://127.0.0.1'
 NUM_ENGINES = 1
 VERBOSE_JOBS = ut.get_argflag('--bg') or ut.get_argflag('--fg') or ut.get_argflag('--verbose-jobs')
 
+# Extra engines reserved for the fast lane. Each engine opens the database,
+# so by default the single slow lane engine also serves the fast lane. It
+# takes fast jobs first, but can not preempt a running slow job.
+NUM_FAST_ENGINES = ut.get_argval(
+    '--fast-lane-engines', type_=int, default=0,
+    help_=('number of engines reserved for the fast lane. With 0 (the '
+           'default) fast jobs wait for any running slow job to finish'))
+
+# Named job lanes. Each lane owns ``num_engines`` engines. An idle engine takes
+# work from its own lane or from a lane with a higher priority, and lanes of
+# equal priority split engines in proportion to their ``share``.
+JOB_LANES = ut.odict([
+    ('fast', dict(num_engines=NUM_FAST_ENGINES, priority=1, share=1)),
+    ('slow', dict(num_engines=NUM_ENGINES, priority=0, share=1)),
+])
+# Actions that do not run in DEFAULT_LANE
+ACTION_LANES = {
+    'query_chips_simple_dict': 'slow',
+    'query_chips_graph': 'slow',
+    'load_identification_query_object_worker': 'slow',
+}
+DEFAULT_LANE = 'fast'
+
+# Completed job results are kept in this sqlite file in the database cache
+# directory for JOB_RESULT_TTL seconds
+JOB_STORE_FNAME = 'jobs.sqlite3'
+JOB_RESULT_TTL = ut.get_argval('--job-result-ttl', type_=float, default=14 * 24 * 60 * 60)
+JOB_PRUNE_INTERVAL = 60 * 60
+
 
 def update_proctitle(procname):
     try:
@@ -247,6 +284,16 @@ def get_job_status(ibs, jobid):
     return status
 
 
+@register_ibs_method
+@register_api('/api/engine/lane/metrics/', methods=['GET', 'POST'], __api_plural_check__=False)
+def get_job_lane_metrics(ibs):
+    """
+    Web call that returns the queue depth and wait times of each job lane
+    """
+    reply = ibs.job_manager.jobiface.get_lane_metrics()
+    return reply['lane_metrics']
+
+
 @register_ibs_method
 @register_api('/api/engine/job/result/', methods=['GET', 'POST'])
 def get_job_result(ibs, jobid):
@@ -329,17 +376,26 @@ def job_engine_tester():
         identify_jobid = jobiface.queue_job('query_chips_simple_dict',
                                             callback_url, callback_method,
                                             *args, **kwargs)
+        # Short jobs run in the fast lane. With --fast-lane-engines they do
+        # not wait on the query. Without it they run once the query is done.
+        for time_ in [.1, .2, .3]:
+            jobid = jobiface.queue_job('helloworld', callback_url,
+                                       callback_method, time_)
+            jobid_list.append(jobid)
         for jobid in jobid_list:
             jobiface.wait_for_job_result(jobid)
 
         jobiface.wait_for_job_result(identify_jobid)
+        reply = jobiface.get_lane_metrics()
+        print('lane_metrics = %s' % (ut.repr3(reply['lane_metrics']),))
     print('FINISHED TEST SCRIPT')
 
 
 class JobBackend(object):
-    def __init__(self, **kwargs):
+    def __init__(self, lanes=None, **kwargs):
         #self.num_engines = 3
-        self.num_engines = NUM_ENGINES
+        self.lanes = JOB_LANES if lanes is None else lanes
+        self.num_engines = sum(lane['num_engines'] for lane in self.lanes.values())
         self.engine_queue_proc = None
         self.collect_queue_proc = None
         self.engine_procs = None
@@ -419,21 +475,25 @@ class JobBackend(object):
             return proc
 
         if self.spawn_queue:
-            self.engine_queue_proc = _spawner(engine_queue_loop, self.port_dict)
+            self.engine_queue_proc = _spawner(engine_queue_loop, self.port_dict, self.lanes)
             self.collect_queue_proc = _spawner(collect_queue_loop, self.port_dict)
         if self.spawn_collector:
             self.collect_proc = _spawner(collector_loop, self.port_dict, dbdir, containerized)
         if self.spawn_engine:
             if self.fg_engine:
                 print('ENGINE IS IN DEBUG FOREGROUND MODE')
-                # Spawn engine in foreground process
-                assert self.num_engines == 1, 'fg engine only works with one engine'
-                engine_loop(0, self.port_dict, dbdir)
+                # Spawn a single engine that serves every lane in the
+                # foreground process
+                engine_loop(0, self.port_dict, dbdir, lane=None)
                 assert False, 'should never see this'
             else:
                 # Normal case
-                self.engine_procs = [_spawner(engine_loop, i, self.port_dict, dbdir)
-                                      for i in range(self.num_engines)]
+                engine_lanes = [
+                    lane for lane, lanecfg in self.lanes.items()
+                    for _ in range(lanecfg['num_engines'])
+                ]
+                self.engine_procs = [_spawner(engine_loop, i, self.port_dict, dbdir, lane)
+                                      for i, lane in enumerate(engine_lanes)]
         # wait for processes to spin up
         if self.spawn_queue:
             assert self.engine_queue_proc.is_alive(), 'engine died too soon'
@@ -524,6 +584,23 @@ class JobInterface(object):
             jobid = reply_notify['jobid']
             return jobid
 
+    def get_lane_metrics(jobiface):
+        """
+        Asks the engine queue for queue-depth and wait-time metrics per lane
+        """
+        with ut.Indenter('[client %d] ' % (jobiface.id_)):
+            print = partial(ut.colorprint, color='teal')
+            if jobiface.verbose >= 1:
+                print('----')
+                print('Request lane metrics')
+            # CALLS: engine_queue
+            jobiface.engine_deal_sock.send_json({'control': 'lane_metrics'})
+            # RETURNED FROM: job_client_lane_metrics
+            reply = jobiface.engine_deal_sock.recv_json()
+            if jobiface.verbose >= 2:
+                print('got reply = %s' % (ut.repr2(reply, truncate=True),))
+        return reply
+
     def get_job_id_list(jobiface):
         with ut.Indenter('[client %d] ' % (jobiface.id_)):
             print = partial(ut.colorprint, color='teal')
@@ -677,9 +754,241 @@ def make_queue_loop(name='collect'):
 collect_queue_loop = make_queue_loop(name='collect')
 
 
-def engine_queue_loop(port_dict):
+class JobLaneScheduler(object):
+    """
+    Per-lane job queues and engine bookkeeping used by the engine queue.
+
+    Jobs are routed to a lane by action (see ACTION_LANES). When an engine
+    reports that it is ready it is given the oldest job from the eligible lane
+    with the highest priority. Eligible lanes are its own lane and every lane
+    with a higher priority, so slow engines help drain fast work but fast
+    engines never pick up slow work. Ties in priority go to the lane that has
+    had the fewest dispatches relative to its share.
+
+    Args:
+        lanes (dict): maps lane names to dicts with num_engines, priority and
+            share (default = JOB_LANES)
+        action_lanes (dict): maps actions to lanes (default = ACTION_LANES)
+        default_lane (str): lane of unlisted actions (default = DEFAULT_LANE)
+
+    CommandLine:
+        python -m ibeis.web.job_engine JobLaneScheduler
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.web.job_engine import *  # NOQA
+        >>> lanes = ut.odict([
+        >>>     ('fast', dict(num_engines=1, priority=1, share=1)),
+        >>>     ('slow', dict(num_engines=1, priority=0, share=1)),
+        >>> ])
+        >>> sched = JobLaneScheduler(lanes, {'query': 'slow'}, 'fast')
+        >>> sched.enqueue('job1', 'q1', action='query', now=0)
+        >>> sched.enqueue('job2', 'q2', action='query', now=0)
+        >>> sched.enqueue('job3', 'd1', action='detect', now=1)
+        >>> sched.engine_ready('e_slow', 'slow', now=2)
+        >>> # The slow engine prefers the higher priority fast job
+        >>> print(sched.dispatch(now=2))
+        [('e_slow', 'job3', 'd1')]
+        >>> sched.engine_ready('e_fast', 'fast', now=3)
+        >>> # The fast engine never takes slow work
+        >>> print(sched.dispatch(now=3))
+        []
+        >>> sched.engine_ready('e_slow', 'slow', now=4)
+        >>> print(sched.dispatch(now=4))
+        [('e_slow', 'job1', 'q1')]
+        >>> metrics = sched.get_metrics(now=5)
+        >>> print(ut.repr4(ut.dict_subset(metrics['fast'], [
+        >>>     'queue_depth', 'running', 'completed', 'wait_max'])))
+        >>> print(ut.repr4(ut.dict_subset(metrics['slow'], [
+        >>>     'queue_depth', 'running', 'completed', 'wait_max', 'oldest_wait'])))
+        {
+            'queue_depth': 0,
+            'running': 0,
+            'completed': 1,
+            'wait_max': 1,
+        }
+        {
+            'queue_depth': 1,
+            'running': 1,
+            'completed': 0,
+            'wait_max': 4,
+            'oldest_wait': 5,
+        }
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.web.job_engine import *  # NOQA
+        >>> # Lanes of equal priority split a shared engine by their shares
+        >>> lanes = {'a': dict(num_engines=0, priority=0, share=2),
+        >>>          'b': dict(num_engines=0, priority=0, share=1)}
+        >>> sched = JobLaneScheduler(lanes, {'a': 'a', 'b': 'b'}, 'a')
+        >>> for count in range(6):
+        >>>     sched.enqueue('a%d' % count, None, action='a', now=0)
+        >>>     sched.enqueue('b%d' % count, None, action='b', now=0)
+        >>> order = []
+        >>> for count in range(6):
+        >>>     sched.engine_ready('shared', None, now=count)
+        >>>     order.extend([jobid for _, jobid, _ in sched.dispatch(now=count)])
+        >>> print(order)
+        ['a0', 'b0', 'a1', 'a2', 'b1', 'a3']
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.web.job_engine import *  # NOQA
+        >>> # With --fast-lane-engines=0 a fast job that arrives while the only
+        >>> # engine runs a slow job waits until that job is done
+        >>> lanes = ut.odict([
+        >>>     ('fast', dict(num_engines=0, priority=1, share=1)),
+        >>>     ('slow', dict(num_engines=1, priority=0, share=1)),
+        >>> ])
+        >>> sched = JobLaneScheduler(lanes, {'query': 'slow'}, 'fast')
+        >>> sched.enqueue('query1', None, action='query', now=0)
+        >>> sched.engine_ready('e_slow', 'slow', now=0)
+        >>> print(sched.dispatch(now=0))
+        [('e_slow', 'query1', None)]
+        >>> sched.enqueue('detect1', None, action='detect', now=1)
+        >>> print(sched.dispatch(now=2))
+        []
+        >>> sched.engine_ready('e_slow', 'slow', now=3600)
+        >>> print(sched.dispatch(now=3600))
+        [('e_slow', 'detect1', None)]
+        >>> print(sched.get_metrics(now=3600)['fast']['wait_max'])
+        3599
+    """
+    def __init__(sched, lanes=None, action_lanes=None, default_lane=None):
+        import collections
+        sched.lanes = JOB_LANES if lanes is None else lanes
+        sched.action_lanes = ACTION_LANES if action_lanes is None else action_lanes
+        sched.default_lane = DEFAULT_LANE if default_lane is None else default_lane
+        assert sched.default_lane in sched.lanes, 'unknown default lane'
+        # lane -> deque of (jobid, payload, enqueue_time)
+        sched.pending = {lane: collections.deque() for lane in sched.lanes}
+        # engine -> lane it belongs to
+        sched.engine_lane = {}
+        # idle engines in the order they became ready
+        sched.idle = ut.odict()
+        # engine -> (lane, jobid, dispatch_time)
+        sched.running = {}
+        sched.stats = {
+            lane: dict(dispatched=0, completed=0, wait_total=0.0,
+                       wait_max=0.0, run_total=0.0)
+            for lane in sched.lanes
+        }
+
+    def lane_of(sched, action):
+        lane = sched.action_lanes.get(action, sched.default_lane)
+        if lane not in sched.lanes:
+            lane = sched.default_lane
+        return lane
+
+    def enqueue(sched, jobid, payload, action=None, now=None):
+        """
+        Adds a job to the queue of its lane and returns the lane name.
+        The action is read from the payload's engine request if not given.
+        """
+        if now is None:
+            now = time.time()
+        if action is None:
+            action = payload[-1]['action']
+        lane = sched.lane_of(action)
+        sched.pending[lane].append((jobid, payload, now))
+        return lane
+
+    def engine_ready(sched, engine, lane, now=None):
+        """
+        Marks an engine idle. If it was running a job, that job is recorded as
+        completed. A lane of None means the engine serves every lane.
+        """
+        if now is None:
+            now = time.time()
+        sched.engine_lane[engine] = lane
+        if engine in sched.running:
+            job_lane, jobid, start = sched.running.pop(engine)
+            stats = sched.stats[job_lane]
+            stats['completed'] += 1
+            stats['run_total'] += now - start
+        sched.idle[engine] = True
+
+    def _pick_lane(sched, engine_lane):
+        best_lane = None
+        best_key = None
+        floor = (None if engine_lane is None else
+                 sched.lanes[engine_lane]['priority'])
+        for lane, lanecfg in sched.lanes.items():
+            if not sched.pending[lane]:
+                continue
+            if floor is not None and lane != engine_lane and lanecfg['priority'] <= floor:
+                continue
+            usage = sched.stats[lane]['dispatched'] / float(lanecfg.get('share', 1))
+            key = (lanecfg['priority'], -usage)
+            if best_key is None or key > best_key:
+                best_lane, best_key = lane, key
+        return best_lane
+
+    def dispatch(sched, now=None):
+        """
+        Assigns queued jobs to idle engines.
+
+        Returns:
+            list: of (engine, jobid, payload) tuples to send
+        """
+        if now is None:
+            now = time.time()
+        def _engine_priority(engine):
+            lane = sched.engine_lane[engine]
+            # Engines of high priority lanes choose first so they claim their
+            # own work before lower lanes help out.
+            return float('inf') if lane is None else sched.lanes[lane]['priority']
+        assignments = []
+        for engine in sorted(sched.idle, key=_engine_priority, reverse=True):
+            lane = sched._pick_lane(sched.engine_lane[engine])
+            if lane is None:
+                continue
+            jobid, payload, queued = sched.pending[lane].popleft()
+            wait = now - queued
+            stats = sched.stats[lane]
+            stats['dispatched'] += 1
+            stats['wait_total'] += wait
+            stats['wait_max'] = max(stats['wait_max'], wait)
+            del sched.idle[engine]
+            sched.running[engine] = (lane, jobid, now)
+            assignments.append((engine, jobid, payload))
+        return assignments
+
+    def get_metrics(sched, now=None):
+        """
+        Returns queue depth, running jobs and wait / run times for each lane
+        """
+        if now is None:
+            now = time.time()
+        metrics = ut.odict()
+        for lane, lanecfg in sched.lanes.items():
+            stats = sched.stats[lane]
+            pending = sched.pending[lane]
+            num_running = sum(job_lane == lane for job_lane, _, _ in
+                              sched.running.values())
+            metrics[lane] = ut.odict([
+                ('num_engines', lanecfg['num_engines']),
+                ('priority', lanecfg['priority']),
+                ('share', lanecfg.get('share', 1)),
+                ('queue_depth', len(pending)),
+                ('running', num_running),
+                ('dispatched', stats['dispatched']),
+                ('completed', stats['completed']),
+                ('wait_mean', stats['wait_total'] / max(stats['dispatched'], 1)),
+                ('wait_max', stats['wait_max']),
+                ('oldest_wait', (now - pending[0][2]) if pending else 0.0),
+                ('run_mean', stats['run_total'] / max(stats['completed'], 1)),
+            ])
+        return metrics
+
+
+def engine_queue_loop(port_dict, lanes=None):
     """
     Specialized queue loop
+
+    Jobs are held in per-lane queues by a :class:`JobLaneScheduler` and are
+    only handed to an engine once that engine reports that it is ready.
     """
     # Flow of information tags:
     # NAME: engine_queue
@@ -698,8 +1007,9 @@ def engine_queue_loop(port_dict):
         rout_sock.bind(iface1)
         if VERBOSE_JOBS:
             print('bind %s_url2 = %r' % (name, iface1,))
-        # bind the server router to the queue dealer
-        deal_sock = ctx.socket(zmq.DEALER)
+        # bind the engine dealers to the queue router. Engines announce
+        # themselves and are addressed individually by identity.
+        deal_sock = ctx.socket(zmq.ROUTER)
         deal_sock.setsockopt_string(zmq.IDENTITY, 'special_queue.' + name + '.' + 'DEALER')
         deal_sock.bind(iface2)
         if VERBOSE_JOBS:
@@ -711,6 +1021,7 @@ def engine_queue_loop(port_dict):
         if VERBOSE_JOBS:
             print('connect collect_url1 = %r' % (port_dict['collect_url1'],))
         job_counter = 0
+        scheduler = JobLaneScheduler(lanes)
 
         # but this shows what is really going on:
         poller = zmq.Poller()
@@ -721,13 +1032,24 @@ def engine_queue_loop(port_dict):
                 evts = dict(poller.poll())
                 if rout_sock in evts:
                     # HACK GET REQUEST FROM CLIENT
-                    job_counter += 1
                     # CALLER: job_client
                     idents, engine_request = rcv_multipart_json(rout_sock, num=1, print=print)
 
+                    if engine_request.get('control', None) == 'lane_metrics':
+                        # CALLER: job_client_lane_metrics
+                        reply = {
+                            'status': 'ok',
+                            'lane_metrics': scheduler.get_metrics(),
+                        }
+                        send_multipart_json(rout_sock, idents, reply)
+                        continue
+
+                    job_counter += 1
                     #jobid = 'result_%s' % (id_,)
-                    #jobid = 'result_%s' % (uuid.uuid4(),)
-                    jobid = 'jobid-%04d' % (job_counter,)
+                    #jobid = 'jobid-%04d' % (job_counter,)
+                    # Job statuses outlive the queue, so ids must be unique
+                    # across restarts
+                    jobid = 'jobid-%s' % (uuid.uuid4(),)
                     if VERBOSE_JOBS:
                         print('Creating jobid %r' % (jobid,))
 
@@ -748,19 +1070,29 @@ def engine_queue_loop(port_dict):
                         print('... notifying client that job was accepted')
                     # RETURNS: job_client_return
                     send_multipart_json(rout_sock, idents, reply_notify)
+                    lane = scheduler.enqueue(jobid, (idents, engine_request))
                     if VERBOSE_JOBS:
-                        print('... notifying backend engine to start')
-                    # CALL: engine_
-                    send_multipart_json(deal_sock, idents, engine_request)
+                        print('... queued %r in lane %r' % (jobid, lane))
                 if deal_sock in evts:
-                    pass
+                    # CALLER: engine_ready
+                    engine_idents, engine_msg = rcv_multipart_json(deal_sock, num=1, print=print)
+                    engine_ident = engine_idents[0]
+                    scheduler.engine_ready(engine_ident, engine_msg['lane'])
+                for engine_ident, jobid, payload in scheduler.dispatch():
+                    idents, engine_request = payload
+                    if VERBOSE_JOBS:
+                        print('... notifying backend engine %r to start %r' % (
+                            engine_ident, jobid))
+                    # CALL: engine_
+                    send_multipart_json(deal_sock, [engine_ident] + idents,
+                                        engine_request)
         except KeyboardInterrupt:
             print('Caught ctrl+c in %s queue. Gracefully exiting' % (loop_name,))
         if VERBOSE_JOBS:
             print('Exiting %s queue' % (loop_name,))
 
 
-def engine_loop(id_, port_dict, dbdir=None):
+def engine_loop(id_, port_dict, dbdir=None, lane=None):
     r"""
     IBEIS:
         This will be part of a worker process with its own IBEISController
@@ -769,7 +1101,9 @@ def engine_loop(id_, port_dict, dbdir=None):
         Needs to send where the results will go and then publish the results there.
 
     The engine_loop - receives messages, performs some action, and sends a reply,
-    preserving the leading two message parts as routing identities
+    preserving the leading message part as the routing identity. The engine
+    tells the queue which lane it belongs to (None serves every lane) and
+    asks for new work each time it finishes a job.
     """
     # NAME: engine_
     # CALLED_FROM: engine_queue
@@ -779,17 +1113,21 @@ def engine_loop(id_, port_dict, dbdir=None):
     print = partial(ut.colorprint, color='darkred')
     with ut.Indenter('[engine %d] ' % (id_)):
         if VERBOSE_JOBS:
-            print('Initializing engine')
+            print('Initializing engine in lane=%r' % (lane,))
             print('connect engine_url2 = %r' % (port_dict['engine_url2'],))
         assert dbdir is not None
         #ibs = ibeis.opendb(dbname)
         ibs = ibeis.opendb(dbdir=dbdir, use_cache=False, web=False, force_serial=True)
 
-        engine_rout_sock = ctx.socket(zmq.ROUTER)
-        engine_rout_sock.connect(port_dict['engine_url2'])
+        engine_deal_sock = ctx.socket(zmq.DEALER)
+        engine_deal_sock.setsockopt_string(zmq.IDENTITY, 'engine.%s.%d.DEALER' % (lane, id_))
+        engine_deal_sock.connect(port_dict['engine_url2'])
+        ready_msg = {'action': 'ready', 'lane': lane}
+        # CALLS: engine_ready
+        engine_deal_sock.send_json(ready_msg)
 
         collect_deal_sock = ctx.socket(zmq.DEALER)
-        collect_deal_sock.setsockopt_string(zmq.IDENTITY, 'engine.collect.DEALER')
+        collect_deal_sock.setsockopt_string(zmq.IDENTITY, 'engine.%s.%d.collect.DEALER' % (lane, id_))
         collect_deal_sock.connect(port_dict['collect_url1'])
         if VERBOSE_JOBS:
             print('connect collect_url1 = %r' % (port_dict['collect_url1'],))
@@ -797,7 +1135,7 @@ def engine_loop(id_, port_dict, dbdir=None):
 
         try:
             while True:
-                idents, engine_request = rcv_multipart_json(engine_rout_sock, print=print)
+                idents, engine_request = rcv_multipart_json(engine_deal_sock, num=1, print=print)
 
                 action = engine_request['action']
                 jobid  = engine_request['jobid']
@@ -810,7 +1148,7 @@ def engine_loop(id_, port_dict, dbdir=None):
 
                 # Store results in the collector
                 collect_request = dict(
-                    idents=idents,
+                    idents=[ident.decode('utf-8') for ident in idents],
                     action='store',
                     jobid=jobid,
                     engine_result=engine_result,
@@ -821,6 +1159,8 @@ def engine_loop(id_, port_dict, dbdir=None):
                     print('...done working. pushing result to collector')
                 # CALLS: collector_store
                 collect_deal_sock.send_json(collect_request)
+                # CALLS: engine_ready
+                engine_deal_sock.send_json(ready_msg)
         except KeyboardInterrupt:
             print('Caught ctrl+c in engine loop. Gracefully exiting')
         # ----
@@ -861,6 +1201,180 @@ def on_engine_request(ibs, jobid, action, args, kwargs):
     return engine_result
 
 
+class JobResultStore(object):
+    """
+    SQLite table of job statuses and results used by the collector.
+
+    The database runs in WAL mode so status polls are not blocked by result
+    writes. Rows are keyed by jobid and indexed by status and update time, so
+    status and result lookups are single index reads and old results can be
+    pruned without scanning. Statuses survive collector restarts. Jobs that
+    are still working when a store is opened were lost by the engines of a
+    previous run, so they are completed with an exception result (and then
+    expire like any other result).
+
+    Args:
+        fpath (str): path to the sqlite file (':memory:' for a temporary one)
+        ttl (float): seconds to keep completed jobs (default = JOB_RESULT_TTL)
+
+    CommandLine:
+        python -m ibeis.web.job_engine JobResultStore
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.web.job_engine import *  # NOQA
+        >>> store = JobResultStore(':memory:', ttl=60)
+        >>> store.notify('job1', now=0)
+        >>> store.notify('job2', now=0)
+        >>> print(store.get_status('job1'))
+        ('working', None)
+        >>> store.store_result('job1', {'exec_status': 'ok', 'json_result': '1'}, now=10)
+        >>> print(store.get_status('job1'))
+        ('completed', 'ok')
+        >>> print(ut.repr2(store.get_result('job1'), sorted_=True))
+        {'exec_status': 'ok', 'json_result': '1'}
+        >>> print(store.get_status('badjob'))
+        None
+        >>> print(store.get_jobids())
+        ['job1']
+        >>> # Completed results expire, working jobs are kept
+        >>> print(store.prune(now=100))
+        1
+        >>> print(store.get_jobids(status=None))
+        ['job2']
+        >>> # Reopening the store completes jobs lost by a restart
+        >>> from os.path import join
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'testfiles')
+        >>> fpath = join(dpath, 'test_job_store.sqlite3')
+        >>> ut.delete(fpath, verbose=False)
+        >>> store = JobResultStore(fpath, ttl=60)
+        >>> store.notify('job3', now=0)
+        >>> store.close()
+        >>> store = JobResultStore(fpath, ttl=60)
+        >>> print(store.get_status('job3'))
+        ('completed', 'exception')
+        >>> print(store.get_result('job3')['json_result'])
+        "Job was lost when the job engine restarted"
+        >>> store.close()
+        >>> ut.delete(fpath, verbose=False)
+    """
+    def __init__(store, fpath, ttl=None):
+        import sqlite3
+        store.fpath = fpath
+        store.ttl = JOB_RESULT_TTL if ttl is None else ttl
+        store.connection = sqlite3.connect(fpath)
+        store.connection.execute('PRAGMA journal_mode=WAL')
+        store.connection.execute('PRAGMA synchronous=NORMAL')
+        with store.connection:
+            store.connection.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    jobid TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    exec_status TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    result BLOB
+                )
+                ''')
+            store.connection.execute(
+                'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated)')
+        store._last_prune = None
+        store.mark_lost()
+
+    def close(store):
+        store.connection.close()
+
+    def notify(store, jobid, now=None):
+        """ Records a job that was accepted but has not finished """
+        if now is None:
+            now = time.time()
+        with store.connection:
+            store.connection.execute(
+                'INSERT OR REPLACE INTO jobs (jobid, status, created, updated) '
+                'VALUES (?, ?, ?, ?)', (jobid, 'working', now, now))
+
+    def store_result(store, jobid, engine_result, now=None):
+        """ Records the result of a finished job """
+        if now is None:
+            now = time.time()
+        blob = ut.to_json(engine_result).encode('utf-8')
+        with store.connection:
+            store.connection.execute(
+                'INSERT OR REPLACE INTO jobs '
+                '(jobid, status, exec_status, created, updated, result) '
+                'VALUES (?, ?, ?, COALESCE((SELECT created FROM jobs WHERE jobid = ?), ?), ?, ?)',
+                (jobid, 'completed', engine_result['exec_status'], jobid, now,
+                 now, blob))
+
+    def mark_lost(store, now=None):
+        """
+        Completes every working job with an exception result and returns how
+        many there were. Called when the store is opened.
+        """
+        jobids = store.get_jobids(status='working')
+        for jobid in jobids:
+            engine_result = dict(
+                exec_status='exception',
+                json_result=ut.to_json('Job was lost when the job engine restarted'),
+                jobid=jobid,
+            )
+            store.store_result(jobid, engine_result, now=now)
+        return len(jobids)
+
+    def get_status(store, jobid):
+        """
+        Returns:
+            tuple: (status, exec_status) or None if the job is unknown
+        """
+        row = store.connection.execute(
+            'SELECT status, exec_status FROM jobs WHERE jobid = ?',
+            (jobid,)).fetchone()
+        return None if row is None else tuple(row)
+
+    def get_result(store, jobid):
+        """ Returns the stored engine result. Raises KeyError if there is none """
+        row = store.connection.execute(
+            'SELECT result FROM jobs WHERE jobid = ?', (jobid,)).fetchone()
+        if row is None or row[0] is None:
+            raise KeyError(jobid)
+        return ut.from_json(bytes(row[0]).decode('utf-8'))
+
+    def get_jobids(store, status='completed'):
+        if status is None:
+            cursor = store.connection.execute(
+                'SELECT jobid FROM jobs ORDER BY created')
+        else:
+            cursor = store.connection.execute(
+                'SELECT jobid FROM jobs WHERE status = ? ORDER BY updated',
+                (status,))
+        return [row[0] for row in cursor]
+
+    def prune(store, now=None):
+        """
+        Deletes completed jobs older than the ttl and returns how many were
+        removed.
+        """
+        if now is None:
+            now = time.time()
+        store._last_prune = now
+        if not store.ttl or store.ttl <= 0:
+            return 0
+        with store.connection:
+            cursor = store.connection.execute(
+                'DELETE FROM jobs WHERE status = ? AND updated < ?',
+                ('completed', now - store.ttl))
+        return cursor.rowcount
+
+    def maybe_prune(store, now=None):
+        """ Prunes at most once every JOB_PRUNE_INTERVAL seconds """
+        if now is None:
+            now = time.time()
+        if store._last_prune is None or now - store._last_prune >= JOB_PRUNE_INTERVAL:
+            return store.prune(now)
+        return 0
+
+
 def collector_loop(port_dict, dbdir, containerized):
     """
     Service that stores completed algorithm results
@@ -876,13 +1390,8 @@ def collector_loop(port_dict, dbdir, containerized):
             print('connect collect_url2  = %r' % (port_dict['collect_url2'],))
 
         ibs = ibeis.opendb(dbdir=dbdir, use_cache=False, web=False)
-        # shelve_path = join(ut.get_shelves_dir(appname='ibeis'), 'engine')
-        shelve_path = ibs.get_shelves_path()
-        ut.delete(shelve_path)
-        ut.ensuredir(shelve_path)
-
-        collecter_data = {}
-        awaiting_data = {}
+        job_store = JobResultStore(join(ibs.get_cachedir(), JOB_STORE_FNAME))
+        job_store.maybe_prune()
         try:
             while True:
                 # several callers here
@@ -892,8 +1401,7 @@ def collector_loop(port_dict, dbdir, containerized):
                 # CALLER: collector_request_result
                 idents, collect_request = rcv_multipart_json(collect_rout_sock, print=print)
                 try:
-                    reply = on_collect_request(collect_request, collecter_data,
-                                               awaiting_data, shelve_path,
+                    reply = on_collect_request(collect_request, job_store,
                                                containerized=containerized)
                 except Exception as ex:
                     print(ut.repr3(collect_request))
@@ -901,12 +1409,12 @@ def collector_loop(port_dict, dbdir, containerized):
                 send_multipart_json(collect_rout_sock, idents, reply)
         except KeyboardInterrupt:
             print('Caught ctrl+c in collector loop. Gracefully exiting')
+        job_store.close()
         if VERBOSE_JOBS:
             print('Exiting collector')
 
 
-def on_collect_request(collect_request, collecter_data, awaiting_data, shelve_path,
-                       containerized=False):
+def on_collect_request(collect_request, job_store, containerized=False):
     """ Run whenever the collector recieves a message """
     import requests
     reply = {}
@@ -916,10 +1424,7 @@ def on_collect_request(collect_request, collecter_data, awaiting_data, shelve_pa
     if action == 'notification':
         # From the Queue
         jobid = collect_request['jobid']
-        awaiting_data[jobid] = collect_request['text']
-        # Make waiting lock
-        lock_filepath = join(shelve_path, '%s.lock' % (jobid, ))
-        ut.touch(lock_filepath)
+        job_store.notify(jobid)
     elif action == 'store':
         # From the Engine
         engine_result = collect_request['engine_result']
@@ -930,21 +1435,8 @@ def on_collect_request(collect_request, collecter_data, awaiting_data, shelve_pa
         if containerized:
             callback_url = callback_url.replace('://localhost/', '://wildbook:8080/')
 
-        # OLD METHOD
-        # collecter_data[jobid] = engine_result
-        collecter_data[jobid] = engine_result['exec_status']
-
-        # NEW METHOD
-        shelve_filepath = join(shelve_path, '%s.shelve' % (jobid, ))
-        shelf = shelve.open(shelve_filepath, writeback=True)
-        try:
-            shelf[str('result')] = engine_result
-        finally:
-            shelf.close()
-
-        # Delete the lock
-        lock_filepath = join(shelve_path, '%s.lock' % (jobid, ))
-        ut.delete(lock_filepath)
+        job_store.store_result(jobid, engine_result)
+        job_store.maybe_prune()
 
         if callback_url is not None:
             if callback_method is None:
@@ -983,32 +1475,24 @@ def on_collect_request(collect_request, collecter_data, awaiting_data, shelve_pa
     elif action == 'job_status':
         # From a Client
         jobid = collect_request['jobid']
-        if jobid in collecter_data:
+        status = job_store.get_status(jobid)
+        if status is None:
+            reply['jobstatus'] = 'unknown'
+        elif status[0] == 'completed':
             reply['jobstatus'] = 'completed'
-            reply['exec_status'] = collecter_data[jobid]
-        elif jobid in awaiting_data:
-            reply['jobstatus'] = 'working'
+            reply['exec_status'] = status[1]
         else:
-            reply['jobstatus'] = 'unknown'
+            reply['jobstatus'] = 'working'
         reply['status'] = 'ok'
         reply['jobid'] = jobid
     elif action == 'job_id_list':
         reply['status'] = 'ok'
-        reply['jobid_list'] = list(collecter_data.keys())
+        reply['jobid_list'] = job_store.get_jobids(status='completed')
     elif action == 'job_result':
         # From a Client
         jobid = collect_request['jobid']
         try:
-            # OLD METHOD
-            # engine_result = collecter_data[jobid]
-            # NEW METHOD
-            shelve_filepath = join(shelve_path, '%s.shelve' % (jobid, ))
-            shelf = shelve.open(shelve_filepath)
-            try:
-                engine_result = shelf[str('result')]
-            finally:
-                shelf.close()
-
+            engine_result = job_store.get_result(jobid)
             json_result = engine_result['json_result']
             reply['jobid'] = jobid
             reply['status'] = 'ok'
@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -*-
+"""
+Background rendering of the images shown on the graph review page.
+
+The review page needs two images for every pair it shows. Computing the
+pairwise match and rendering the figures takes on the order of a second per
+pair, so rendering on request puts that latency in front of every reviewer.
+Instead, whenever the graph client receives the next batch of pairs from the
+inference priority queue, the top REVIEW_PRERENDER of them are rendered by a
+pool of worker processes. The review page then reads finished images from a
+size-bounded on-disk LRU cache and only falls back to rendering on demand for
+pairs that were not rendered in time.
+
+CommandLine:
+    python -m ibeis.web.review_render --allexamples
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import collections
+import threading
+import time
+import os
+from os.path import join, getsize, getmtime, splitext, basename, isfile
+import utool as ut
+(print, rrr, profile) = ut.inject2(__name__)
+
+
+# Number of pairs at the front of the review queue to render ahead of time
+REVIEW_PRERENDER = ut.get_argval('--review-prerender', type_=int, default=50)
+# Number of background render processes (0 disables prerendering)
+REVIEW_RENDER_WORKERS = ut.get_argval('--review-render-workers', type_=int, default=2)
+# Size bound of the on-disk review image cache
+REVIEW_CACHE_MB = ut.get_argval('--review-cache-mb', type_=float, default=512)
+
+# Render services are shared by all graph clients of the same database
+_RENDER_SERVICES = {}
+_RENDER_SERVICES_LOCK = threading.Lock()
+
+
+class ReviewImageCache(ut.NiceRepr):
+    """
+    Size-bounded on-disk cache of rendered review images.
+
+    Images are stored one file per key, where the key is the file name. When
+    the total size goes above max_bytes the least recently used files are
+    removed. Recency is kept in memory and mirrored to the file mtimes so the
+    order survives a restart of the web server. Every file found in dpath
+    counts toward the bound, including thumbnails written under other names
+    by older versions.
+
+    Args:
+        dpath (str): cache directory
+        max_bytes (int): size bound (default = REVIEW_CACHE_MB)
+
+    CommandLine:
+        python -m ibeis.web.review_render ReviewImageCache
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.web.review_render import *  # NOQA
+        >>> import numpy as np
+        >>> dpath = ut.ensure_app_resource_dir('ibeis', 'test_review_cache')
+        >>> ut.delete(dpath)
+        >>> image = np.zeros((20, 30, 3), dtype=np.uint8)
+        >>> cache = ReviewImageCache(dpath, max_bytes=1E9)
+        >>> cache.put('a.png', image)
+        >>> nbytes = cache.nbytes
+        >>> cache.max_bytes = nbytes * 2
+        >>> cache.put('b.png', image)
+        >>> cache.get('a.png').shape
+        (20, 30, 3)
+        >>> cache.put('c.png', image)
+        >>> # b was the least recently used image
+        >>> print(sorted(cache.keys()))
+        ['a.png', 'c.png']
+        >>> print(cache.get('b.png'))
+        None
+        >>> # The recency order is recovered from disk
+        >>> cache2 = ReviewImageCache(dpath, max_bytes=nbytes * 2)
+        >>> print(list(cache2.keys()))
+        ['a.png', 'c.png']
+        >>> print(ut.repr2(cache.stats, sorted_=True))
+        {'evicted': 1, 'hits': 1, 'misses': 1, 'puts': 3}
+        >>> # Files without an image suffix are tracked too
+        >>> ut.writeto(cache2.fpath('legacy_thumb'), 'x' * nbytes * 2)
+        >>> cache3 = ReviewImageCache(dpath, max_bytes=nbytes * 2)
+        >>> print(list(cache3.keys()))
+        ['legacy_thumb']
+        >>> ut.delete(dpath)
+    """
+
+    def __init__(cache, dpath, max_bytes=None):
+        cache.dpath = ut.ensuredir(dpath)
+        if max_bytes is None:
+            max_bytes = int(REVIEW_CACHE_MB * 2 ** 20)
+        cache.max_bytes = max_bytes
+        cache.nbytes = 0
+        cache.stats = ut.ddict(int)
+        cache._lock = threading.RLock()
+        # key -> nbytes, ordered from least to most recently used
+        cache._index = collections.OrderedDict()
+        cache._scan()
+
+    def __nice__(cache):
+        return '%d files, %.1f/%.1f MB' % (len(cache._index),
+                                           cache.nbytes / 2 ** 20,
+                                           cache.max_bytes / 2 ** 20)
+
+    def __contains__(cache, key):
+        return key in cache._index
+
+    def __len__(cache):
+        return len(cache._index)
+
+    def keys(cache):
+        return cache._index.keys()
+
+    def fpath(cache, key):
+        return join(cache.dpath, key)
+
+    def _scan(cache):
+        fpaths = [join(cache.dpath, fname) for fname in os.listdir(cache.dpath)]
+        fpaths = [fpath for fpath in fpaths if isfile(fpath)]
+        # Partially written files from a killed worker
+        for fpath in ut.compress(fpaths, ['.tmp' in basename(f) for f in fpaths]):
+            ut.delete(fpath, verbose=False)
+        fpaths = [f for f in fpaths if '.tmp' not in basename(f)]
+        with cache._lock:
+            for fpath in sorted(fpaths, key=getmtime):
+                cache._add(basename(fpath))
+            cache._evict()
+
+    def _add(cache, key):
+        nbytes = getsize(cache.fpath(key))
+        cache.nbytes += nbytes - cache._index.pop(key, 0)
+        cache._index[key] = nbytes
+
+    def _evict(cache):
+        # Never evict the most recent file, even if it alone is too large
+        while cache.nbytes > cache.max_bytes and len(cache._index) > 1:
+            key, nbytes = cache._index.popitem(last=False)
+            cache.nbytes -= nbytes
+            cache.stats['evicted'] += 1
+            ut.delete(cache.fpath(key), verbose=False)
+
+    def tmp_fpath(cache, key):
+        """ Scratch path that is moved over the cache file when complete """
+        root, ext = splitext(key)
+        return cache.fpath('%s.tmp%d_%d%s' % (root, os.getpid(),
+                                              threading.current_thread().ident,
+                                              ext))
+
+    def get(cache, key):
+        """ Returns the cached image or None """
+        with cache._lock:
+            if key not in cache._index:
+                cache.stats['misses'] += 1
+                return None
+        # Decode without holding the lock so requests do not serialize
+        fpath = cache.fpath(key)
+        image = _imread(fpath)
+        with cache._lock:
+            if image is None:
+                # The file was removed behind our back
+                if key in cache._index:
+                    cache.nbytes -= cache._index.pop(key)
+                cache.stats['misses'] += 1
+                return None
+            # Unless it was evicted while it was being read
+            if key in cache._index:
+                cache._index.move_to_end(key)
+                os.utime(fpath, None)
+            cache.stats['hits'] += 1
+        return image
+
+    def put(cache, key, image):
+        """ Writes an image into the cache """
+        import cv2
+        tmp_fpath = cache.tmp_fpath(key)
+        if not cv2.imwrite(tmp_fpath, image):
+            raise IOError('Unable to write review image %r' % (key,))
+        os.replace(tmp_fpath, cache.fpath(key))
+        cache.add(key)
+
+    def add(cache, key):
+        """ Registers an image file that was written directly to fpath(key) """
+        with cache._lock:
+            cache._add(key)
+            cache.stats['puts'] += 1
+            cache._evict()
+
+    def clear(cache):
+        with cache._lock:
+            for key in list(cache._index.keys()):
+                ut.delete(cache.fpath(key), verbose=False)
+            cache._index.clear()
+            cache.nbytes = 0
+
+
+def get_review_image_cache(ibs):
+    """ The review image cache of a database """
+    return get_review_render_service(ibs).cache
+
+
+def get_review_render_service(ibs):
+    """ The (lazily created) review render service of a database """
+    with _RENDER_SERVICES_LOCK:
+        service = _RENDER_SERVICES.get(ibs.dbdir, None)
+        if service is None:
+            service = ReviewRenderService(ibs)
+            _RENDER_SERVICES[ibs.dbdir] = service
+    return service
+
+
+def review_image_keys(ibs, edge, match_config, view_orientation='vertical',
+                      view_version=1):
+    """
+    Cache keys of the clean image and the match image shown when reviewing
+    a pair. The keys change when the annotations or the match config change.
+
+    Example:
+        >>> # ENABLE_DOCTEST
+        >>> from ibeis.web.review_render import *  # NOQA
+        >>> import ibeis
+        >>> ibs = ibeis.opendb(defaultdb='testdb1')
+        >>> keys1 = review_image_keys(ibs, (2, 1), {})
+        >>> keys2 = review_image_keys(ibs, (1, 2), {}, view_version=2)
+        >>> keys3 = review_image_keys(ibs, (1, 2), {'K': 3})
+        >>> print(keys1[0][0:16])
+        review_1,2_clean
+        >>> print(keys1[1][0:13])
+        review_1,2_v1
+        >>> assert keys1[0] == keys2[0] and keys1[1] != keys2[1]
+        >>> assert keys1[0] != keys3[0]
+    """
+    aid1, aid2 = sorted(map(int, edge))
+    visual_uuids = ibs.get_annot_visual_uuids([aid1, aid2])
+    hashstr = ut.hash_data([visual_uuids, sorted((match_config or {}).items()),
+                            view_orientation])[0:16]
+    key_clean = 'review_%d,%d_clean_%s.png' % (aid1, aid2, hashstr)
+    key_match = 'review_%d,%d_v%d_%s.png' % (aid1, aid2, view_version, hashstr)
+    return key_clean, key_match
+
+
+def render_review_images(ibs, edge, match_config, view_orientation='vertical',
+                         view_version=1):
+    """
+    Computes the match of a pair and renders its clean and match images
+
+    Returns:
+        tuple: (image_clean, image_match)
+    """
+    from ibeis.algo.verif import pairfeat
+    from ibeis.web.apis_query import ensure_review_image_v2
+    extr = pairfeat.PairwiseFeatureExtractor(
+        ibs, config={'match_config': match_config or {}})
+    match = extr._exec_pairwise_match([tuple(edge)])[0]
+    image_clean = ensure_review_image_v2(ibs, match,
+                                         view_orientation=view_orientation,
+                                         overlay=False)
+    if view_version == 1:
+        image_match = ensure_review_image_v2(ibs, match, draw_heatmask=True,
+                                             view_orientation=view_orientation)
+    else:
+        image_match = ensure_review_image_v2(ibs, match, draw_matches=True,
+                                             view_orientation=view_orientation)
+    return image_clean, image_match
+
+
+# Database opened once by each render worker process
+_WORKER_IBS = None
+
+
+def _init_render_worker(dbdir):
+    global _WORKER_IBS
+    import matplotlib
+    matplotlib.use('Agg')
+    # plottool only styles matplotlib in the main process. Apply the same
+    # style here so rendered images match those of the web server.
+    from plottool_ibeis import __MPL_INIT__
+    __MPL_INIT__._init_mpl_rcparams()
+    import ibeis
+    _WORKER_IBS = ibeis.opendb(dbdir=dbdir, web=False)
+
+
+def _render_to_files(ibs, edge, match_config, view_orientation, view_version,
+                     fpaths, tmp_fpaths):
+    import cv2
+    tt = time.time()
+    images = render_review_images(ibs, edge, match_config,
+                                  view_orientation=view_orientation,
+                                  view_version=view_version)
+    for image, fpath, tmp_fpath in zip(images, fpaths, tmp_fpaths):
+        if not cv2.imwrite(tmp_fpath, image):
+            raise IOError('Unable to write review image %r' % (fpath,))
+        os.replace(tmp_fpath, fpath)
+    return time.time() - tt
+
+
+def _render_worker(edge, match_config, view_orientation, view_version, fpaths,
+                   tmp_fpaths):
+    return _render_to_files(_WORKER_IBS, edge, match_config, view_orientation,
+                            view_version, fpaths, tmp_fpaths)
+
+
+class ReviewRenderService(ut.NiceRepr):
+    """
+    Renders review images in background processes and serves them from a
+    ReviewImageCache.
+
+    Args:
+        ibs (IBEISController):
+        cache (ReviewImageCache): (default = one in the match thumb dir)
+        num_workers (int): render processes; 0 disables prerendering
+            (default = REVIEW_RENDER_WORKERS)
+        num_prerender (int): number of queued pairs rendered ahead of time
+            (default = REVIEW_PRERENDER)
+
+    CommandLine:
+        python -m ibeis.web.review_render ReviewRenderService
+
+    Example:
+        >>> # DISABLE_DOCTEST
+        >>> from ibeis.web.review_render import *  # NOQA
+        >>> import ibeis
+        >>> ibs = ibeis.opendb(defaultdb='testdb1')
+        >>> service = ReviewRenderService(ibs, num_workers=1)
+        >>> service.cache.clear()
+        >>> edges = [(1, 2), (2, 3), (1, 3)]
+        >>> service.prerender(edges, {})
+        >>> service.wait()
+        >>> images = service.get_images((2, 1), {})
+        >>> images = service.get_images((4, 5), {})
+        >>> metrics = service.metrics()
+        >>> print(ut.repr2(ut.dict_subset(metrics, ['hits', 'misses', 'rendered'])))
+        {'hits': 1, 'misses': 1, 'rendered': 3}
+        >>> service.shutdown()
+    """
+
+    def __init__(service, ibs, cache=None, num_workers=None,
+                 num_prerender=None):
+        if cache is None:
+            cache = ReviewImageCache(join(ibs.get_match_thumbdir(), 'review'))
+        service.ibs = ibs
+        service.cache = cache
+        service.num_workers = (REVIEW_RENDER_WORKERS if num_workers is None
+                               else num_workers)
+        service.num_prerender = (REVIEW_PRERENDER if num_prerender is None
+                                 else num_prerender)
+        service.stats = ut.ddict(int)
+        # Seconds spent rendering a pair and serving a request
+        service.render_times = collections.deque(maxlen=1000)
+        service.serve_times = collections.deque(maxlen=1000)
+        service._executor = None
+        # key_match -> future of renders that have not finished
+        service._pending = {}
+        service._lock = threading.RLock()
+
+    def __nice__(service):
+        return '%d workers, %d pending, %s' % (
+            service.num_workers, len(service._pending), service.cache.__nice__())
+
+    def _get_executor(service):
+        if service._executor is None:
+            import concurrent.futures
+            import multiprocessing
+            # Spawn so workers do not inherit the web server threads
+            service._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=service.num_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_render_worker,
+                initargs=(service.ibs.dbdir,))
+        return service._executor
+
+    def shutdown(service):
+        with service._lock:
+            for future in service._pending.values():
+                future.cancel()
+            service._pending = {}
+        if service._executor is not None:
+            service._executor.shutdown(wait=True)
+            service._executor = None
+
+    def _submit(service, edge, match_config, view_orientation, view_version,
+                keys):
+        """ Starts a background render. Must be called with the lock held. """
+        cache = service.cache
+        fpaths = [cache.fpath(key) for key in keys]
+        tmp_fpaths = [cache.tmp_fpath(key) for key in keys]
+        future = service._get_executor().submit(
+            _render_worker, edge, match_config, view_orientation, view_version,
+            fpaths, tmp_fpaths)
+
+        def _on_done(future):
+            with service._lock:
+                if service._pending.get(keys[1], None) is future:
+                    del service._pending[keys[1]]
+                if future.cancelled():
+                    service.stats['cancelled'] += 1
+                    return
+                ex = future.exception()
+                if ex is not None:
+                    service.stats['errors'] += 1
+                    print('[review_render] Failed to render %r: %r' % (edge, ex))
+                    return
+                for key in keys:
+                    cache.add(key)
+                service.stats['rendered'] += 1
+                service.render_times.append(future.result())
+
+        service._pending[keys[1]] = future
+        future.add_done_callback(_on_done)
+        return future
+
+    def prerender(service, edges, match_config, view_orientation='vertical',
+                  view_version=1):
+        """
+        Renders the first num_prerender pairs in edges in the background.
+        Renders of other pairs that have not started yet are cancelled.
+        """
+        if service.num_workers <= 0 or service.num_prerender <= 0:
+            return
+        ibs = service.ibs
+        edges = list(edges)[0:service.num_prerender]
+        with service._lock:
+            wanted = set()
+            for edge in edges:
+                keys = review_image_keys(ibs, edge, match_config,
+                                         view_orientation, view_version)
+                wanted.add(keys[1])
+                if keys[1] in service._pending:
+                    continue
+                if all(key in service.cache for key in keys):
+                    continue
+                service.stats['prerender'] += 1
+                service._submit(edge, match_config, view_orientation,
+                                view_version, keys)
+            for key, future in list(service._pending.items()):
+                if key not in wanted:
+                    future.cancel()
+
+    def get_images(service, edge, match_config, view_orientation='vertical',
+                   view_version=1):
+        """
+        Returns the clean and match images of a pair, rendering them if they
+        are not cached.
+
+        Returns:
+            tuple: (image_clean, image_match)
+        """
+        tt = time.time()
+        cache = service.cache
+        keys = review_image_keys(service.ibs, edge, match_config,
+                                 view_orientation, view_version)
+        images = [cache.get(key) for key in keys]
+        if all(image is not None for image in images):
+            service.stats['hits'] += 1
+        else:
+            with service._lock:
+                future = service._pending.get(keys[1], None)
+                if future is not None and future.cancel():
+                    # Queued behind other pairs; faster to render it here
+                    future = None
+            if future is not None:
+                # Already being rendered in the background
+                service.stats['waits'] += 1
+                try:
+                    future.result()
+                except Exception:
+                    future = None
+            if future is None:
+                service.stats['misses'] += 1
+                fpaths = [cache.fpath(key) for key in keys]
+                tmp_fpaths = [cache.tmp_fpath(key) for key in keys]
+                seconds = _render_to_files(service.ibs, edge, match_config,
+                                           view_orientation, view_version,
+                                           fpaths, tmp_fpaths)
+                service.render_times.append(seconds)
+                for key in keys:
+                    cache.add(key)
+            images = [_imread(cache.fpath(key)) for key in keys]
+        service.serve_times.append(time.time() - tt)
+        return tuple(images)
+
+    def wait(service):
+        """ Blocks until all background renders have finished """
+        import concurrent.futures
+        with service._lock:
+            futures = list(service._pending.values())
+        concurrent.futures.wait(futures)
+
+    def metrics(service):
+        """
+        Hit-rate and latency summary. A request is a hit if both images were
+        cached, a wait if it joined a background render that had not finished,
+        and a miss if it had to render the pair itself.
+        """
+        import numpy as np
+
+        def _summary(times):
+            times = np.array(times)
+            if len(times) == 0:
+                return None
+            return {
+                'count': len(times),
+                'mean': float(times.mean()),
+                'p50': float(np.percentile(times, 50)),
+                'p95': float(np.percentile(times, 95)),
+                'max': float(times.max()),
+            }
+
+        stats = service.stats
+        num_requests = stats['hits'] + stats['waits'] + stats['misses']
+        metrics = {
+            'requests': num_requests,
+            'hits': stats['hits'],
+            'waits': stats['waits'],
+            'misses': stats['misses'],
+            'hit_rate': (stats['hits'] / num_requests) if num_requests else None,
+            'prerender': stats['prerender'],
+            'rendered': stats['rendered'],
+            'cancelled': stats['cancelled'],
+            'errors': stats['errors'],
+            'pending': len(service._pending),
+            'render_seconds': _summary(service.render_times),
+            'serve_seconds': _summary(service.serve_times),
+            'cache_files': len(service.cache),
+            'cache_bytes': service.cache.nbytes,
+            'cache_max_bytes': service.cache.max_bytes,
+            'cache_evicted': service.cache.stats['evicted'],
+        }
+        return metrics
+
+
+def _imread(fpath):
+    import cv2
+    return cv2.imread(fpath, cv2.IMREAD_UNCHANGED)
+
+
+if __name__ == '__main__':
+    """
+    CommandLine:
+        python -m ibeis.web.review_render
+        python -m ibeis.web.review_render --allexamples
+    """
+    import multiprocessing
+    multiprocessing.freeze_support()  # for win32
+    import utool as ut  # NOQA
+    ut.doctest_funcs()
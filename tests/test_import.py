@@ -1,2 +1,82 @@
+import os
+import subprocess
+import sys
+
+
+# Subsystems that ``import ibeis`` must leave to first use
+HEAVY_MODULES = [
+    'cv2',
+    'flask',
+    'matplotlib.pyplot',
+    'ibeis.control.IBEISControl',
+    'ibeis.algo',
+    'ibeis.web',
+    'ibeis.gui',
+    'ibeis.viz',
+]
+
+
+def _run_cold(code):
+    """ Runs code in a fresh interpreter and returns its stdout """
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return out.decode('utf8').strip().splitlines()[-1]
+
+
 def test_import():
-    import ibeis
\ No newline at end of file
+    import ibeis
+
+
+def test_import_is_lazy():
+    code = (
+        'import sys, ibeis; '
+        'print("loaded=" + ",".join(m for m in {!r} if m in sys.modules))'
+    ).format(HEAVY_MODULES)
+    loaded = _run_cold(code)[len('loaded='):]
+    assert loaded == '', 'import ibeis eagerly loaded: {}'.format(loaded)
+
+
+def test_lazy_attributes():
+    import ibeis
+    from ibeis.algo.hots import chip_match
+    assert ibeis.ChipMatch is chip_match.ChipMatch
+    assert ibeis.opendb is ibeis.main_module.opendb
+    assert callable(ibeis.testdata_qreq_)
+
+
+def test_lazy_init_submodules():
+    """
+    ``import ibeis`` used to import these ibeis.init submodules as a side
+    effect, so callers reach them as attributes
+    """
+    code = (
+        'import ibeis; '
+        'print(ibeis.init.main_helpers.__name__, ibeis.init.sysres.__name__, '
+        'ibeis.init.filter_annots.__name__)'
+    )
+    assert _run_cold(code) == (
+        'ibeis.init.main_helpers ibeis.init.sysres ibeis.init.filter_annots')
+
+
+def test_import_core_annots_first():
+    """
+    The depcache preprocessors must import without ``import ibeis`` having
+    loaded ibeis.algo first
+    """
+    code = 'import ibeis.core_annots, ibeis.core_images; print("ok")'
+    assert _run_cold(code) == 'ok'
+
+
+def test_import_time():
+    """
+    Cold ``python -c "import ibeis"`` benchmark. The budget can be adjusted
+    with the IBEIS_IMPORT_TIME_BUDGET environment variable (seconds).
+    """
+    budget = float(os.environ.get('IBEIS_IMPORT_TIME_BUDGET', 3.0))
+    code = (
+        'import time; start = time.perf_counter(); import ibeis; '
+        'print(time.perf_counter() - start)'
+    )
+    seconds = min(float(_run_cold(code)) for _ in range(3))
+    print('cold import ibeis: {:.3f}s'.format(seconds))
+    assert seconds < budget, (
+        'import ibeis took {:.3f}s, budget is {:.3f}s'.format(seconds, budget))